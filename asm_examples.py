@@ -355,8 +355,64 @@ else:
     assert ind1 == ind2
     print("First >= 0: %d" % ind1)
     print("ASM version took %0.2fms" % (duration1*1000)) 
-    print("Python version took %0.2fms" % (duration2*1000)) 
-    
+    print("Python version took %0.2fms" % (duration2*1000))
+
+
+
+print("""
+   Example 9: passing arrays without ctypes
+------------------------------------------------------
+""")
 
+if ARCH == 64 and sys.platform != 'win32':
+    # A builtin function accepts the array itself; the address and length of
+    # its buffer are passed to the code, and the item type is checked.
+    page = CodePage(find_first.page.asm)
+    find_first_fast = page.get_builtin(restype=ctypes.c_uint64, 
+                                       argtypes=[Buffer(ctypes.c_int32, length=True)],
+                                       name='find_first')
+    print("First >= 0: %d" % find_first_fast(data))
+    try:
+        find_first_fast(bytearray(8))
+    except TypeError as exc:
+        print("Wrong array type: %s" % exc)
 
 
+print("""
+   Example 10: using several cores
+------------------------------------------------------
+""")
+
+if ARCH == 64 and sys.platform != 'win32':
+    from pycca.asm.parallel import parallel_reduce, default_pool
+    
+    # long sum(int* data, long n)
+    array_sum = mkfunction([
+        xor(eax, eax),
+        test(rsi, rsi),
+        je('done'),
+        label('loop'),
+        movsxd(rcx, dword([rdi])),
+        add(rax, rcx),
+        add(rdi, 4),
+        dec(rsi),
+        jne('loop'),
+        label('done'),
+        ret(),
+    ])
+    array_sum.argtypes = [ctypes.c_void_p, ctypes.c_long]
+    array_sum.restype = ctypes.c_long
+    
+    # The GIL is released while array_sum runs, so chunks of the array are
+    # summed concurrently by a pool of threads.
+    start = time.time()
+    total1 = array_sum(addr, len(data))
+    duration1 = time.time() - start
+    default_pool()  # start threads before timing
+    start = time.time()
+    total2 = parallel_reduce(array_sum, [data])
+    duration2 = time.time() - start
+    assert total1 == total2
+    print("Sum: %d" % total1)
+    print("Single thread took %0.2fms" % (duration1*1000)) 
+    print("%d threads took %0.2fms" % (len(default_pool()), duration2*1000)) 
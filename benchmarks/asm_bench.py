@@ -0,0 +1,257 @@
+"""
+Assembler throughput benchmarks.
+
+Measures how fast pycca encodes instructions (for every instruction class
+and every kind of operand), parses assembly text, and builds CodePages::
+
+    python benchmarks/asm_bench.py -o baseline.json
+    python benchmarks/asm_bench.py -c baseline.json
+
+Encoding rates are reported in instructions per second for
+``Instruction(...).code`` (which includes creating the instruction object,
+since the encoded bytes are cached on each instance).
+"""
+from __future__ import print_function, division
+import os, sys, collections
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import best_time, Results, argument_parser, finish
+
+from pycca.asm import *
+from pycca.asm import instructions
+from pycca.asm.instruction import Instruction, RelBranchInstruction
+from pycca.asm.pointer import Pointer
+from pycca.asm.parser import parse_asm
+
+
+# Memory operand shapes (as in tests/test_pointer.py); each is a function
+# returning a new operand list.
+if ARCH == 64:
+    base, index, ext = rax, rbx, r12
+else:
+    base, index, ext = eax, ebx, esi
+pointer_shapes = collections.OrderedDict([
+    ('[disp]', lambda: [0x123]),
+    ('[base]', lambda: [base]),
+    ('[index*2]', lambda: [index*2]),
+    ('[base+index*2]', lambda: [base + index*2]),
+    ('[base+disp8]', lambda: [base + 0x12]),
+    ('[base+disp32]', lambda: [base + 0x12345]),
+    ('[index*2+disp]', lambda: [index*2 + 0x123]),
+    ('[base+index*2+disp]', lambda: [base + index*2 + 0x123]),
+    ('[base+index]', lambda: [base + index]),
+    ('[base+index+disp]', lambda: [base + index + 0x123]),
+    ('[ext+index*8+disp]', lambda: [ext + index*8 + 0x123]),
+])
+if ARCH == 64:
+    pointer_shapes['[rip+disp]'] = lambda: [rip + 0x123]
+
+sized_pointer = {8: byte, 16: word, 32: dword, 64: qword, None: Pointer}
+
+
+def memory_operands(bits):
+    return [('mem' + shape, lambda shape=shape: sized_pointer[bits](
+                pointer_shapes[shape]()))
+            for shape in pointer_shapes]
+
+
+def register_operands(bits):
+    regs = {8: [al, cl], 16: [ax, cx], 32: [eax, ecx]}
+    if ARCH == 64:
+        regs = {8: [al, r10b], 16: [ax, r10w], 32: [eax, r10d],
+                64: [rax, r10]}
+    return [('reg%d' % bits, lambda r=r: r) for r in regs.get(bits, [])]
+
+
+def xmm_operands():
+    regs = [xmm0, xmm7]
+    if ARCH == 64:
+        regs.append(xmm10)
+    return [('xmm', lambda r=r: r) for r in regs]
+
+
+imm_values = {8: 0x12, 16: 0x1234, 32: 0x12345678, 64: 0x123456789a}
+
+
+def operand_kinds(kind):
+    """Return a list of (operand kind name, factory) that may be used for
+    the operand type *kind* in an instruction mode signature.
+    """
+    if kind.startswith('imm'):
+        bits = int(kind[3:])
+        return [('imm%d' % bits, lambda: imm_values[bits])]
+    if kind.startswith('rel'):
+        return [('rel', lambda: 0x100)]
+    if kind in ('r8', 'r16', 'r32', 'r64'):
+        return register_operands(int(kind[1:]))
+    if kind.startswith('r/m'):
+        bits = int(kind[3:])
+        return register_operands(bits) + memory_operands(bits)
+    if kind == 'xmm1':
+        return xmm_operands()
+    if kind.startswith('xmm'):
+        bits = int(kind.partition('/m')[2])
+        return xmm_operands() + memory_operands(bits if bits <= 64 else None)
+    if kind.lower() in ('st(i)', 'st(0)'):
+        return [('st', lambda: st(0)), ('st', lambda: st(3))]
+    if kind.startswith('m'):
+        digits = ''.join(c for c in kind if c.isdigit())
+        bits = int(digits) if digits else None
+        return memory_operands(bits if bits in sized_pointer else None)
+    if kind == '1':
+        return [('1', lambda: 1)]
+    if kind == 'cl':
+        return [('cl', lambda: cl)]
+    raise ValueError("Unknown operand type %r" % kind)
+
+
+def instruction_classes():
+    for name in sorted(dir(instructions)):
+        obj = getattr(instructions, name)
+        if (isinstance(obj, type) and issubclass(obj, Instruction) and
+                obj not in (Instruction, RelBranchInstruction) and
+                obj.__name__ == name):
+            modes = obj.modes
+            if isinstance(modes, property):
+                try:
+                    modes = object.__new__(obj).modes
+                except TypeError:
+                    # base class with modes defined by subclasses
+                    continue
+            yield obj, modes
+
+
+def encoding_cases():
+    """Return a list of (instruction class, operand kind names, argument
+    factories) for every combination of operand kinds that the assembler
+    accepts.
+    """
+    archind = 2 if ARCH == 64 else 3
+    cases = []
+    for cls, modes in instruction_classes():
+        seen = set()
+        for sig, mode in modes.items():
+            if not mode[archind]:
+                continue
+            combos = [((), ())]
+            for kind in sig:
+                combos = [(names + (name,), facs + (fac,))
+                          for names, facs in combos
+                          for name, fac in operand_kinds(kind)]
+            for names, facs in combos:
+                args = [f() for f in facs]
+                try:
+                    cls(*args).code
+                except Exception:
+                    continue
+                key = tuple(str(a) for a in args)
+                if key in seen:
+                    continue
+                seen.add(key)
+                cases.append((cls, names, facs))
+    return cases
+
+
+def encode_rate(cases):
+    # Return instructions encoded per second for the list of cases
+    args = [(cls, [f() for f in facs]) for cls, names, facs in cases]
+    def run():
+        for cls, a in args:
+            cls(*a).code
+    return len(args) / best_time(run)
+
+
+def bench_encoding(results):
+    cases = encoding_cases()
+    by_class = collections.OrderedDict()
+    by_kind = collections.OrderedDict()
+    for case in cases:
+        by_class.setdefault(case[0].__name__, []).append(case)
+        for kind in set(case[1]):
+            by_kind.setdefault(kind, []).append(case)
+    results.add('encode/all', encode_rate(cases), 'instr/s')
+    for name, group in by_class.items():
+        results.add('encode/instruction/%s' % name, encode_rate(group),
+                    'instr/s')
+    for name in sorted(by_kind):
+        results.add('encode/operand/%s' % name, encode_rate(by_kind[name]),
+                    'instr/s')
+
+
+# Representative code for parsing and CodePage benchmarks: a loop
+# containing a mix of common instructions.
+if ARCH == 64:
+    program_block = """
+    loop_{n}:
+        mov rax, qword ptr [rdi + rcx*8 + 0x10]
+        add rax, rbx
+        imul rax, rdx
+        lea rsi, [rsi + rax*2 + 8]
+        movsd xmm0, qword ptr [rdi + rcx*8]
+        addsd xmm1, xmm0
+        cmp rcx, 0x1000
+        dec rcx
+        jne loop_{n}
+        push r12
+        pop r12
+    """
+else:
+    program_block = """
+    loop_{n}:
+        mov eax, dword ptr [edi + ecx*4 + 0x10]
+        add eax, ebx
+        imul eax, edx
+        lea esi, [esi + eax*2 + 8]
+        movsd xmm0, qword ptr [edi + ecx*8]
+        addsd xmm1, xmm0
+        cmp ecx, 0x1000
+        dec ecx
+        jne loop_{n}
+        push ebx
+        pop ebx
+    """
+block_size = 11
+
+
+def program_text(size):
+    blocks = [program_block.format(n=i) for i in range(size // block_size)]
+    return '\n'.join(blocks) + '\n    ret\n'
+
+
+def bench_parser(results):
+    text = program_text(1000)
+    lines = len([l for l in text.split('\n') if l.strip()])
+    rate = lines / best_time(lambda: parse_asm(text))
+    results.add('parse_asm', rate, 'lines/s')
+
+
+def bench_codepage(results, sizes):
+    for size in sizes:
+        # Each run parses the text again, since instruction objects cache
+        # their encoded bytes.
+        text = program_text(size)
+        count = len(parse_asm(text))
+        def build():
+            CodePage(text)
+        t = best_time(build, repeat=3 if size > 10000 else 7)
+        results.add('codepage/%d' % size, count / t, 'instr/s')
+
+
+def main():
+    parser = argument_parser(__doc__.strip().split('\n')[0])
+    parser.add_argument('--sizes', default='1000,10000,100000',
+                        help="program sizes (in instructions) for the "
+                        "CodePage benchmark (default 1000,10000,100000)")
+    parser.add_argument('--skip-encoding', action='store_true',
+                        help="skip the per-instruction encoding benchmarks")
+    args = parser.parse_args()
+
+    results = Results()
+    if not args.skip_encoding:
+        bench_encoding(results)
+    bench_parser(results)
+    bench_codepage(results, [int(s) for s in args.sizes.split(',')])
+    finish(args, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""
+Timing, result files, and baseline comparison shared by the benchmark
+scripts in this directory.
+
+Results are written as JSON::
+
+    {"info": {...platform description...},
+     "results": {"name": {"value": 1234.5, "unit": "instr/s",
+                          "higher_is_better": true}, ...}}
+"""
+from __future__ import print_function, division
+import sys, json, time, platform, argparse
+
+timer = getattr(time, 'perf_counter', time.time)
+
+
+def best_time(func, repeat=7, min_time=0.1):
+    """Return the best time per call (in seconds) over *repeat* runs of 
+    *func*, calling it enough times per run that each run takes at least 
+    *min_time*. The minimum is used because noise (other processes, 
+    frequency scaling) only makes runs slower.
+    """
+    number = 1
+    while True:
+        start = timer()
+        for i in range(number):
+            func()
+        elapsed = timer() - start
+        if elapsed >= min_time:
+            break
+        number *= 2 if elapsed == 0 else max(2, int(min_time / elapsed * 1.2))
+    best = elapsed
+    for i in range(repeat - 1):
+        start = timer()
+        for i in range(number):
+            func()
+        best = min(best, timer() - start)
+    return best / number
+
+
+def system_info():
+    import pycca
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'platform': platform.platform(),
+        'pycca': pycca.__version__,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+class Results(object):
+    """Collection of named benchmark results.
+    """
+    def __init__(self):
+        self.results = {}
+
+    def add(self, name, value, unit, higher_is_better=True):
+        self.results[name] = {'value': value, 'unit': unit,
+                              'higher_is_better': higher_is_better}
+        print("%-60s %12.4g %s" % (name, value, unit))
+
+    def save(self, filename):
+        with open(filename, 'w') as fh:
+            json.dump({'info': system_info(), 'results': self.results}, fh,
+                      indent=1, sort_keys=True)
+
+    def compare(self, filename, tolerance):
+        """Print a comparison against the results stored in *filename* and
+        return the names of results that are worse by more than
+        *tolerance* (a fraction).
+        """
+        with open(filename) as fh:
+            baseline = json.load(fh)['results']
+        regressions = []
+        print("\n%-60s %12s %12s %8s" % ('benchmark', 'baseline', 'current',
+                                         'change'))
+        for name in sorted(self.results):
+            if name not in baseline:
+                continue
+            old = baseline[name]['value']
+            new = self.results[name]['value']
+            if old == 0:
+                continue
+            change = new / old - 1
+            if not self.results[name]['higher_is_better']:
+                change = -change
+            flag = ''
+            if change < -tolerance:
+                flag = '  REGRESSION'
+                regressions.append(name)
+            print("%-60s %12.4g %12.4g %+7.1f%%%s" % (name, old, new,
+                                                      change * 100, flag))
+        missing = set(baseline) - set(self.results)
+        if missing:
+            print("\n%d baseline result(s) not measured." % len(missing))
+        return regressions
+
+
+def argument_parser(description):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--output', '-o', metavar='FILE',
+                        help="write results to a JSON file")
+    parser.add_argument('--compare', '-c', metavar='FILE',
+                        help="compare against a baseline JSON file; the exit "
+                        "status is 1 if any result regressed")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="fraction by which a result may be worse than "
+                        "the baseline before it is reported as a "
+                        "regression (default 0.25)")
+    return parser
+
+
+def finish(args, results):
+    """Save and compare *results* as requested by the command line *args*,
+    and exit.
+    """
+    if args.output:
+        results.save(args.output)
+    if args.compare:
+        regressions = results.compare(args.compare, args.tolerance)
+        if regressions:
+            print("\n%d regression(s) beyond %d%%" % (len(regressions),
+                                                     args.tolerance * 100))
+            sys.exit(1)
+    sys.exit(0)
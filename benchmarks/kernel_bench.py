@@ -0,0 +1,385 @@
+"""
+Generated-code quality benchmarks.
+
+Times a set of reference kernels (sum, dot, find_first, saxpy, memcpy and
+histogram) implemented with pycca assembly and with the pycca C compiler,
+against numpy and (when gcc is available) the same C code compiled with
+``gcc -O2`` and loaded with ctypes::
+
+    python benchmarks/kernel_bench.py -o kernels.json
+    python benchmarks/kernel_bench.py -c kernels.json
+
+Results are reported in cycles per element for arrays sized to fit in the
+L1 and L2 caches and to exceed the last-level cache. Cycles are time stamp
+counter (reference) cycles, measured with ``rdtsc``, and include the
+overhead of one call through ctypes (or numpy) per array.
+
+Requires numpy and a 64-bit Linux or OSX system.
+"""
+from __future__ import print_function, division
+import os, sys, time, ctypes, tempfile, subprocess, shutil, collections
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import best_time, Results, argument_parser, finish
+
+import numpy as np
+from pycca.asm import *
+from pycca.cc import compile as cc_compile
+
+
+# C versions of the kernels, used by the pycca C compiler and gcc
+c_source = collections.OrderedDict([
+    ('sum', """
+        double sum(double* x, long n) {
+            double s = 0;
+            long i;
+            for (i = 0; i < n; i++) { s = s + x[i]; }
+            return s;
+        }"""),
+    ('dot', """
+        double dot(double* x, double* y, long n) {
+            double s = 0;
+            long i;
+            for (i = 0; i < n; i++) { s = s + x[i] * y[i]; }
+            return s;
+        }"""),
+    ('find_first', """
+        long find_first(int* x, long n) {
+            long i;
+            for (i = 0; i < n; i++) { if (x[i] >= 0) return i; }
+            return n;
+        }"""),
+    ('saxpy', """
+        void saxpy(float a, float* x, float* y, long n) {
+            long i;
+            for (i = 0; i < n; i++) { y[i] = a * x[i] + y[i]; }
+        }"""),
+    ('memcpy', """
+        void memcpy(char* dst, char* src, long n) {
+            long i;
+            for (i = 0; i < n; i++) { dst[i] = src[i]; }
+        }"""),
+    ('histogram', """
+        void histogram(int* x, long* h, long n) {
+            long i;
+            for (i = 0; i < n; i++) { h[x[i]] = h[x[i]] + 1; }
+        }"""),
+])
+
+# Hand-written assembly versions (System V calling convention)
+asm_source = collections.OrderedDict([
+    # two accumulators hide the latency of addsd
+    ('sum', """
+        xorpd xmm0, xmm0
+        xorpd xmm1, xmm1
+        xor rax, rax
+        mov rcx, rsi
+        and rcx, -2
+        jmp sum_test2
+    sum_loop2:
+        addsd xmm0, qword ptr [rdi + rax*8]
+        addsd xmm1, qword ptr [rdi + rax*8 + 8]
+        add rax, 2
+    sum_test2:
+        cmp rax, rcx
+        jl sum_loop2
+        cmp rax, rsi
+        jge sum_done
+        addsd xmm0, qword ptr [rdi + rax*8]
+    sum_done:
+        addsd xmm0, xmm1
+        ret
+    """),
+    ('dot', """
+        xorpd xmm0, xmm0
+        xorpd xmm1, xmm1
+        xor rax, rax
+        mov rcx, rdx
+        and rcx, -2
+        jmp dot_test2
+    dot_loop2:
+        movsd xmm2, qword ptr [rdi + rax*8]
+        mulsd xmm2, qword ptr [rsi + rax*8]
+        addsd xmm0, xmm2
+        movsd xmm3, qword ptr [rdi + rax*8 + 8]
+        mulsd xmm3, qword ptr [rsi + rax*8 + 8]
+        addsd xmm1, xmm3
+        add rax, 2
+    dot_test2:
+        cmp rax, rcx
+        jl dot_loop2
+        cmp rax, rdx
+        jge dot_done
+        movsd xmm2, qword ptr [rdi + rax*8]
+        mulsd xmm2, qword ptr [rsi + rax*8]
+        addsd xmm0, xmm2
+    dot_done:
+        addsd xmm0, xmm1
+        ret
+    """),
+    # as in asm_examples.py (Example 8)
+    ('find_first', """
+        mov rax, 0
+        cmp rax, rsi
+        jge find_done
+    find_loop:
+        cmp dword ptr [rdi + rax*4], 0
+        jge find_done
+        inc rax
+        cmp rax, rsi
+        jl find_loop
+    find_done:
+        ret
+    """),
+    ('saxpy', """
+        xor rax, rax
+        test rdx, rdx
+        je saxpy_done
+    saxpy_loop:
+        movss xmm1, dword ptr [rdi + rax*4]
+        mulss xmm1, xmm0
+        addss xmm1, dword ptr [rsi + rax*4]
+        movss dword ptr [rsi + rax*4], xmm1
+        inc rax
+        cmp rax, rdx
+        jl saxpy_loop
+    saxpy_done:
+        ret
+    """),
+    # 8 bytes at a time, then the remaining bytes
+    ('memcpy', """
+        xor rax, rax
+        mov rcx, rdx
+        and rcx, -8
+        jmp copy_test8
+    copy_loop8:
+        mov r8, qword ptr [rsi + rax]
+        mov qword ptr [rdi + rax], r8
+        add rax, 8
+    copy_test8:
+        cmp rax, rcx
+        jl copy_loop8
+        jmp copy_test1
+    copy_loop1:
+        mov r8b, byte ptr [rsi + rax]
+        mov byte ptr [rdi + rax], r8b
+        inc rax
+    copy_test1:
+        cmp rax, rdx
+        jl copy_loop1
+        ret
+    """),
+    ('histogram', """
+        xor rax, rax
+        test rdx, rdx
+        je hist_done
+    hist_loop:
+        movsxd rcx, dword ptr [rdi + rax*4]
+        inc qword ptr [rsi + rcx*8]
+        inc rax
+        cmp rax, rdx
+        jl hist_loop
+    hist_done:
+        ret
+    """),
+])
+
+# ctypes signatures (restype, argtypes) of the kernels
+ptr, long_ = ctypes.c_void_p, ctypes.c_long
+signatures = {
+    'sum': (ctypes.c_double, [ptr, long_]),
+    'dot': (ctypes.c_double, [ptr, ptr, long_]),
+    'find_first': (long_, [ptr, long_]),
+    'saxpy': (None, [ctypes.c_float, ptr, ptr, long_]),
+    'memcpy': (None, [ptr, ptr, long_]),
+    'histogram': (None, [ptr, ptr, long_]),
+}
+
+# Bytes of array data read or written per element
+element_bytes = {'sum': 8, 'dot': 16, 'find_first': 4, 'saxpy': 8,
+                 'memcpy': 2, 'histogram': 4}
+
+
+def make_data(kernel, n):
+    """Return (arguments for a compiled kernel, function computing the same
+    result with numpy, function checking a compiled kernel's result).
+    """
+    if kernel == 'sum':
+        x = np.random.random(n)
+        expect = x.sum()
+        return ((x.ctypes.data, n), lambda: x.sum(),
+                lambda r: np.allclose(r, expect))
+    if kernel == 'dot':
+        x, y = np.random.random(n), np.random.random(n)
+        expect = x.dot(y)
+        return ((x.ctypes.data, y.ctypes.data, n), lambda: x.dot(y),
+                lambda r: np.allclose(r, expect))
+    if kernel == 'find_first':
+        # the whole array is searched
+        x = -np.ones(n, dtype=np.int32)
+        x[-1] = 1
+        return ((x.ctypes.data, n), lambda: np.argmax(x >= 0),
+                lambda r: r == n - 1)
+    if kernel == 'saxpy':
+        x = np.random.random(n).astype(np.float32)
+        y = np.zeros(n, dtype=np.float32)
+        def check(r):
+            ok = np.allclose(y, 0.5 * x)
+            y[:] = 0
+            return ok
+        def numpy_saxpy():
+            y[:] += np.float32(0.5) * x
+        return ((0.5, x.ctypes.data, y.ctypes.data, n), numpy_saxpy, check)
+    if kernel == 'memcpy':
+        src = np.random.randint(0, 256, n).astype(np.uint8)
+        dst = np.zeros(n, dtype=np.uint8)
+        return ((dst.ctypes.data, src.ctypes.data, n),
+                lambda: np.copyto(dst, src),
+                lambda r: (dst == src).all())
+    if kernel == 'histogram':
+        x = np.random.randint(0, 256, n).astype(np.int32)
+        h = np.zeros(256, dtype=np.int64)
+        expect = np.bincount(x, minlength=256)
+        def check(r):
+            ok = (h == expect).all()
+            h[:] = 0
+            return ok
+        return ((x.ctypes.data, h.ctypes.data, n),
+                lambda: np.bincount(x, minlength=256), check)
+    raise ValueError(kernel)
+
+
+def set_signature(fn, kernel):
+    fn.restype, fn.argtypes = signatures[kernel]
+    return fn
+
+
+def asm_kernels():
+    return dict((name, set_signature(mkfunction(src), name))
+                for name, src in asm_source.items())
+
+
+def cc_kernels():
+    kernels = {}
+    for name, src in c_source.items():
+        code = cc_compile(src)
+        kernels[name] = set_signature(getattr(code, name), name)
+    return kernels
+
+
+def gcc_kernels(tmpdir):
+    """Compile the C kernels with gcc -O2 and return a dict of functions, or
+    None if gcc is not available.
+    """
+    src = os.path.join(tmpdir, 'kernels.c')
+    lib = os.path.join(tmpdir, 'kernels.so')
+    with open(src, 'w') as fh:
+        # avoid clashing with the builtin memcpy
+        fh.write('\n'.join(c_source.values()).replace('memcpy', 'copy_bytes'))
+    try:
+        subprocess.check_call(['gcc', '-O2', '-fPIC', '-shared', '-o', lib,
+                               src])
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    dll = ctypes.CDLL(lib)
+    return dict((name, set_signature(getattr(dll, 'copy_bytes' if name ==
+                                             'memcpy' else name), name))
+                for name in c_source)
+
+
+def tsc_frequency():
+    """Return the frequency (Hz) of the processor time stamp counter.
+    """
+    read_tsc = mkfunction([
+        rdtsc(),
+        shl(rdx, 32),
+        or_(rax, rdx),
+        ret(),
+    ])
+    read_tsc.restype = ctypes.c_uint64
+    t0, c0 = time.time(), read_tsc()
+    time.sleep(0.2)
+    t1, c1 = time.time(), read_tsc()
+    return (c1 - c0) / (t1 - t0)
+
+
+def cache_sizes():
+    """Return the sizes (bytes) of the L1 data, L2 and last-level caches.
+    """
+    sizes = {1: 32 * 1024, 2: 1024 * 1024, 3: 32 * 1024 * 1024}
+    path = '/sys/devices/system/cpu/cpu0/cache'
+    if os.path.isdir(path):
+        for index in os.listdir(path):
+            try:
+                with open(os.path.join(path, index, 'type')) as fh:
+                    if fh.read().strip() == 'Instruction':
+                        continue
+                with open(os.path.join(path, index, 'level')) as fh:
+                    level = int(fh.read())
+                with open(os.path.join(path, index, 'size')) as fh:
+                    size = fh.read().strip()
+            except (IOError, OSError, ValueError):
+                continue
+            scale = {'K': 1024, 'M': 1024**2}.get(size[-1], 1)
+            sizes[level] = int(size.rstrip('KM')) * scale
+    sizes[3] = max(sizes.values())
+    return sizes
+
+
+def main():
+    parser = argument_parser(__doc__.strip().split('\n')[0])
+    parser.add_argument('--kernels', default=','.join(c_source),
+                        help="comma-separated kernels to run (default all)")
+    parser.add_argument('--max-bytes', type=int, default=512 * 1024**2,
+                        help="largest total array size used for the "
+                        "out-of-cache runs (default 512 MB)")
+    args = parser.parse_args()
+
+    if ARCH != 64 or sys.platform == 'win32':
+        sys.exit("The kernel benchmarks require 64-bit Linux or OSX.")
+
+    caches = cache_sizes()
+    # total bytes of array data for each memory level
+    levels = collections.OrderedDict([
+        ('L1', caches[1] // 2),
+        ('L2', caches[2] // 2),
+        ('DRAM', min(4 * caches[3], args.max_bytes)),
+    ])
+    hz = tsc_frequency()
+    print("Time stamp counter: %0.2f GHz; caches: %s" % (
+        hz / 1e9, ', '.join('L%d=%dK' % (l, s // 1024)
+                            for l, s in sorted(caches.items()))))
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        impls = collections.OrderedDict([('asm', asm_kernels()),
+                                         ('cc', cc_kernels())])
+        gcc = gcc_kernels(tmpdir)
+        if gcc is None:
+            print("gcc is not available; skipping gcc -O2 kernels.")
+        else:
+            impls['gcc'] = gcc
+
+        results = Results()
+        for kernel in args.kernels.split(','):
+            for level, nbytes in levels.items():
+                n = nbytes // element_bytes[kernel]
+                kargs, numpy_fn, check = make_data(kernel, n)
+                timings = [('numpy', numpy_fn)]
+                for impl, kernels in impls.items():
+                    fn = kernels[kernel]
+                    if not check(fn(*kargs)):
+                        raise RuntimeError("%s %s returned an incorrect "
+                                           "result." % (impl, kernel))
+                    timings.append((impl, lambda fn=fn: fn(*kargs)))
+                for impl, func in timings:
+                    cycles = best_time(func) * hz / n
+                    results.add('%s/%s/%s' % (kernel, level, impl), cycles,
+                                'cycles/element', higher_is_better=False)
+                del kargs, numpy_fn, check, timings
+    finally:
+        shutil.rmtree(tmpdir)
+    finish(args, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
+import ctypes, ctypes.util
 import numpy as np
-from pycca.cc import CCode, Function, Assign, Return
+from pycca.cc import CCode, Function, Assign, Return, compile
 
 code = CCode([
     Function('int', 'add_one', [('int', 'x')], [
@@ -27,43 +28,52 @@ print "12.3 = ", c.fn()
 
 
 # Example: GIL handling for long operations
-#code = CCode([
-    #Function('int', 'add_one', [('int', 'x')], [
-        #Declare(['int', 'ts']),
-        #Assign(ts=Call(ctypes.pythonapi.PyThreadState_Get)),
-        #Assign(ts=ctypes.pythonapi.PyEval_SaveThread, 'ts'),
-        ## GIL is released, now do work:
-        #Assign(x='x + 1'),
-        ## Re-acquire GIL before returning:
-        #Call(ctypes.pythonapi.PyEval_RestoreThread, 'ts'),
-        #Return('x')
-    #])
-#])
+# By default the GIL is released while compiled functions run, so they may run
+# concurrently in several threads. With nogil=False, the GIL is held and the 
+# Python C API can be used to control it explicitly:
+code = compile("""
+    void* PyEval_SaveThread(void);
+    void PyEval_RestoreThread(void* ts);
+    
+    int add_one(int x) {
+        void* ts = PyEval_SaveThread();
+        // GIL is released, now do work:
+        x = x + 1;
+        // Re-acquire GIL before returning:
+        PyEval_RestoreThread(ts);
+        return x;
+    }
+""", nogil=False)
+print "3 + 1 = %d" % code.add_one(3)
 
 
 # Example: coding in pure C        
-#find_greater = compile("""
-    #int find_greater(int* array, int size, int threshold) {
-        #int i;
-        #for( i=0; i<size; i++) {
-            #if( array[i] > threshold )
-                #return i;
-        #}
-        #return -1;
-    #}
-#""")
+code = compile("""
+    int find_greater(int* array, int size, int threshold) {
+        int i;
+        for( i=0; i<size; i++) {
+            if( array[i] > threshold )
+                return i;
+        }
+        return -1;
+    }
+""")
+find_greater = code.find_greater
+
+data = np.arange(10000, dtype=np.int32)
+print "First > 5000:", find_greater(data.ctypes.data, len(data), 5000)
 
 
 # Example: inserting objects into global namespace
-#compile("""
-    #double exp_x_plus_one(double x) {
-        #return exp(x + 1);
-    #}
-#""", globals={'exp': ctypes.cdll.LoadLibrary('m').exp})
-
-
-#data = np.arange(10000)
-#print "First > 5000:", find_greater(data, len(data), 5000)
+libm = ctypes.cdll.LoadLibrary(ctypes.util.find_library('m'))
+code = compile("""
+    double exp(double x);
+    
+    double exp_x_plus_one(double x) {
+        return exp(x + 1);
+    }
+""", globals={'exp': libm.exp})
+print "exp(1 + 1) =", code.exp_x_plus_one(1.0)
 
 
 # Examples: coding using with-blocks 
@@ -54,5 +54,10 @@ from .instructions import *
 from .register import *
 from .pointer import byte, word, dword, qword
 from .codepage import CodePage, mkfunction
+from .builtin import Buffer, ConstPointer, builtin_function
+from .batch import BatchFunction
 from .label import label
+from .patch import patch
+from .align import align
+from .data import db, dw, dd, dq, dfloat, ddouble, ConstantPool
 from .util import *
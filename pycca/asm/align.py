@@ -0,0 +1,140 @@
+# -'- coding: utf-8 -'-
+
+from .instruction import RelBranchInstruction, Label
+
+
+# Recommended multi-byte NOP sequences (Intel SDM vol. 2B, NOP), indexed by
+# length
+_nops = [
+    b'',
+    b'\x90',
+    b'\x66\x90',
+    b'\x0f\x1f\x00',
+    b'\x0f\x1f\x40\x00',
+    b'\x0f\x1f\x44\x00\x00',
+    b'\x66\x0f\x1f\x44\x00\x00',
+    b'\x0f\x1f\x80\x00\x00\x00\x00',
+    b'\x0f\x1f\x84\x00\x00\x00\x00\x00',
+    b'\x66\x0f\x1f\x84\x00\x00\x00\x00\x00',
+]
+
+
+def nop_padding(size):
+    """Return *size* bytes of padding made of as few NOP instructions as
+    possible.
+    """
+    longest = len(_nops) - 1
+    return _nops[longest] * (size // longest) + _nops[size % longest]
+
+
+def align(n, max_skip=None, fill=None):
+    """
+    Pad the code with NOP instructions so that the next instruction begins
+    at an address that is a multiple of *n* (a power of 2).
+
+    If more than *max_skip* bytes of padding would be needed, no padding is
+    added. If *fill* is given, the padding is made of that byte value 
+    instead of NOP instructions (for aligning data).
+    """
+    return Align(n, max_skip, fill)
+
+
+class Align(object):
+    """Padding that aligns the following code.
+
+    The padding depends on the address of the code, which is set by
+    :func:`place`; until then, the length is the largest possible padding.
+    """
+    def __init__(self, n, max_skip=None, fill=None, addr=None):
+        if n < 1 or n & (n - 1) != 0:
+            raise ValueError("Alignment must be a power of 2.")
+        self.n = n
+        self.max_skip = max_skip
+        self.fill = fill
+        self.addr = addr
+        self.code = None
+        if addr is not None:
+            size = -addr % n
+            if max_skip is not None and size > max_skip:
+                size = 0
+            if fill is None:
+                self.code = nop_padding(size)
+            else:
+                self.code = bytes(bytearray([fill])) * size
+
+    def place(self, addr):
+        """Return a copy of this object with padding for the address
+        *addr*.
+        """
+        return Align(self.n, self.max_skip, self.fill, addr)
+
+    def __len__(self):
+        if self.code is not None:
+            return len(self.code)
+        if self.max_skip is not None:
+            return min(self.n - 1, self.max_skip)
+        return self.n - 1
+
+    def __str__(self):
+        args = [str(self.n)]
+        if self.fill is not None or self.max_skip is not None:
+            args.append('' if self.fill is None else str(self.fill))
+        if self.max_skip is not None:
+            args.append(str(self.max_skip))
+        return '.align ' + ', '.join(args)
+
+
+def place(asm, addr):
+    """Return a copy of the list *asm* with padding set for each
+    :class:`Align` when the code is loaded at *addr*.
+    """
+    out = []
+    for cmd in asm:
+        if isinstance(cmd, Align):
+            cmd = cmd.place(addr)
+        out.append(cmd)
+        addr += len(cmd)
+    return out
+
+
+def loop_labels(asm):
+    """Return the names of labels in *asm* that are the target of a jump
+    from later in the code.
+    """
+    seen = set()
+    names = []
+    for cmd in asm:
+        if isinstance(cmd, Label):
+            seen.add(cmd.name)
+        elif (isinstance(cmd, RelBranchInstruction) and
+                isinstance(cmd.args[0], str) and cmd.args[0] in seen and
+                cmd.args[0] not in names):
+            names.append(cmd.args[0])
+    return names
+
+
+def align_labels(asm, n, max_skip=None):
+    """Return a copy of *asm* with an :class:`Align` inserted before the
+    labels of each function entry and loop target.
+
+    Function entries are as for
+    :func:`function_labels() <pycca.asm.instrument.function_labels>`, so
+    labels that are reached by falling through from the preceding
+    instruction are only padded if they are loop targets. Consecutive labels
+    share the padding.
+    """
+    from .instrument import function_labels
+    names = set(function_labels(asm)) | set(loop_labels(asm))
+    out = []
+    labels = []
+    for cmd in list(asm) + [None]:
+        if isinstance(cmd, Label):
+            labels.append(cmd)
+            continue
+        if any(label.name in names for label in labels):
+            out.append(Align(n, max_skip))
+        out.extend(labels)
+        labels = []
+        if cmd is not None:
+            out.append(cmd)
+    return out
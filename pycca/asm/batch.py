@@ -0,0 +1,253 @@
+# -'- coding: utf-8 -'-
+"""
+Apply a scalar function to many sets of arguments in a single call.
+
+A batch function is a small driver loop, assembled by pycca, that reads one
+row of arguments from each of several arrays, calls the target function,
+and writes its return value to an output array. Python (ctypes) overhead is
+paid once per batch rather than once per row.
+"""
+
+import sys, array, ctypes
+
+from . import ARCH
+from .instructions import *
+from .register import *
+from .pointer import dword, qword
+from .label import label
+from .builtin import Buffer, _kind
+
+
+class Py_buffer(ctypes.Structure):
+    _fields_ = [
+        ('buf', ctypes.c_void_p),
+        ('obj', ctypes.c_void_p),
+        ('len', ctypes.c_ssize_t),
+        ('itemsize', ctypes.c_ssize_t),
+        ('readonly', ctypes.c_int),
+        ('ndim', ctypes.c_int),
+        ('format', ctypes.c_char_p),
+        ('shape', ctypes.POINTER(ctypes.c_ssize_t)),
+        ('strides', ctypes.POINTER(ctypes.c_ssize_t)),
+        ('suboffsets', ctypes.c_void_p),
+        ('internal', ctypes.c_void_p),
+    ]
+
+PyBUF_WRITABLE = 0x0001
+PyBUF_RECORDS_RO = 0x001c  # PyBUF_STRIDES | PyBUF_FORMAT
+
+# ctypes type used for the array of each kind of argument
+_kind_types = {
+    'int32': ctypes.c_int32,
+    'int64': ctypes.c_int64,
+    'pointer': ctypes.c_int64,
+    'float': ctypes.c_float,
+    'double': ctypes.c_double,
+}
+# array.array typecodes used to allocate output arrays
+_typecodes = {'int32': 'i', 'int64': 'q', 'pointer': 'q', 'float': 'f', 
+              'double': 'd'}
+
+
+def _get_buffer(obj, ctype, writable=False):
+    # Request a 1-dimensional buffer of *ctype* items from *obj* and return
+    # the Py_buffer. The caller must release it with _release_buffer().
+    view = Py_buffer()
+    flags = PyBUF_RECORDS_RO | (PyBUF_WRITABLE if writable else 0)
+    get = ctypes.pythonapi.PyObject_GetBuffer
+    get.argtypes = [ctypes.py_object, ctypes.POINTER(Py_buffer), ctypes.c_int]
+    get(obj, ctypes.byref(view), flags)
+    fmt = (view.format or b'B').decode('ascii').lstrip('@=<')
+    if len(fmt) != 1 or fmt not in Buffer.formats[ctype] or view.ndim != 1:
+        _release_buffer(view)
+        raise TypeError("Expected 1-dimensional array of %s (format '%s'), "
+                        "got format '%s' with %d dimensions" % 
+                        (ctype.__name__, Buffer.formats[ctype][0], fmt, 
+                         view.ndim))
+    return view
+
+
+def _release_buffer(view):
+    release = ctypes.pythonapi.PyBuffer_Release
+    release.argtypes = [ctypes.POINTER(Py_buffer)]
+    release(ctypes.byref(view))
+
+
+def batch_driver(addr, restype, argtypes):
+    """Return the assembly for a driver loop that calls the function at 
+    *addr* once per row.
+
+    The driver has the signature of a numpy inner loop:
+    ``void driver(char** columns, long* n, long* strides, void* data)``.
+    For each of ``n[0]`` rows, one argument is read from each of the first
+    ``len(argtypes)`` columns, the function is called, and the return value
+    (if *restype* is not None) is written to the last column. Column 
+    pointers advance by their stride in bytes; the *columns* array itself is
+    not modified. A faster loop is used when all columns are contiguous.
+    """
+    kinds = [_kind(t) for t in argtypes]
+    if 'buffer' in kinds:
+        raise TypeError("Buffer arguments are not supported by batch "
+                        "functions.")
+    rkind = None if restype is None else _kind(restype)
+    nint = len([k for k in kinds if k not in ('double', 'float')])
+    if nint > 6 or len(kinds) - nint > 8:
+        raise TypeError("Batch functions support at most 6 integer / "
+                        "pointer and 8 floating-point arguments.")
+    columns = kinds + ([] if rkind is None else [rkind])
+    sizes = [ctypes.sizeof(_kind_types[kind]) for kind in columns]
+    
+    # Column pointers are copied to the stack below the saved registers
+    def column(i):
+        return qword([rbp - (24 + 8 * i)])
+    local_size = (8 * len(columns) + 8 + 15) // 16 * 16
+
+    code = [
+        push(rbp),
+        mov(rbp, rsp),
+        push(r12),
+        push(r14),
+        sub(rsp, local_size),
+        mov(r12, qword([rsi])),
+        mov(r14, rdx),
+    ]
+    for i in range(len(columns)):
+        code += [mov(rax, qword([rdi + 8 * i])), mov(column(i), rax)]
+    code += [
+        test(r12, r12),
+        je('done'),
+    ]
+    for i, size in enumerate(sizes):
+        code += [cmp(qword([r14 + 8 * i]), size), jne('strided')]
+
+    def loop(name, strided):
+        # Load one row of arguments and advance the column pointers
+        def advance(reg, i):
+            if strided:
+                return add(reg, qword([r14 + 8 * i]))
+            return add(reg, sizes[i])
+        code = [label(name)]
+        iregs = [rdi, rsi, rdx, rcx, r8, r9]
+        fregs = [xmm0, xmm1, xmm2, xmm3, xmm4, xmm5, xmm6, xmm7]
+        for i, kind in enumerate(kinds):
+            code.append(mov(rax, column(i)))
+            if kind == 'double':
+                code.append(movsd(fregs.pop(0), qword([rax])))
+            elif kind == 'float':
+                code.append(movss(fregs.pop(0), dword([rax])))
+            elif kind == 'int32':
+                code.append(movsxd(iregs.pop(0), dword([rax])))
+            else:
+                code.append(mov(iregs.pop(0), qword([rax])))
+            code += [advance(rax, i), mov(column(i), rax)]
+        code += [mov(r11, addr), call(r11)]
+
+        # Store the result
+        if rkind is not None:
+            i = len(kinds)
+            code.append(mov(rcx, column(i)))
+            if rkind == 'double':
+                code.append(movsd(qword([rcx]), xmm0))
+            elif rkind == 'float':
+                code.append(movss(dword([rcx]), xmm0))
+            elif rkind == 'int32':
+                code.append(mov(dword([rcx]), eax))
+            else:
+                code.append(mov(qword([rcx]), rax))
+            code += [advance(rcx, i), mov(column(i), rcx)]
+        code += [
+            dec(r12),
+            jne(name),
+        ]
+        return code
+
+    code += loop('contiguous', False) + [jmp('done')]
+    code += loop('strided', True)
+    code += [
+        label('done'),
+        lea(rsp, [rbp - 16]),
+        pop(r14),
+        pop(r12),
+        pop(rbp),
+        ret(),
+    ]
+    return code
+
+
+class BatchFunction(object):
+    """Calls a function once for each row of a set of arrays, using a 
+    native driver loop (see :func:`batch_driver`).
+
+    Calling ``batch(a, b, ..., out=None)`` calls the function with 
+    ``(a[i], b[i], ...)`` for each *i* and stores the result in ``out[i]``.
+    Arguments may be any 1-dimensional objects supporting the buffer 
+    protocol with items of the matching type, including non-contiguous 
+    numpy arrays and memoryviews. A single numpy structured array may be 
+    given instead, in which case its fields are used as the arguments in 
+    order. If *out* is not given, a new array.array is allocated. Returns 
+    *out*, or None if the function has no return value.
+
+    If *nogil* is True, the GIL is released while the loop runs.
+
+    Only the System V x86-64 calling convention is supported.
+    """
+    def __init__(self, addr, restype, argtypes, nogil=True, target=None):
+        from .codepage import CodePage
+        if ARCH != 64 or sys.platform == 'win32':
+            raise NotImplementedError("Batch functions require the System V "
+                                      "x86-64 calling convention.")
+        self.restype = restype
+        self.argtypes = list(argtypes)
+        self.kinds = [_kind(t) for t in self.argtypes]
+        self.rkind = None if restype is None else _kind(restype)
+        self.page = CodePage(batch_driver(addr, restype, self.argtypes))
+        self.driver = self.page.get_function(nogil=nogil)
+        self.driver.argtypes = [ctypes.c_void_p, ctypes.c_void_p, 
+                                ctypes.c_void_p, ctypes.c_void_p]
+        self.driver.restype = None
+        self.target = target  # keep the code page alive
+
+    def __call__(self, *args, **kwds):
+        out = kwds.pop('out', None)
+        if len(kwds) > 0:
+            raise TypeError("Unexpected keyword arguments: %s" % 
+                            ', '.join(kwds))
+        if (len(args) == 1 and len(self.argtypes) != 1 and
+                getattr(getattr(args[0], 'dtype', None), 'names', None)):
+            # numpy structured array
+            names = args[0].dtype.names
+            if len(names) < len(self.argtypes):
+                raise TypeError("Structured array has %d fields; %d are "
+                                "needed." % (len(names), len(self.argtypes)))
+            args = [args[0][name] for name in names[:len(self.argtypes)]]
+        if len(args) != len(self.argtypes):
+            raise TypeError("Expected %d arrays (%d given)" % 
+                            (len(self.argtypes), len(args)))
+
+        views = []
+        try:
+            for arg, kind in zip(args, self.kinds):
+                views.append(_get_buffer(arg, _kind_types[kind]))
+            lengths = set(view.shape[0] for view in views)
+            if len(lengths) > 1:
+                raise ValueError("Arrays have different lengths: %s" % 
+                                 sorted(lengths))
+            n = lengths.pop() if len(lengths) > 0 else 0
+            if self.rkind is not None:
+                if out is None:
+                    out = array.array(_typecodes[self.rkind], [0]) * n
+                views.append(_get_buffer(out, _kind_types[self.rkind], 
+                                         writable=True))
+                if views[-1].shape[0] < n:
+                    raise ValueError("Output array is too short (%d < %d)" %
+                                     (views[-1].shape[0], n))
+            columns = (ctypes.c_void_p * len(views))(
+                *[view.buf for view in views])
+            strides = (ctypes.c_ssize_t * len(views))(
+                *[view.strides[0] for view in views])
+            self.driver(columns, ctypes.byref(ctypes.c_ssize_t(n)), strides,
+                        None)
+        finally:
+            for view in views:
+                _release_buffer(view)
+        return out
@@ -0,0 +1,535 @@
+# -'- coding: utf-8 -'-
+"""
+Python builtin functions that call machine code directly.
+
+Calling through a ctypes function object costs about a microsecond per call
+for argument conversion. The functions generated here avoid ctypes entirely
+at call time: a small trampoline, assembled by pycca, receives the arguments
+using the METH_FASTCALL convention (METH_VARARGS on older Pythons), unboxes
+them with the Python C API, calls the target function, and boxes the result.
+"""
+
+import sys, struct, ctypes
+
+from . import ARCH
+from .instructions import *
+from .register import *
+from .pointer import byte, dword, qword
+from .label import label
+
+
+class PyMethodDef(ctypes.Structure):
+    _fields_ = [
+        ('ml_name', ctypes.c_char_p),
+        ('ml_meth', ctypes.c_void_p),
+        ('ml_flags', ctypes.c_int),
+        ('ml_doc', ctypes.c_char_p),
+    ]
+
+METH_VARARGS = 0x0001
+METH_FASTCALL = 0x0080
+HAVE_FASTCALL = sys.version_info >= (3, 7)
+
+# Size reserved for each Py_buffer struct (80 bytes on 64-bit Python 3)
+BUFFER_SIZE = 96
+PyBUF_SIMPLE = 0
+PyBUF_WRITABLE = 0x0001
+PyBUF_FORMAT = 0x0004
+PyBUF_STRIDES = 0x0018
+PyBUF_C_CONTIGUOUS = 0x0038
+
+# ctypes types accepted for each kind of argument / return value
+_int32_types = (ctypes.c_int, ctypes.c_int32)
+_int64_types = (ctypes.c_long, ctypes.c_longlong, ctypes.c_int64,
+                ctypes.c_size_t, ctypes.c_ssize_t)
+_pointer_types = (ctypes.c_void_p, ctypes.c_char_p)
+# ctypes objects that hold an address rather than the data it points to
+_ctypes_pointers = _pointer_types + (ctypes._Pointer,)
+
+
+def _kind(typ):
+    # Classify a ctypes type as 'int32', 'int64', 'double', 'float',
+    # 'pointer', or 'buffer'.
+    if isinstance(typ, Buffer):
+        return 'buffer'
+    if isinstance(typ, ConstPointer):
+        return 'pointer'
+    if typ in _int32_types:
+        return 'int32'
+    if typ in _int64_types:
+        return 'int64'
+    if typ is ctypes.c_double:
+        return 'double'
+    if typ is ctypes.c_float:
+        return 'float'
+    if typ in _pointer_types or issubclass(typ, ctypes._Pointer):
+        return 'pointer'
+    raise TypeError("Unsupported type %s for builtin function" % typ.__name__)
+
+
+class Buffer(object):
+    """Typed buffer argument for :func:`builtin_function`.
+
+    The argument may be any object supporting the buffer protocol (numpy
+    arrays, array.array, bytearray, memoryview, mmap, ...) whose items have
+    the ctypes type *ctype* (c_double, c_float, c_int, c_long, c_int64, 
+    c_char, or c_uint8); its format is checked on each call. No data is
+    copied.
+
+    The function receives the address of the first item, followed by the
+    number of items if *length* is True, followed by the distance between
+    items (in items, not bytes) if *strided* is True. Buffers must be
+    C-contiguous unless *strided* is True, in which case they must be
+    1-dimensional. If *writable* is True, read-only buffers are rejected.
+    """
+    # struct module format characters accepted for each type
+    formats = {
+        ctypes.c_double: 'd',
+        ctypes.c_float: 'f',
+        ctypes.c_int: 'i',
+        ctypes.c_int32: 'i',
+        ctypes.c_long: 'lq',
+        ctypes.c_longlong: 'lq',
+        ctypes.c_int64: 'lq',
+        ctypes.c_char: 'cbB',
+        ctypes.c_byte: 'cbB',
+        ctypes.c_uint8: 'cbB',
+    }
+
+    def __init__(self, ctype, length=False, strided=False, writable=False):
+        if ctype not in self.formats:
+            raise TypeError("Unsupported buffer type %s" % ctype.__name__)
+        self.ctype = ctype
+        self.itemsize = ctypes.sizeof(ctype)
+        self.length = length
+        self.strided = strided
+        self.writable = writable
+
+    @property
+    def flags(self):
+        # Py_buffer request flags
+        flags = PyBUF_FORMAT
+        flags |= PyBUF_STRIDES if self.strided else PyBUF_C_CONTIGUOUS
+        if self.writable:
+            flags |= PyBUF_WRITABLE
+        return flags
+
+    @property
+    def nargs(self):
+        # Number of arguments passed to the function for this buffer
+        return 1 + int(self.length) + int(self.strided)
+
+    def __repr__(self):
+        opts = ''.join(', %s=True' % opt for opt in 
+                       ('length', 'strided', 'writable') if getattr(self, opt))
+        return "Buffer(%s%s)" % (self.ctype.__name__, opts)
+
+
+class ConstPointer(object):
+    """Pointer argument for :func:`builtin_function` whose referenced data is
+    not modified by the function.
+
+    Plain pointer arguments accept only writable buffers; a ConstPointer
+    argument also accepts read-only buffers such as bytes. *ctype* is the pointer 
+    type passed to the function (c_void_p by default).
+    """
+    def __init__(self, ctype=ctypes.c_void_p):
+        if _kind(ctype) != 'pointer':
+            raise TypeError("ConstPointer requires a pointer type, not %s" % 
+                            ctype.__name__)
+        self.ctype = ctype
+
+    def __repr__(self):
+        return "ConstPointer(%s)" % self.ctype.__name__
+
+
+class _CApi(object):
+    # Addresses of the Python C API functions used by trampolines
+    functions = ['PyLong_AsLong', 'PyLong_FromLong', 'PyFloat_AsDouble',
+                 'PyFloat_FromDouble', 'PyLong_AsVoidPtr', 'PyLong_FromVoidPtr',
+                 'PyObject_GetBuffer', 'PyBuffer_Release', 'PyObject_IsInstance',
+                 'PyErr_Occurred',
+                 'PyErr_Clear', 'PyErr_Format', 'Py_IncRef',
+                 'PyEval_SaveThread', 'PyEval_RestoreThread']
+
+    def __getattr__(self, name):
+        if name not in self.functions:
+            raise AttributeError(name)
+        addr = ctypes.cast(getattr(ctypes.pythonapi, name), ctypes.c_void_p).value
+        setattr(self, name, addr)
+        return addr
+
+    def exception(self, name):
+        # Address of a builtin exception type such as PyExc_TypeError
+        return ctypes.c_void_p.in_dll(ctypes.pythonapi, name).value
+
+_capi = _CApi()
+
+
+class BuiltinFunctionData(object):
+    """Holds the memory used by a builtin function created with
+    :func:`builtin_function`. This object is the function's ``__self__``,
+    which keeps the memory alive as long as the function exists.
+    """
+    def __init__(self, name, page, method_def, strings, target):
+        self.name = name
+        self.page = page
+        self.method_def = method_def
+        self.strings = strings
+        self.target = target
+
+    def __repr__(self):
+        return "<BuiltinFunctionData for %s>" % self.name
+
+
+def _call(addr):
+    return [mov(r11, addr), call(r11)]
+
+
+def trampoline(addr, restype, argtypes, name, nogil=True, fastcall=None):
+    """Return the assembly for a trampoline that calls the function at *addr*
+    with signature (*restype*, *argtypes*) given as ctypes types or
+    :class:`Buffer` or :class:`ConstPointer` instances.
+
+    The trampoline has the signature of a METH_FASTCALL function
+    ``(self, args, nargs)``, or of a METH_VARARGS function ``(self, tuple)``
+    if *fastcall* is False. Also returns the list of C strings that must be
+    kept alive while the code is in use.
+    """
+    if fastcall is None:
+        fastcall = HAVE_FASTCALL
+    kinds = [_kind(t) for t in argtypes]
+    rkind = None if restype is None else _kind(restype)
+    if rkind == 'buffer':
+        raise TypeError("Buffer may not be used as a return type.")
+    # Kinds of the arguments passed to the target function; buffers expand
+    # to a pointer, length, and stride.
+    ckinds = []
+    first = []   # index of the first target argument for each argument
+    for typ, kind in zip(argtypes, kinds):
+        first.append(len(ckinds))
+        if kind == 'buffer':
+            ckinds += ['pointer'] + ['int64'] * (typ.nargs - 1)
+        else:
+            ckinds.append(kind)
+    nint = len([k for k in ckinds if k not in ('double', 'float')])
+    if nint > 6 or len(ckinds) - nint > 8:
+        raise TypeError("Builtin functions support at most 6 integer / "
+                        "pointer and 8 floating-point arguments.")
+    nargs = len(kinds)
+    nbuf = len([k for k in kinds if k in ('pointer', 'buffer')])
+
+    # Stack layout below rbp: saved rbx and r12, then one slot per target 
+    # argument, the result, and a Py_buffer for each pointer argument.
+    def slot(i):
+        return qword([rbp - (24 + 8 * i)])
+    result = qword([rbp - (24 + 8 * len(ckinds))])
+    def view(j):
+        return rbp - (32 + 8 * len(ckinds) + BUFFER_SIZE * (j + 1))
+    local_size = 8 * len(ckinds) + 16 + BUFFER_SIZE * nbuf
+    local_size = (local_size + 15) // 16 * 16
+
+    strings = []
+    def string(text):
+        buf = ctypes.create_string_buffer(text.encode('ascii'))
+        strings.append(buf)
+        return ctypes.addressof(buf)
+
+    def raise_error(exc, message):
+        # Set an exception; rdx may hold a value used by the message format
+        return [
+            mov(rdi, _capi.exception(exc)),
+            mov(rsi, string(message)),
+            xor(eax, eax),
+        ] + _call(_capi.PyErr_Format)
+
+    code = [
+        push(rbp),
+        mov(rbp, rsp),
+        push(rbx),
+        push(r12),
+        sub(rsp, local_size),
+    ]
+    if not fastcall:
+        # METH_VARARGS: tuple size and items follow ob_refcnt and ob_type
+        code += [mov(rdx, qword([rsi + 16])), lea(rsi, [rsi + 24])]
+    code += [
+        mov(rbx, rsi),
+        cmp(rdx, nargs),
+        je('args_ok'),
+    ] + raise_error('PyExc_TypeError', 
+                    "%s() takes exactly %d arguments (%%zd given)" % 
+                    (name, nargs)) + [
+        xor(eax, eax),
+        jmp('done'),
+        label('args_ok'),
+    ]
+    # Buffers are released on exit if their 'obj' field is set
+    for j in range(nbuf):
+        code.append(mov(qword([view(j) + 8]), 0))
+
+    # Unbox arguments into stack slots
+    j = 0
+    for i, kind in enumerate(kinds):
+        ok = 'arg%d_ok' % i
+        k = first[i]
+        code.append(mov(rdi, qword([rbx + 8 * i])))
+        if kind in ('int32', 'int64'):
+            code += _call(_capi.PyLong_AsLong) + [
+                mov(slot(k), rax),
+                cmp(rax, -1),
+                jne(ok),
+            ]
+        elif kind in ('double', 'float'):
+            code += _call(_capi.PyFloat_AsDouble)
+            if kind == 'float':
+                code.append(cvtsd2ss(xmm0, xmm0))
+            code += [
+                movsd(slot(k), xmm0),
+                mov(rax, slot(k)),
+                mov(rcx, struct.unpack('q', struct.pack('d', -1.0))[0]),
+                cmp(rax, rcx) if kind == 'double' else cmp(eax, 0xbf800000 - 2**32),
+                jne(ok),
+            ]
+        elif kind == 'buffer':
+            code += _unbox_buffer(argtypes[i], i, name, view(j), slot, k,
+                                  string, raise_error)
+            j += 1
+            continue
+        else:
+            # Pointers may be given as objects supporting the buffer
+            # protocol, integer addresses, or None. Read-only buffers are
+            # accepted only for ConstPointer arguments. ctypes pointers also
+            # support the buffer protocol; their storage holds the address
+            # to pass.
+            none = 'arg%d_none' % i
+            const = isinstance(argtypes[i], ConstPointer)
+            code += [
+                mov(rax, id(None)),
+                cmp(rdi, rax),
+                je(none),
+                lea(rsi, [view(j)]),
+                mov(edx, PyBUF_SIMPLE if const else PyBUF_WRITABLE),
+            ] + _call(_capi.PyObject_GetBuffer) + [
+                test(eax, eax),
+                jne('arg%d_int' % i),
+                mov(rdi, qword([rbx + 8 * i])),
+                mov(rsi, id(_ctypes_pointers)),
+            ] + _call(_capi.PyObject_IsInstance) + [
+                mov(rcx, qword([view(j)])),
+                test(eax, eax),
+                jle('arg%d_buffer' % i),
+                mov(rcx, qword([rcx])),
+                label('arg%d_buffer' % i),
+                mov(slot(k), rcx),
+                jmp(ok),
+                label('arg%d_int' % i),
+            ] + _call(_capi.PyErr_Clear) + [
+                mov(rdi, qword([rbx + 8 * i])),
+            ] + _call(_capi.PyLong_AsVoidPtr) + [
+                mov(slot(k), rax),
+                test(rax, rax),
+                jne(ok),
+                jmp('arg%d_check' % i),
+                label(none),
+                mov(slot(k), 0),
+                jmp(ok),
+                label('arg%d_check' % i),
+            ]
+            j += 1
+        # -1 (or NULL) may indicate an error
+        code += _call(_capi.PyErr_Occurred) + [
+            test(rax, rax),
+            jne('fail'),
+            label(ok),
+        ]
+
+    # Call the target function
+    if nogil:
+        code += _call(_capi.PyEval_SaveThread) + [mov(r12, rax)]
+    iregs = [rdi, rsi, rdx, rcx, r8, r9]
+    fregs = [xmm0, xmm1, xmm2, xmm3, xmm4, xmm5, xmm6, xmm7]
+    for k, kind in enumerate(ckinds):
+        if kind == 'double':
+            code.append(movsd(fregs.pop(0), slot(k)))
+        elif kind == 'float':
+            code.append(movss(fregs.pop(0), dword([rbp - (24 + 8 * k)])))
+        else:
+            code.append(mov(iregs.pop(0), slot(k)))
+    code += _call(addr)
+    if rkind in ('double', 'float'):
+        if rkind == 'float':
+            code.append(cvtss2sd(xmm0, xmm0))
+        code.append(movsd(result, xmm0))
+    elif rkind == 'int32':
+        code += [movsxd(rax, eax), mov(result, rax)]
+    elif rkind is not None:
+        code.append(mov(result, rax))
+    if nogil:
+        code += [mov(rdi, r12)] + _call(_capi.PyEval_RestoreThread)
+
+    # Box the result
+    if rkind in ('double', 'float'):
+        code += [movsd(xmm0, result)] + _call(_capi.PyFloat_FromDouble)
+    elif rkind in ('int32', 'int64'):
+        code += [mov(rdi, result)] + _call(_capi.PyLong_FromLong)
+    elif rkind == 'pointer':
+        # NULL is returned as None, as for ctypes c_void_p
+        code += [
+            mov(rdi, result),
+            test(rdi, rdi),
+            je('return_none'),
+        ] + _call(_capi.PyLong_FromVoidPtr) + [jmp('boxed')]
+    if rkind in (None, 'pointer'):
+        code += [label('return_none'), mov(rdi, id(None))] + _call(
+            _capi.Py_IncRef) + [mov(rax, id(None))]
+    code += [label('boxed'), mov(result, rax), jmp('cleanup')]
+
+    code += [
+        label('fail'),
+        mov(result, 0),
+        label('cleanup'),
+    ]
+    for j in range(nbuf):
+        skip = 'release%d' % j
+        code += [
+            cmp(qword([view(j) + 8]), 0),
+            je(skip),
+            lea(rdi, [view(j)]),
+        ] + _call(_capi.PyBuffer_Release) + [
+            label(skip),
+        ]
+    code += [
+        mov(rax, result),
+        label('done'),
+        lea(rsp, [rbp - 16]),
+        pop(r12),
+        pop(rbx),
+        pop(rbp),
+        ret(),
+    ]
+    return code, strings
+
+
+def _unbox_buffer(buf, i, name, view, slot, k, string, raise_error):
+    # Return code that requests a buffer for argument *i* (already in rdi),
+    # checks its format and shape, and stores the pointer, length, and
+    # stride in consecutive slots starting at *k*.
+    shift = buf.itemsize.bit_length() - 1
+    arg = 'arg%d' % i
+    code = [
+        lea(rsi, [view]),
+        mov(edx, buf.flags),
+    ] + _call(_capi.PyObject_GetBuffer) + [
+        test(eax, eax),
+        jne('fail'),
+        # A NULL format means unsigned bytes
+        mov(rdx, qword([view + 40])),
+        test(rdx, rdx),
+        jne(arg + '_format'),
+        mov(rdx, string('B')),
+        label(arg + '_format'),
+        # Skip native / little-endian byte order prefixes
+        mov(rax, rdx),
+        movzx(ecx, byte([rax])),
+    ]
+    for prefix in '@=<':
+        code += [cmp(cl, ord(prefix)), je(arg + '_prefix')]
+    code += [
+        jmp(arg + '_code'),
+        label(arg + '_prefix'),
+        add(rax, 1),
+        movzx(ecx, byte([rax])),
+        label(arg + '_code'),
+        cmp(byte([rax + 1]), 0),
+        jne(arg + '_bad_format'),
+    ]
+    for char in Buffer.formats[buf.ctype]:
+        code += [cmp(cl, ord(char)), je(arg + '_format_ok')]
+    code += [
+        label(arg + '_bad_format'),
+    ] + raise_error('PyExc_TypeError', 
+                    "%s() argument %d must be a buffer of %s (format '%s'), "
+                    "not format '%%s'" % (name, i + 1, buf.ctype.__name__,
+                                          Buffer.formats[buf.ctype][0])) + [
+        jmp('fail'),
+        label(arg + '_format_ok'),
+        mov(rax, qword([view])),
+        mov(slot(k), rax),
+    ]
+    if buf.length:
+        k += 1
+        code += [
+            mov(rax, qword([view + 16])),
+            sar(rax, shift),
+            mov(slot(k), rax),
+        ]
+    if buf.strided:
+        k += 1
+        code += [
+            cmp(dword([view + 36]), 1),
+            je(arg + '_ndim_ok'),
+        ] + raise_error('PyExc_ValueError', 
+                        "%s() argument %d must be a 1-dimensional buffer" %
+                        (name, i + 1)) + [
+            jmp('fail'),
+            label(arg + '_ndim_ok'),
+            mov(rax, qword([view + 56])),
+            mov(rax, qword([rax])),
+            test(rax, buf.itemsize - 1),
+            je(arg + '_stride_ok'),
+        ] + raise_error('PyExc_ValueError',
+                        "%s() argument %d has a stride that is not a "
+                        "multiple of its item size" % (name, i + 1)) + [
+            jmp('fail'),
+            label(arg + '_stride_ok'),
+            sar(rax, shift),
+            mov(slot(k), rax),
+        ]
+    return code
+
+
+def builtin_function(addr, restype, argtypes, name='function', nogil=True,
+                     doc=None, target=None):
+    """Return a Python builtin function that calls the machine code at *addr*.
+
+    *restype* and *argtypes* give the signature of the function as ctypes
+    types (c_int, c_long, c_float, c_double, c_void_p, or ctypes pointer
+    types; restype may be None). Integer and floating-point arguments are
+    converted as ctypes would convert them. Pointer arguments accept writable
+    objects supporting the buffer protocol (the address of the buffer is 
+    passed), ctypes pointers and c_void_p instances (their value is passed),
+    integer addresses, and None; pointer types wrapped in
+    :class:`ConstPointer` also accept read-only buffers. Arguments given as :class:`Buffer` instances
+    accept only buffers with the expected item type and layout, and may pass
+    the length and stride of the buffer as additional arguments. Pointer
+    return values are returned as integers, or None for NULL.
+
+    If *nogil* is True, the GIL is released while the function runs. The
+    *target* object (for example, the CodePage containing *addr*) is kept
+    alive as long as the builtin function exists.
+
+    Only the System V x86-64 calling convention is supported.
+    """
+    from .codepage import CodePage
+    if ARCH != 64 or sys.platform == 'win32':
+        raise NotImplementedError("Builtin functions require the System V "
+                                  "x86-64 calling convention.")
+    asm, strings = trampoline(addr, restype, argtypes, name, nogil)
+    page = CodePage(asm)
+
+    name_buf = ctypes.create_string_buffer(name.encode('ascii'))
+    doc_buf = None if doc is None else ctypes.create_string_buffer(doc.encode('utf-8'))
+    method_def = PyMethodDef(ctypes.cast(name_buf, ctypes.c_char_p),
+                             page.page_addr,
+                             METH_FASTCALL if HAVE_FASTCALL else METH_VARARGS,
+                             None if doc_buf is None else
+                             ctypes.cast(doc_buf, ctypes.c_char_p))
+    data = BuiltinFunctionData(name, page, method_def,
+                               strings + [name_buf, doc_buf], target)
+
+    new = ctypes.pythonapi.PyCFunction_NewEx
+    new.restype = ctypes.py_object
+    new.argtypes = [ctypes.POINTER(PyMethodDef), ctypes.py_object,
+                    ctypes.py_object]
+    return new(ctypes.byref(method_def), data, None)
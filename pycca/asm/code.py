@@ -33,6 +33,26 @@ class Code(object):
             code = code[:i] + val + code[i+len(val):]
         return code
 
+    def relocations(self, symbols, shifted):
+        """Return a list of (index, packing) for each replacement whose value
+        is an absolute address within the program.
+
+        *shifted* contains the same symbols as *symbols*, with all addresses
+        offset by the same amount (as if the program were loaded at a 
+        different address).
+        Replacements whose value changes by that amount must be adjusted if
+        the code is moved; relative offsets do not change.
+        """
+        delta = shifted['instr_addr'] - symbols['instr_addr']
+        relocs = []
+        for i, expr, packing in self.replacements:
+            change = eval(expr, shifted) - eval(expr, symbols)
+            if change == delta:
+                relocs.append((i, packing))
+            elif change != 0:
+                raise ValueError("Cannot relocate expression '%s'" % expr)
+        return relocs
+
     def __add__(self, x):
         if isinstance(x, Code):
             code = Code(self.code + x.code)
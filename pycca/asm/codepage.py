@@ -1,10 +1,31 @@
 # -'- coding: utf-8 -'-
 
-import sys, mmap, ctypes
+import os, re, sys, mmap, ctypes, struct, threading, contextlib
+from . import ARCH
 from .instruction import Instruction, Code, Label
+from .patch import Patch
+from .align import Align, place, align_labels
+from .data import Data
 from .parser import parse_asm
 
 
+# ctypes releases the GIL when calling foreign functions unless the function
+# type has the FUNCFLAG_PYTHONAPI flag (as for ctypes.pythonapi).
+if sys.platform == 'win32':
+    NoGilFunction = ctypes.WINFUNCTYPE(None)  # stdcall
+else:
+    NoGilFunction = ctypes.CFUNCTYPE(None)    # cdecl
+
+class GilFunction(NoGilFunction):
+    _flags_ = NoGilFunction._flags_ | ctypes._FUNCFLAG_PYTHONAPI
+
+# Offset used to detect label references that are absolute addresses
+RELOC_SHIFT = 0x10000
+
+# Size and alignment of pages allocated with hugepages=True
+HUGE_PAGE_SIZE = 2 * 1024**2
+
+
 class CodePage(object):
     """Compiles assembly, loads machine code into executable memory, and 
     generates python functions for accessing the code.
@@ -18,9 +39,62 @@ class CodePage(object):
     sequence of asm commands are compiled and written. The memory page(s) may 
     contain multiple functions; use get_function(label) to create functions 
     beginning at a specific location in the code.
+    
+    If *shared* is True (Linux only), the code is written to a shared memory
+    file (see :class:`SharedPage`). Forked processes share the same physical
+    memory, and the CodePage may be pickled and sent to other processes (for
+    example, with multiprocessing), which map the code without recompiling
+    it. Code that refers to addresses outside the page (such as calls to 
+    library functions by address) is only valid in processes that load those
+    libraries at the same addresses, such as forked children.
+
+    If *profile* is True (64-bit only), each function in the page counts its
+    calls and the processor cycles spent in it; see 
+    :mod:`pycca.asm.instrument`. The counters are available as 
+    ``page.profile``. *profile* may also be a list of the labels to 
+    instrument. Without *profile*, the generated code is unchanged.
+
+    *capacity* is the minimum number of bytes to reserve for the page; space
+    beyond the compiled code is used by :func:`add`.
+
+    Immediate operands created with :func:`patch() <pycca.asm.patch>` may be
+    changed after compiling with :func:`CodePage.patch`.
+
+    By default the page is mapped with read, write and execute access. If 
+    *wx* is True or 'mprotect', the page is never writable and executable
+    at the same time (see :class:`ProtectedPage`): the code is written and
+    then the page is made read/execute with a single mprotect() call. Later
+    changes made by :func:`add` and :func:`patch` make the page writable
+    again while they run; use :func:`writable` to group several changes.
+    Code in the page must not run while it is writable. If *wx* is 'dual' 
+    (Linux only), the code is written through a second, read/write mapping
+    of the same memory instead, so the protection never changes and the
+    code may be modified while it runs.
+
+    If *hugepages* is True (Linux only), the page is allocated in multiples
+    of 2 MB, aligned to 2 MB, and backed by huge pages if possible to 
+    reduce instruction TLB misses in large programs (see 
+    :class:`HugePage`). The backing that was used is given by 
+    :attr:`backing`. Shared pages and pages with ``wx='dual'`` always use
+    normal pages.
+
+    If *align* is given, it is an alignment (or a tuple of alignment and 
+    maximum padding, as for :func:`align() <pycca.asm.align>`) applied to 
+    each function entry and loop target label, including labels in code 
+    added later (see :func:`align_labels() 
+    <pycca.asm.align.align_labels>`).
+
+    *constants* may be a :class:`ConstantPool <pycca.asm.data.ConstantPool>`
+    used by the code; its constants are placed after the code, and 
+    constants used by code added later are placed after that code.
     """
-    def __init__(self, asm, namespace=None):
+    def __init__(self, asm, namespace=None, shared=False, profile=False,
+                 capacity=None, wx=False, hugepages=False, align=None,
+                 constants=None):
         self.labels = {}
+        self.patches = {}       # name => [(address, packing, sign-extended)]
+        self.patch_values = {}  # name => current value
+        self.segments = []
         if isinstance(asm, str):
             asm = parse_asm(asm, namespace=namespace)
         else:
@@ -28,15 +102,55 @@ class CodePage(object):
                 raise TypeError("Namespace argument may only be used with "
                                 "string assembly type.")
         
+        self.constants = constants
+        if constants is not None:
+            asm = list(asm) + constants.asm()
+
+        self.align = align
+        if align is not None:
+            asm = self._align_labels(asm)
+
+        self.profile = None
+        if profile:
+            if ARCH == 32:
+                raise NotImplementedError("Profiling is only supported for "
+                                          "64-bit code.")
+            if shared:
+                raise ValueError("Profiled code refers to counters in this "
+                                 "process and cannot be shared.")
+            from .instrument import instrument
+            functions = None if profile is True else profile
+            asm, self.profile = instrument(asm, functions)
+
         self.asm = asm
-        code_size = len(self)
-        #pagesize = os.sysconf("SC_PAGESIZE")
+        self.wx = wx
+        self.hugepages = hugepages
+        huge = (hugepages and sys.platform.startswith('linux') and 
+                not shared and wx != 'dual')
+        code_size = max(len(self), capacity or 0, 1)
+        # round up to whole pages; the rest of the last page is free
+        pagesize = HUGE_PAGE_SIZE if huge else mmap.PAGESIZE
+        code_size = -(-code_size // pagesize) * pagesize
         
         # Create a memory-mapped page with execute privileges
-        if sys.platform == 'win32':
+        if wx:
+            if wx not in (True, 'mprotect', 'dual'):
+                raise ValueError("wx must be True, 'mprotect', or 'dual'.")
+            if shared:
+                raise ValueError("W^X is not supported for shared pages.")
+            self.page = ProtectedPage(code_size, dual=(wx == 'dual'),
+                                      hugepages=huge)
+            self.page_addr = self.page.addr
+        elif shared:
+            self.page = SharedPage(code_size)
+            self.page_addr = self.page.addr
+        elif sys.platform == 'win32':
             #self.page = mmap.mmap(-1, code_size, access=0x40)
             self.page = WinPage(code_size)
             self.page_addr = self.page.addr
+        elif huge:
+            self.page = HugePage(code_size)
+            self.page_addr = self.page.addr
         else:
             PROT_NONE = 0
             PROT_READ = 1
@@ -49,75 +163,376 @@ class CodePage(object):
             self.page_addr = ctypes.addressof(buf)
         
         # Compile machine code and write to the page.
+        self.asm = asm = place(asm, self.page_addr)
         code = self.compile(asm)
         assert len(code) <= len(self.page)
         self.page.write(bytes(code))
         self.code = code
+        if isinstance(self.page, ProtectedPage):
+            self.page.protect()
+
+        # Optionally describe the code to debuggers
+        from . import gdbjit
+        if gdbjit.enabled:
+            gdbjit.register(self)
         
     def __len__(self):
+        if self.asm is None:
+            return len(self.code)
         return sum(map(len, self.asm))
 
-    def get_function(self, label=None):
+    @property
+    def backing(self):
+        """The kind of memory used for the page: 'hugetlb' (explicit huge 
+        pages), 'thp' (transparent huge pages), or 'normal'.
+        """
+        return getattr(self.page, 'backing', 'normal')
+
+    def __reduce__(self):
+        if not isinstance(self.page, SharedPage):
+            raise TypeError("Only CodePages created with shared=True may be "
+                            "pickled.")
+        from multiprocessing.reduction import DupFd
+        return (_attach_shared, (DupFd(self.page.fd), len(self.code), 
+                                 self.page_addr, self.labels, 
+                                 self.relocations, self.patches))
+
+    def add(self, asm, namespace=None, nogil=True):
+        """Compile *asm* (an assembly string or a list of instructions) and
+        add it to the page, returning a dict of {label: function} for the
+        new functions (labels that are not jump targets; see 
+        :func:`get_function`).
+
+        Existing code is not moved or recompiled, so functions that were
+        already created remain valid. The new code may refer to labels 
+        defined earlier in the page. It is written to the space reserved by
+        the *capacity* argument if possible; otherwise it is placed in a new
+        segment of executable memory (see ``page.segments``) that is at least 
+        as large as the page so far. Segments are not included in 
+        :func:`dump`, :func:`write_object`, or :func:`write_library`.
+
+        Calls to :func:`add` must not be made concurrently with each other.
+        """
+        if isinstance(asm, str):
+            # labels are referred to by name
+            symbols = dict((name, name) for name in self.labels)
+            symbols.update(namespace or {})
+            asm = parse_asm(asm, namespace=symbols)
+        elif namespace is not None:
+            raise TypeError("Namespace argument may only be used with "
+                            "string assembly type.")
+        if self.asm is None:
+            raise RuntimeError("Code cannot be added to a CodePage received "
+                               "from another process.")
+        if self.profile is not None:
+            raise NotImplementedError("Code cannot be added to a profiled "
+                                      "CodePage.")
+        for cmd in asm:
+            if isinstance(cmd, Label) and cmd.name in self.labels:
+                raise NameError("Label '%s' is already defined." % cmd.name)
+        if self.constants is not None:
+            asm = list(asm) + self.constants.asm()
+        if self.align is not None:
+            asm = self._align_labels(asm)
+
+        size = sum(map(len, asm))
+        seg = self.segments[-1] if len(self.segments) > 0 else self
+        if len(seg.code) + size > len(seg.page):
+            if isinstance(self.page, SharedPage):
+                raise ValueError("Shared CodePage does not have room for %d "
+                                 "more bytes; use the *capacity* argument "
+                                 "to reserve space." % size)
+            total = sum(len(s.page) for s in [self] + self.segments)
+            seg = CodePage([], capacity=max(size, total), wx=self.wx,
+                           hugepages=self.hugepages)
+            seg.patches = self.patches
+            seg.patch_values = self.patch_values
+            self.segments.append(seg)
+        with seg.writable():
+            seg._append(asm, None if seg is self else self.labels)
+        self.labels.update(seg.labels)
+
+        from .instrument import function_labels
+        return dict((name, self.get_function(name, nogil=nogil)) 
+                    for name in function_labels(asm))
+
+    def _align_labels(self, asm):
+        if isinstance(self.align, tuple):
+            return align_labels(asm, *self.align)
+        return align_labels(asm, self.align)
+
+    def _append(self, asm, extern=None):
+        # Compile *asm* after the existing code in the page
+        asm = place(asm, self.page_addr + len(self.code))
+        code = self._compile(asm, self.page_addr + len(self.code), extern)
+        self.page.write(bytes(code))
+        self.code += code
+        self.asm = list(self.asm) + list(asm)
+        from . import gdbjit
+        gdbjit.update(self)
+
+    def patch(self, name, value):
+        """Set the value of the immediate operands created with
+        ``patch(name, ...)``, rewriting the code in place.
+
+        Each field is written with a single aligned store if it does not
+        cross a boundary of the native word size (8 bytes for 64-bit code),
+        so that threads executing the code concurrently see either the old
+        or the new value. Use :func:`patch_atomic` to check this.
+
+        Raises ValueError, without modifying the code, if any field would
+        not hold *value* unchanged (fields that the instruction sign-extends 
+        accept only values in the signed range of the field).
+
+        Code added to the page later that uses the same name is compiled 
+        with the current value.
+        """
+        if name not in self.patches:
+            raise NameError("Patch point '%s' does not exist." % name)
+        # Check that the value fits every field before writing any of them
+        writes = [(addr, _pack_patch(name, value, packing, signed))
+                  for addr, packing, signed in self.patches[name]]
+        with _patch_lock, self.writable():
+            for addr, data in writes:
+                _write_code(addr + self._write_offset(addr), data)
+            self.patch_values[name] = value
+
+    @contextlib.contextmanager
+    def writable(self):
+        """Context manager that allows the code in the page and its segments
+        to be modified.
+
+        For pages created with ``wx=True``, each segment is made writable
+        (and not executable) on entry and executable again on exit, using
+        one mprotect() call each time; calls to :func:`add` and 
+        :func:`patch` inside the context do not change the protection 
+        again. For other pages this does nothing.
+        """
+        pages = [seg.page for seg in [self] + self.segments
+                 if isinstance(seg.page, ProtectedPage)]
+        for page in pages:
+            page.unprotect()
+        try:
+            yield
+        finally:
+            for page in pages:
+                page.protect()
+
+    def _write_offset(self, addr):
+        # Return the offset from *addr* to its writable mapping
+        for seg in [self] + self.segments:
+            if (seg.page_addr <= addr < seg.page_addr + len(seg.page) and
+                    isinstance(seg.page, ProtectedPage)):
+                return seg.page.rw_offset
+        return 0
+
+    def patch_atomic(self, name):
+        """Return True if all fields of the patch point *name* can be 
+        written with a single aligned store.
+        """
+        word = ARCH // 8
+        return all(addr // word == (addr + struct.calcsize(packing) - 1) // word
+                   for addr, packing, signed in self.patches[name])
+
+    def get_function(self, label=None, nogil=True):
         """Create and return a python function that points to a specific label
         within the compiled code block, or the first byte if no label is given. 
         
         The return value is a *ctypes* function; it is recommended to set the
         restype and argtypes properties on the function before calling it.
+        
+        If *nogil* is True (the default), the GIL is released while the 
+        function runs, so that calls made from several Python threads may run
+        concurrently. Such code must not access Python objects or call the
+        Python C API. If *nogil* is False, the GIL is held during the call.
         """
         addr = self.page_addr
         if label is not None:
             addr = self.labels[label]
         
         # Turn this into a callable function
-        if sys.platform == 'win32':
-            f = ctypes.WINFUNCTYPE(None)(addr)  # stdcall    
-        else:
-            f = ctypes.CFUNCTYPE(None)(addr)    # cdecl
+        f = (NoGilFunction if nogil else GilFunction)(addr)
         f.page = self  # Make sure page stays alive as long as function pointer!
         return f
 
+    def get_builtin(self, label=None, restype=None, argtypes=(), nogil=True,
+                    name=None):
+        """Return a Python builtin function that calls the code at *label*
+        with the given signature (ctypes types for the return value and 
+        arguments).
+        
+        Builtin functions are much faster to call than ctypes functions; see
+        :func:`builtin_function() <pycca.asm.builtin.builtin_function>`.
+        """
+        from .builtin import builtin_function
+        addr = self.page_addr if label is None else self.labels[label]
+        if name is None:
+            name = 'function' if label is None else label
+        return builtin_function(addr, restype, argtypes, name=name, 
+                                nogil=nogil, target=self)
+
+    def get_batch(self, label=None, restype=None, argtypes=(), nogil=True):
+        """Return a :class:`BatchFunction <pycca.asm.batch.BatchFunction>`
+        that calls the code at *label* once for each row of a set of arrays.
+        
+        *restype* and *argtypes* give the signature of the function as ctypes
+        types.
+        """
+        from .batch import BatchFunction
+        addr = self.page_addr if label is None else self.labels[label]
+        return BatchFunction(addr, restype, argtypes, nogil=nogil, 
+                             target=self)
+
+    def get_ufunc(self, name, kernels, identity=None, doc=None):
+        """Return a numpy ufunc with one inner loop for each item in 
+        *kernels*.
+        
+        Each kernel is either ``(label, restype, argtypes)``, giving a scalar
+        function that is called once per element, or ``(label, types)``,
+        giving an inner loop written with the numpy signature 
+        ``void loop(char** args, npy_intp* n, npy_intp* steps, void* data)``
+        whose last type is the output. See 
+        :func:`make_ufunc() <pycca.asm.ufunc.make_ufunc>`.
+        """
+        from .ufunc import InnerLoop, make_ufunc
+        loops = []
+        for kernel in kernels:
+            addr = self.labels[kernel[0]]
+            if len(kernel) == 3:
+                loop = InnerLoop.from_scalar(addr, kernel[1], kernel[2], 
+                                             target=self)
+            else:
+                loop = InnerLoop(addr, kernel[1], target=self)
+            loops.append(loop)
+        return make_ufunc(name, loops, identity=identity, doc=doc)
+
+    def write_object(self, filename):
+        """Write the code to an ELF64 relocatable object file (Linux x86-64).
+        
+        Labels become symbols; see :mod:`pycca.asm.elf`.
+        """
+        from .elf import object_file
+        with open(filename, 'wb') as fh:
+            fh.write(object_file(self))
+
+    def write_library(self, filename, soname=None):
+        """Write the code to an ELF64 shared library (Linux x86-64) that can
+        be loaded with ``ctypes.CDLL``.
+        
+        Labels that do not begin with an underscore are exported; see 
+        :mod:`pycca.asm.elf`.
+        """
+        from .elf import shared_library
+        with open(filename, 'wb') as fh:
+            fh.write(shared_library(self, soname))
+
     def compile(self, asm):
-        ptr = self.page_addr
+        self.relocations = []
+        return self._compile(place(asm, self.page_addr), self.page_addr)
+
+    def _compile(self, asm, addr, extern=None):
+        # Compile *asm* to be loaded at *addr* within the page. *extern* 
+        # may give the addresses of labels defined outside the page.
+        ptr = addr
         # First locate all labels
         for cmd in asm:
             ptr += len(cmd)
             if isinstance(cmd, Label):
                 self.labels[cmd.name] = ptr
                 
+        # Find the initial values of patch points; those already in the 
+        # page keep their current value.
+        values = {}
+        for cmd in asm:
+            if not isinstance(cmd, Instruction):
+                continue
+            for arg in cmd.args:
+                if not isinstance(arg, Patch):
+                    continue
+                if arg.name in self.labels or (extern and arg.name in extern):
+                    raise NameError("Patch point '%s' has the same name as a "
+                                    "label." % arg.name)
+                if arg.name in self.patch_values:
+                    continue
+                if values.setdefault(arg.name, arg.value) != arg.value:
+                    raise ValueError("Patch point '%s' has more than one "
+                                     "initial value." % arg.name)
+        values.update((name, value) for name, value in 
+                      self.patch_values.items() if name not in values)
+                
         # now compile
-        symbols = self.labels.copy()
+        symbols = dict(extern or {})
+        symbols.update(self.labels)
+        # Symbols as if the code (with any external labels) were loaded 
+        # elsewhere, used to find the absolute addresses that must be 
+        # relocated when the code is moved
+        shifted = dict((k, v + RELOC_SHIFT) for k, v in symbols.items())
+        # Patch fields are written below, once the code is complete
+        symbols.update((name, 0) for name in values)
+        shifted.update((name, 0) for name in values)
+        offset = addr - self.page_addr
         code = b''
+        sites = []
         for cmd in asm:
             if isinstance(cmd, Label):
                 continue
             
+            instr = None
             if isinstance(cmd, Instruction):
+                instr = cmd
+                cmd = cmd.code
+            elif isinstance(cmd, (Align, Data)):
                 cmd = cmd.code
                 
             if isinstance(cmd, Code):
                 # Make some special symbols available when resolving
                 # expressions:
-                symbols['instr_addr'] = self.page_addr + len(code)
+                symbols['instr_addr'] = addr + len(code)
                 symbols['next_instr_addr'] = symbols['instr_addr'] + len(cmd)
+                for name in ('instr_addr', 'next_instr_addr'):
+                    shifted[name] = symbols[name] + RELOC_SHIFT
+                for i, packing in cmd.relocations(symbols, shifted):
+                    self.relocations.append((offset + len(code) + i, 
+                                             packing))
+                for i, expr, packing in cmd.replacements:
+                    if expr in values:
+                        signed = instr is None or instr._patch[2]
+                        sites.append((expr, len(code) + i, packing, signed))
                 
                 cmd = cmd.compile(symbols)
             
             code += cmd
+        
+        # Write the value of each patch point into its fields
+        for name, i, packing, signed in sites:
+            data = _pack_patch(name, values[name], packing, signed)
+            code = code[:i] + data + code[i+len(data):]
+        for name, i, packing, signed in sites:
+            self.patches.setdefault(name, []).append((addr + i, packing, 
+                                                      signed))
+        for name in set(site[0] for site in sites):
+            self.patch_values.setdefault(name, values[name])
         return code
 
     def dump(self):
         """Return a string representation of the machine code and assembly
         instructions contained in the code page.
         """
+        if self.asm is None:
+            raise RuntimeError("Assembly is not available for a CodePage "
+                               "received from another process.")
         code = ''
         ptr = 0
         for instr in self.asm:
             hex = ''
-            if isinstance(instr, Instruction):
-                for c in bytearray(instr.code):
+            if not isinstance(instr, Label):
+                # use compiled code so that label references are resolved
+                for c in bytearray(self.code[ptr:ptr+len(instr)]):
                     hex += '%02x' % c
+            if not isinstance(instr, Instruction):
+                instr = repr(instr) if isinstance(instr, bytes) else instr
             code += '0x%04x: %s%s%s\n' % (ptr, hex, ' '*(40-len(hex)), instr)
-            ptr += len(hex)/2
+            ptr += len(hex)//2
         return code
 
 
@@ -151,7 +566,329 @@ class WinPage(object):
         vfree(self.addr, self.size, MEM_RELEASE)
     
 
-def mkfunction(code, namespace=None):
+class ProtectedPage(object):
+    """Executable memory that is never writable and executable at the same
+    time (W^X).
+
+    The page is created writable and becomes read/execute when 
+    :func:`protect` is called; :func:`unprotect` makes it writable again.
+    Calls may be nested, and only the outermost pair changes the 
+    protection, with one mprotect() call each.
+
+    If *dual* is True (Linux only), a shared memory file is mapped twice: 
+    read/execute at *addr* and read/write at ``addr + rw_offset``. Code is
+    written through the second mapping, and the protection never changes.
+    """
+    def __init__(self, size, dual=False, hugepages=False):
+        if sys.platform == 'win32':
+            raise NotImplementedError("W^X pages are not supported on "
+                                      "Windows.")
+        if dual and not sys.platform.startswith('linux'):
+            raise NotImplementedError("Dual-mapped pages require Linux.")
+        self.size = size
+        self.ptr = 0
+        self.dual = dual
+        self._writers = 1
+        self._lock = threading.Lock()
+        if dual:
+            self.fd = _memfd('pycca', size)
+            self.addr = _mmap(size, self.fd, prot=_PROT_RX)
+            self.rw_addr = _mmap(size, self.fd, prot=_PROT_RW)
+        elif hugepages:
+            self.fd = None
+            self._huge = _HugeMapping(size, _PROT_RW)
+            self.addr = self.rw_addr = self._huge.addr
+        else:
+            self.fd = None
+            self.addr = _mmap(size, -1, shared=False, prot=_PROT_RW)
+            self.rw_addr = self.addr
+        self.rw_offset = self.rw_addr - self.addr
+
+    def write(self, data):
+        ctypes.memmove(self.rw_addr + self.ptr, data, len(data))
+        self.ptr += len(data)
+
+    def protect(self):
+        with self._lock:
+            self._writers -= 1
+            if self._writers == 0 and not self.dual:
+                _mprotect(self.addr, self.size, _PROT_RX)
+
+    def unprotect(self):
+        with self._lock:
+            self._writers += 1
+            if self._writers == 1 and not self.dual:
+                _mprotect(self.addr, self.size, _PROT_RW)
+
+    @property
+    def backing(self):
+        huge = getattr(self, '_huge', None)
+        return 'normal' if huge is None else huge.backing
+
+    def __len__(self):
+        return self.size
+
+    def __del__(self):
+        if getattr(self, '_huge', None) is not None:
+            return  # unmapped by _HugeMapping
+        _munmap(self.addr, self.size)
+        if self.dual:
+            _munmap(self.rw_addr, self.size)
+            os.close(self.fd)
+
+
+class HugePage(object):
+    """Private executable memory aligned to :data:`HUGE_PAGE_SIZE` and 
+    backed by huge pages if possible (Linux only).
+
+    *size* must be a multiple of HUGE_PAGE_SIZE. Explicit huge pages 
+    (MAP_HUGETLB) are used if the system has reserved enough of them; 
+    otherwise the memory is advised to use transparent huge pages (with
+    madvise(MADV_HUGEPAGE)), and if that is not possible, normal pages are 
+    used. :attr:`backing` gives the result: 'hugetlb', 'thp', or 'normal'.
+    """
+    def __init__(self, size):
+        if not sys.platform.startswith('linux'):
+            raise NotImplementedError("Huge pages require Linux.")
+        self.size = size
+        self.ptr = 0
+        self._huge = _HugeMapping(size, _PROT_RWX)
+        self.addr = self._huge.addr
+
+    @property
+    def backing(self):
+        return self._huge.backing
+
+    def write(self, data):
+        ctypes.memmove(self.addr + self.ptr, data, len(data))
+        self.ptr += len(data)
+
+    def __len__(self):
+        return self.size
+
+
+class _HugeMapping(object):
+    # Anonymous private memory aligned to HUGE_PAGE_SIZE, using huge pages 
+    # if possible
+    def __init__(self, size, prot):
+        MAP_HUGETLB = 0x40000
+        MADV_HUGEPAGE = 14
+        self.size = size
+        try:
+            self.addr = _mmap(size, -1, shared=False, prot=prot, 
+                              flags=MAP_HUGETLB)
+            self._backing = 'hugetlb'
+            return
+        except OSError:
+            # no huge pages reserved
+            pass
+        # Reserve enough to align the start, then release the excess
+        ptr = _mmap(size + HUGE_PAGE_SIZE, -1, shared=False, prot=prot)
+        self.addr = -(-ptr // HUGE_PAGE_SIZE) * HUGE_PAGE_SIZE
+        if self.addr > ptr:
+            _munmap(ptr, self.addr - ptr)
+        end = ptr + size + HUGE_PAGE_SIZE
+        if end > self.addr + size:
+            _munmap(self.addr + size, end - self.addr - size)
+        if _get_libc().madvise(self.addr, size, MADV_HUGEPAGE) == 0:
+            self._backing = 'thp'
+        else:
+            # kernel without transparent huge pages, or disabled
+            self._backing = 'normal'
+
+    @property
+    def backing(self):
+        # Transparent huge pages are only used if available when the memory
+        # is first written
+        if self._backing == 'thp' and _anon_huge_pages(self.addr) == 0:
+            return 'normal'
+        return self._backing
+
+    def __del__(self):
+        _munmap(self.addr, self.size)
+
+
+def _anon_huge_pages(addr):
+    # Return the size (kB) of transparent huge pages in the mapping that 
+    # contains *addr*, or None if it cannot be determined.
+    try:
+        lines = open('/proc/self/smaps').readlines()
+    except IOError:
+        return None
+    found = False
+    for line in lines:
+        m = re.match(r'([0-9a-f]+)-([0-9a-f]+) ', line)
+        if m is not None:
+            start, end = [int(x, 16) for x in m.groups()]
+            found = start <= addr < end
+        elif found and line.startswith('AnonHugePages:'):
+            return int(line.split()[1])
+    return None
+
+
+class SharedPage(object):
+    """Executable memory backed by a shared memory file (memfd).
+
+    If *fd* is given, an existing file is mapped, preferably at *addr*.
+    If the page cannot be placed there, it is mapped elsewhere; in that
+    case, if *relocations* (a list of (offset, packing) as recorded by 
+    :func:`CodePage.compile`) is not empty, the mapping is made private and
+    the relocated addresses are adjusted.
+    """
+    def __init__(self, size, fd=None, addr=None, relocations=()):
+        if not sys.platform.startswith('linux'):
+            raise NotImplementedError("Shared code pages require Linux.")
+        self.size = size
+        self.ptr = 0
+        if fd is None:
+            fd = _memfd('pycca', size)
+        self.fd = fd
+        self.addr = _mmap(size, fd, addr, shared=True)
+        self.delta = 0 if addr is None else self.addr - addr
+        if self.delta != 0 and len(relocations) > 0:
+            # Private copy of the code with relocated addresses
+            _munmap(self.addr, size)
+            self.addr = _mmap(size, fd, None, shared=False)
+            for offset, packing in relocations:
+                field = self.addr + offset
+                n = struct.calcsize(packing)
+                val = struct.unpack(packing, ctypes.string_at(field, n))[0]
+                ctypes.memmove(field, struct.pack(packing, val + self.delta), n)
+
+    def write(self, data):
+        ctypes.memmove(self.addr + self.ptr, data, len(data))
+        self.ptr += len(data)
+
+    def __len__(self):
+        return self.size
+
+    def __del__(self):
+        _munmap(self.addr, self.size)
+        os.close(self.fd)
+
+
+def _memfd(name, size):
+    # Return a file descriptor for an anonymous shared memory file
+    if hasattr(os, 'memfd_create'):
+        fd = os.memfd_create(name)
+    else:
+        import tempfile
+        fd, path = tempfile.mkstemp(prefix=name, dir='/dev/shm')
+        os.unlink(path)
+    os.ftruncate(fd, size)
+    return fd
+
+
+_libc = None
+
+# PROT_READ | PROT_WRITE, PROT_READ | PROT_EXEC, and all three
+_PROT_RW = 3
+_PROT_RX = 5
+_PROT_RWX = 7
+
+def _get_libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(None, use_errno=True)
+        _libc.mmap.restype = ctypes.c_void_p
+        _libc.mmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int,
+                               ctypes.c_int, ctypes.c_int, ctypes.c_long]
+        _libc.munmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+        _libc.mprotect.argtypes = [ctypes.c_void_p, ctypes.c_size_t, 
+                                   ctypes.c_int]
+        _libc.madvise.argtypes = [ctypes.c_void_p, ctypes.c_size_t, 
+                                  ctypes.c_int]
+    return _libc
+
+
+def _mmap(size, fd, addr=None, shared=True, prot=_PROT_RWX, flags=0):
+    # Map *fd* (or anonymous memory if *fd* is -1) with access *prot*, at
+    # *addr* if possible. *flags* are added to the mmap() flags.
+    libc = _get_libc()
+    flags |= mmap.MAP_SHARED if shared else mmap.MAP_PRIVATE
+    if fd == -1:
+        flags |= mmap.MAP_ANONYMOUS
+    if addr is not None:
+        MAP_FIXED_NOREPLACE = 0x100000
+        ptr = libc.mmap(addr, size, prot, flags | MAP_FIXED_NOREPLACE, fd, 0)
+        if ptr == addr:
+            return ptr
+        if ptr is not None and ptr != ctypes.c_void_p(-1).value:
+            # older kernels treat the address as a hint only
+            libc.munmap(ptr, size)
+    ptr = libc.mmap(None, size, prot, flags, fd, 0)
+    if ptr is None or ptr == ctypes.c_void_p(-1).value:
+        err = ctypes.get_errno()
+        raise OSError(err, "mmap failed: %s" % os.strerror(err))
+    return ptr
+
+
+def _mprotect(addr, size, prot):
+    if _get_libc().mprotect(addr, size, prot) != 0:
+        err = ctypes.get_errno()
+        raise OSError(err, "mprotect failed: %s" % os.strerror(err))
+
+
+def _munmap(addr, size):
+    _libc.munmap(addr, size)
+
+
+_patch_lock = threading.Lock()
+
+
+def _pack_patch(name, value, packing, signed):
+    # Pack *value* for a field of patch point *name*. Fields that are 
+    # sign-extended by their instruction hold only signed values; others may
+    # also hold unsigned values of the same width.
+    for fmt in (packing,) if signed else (packing, packing.upper()):
+        try:
+            return struct.pack(fmt, value)
+        except struct.error:
+            pass
+    raise ValueError("Value %r does not fit in the %d-bit %sfield of patch "
+                     "point '%s'." % (value, 8 * struct.calcsize(packing), 
+                                      'sign-extended ' if signed else '', 
+                                      name))
+
+def _write_code(addr, data):
+    # Write *data* to code at *addr*, using a single store of one aligned
+    # word if possible
+    word = ARCH // 8
+    start = addr - addr % word
+    if addr + len(data) > start + word:
+        ctypes.memmove(addr, data, len(data))
+        return
+    ctype = ctypes.c_uint64 if word == 8 else ctypes.c_uint32
+    fmt = 'Q' if word == 8 else 'I'
+    field = ctype.from_address(start)
+    buf = bytearray(struct.pack(fmt, field.value))
+    buf[addr-start:addr-start+len(data)] = data
+    field.value = struct.unpack(fmt, bytes(buf))[0]
+
+
+def _attach_shared(handle, size, addr, labels, relocations, patches):
+    # Reconstruct a shared CodePage in another process
+    page = SharedPage(size, handle.detach(), addr, relocations)
+    cp = CodePage.__new__(CodePage)
+    cp.asm = None
+    cp.wx = False
+    cp.hugepages = False
+    cp.align = None
+    cp.constants = None
+    cp.profile = None
+    cp.segments = []
+    cp.page = page
+    cp.page_addr = page.addr
+    cp.labels = dict((k, v + page.delta) for k, v in labels.items())
+    cp.relocations = relocations
+    cp.patches = dict((k, [(a + page.delta, p, s) for a, p, s in v]) 
+                      for k, v in patches.items())
+    cp.patch_values = {}
+    cp.code = ctypes.string_at(page.addr, size)
+    return cp
+
+
+def mkfunction(code, namespace=None, nogil=True):
     """Convenience function that creates a 
     :class:`CodePage <pycca.asm.CodePage>` from the supplied *code* argument 
     and returns a function pointing to the first byte of the compiled code. 
@@ -159,4 +896,4 @@ def mkfunction(code, namespace=None):
     See :func:`CodePage.get_function() <pycca.asm.CodePage.get_function>`.
     """
     page = CodePage(code, namespace=namespace)
-    return page.get_function()
+    return page.get_function(nogil=nogil)
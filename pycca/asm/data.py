@@ -0,0 +1,160 @@
+# -'- coding: utf-8 -'-
+
+import struct
+from .util import long
+from .label import Label
+from .align import Align
+from .pointer import Pointer
+
+
+def db(*values):
+    """
+    Embed bytes in the code. Each value may be an integer (-128 to 255) or a
+    bytes string.
+    """
+    return Data.pack('db', 1, values)
+
+
+def dw(*values):
+    """
+    Embed 16-bit integers in the code.
+    """
+    return Data.pack('dw', 2, values)
+
+
+def dd(*values):
+    """
+    Embed 32-bit integers in the code.
+    """
+    return Data.pack('dd', 4, values)
+
+
+def dq(*values):
+    """
+    Embed 64-bit integers in the code.
+    """
+    return Data.pack('dq', 8, values)
+
+
+def dfloat(*values):
+    """
+    Embed single-precision floating point values in the code.
+    """
+    return Data(b''.join(struct.pack('<f', v) for v in values),
+                'dfloat', values)
+
+
+def ddouble(*values):
+    """
+    Embed double-precision floating point values in the code.
+    """
+    return Data(b''.join(struct.pack('<d', v) for v in values),
+                'ddouble', values)
+
+
+class Data(object):
+    """Bytes embedded in the code, created by :func:`db`, :func:`dw`, etc.
+    """
+    def __init__(self, code, name='db', values=None):
+        self.code = bytes(code)
+        self.name = name
+        self.values = values
+
+    @classmethod
+    def pack(cls, name, size, values):
+        # Pack integers as signed or unsigned little-endian values
+        signed = {1: '<b', 2: '<h', 4: '<i', 8: '<q'}[size]
+        code = b''
+        for val in values:
+            if isinstance(val, (bytes, bytearray)):
+                if size != 1:
+                    raise TypeError("Only db accepts bytes.")
+                code += bytes(val)
+                continue
+            if not isinstance(val, (int, long)):
+                raise TypeError("Invalid %s value %r" % (name, val))
+            try:
+                code += struct.pack(signed, val)
+            except struct.error:
+                try:
+                    code += struct.pack(signed.upper(), val)
+                except struct.error:
+                    raise ValueError("Value %r does not fit in %d bytes." %
+                                     (val, size))
+        return cls(code, name, values)
+
+    def __len__(self):
+        return len(self.code)
+
+    def __str__(self):
+        if self.values is None:
+            return '%s %r' % (self.name, self.code)
+        return '%s %s' % (self.name, ', '.join(map(repr, self.values)))
+
+
+class ConstantPool(object):
+    """Read-only constants that are placed after the code of a CodePage.
+
+    Each method returns a memory operand that refers to the constant by
+    label, so that it is addressed relative to rip in 64-bit code::
+
+        pool = ConstantPool()
+        page = CodePage([movsd(xmm0, pool.double(1.5)), ret()],
+                        constants=pool)
+
+    Equal constants are stored once, and each constant is aligned to its
+    size (up to 16 bytes). Constants are emitted by :func:`asm`, which
+    returns only those that have not been emitted before, so one pool may be
+    used for code added to a page later.
+    """
+    def __init__(self, prefix='_const'):
+        self.prefix = prefix
+        self.entries = {}   # maps bytes to label name
+        self.pending = []   # (name, Data, alignment) not yet emitted
+
+    def add(self, data, bits=None):
+        """Add *data* (a :class:`Data` instance or bytes) to the pool and
+        return a memory operand with the given size in bits that refers to
+        it.
+        """
+        if not isinstance(data, Data):
+            data = Data(data)
+        name = self.entries.get(data.code)
+        if name is None:
+            name = '%s_%d' % (self.prefix, len(self.entries))
+            self.entries[data.code] = name
+            alignment = 1
+            while alignment < min(len(data), 16):
+                alignment *= 2
+            self.pending.append((name, data, alignment))
+        ptr = Pointer(label=name)
+        ptr.bits = bits
+        return ptr
+
+    def double(self, value):
+        return self.add(ddouble(value), 64)
+
+    def float(self, value):
+        return self.add(dfloat(value), 32)
+
+    def quad(self, value):
+        return self.add(dq(value), 64)
+
+    def long(self, value):
+        return self.add(dd(value), 32)
+
+    def asm(self):
+        """Return a list of code objects defining the constants that have
+        been added since the last call, largest alignment first.
+        """
+        pending = sorted(self.pending, key=lambda e: -e[2])
+        self.pending = []
+        code = []
+        for name, data, alignment in pending:
+            if alignment > 1:
+                code.append(Align(alignment, fill=0))
+            code.extend([Label(name), data])
+        return code
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,359 @@
+# -'- coding: utf-8 -'-
+"""
+Write compiled code as ELF64 (x86-64) object files and shared libraries.
+
+Code compiled once with pycca may be saved with :func:`object_file` (a
+relocatable ``.o`` file, to be linked with the system linker) or
+:func:`shared_library` (a minimal ``.so`` file that may be loaded directly
+with ``ctypes.CDLL``). Function entries (see
+:func:`function_labels() <pycca.asm.instrument.function_labels>`) become 
+function symbols that extend to the next function or data, and labels 
+followed by data become object symbols; those that begin with a single 
+underscore are local to the object file, and all others (including 
+reserved names such as ``__name``) are global. Other labels, such as jump
+targets within a function, become local symbols without a type.
+
+Code that refers to addresses outside the page (such as library functions
+called by their address in the current process) cannot be saved usefully.
+"""
+
+import struct
+
+
+# ELF constants
+ET_REL = 1
+ET_DYN = 3
+EM_X86_64 = 62
+SHT_PROGBITS = 1
+SHT_SYMTAB = 2
+SHT_STRTAB = 3
+SHT_RELA = 4
+SHT_HASH = 5
+SHT_DYNAMIC = 6
+SHT_DYNSYM = 11
+SHF_WRITE = 0x1
+SHF_ALLOC = 0x2
+SHF_EXECINSTR = 0x4
+SHF_INFO_LINK = 0x40
+STB_LOCAL = 0
+STB_GLOBAL = 1
+STT_NOTYPE = 0
+STT_OBJECT = 1
+STT_FUNC = 2
+STT_SECTION = 3
+PT_LOAD = 1
+PT_DYNAMIC = 2
+PT_GNU_STACK = 0x6474e551
+PF_X = 1
+PF_W = 2
+PF_R = 4
+DT_NULL = 0
+DT_HASH = 4
+DT_STRTAB = 5
+DT_SYMTAB = 6
+DT_RELA = 7
+DT_RELASZ = 8
+DT_RELAENT = 9
+DT_STRSZ = 10
+DT_SYMENT = 11
+DT_SONAME = 14
+DT_TEXTREL = 22
+DT_FLAGS = 30
+DF_TEXTREL = 0x4
+R_X86_64_64 = 1
+R_X86_64_RELATIVE = 8
+R_X86_64_32 = 10
+R_X86_64_32S = 11
+
+# Relocation types for each packing recorded by CodePage.compile
+_reloc_types = {'Q': R_X86_64_64, 'q': R_X86_64_64, 'I': R_X86_64_32,
+                'i': R_X86_64_32S}
+
+PAGE_SIZE = 0x1000
+
+
+class StringTable(object):
+    """Builds an ELF string table.
+    """
+    def __init__(self):
+        self.data = b'\0'
+        self.offsets = {'': 0}
+
+    def add(self, name):
+        if name not in self.offsets:
+            self.offsets[name] = len(self.data)
+            self.data += name.encode('ascii') + b'\0'
+        return self.offsets[name]
+
+
+def _align(n, align):
+    return (n + align - 1) // align * align
+
+
+def _pad(data, align):
+    return data + b'\0' * (_align(len(data), align) - len(data))
+
+
+def _header(etype, shoff, shnum, shstrndx, phnum=0):
+    ident = b'\x7fELF' + bytes(bytearray([2, 1, 1, 0])) + b'\0' * 8
+    return ident + struct.pack('<HHIQQQIHHHHHH', etype, EM_X86_64, 1, 0,
+                               64 if phnum else 0, shoff, 0, 64,
+                               56 if phnum else 0, phnum, 64, shnum, shstrndx)
+
+
+def _section(name, stype, flags, addr, offset, size, link=0, info=0,
+             align=1, entsize=0):
+    return struct.pack('<IIQQQQIIQQ', name, stype, flags, addr, offset, size,
+                       link, info, align, entsize)
+
+
+def _symbol(name, info, shndx, value, size):
+    return struct.pack('<IBBHQQ', name, info, 0, shndx, value, size)
+
+
+def _is_local(name):
+    return name.startswith('_') and not name.startswith('__')
+
+
+def _label_types(asm):
+    # Return {name: symbol type} for the labels in *asm*
+    from .instruction import Instruction
+    from .label import Label
+    from .align import Align
+    from .instrument import function_labels
+    types = dict((name, STT_FUNC) for name in function_labels(asm))
+    pending = []
+    for cmd in list(asm) + [None]:
+        if isinstance(cmd, Label):
+            pending.append(cmd.name)
+            continue
+        if isinstance(cmd, Align):
+            continue
+        for name in pending:
+            if name in types:
+                continue
+            if cmd is None or isinstance(cmd, Instruction):
+                types[name] = STT_NOTYPE
+            else:
+                types[name] = STT_OBJECT
+        pending = []
+    return types
+
+
+def _layout(page):
+    # Return the code (with relocated fields cleared), the list of
+    # (name, offset, size, type) symbols, and the list of (offset, packing,
+    # target offset) relocations for a CodePage.
+    code = bytearray(page.code)
+    relocs = []
+    for offset, packing in page.relocations:
+        size = struct.calcsize(packing)
+        value = struct.unpack(packing, bytes(code[offset:offset+size]))[0]
+        relocs.append((offset, packing, value - page.page_addr))
+        code[offset:offset+size] = b'\0' * size
+    # (labels in segments added by CodePage.add are outside the code)
+    labels = sorted((addr - page.page_addr, name)
+                    for name, addr in page.labels.items()
+                    if 0 <= addr - page.page_addr <= len(code))
+    if page.asm is None:
+        # (a page received from another process)
+        types = dict((name, STT_FUNC) for offset, name in labels)
+    else:
+        types = _label_types(page.asm)
+    # Functions and data extend to the next function or data
+    starts = [offset for offset, name in labels 
+              if types.get(name, STT_NOTYPE) != STT_NOTYPE] + [len(code)]
+    symbols = []
+    for offset, name in labels:
+        stype = types.get(name, STT_NOTYPE)
+        size = 0
+        if stype != STT_NOTYPE:
+            size = min([s for s in starts if s > offset] or 
+                       [len(code)]) - offset
+        symbols.append((name, offset, size, stype))
+    return bytes(code), symbols, relocs
+
+
+def _binding(symbol):
+    # Labels beginning with a single underscore, and labels that are 
+    # neither functions nor data, are local
+    name, offset, size, stype = symbol
+    if _is_local(name) or stype == STT_NOTYPE:
+        return STB_LOCAL
+    return STB_GLOBAL
+
+
+def object_file(page, addr=0, debug=None):
+    """Return the contents of an ELF64 relocatable object file containing
+    the code, labels, and relocations of *page* (a CodePage).
+
+    *addr* is the address recorded for the .text section (nonzero for an
+    image of code that is already loaded, as used by debuggers). *debug*
+    may be a list of (name, data) for extra, non-loaded sections such as
+    DWARF debugging information.
+    """
+    code, symbols, relocs = _layout(page)
+
+    # Symbols: null, .text section, local labels, global labels
+    strtab = StringTable()
+    local = [s for s in symbols if _binding(s) == STB_LOCAL]
+    glob = [s for s in symbols if _binding(s) == STB_GLOBAL]
+    symtab = _symbol(0, 0, 0, 0, 0)
+    symtab += _symbol(0, (STB_LOCAL << 4) | STT_SECTION, 1, 0, 0)
+    for bind, syms in ((STB_LOCAL, local), (STB_GLOBAL, glob)):
+        for name, offset, size, stype in syms:
+            symtab += _symbol(strtab.add(name), (bind << 4) | stype, 1,
+                              offset, size)
+    first_global = 2 + len(local)
+
+    rela = b''
+    for offset, packing, target in relocs:
+        # relative to the .text section symbol
+        rela += struct.pack('<QQq', offset, (1 << 32) | _reloc_types[packing],
+                            target)
+
+    shstrtab = StringTable()
+    sections = [
+        # name, type, flags, data, link, info, align, entsize
+        ('.text', SHT_PROGBITS, SHF_ALLOC | SHF_EXECINSTR, code, 0, 0, 16, 0),
+        ('.rela.text', SHT_RELA, SHF_INFO_LINK, rela, 3, 1, 8, 24),
+        ('.symtab', SHT_SYMTAB, 0, symtab, 4, first_global, 8, 24),
+        ('.strtab', SHT_STRTAB, 0, strtab.data, 0, 0, 1, 0),
+        # non-executable stack
+        ('.note.GNU-stack', SHT_PROGBITS, 0, b'', 0, 0, 1, 0),
+    ]
+    for name, content in (debug or []):
+        sections.append((name, SHT_PROGBITS, 0, content, 0, 0, 1, 0))
+    sections.append(('.shstrtab', SHT_STRTAB, 0, None, 0, 0, 1, 0))
+    for sec in sections:
+        shstrtab.add(sec[0])
+
+    data = b'\0' * 64
+    headers = _section(0, 0, 0, 0, 0, 0)
+    for name, stype, flags, content, link, info, align, entsize in sections:
+        if content is None:
+            content = shstrtab.data
+        data = _pad(data, align)
+        headers += _section(shstrtab.offsets[name], stype, flags,
+                            addr if name == '.text' else 0,
+                            len(data), len(content), link, info, align,
+                            entsize)
+        data += content
+    data = _pad(data, 8)
+    shoff = len(data)
+    header = _header(ET_REL, shoff, len(sections) + 1, len(sections))
+    return header + data[64:] + headers
+
+
+def shared_library(page, soname=None):
+    """Return the contents of a minimal ELF64 shared library containing the
+    code of *page* (a CodePage), which may be loaded with ``ctypes.CDLL``.
+
+    Function entries and data labels that do not begin with an underscore
+    are exported.
+    Absolute addresses within the page must be 64-bit (R_X86_64_RELATIVE
+    relocations); 32-bit absolute addresses cannot be relocated.
+    """
+    code, symbols, relocs = _layout(page)
+    for offset, packing, target in relocs:
+        if _reloc_types[packing] != R_X86_64_64:
+            raise ValueError("Cannot create a shared library from code with "
+                             "32-bit absolute addresses.")
+    glob = [s for s in symbols if _binding(s) == STB_GLOBAL]
+
+    dynstr = StringTable()
+    if soname is not None:
+        dynstr.add(soname)
+    nphdr = 4
+
+    # Read-only / executable segment: headers, .hash, .dynsym, .dynstr,
+    # .rela.dyn, .text
+    offset = 64 + 56 * nphdr
+    hash_off = _align(offset, 8)
+    nsyms = len(glob) + 1
+    hash_size = 4 * (2 + 1 + nsyms)
+    dynsym_off = _align(hash_off + hash_size, 8)
+    for name, _, _, _ in glob:
+        dynstr.add(name)
+    dynstr_off = dynsym_off + 24 * nsyms
+    rela_off = _align(dynstr_off + len(dynstr.data), 8)
+    text_off = _align(rela_off + 24 * len(relocs), 16)
+    text_end = text_off + len(code)
+    dyn_off = _align(text_end, PAGE_SIZE)
+
+    dynsym = _symbol(0, 0, 0, 0, 0)
+    for name, sym_off, size, stype in glob:
+        dynsym += _symbol(dynstr.offsets[name], (STB_GLOBAL << 4) | stype,
+                          5, text_off + sym_off, size)
+    # SysV hash table with a single bucket
+    chains = [0] + list(range(2, nsyms)) + [0] if nsyms > 1 else [0]
+    hashtab = struct.pack('<II', 1, nsyms)
+    hashtab += struct.pack('<I', 1 if nsyms > 1 else 0)
+    hashtab += struct.pack('<%dI' % nsyms, *chains[:nsyms])
+
+    rela = b''
+    for reloc_off, packing, target in relocs:
+        rela += struct.pack('<QQq', text_off + reloc_off, R_X86_64_RELATIVE,
+                            text_off + target)
+
+    dynamic = [(DT_HASH, hash_off), (DT_STRTAB, dynstr_off),
+               (DT_SYMTAB, dynsym_off), (DT_STRSZ, len(dynstr.data)),
+               (DT_SYMENT, 24)]
+    if soname is not None:
+        dynamic.append((DT_SONAME, dynstr.offsets[soname]))
+    if len(relocs) > 0:
+        dynamic += [(DT_RELA, rela_off), (DT_RELASZ, len(rela)),
+                    (DT_RELAENT, 24), (DT_TEXTREL, 0),
+                    (DT_FLAGS, DF_TEXTREL)]
+    dynamic.append((DT_NULL, 0))
+    dynamic = b''.join(struct.pack('<qQ', tag, val) for tag, val in dynamic)
+    dyn_end = dyn_off + len(dynamic)
+
+    phdrs = struct.pack('<IIQQQQQQ', PT_LOAD, PF_R | PF_X, 0, 0, 0,
+                        text_end, text_end, PAGE_SIZE)
+    phdrs += struct.pack('<IIQQQQQQ', PT_LOAD, PF_R | PF_W, dyn_off, dyn_off,
+                         dyn_off, len(dynamic), len(dynamic), PAGE_SIZE)
+    phdrs += struct.pack('<IIQQQQQQ', PT_DYNAMIC, PF_R | PF_W, dyn_off,
+                         dyn_off, dyn_off, len(dynamic), len(dynamic), 8)
+    phdrs += struct.pack('<IIQQQQQQ', PT_GNU_STACK, PF_R | PF_W, 0, 0, 0,
+                         0, 0, 16)
+
+    data = bytearray(dyn_end)
+    for off, content in ((64, phdrs), (hash_off, hashtab),
+                         (dynsym_off, dynsym), (dynstr_off, dynstr.data),
+                         (rela_off, rela), (text_off, code),
+                         (dyn_off, dynamic)):
+        data[off:off+len(content)] = content
+
+    # Section headers (not needed to load the library, but used by tools
+    # such as objdump)
+    shstrtab = StringTable()
+    sections = [
+        # name, type, flags, offset, size, link, info, align, entsize
+        ('.hash', SHT_HASH, SHF_ALLOC, hash_off, len(hashtab), 2, 0, 8, 4),
+        ('.dynsym', SHT_DYNSYM, SHF_ALLOC, dynsym_off, len(dynsym), 3, 1, 8,
+         24),
+        ('.dynstr', SHT_STRTAB, SHF_ALLOC, dynstr_off, len(dynstr.data), 0,
+         0, 1, 0),
+        ('.rela.dyn', SHT_RELA, SHF_ALLOC, rela_off, len(rela), 2, 0, 8, 24),
+        ('.text', SHT_PROGBITS, SHF_ALLOC | SHF_EXECINSTR, text_off,
+         len(code), 0, 0, 16, 0),
+        ('.dynamic', SHT_DYNAMIC, SHF_ALLOC | SHF_WRITE, dyn_off,
+         len(dynamic), 3, 0, 8, 16),
+    ]
+    for sec in sections:
+        shstrtab.add(sec[0])
+    shstrtab.add('.shstrtab')
+    shstrtab_off = len(data)
+    data += shstrtab.data
+    data = _pad(bytes(data), 8)
+    shoff = len(data)
+    headers = _section(0, 0, 0, 0, 0, 0)
+    for name, stype, flags, off, size, link, info, align, entsize in sections:
+        headers += _section(shstrtab.offsets[name], stype, flags, off, off,
+                            size, link, info, align, entsize)
+    headers += _section(shstrtab.offsets['.shstrtab'], SHT_STRTAB, 0, 0,
+                        shstrtab_off, len(shstrtab.data))
+    header = _header(ET_DYN, shoff, len(sections) + 2, len(sections) + 1,
+                     phnum=nphdr)
+    return header + data[64:] + headers
@@ -0,0 +1,340 @@
+# -'- coding: utf-8 -'-
+"""
+Register generated code with the GDB JIT interface.
+
+Debuggers and profilers normally see pycca code only as raw addresses in an
+anonymous mapping. When registration is enabled (see :func:`enable`, or set
+the environment variable PYCCA_GDB_JIT=1), each new CodePage is described
+to GDB by an in-memory ELF object file containing a symbol for each label
+and, for code assembled from a string by
+:func:`parse_asm() <pycca.asm.parser.parse_asm>`, a DWARF line table that
+maps instructions back to lines of the assembly source. Backtraces then
+show function names (and source lines) instead of addresses.
+
+The interface is described at
+https://sourceware.org/gdb/onlinedocs/gdb/JIT-Interface.html. If the
+process does not already provide ``__jit_debug_register_code`` and
+``__jit_debug_descriptor`` (as LLVM-based JITs do), they are provided by a
+small shared library generated and loaded on first use.
+"""
+
+import os, sys, struct, ctypes, weakref, tempfile, atexit, threading
+
+
+JIT_NOACTION = 0
+JIT_REGISTER_FN = 1
+JIT_UNREGISTER_FN = 2
+
+enabled = os.environ.get('PYCCA_GDB_JIT', '') not in ('', '0')
+
+
+def enable(flag=True):
+    """Enable (or disable) registration of CodePages created from now on.
+    """
+    global enabled
+    enabled = flag
+
+
+class JitCodeEntry(ctypes.Structure):
+    pass
+
+JitCodeEntry._fields_ = [
+    ('next_entry', ctypes.POINTER(JitCodeEntry)),
+    ('prev_entry', ctypes.POINTER(JitCodeEntry)),
+    ('symfile_addr', ctypes.c_void_p),
+    ('symfile_size', ctypes.c_uint64),
+]
+
+
+class JitDescriptor(ctypes.Structure):
+    _fields_ = [
+        ('version', ctypes.c_uint32),
+        ('action_flag', ctypes.c_uint32),
+        ('relevant_entry', ctypes.POINTER(JitCodeEntry)),
+        ('first_entry', ctypes.POINTER(JitCodeEntry)),
+    ]
+
+
+_lock = threading.Lock()
+_interface = None
+_entries = {}   # weakref to CodePage => JitEntry
+_deleted = []   # entries of deleted pages that are not yet unregistered
+
+
+def _provider():
+    # Generate a shared library defining the JIT interface symbols. The
+    # library is kept on disk while the process runs, because debuggers
+    # read symbols from the file.
+    from .codepage import CodePage
+    from .instructions import ret
+    from .label import label
+    from .align import align
+    from .elf import shared_library, PAGE_SIZE
+    global enabled
+    flag, enabled = enabled, False
+    try:
+        # The descriptor is placed on its own memory page, which is made
+        # writable (but not executable) below.
+        page = CodePage([
+            label('__jit_debug_register_code'),
+            ret(),
+            align(PAGE_SIZE, fill=0),
+            label('__jit_debug_descriptor'),
+            struct.pack('<IIQQ', 1, JIT_NOACTION, 0, 0),
+        ])
+    finally:
+        enabled = flag
+    fd, path = tempfile.mkstemp(prefix='pycca-gdbjit-', suffix='.so')
+    with os.fdopen(fd, 'wb') as fh:
+        fh.write(shared_library(page))
+    atexit.register(os.remove, path)
+    lib = ctypes.CDLL(path)
+    # The descriptor is written by this process and read by the debugger
+    desc = JitDescriptor.in_dll(lib, '__jit_debug_descriptor')
+    _mprotect_writable(ctypes.addressof(desc), ctypes.sizeof(desc))
+    return lib
+
+
+def _mprotect_writable(addr, size):
+    # Make the memory pages holding *size* bytes at *addr* readable and 
+    # writable (and not executable).
+    libc = ctypes.CDLL(None, use_errno=True)
+    libc.mprotect.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int]
+    pagesize = os.sysconf('SC_PAGESIZE')
+    start = addr - addr % pagesize
+    PROT_RW = 3
+    if libc.mprotect(start, addr + size - start, PROT_RW) != 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+
+
+def _get_interface():
+    # Return (descriptor, register function) for this process
+    global _interface
+    if _interface is None:
+        try:
+            lib = ctypes.CDLL(None)
+            JitDescriptor.in_dll(lib, '__jit_debug_descriptor')
+        except ValueError:
+            lib = _provider()
+        desc = JitDescriptor.in_dll(lib, '__jit_debug_descriptor')
+        func = ctypes.CFUNCTYPE(None)(('__jit_debug_register_code', lib))
+        _interface = (lib, desc, func)
+    return _interface[1], _interface[2]
+
+
+class JitEntry(object):
+    """A CodePage registered with the debugger; see :func:`register`.
+    """
+    def __init__(self, symfile):
+        self.symfile = ctypes.create_string_buffer(symfile, len(symfile))
+        self.entry = JitCodeEntry()
+        self.entry.symfile_addr = ctypes.addressof(self.symfile)
+        self.entry.symfile_size = len(symfile)
+        self.registered = False
+
+
+def register(page, name=None):
+    """Describe *page* (a CodePage) to the debugger, and return a
+    :class:`JitEntry`. The entry is unregistered automatically when the
+    page is deleted.
+
+    *name* is used as the name of the source file in the line table.
+    """
+    if not sys.platform.startswith('linux'):
+        raise NotImplementedError("The GDB JIT interface is only supported "
+                                  "on Linux.")
+    if name is None:
+        name = '<pycca code at 0x%x>' % page.page_addr
+    entry = JitEntry(symbol_file(page, name))
+    with _lock:
+        desc, notify = _get_interface()
+        first = desc.first_entry
+        if first:
+            entry.entry.next_entry = first
+            first.contents.prev_entry = ctypes.pointer(entry.entry)
+        desc.first_entry = ctypes.pointer(entry.entry)
+        desc.relevant_entry = ctypes.pointer(entry.entry)
+        desc.action_flag = JIT_REGISTER_FN
+        notify()
+        entry.registered = True
+        _entries[weakref.ref(page, _page_deleted)] = entry
+    _drain()
+    return entry
+
+
+def unregister(entry):
+    """Remove a registered entry from the debugger.
+    """
+    with _lock:
+        _unlink(entry)
+    _drain()
+
+
+def _unlink(entry):
+    # Remove *entry* from the descriptor's list; _lock must be held.
+    if not entry.registered:
+        return
+    desc, notify = _get_interface()
+    e = entry.entry
+    if e.prev_entry:
+        e.prev_entry.contents.next_entry = e.next_entry
+    else:
+        desc.first_entry = e.next_entry
+    if e.next_entry:
+        e.next_entry.contents.prev_entry = e.prev_entry
+    desc.relevant_entry = ctypes.pointer(e)
+    desc.action_flag = JIT_UNREGISTER_FN
+    notify()
+    entry.registered = False
+
+
+def _drain():
+    # Unregister the entries of deleted pages. Pages may be deleted by the
+    # garbage collector while _lock is held (possibly by the same thread, in
+    # the middle of updating the list), so this is skipped if the lock is 
+    # taken; the holder drains the queue after releasing it.
+    while _deleted and _lock.acquire(False):
+        try:
+            while _deleted:
+                _unlink(_deleted.pop())
+        finally:
+            _lock.release()
+
+
+def update(page):
+    """Register *page* again after code was added to it, if it was 
+    registered.
+    """
+    for ref, entry in list(_entries.items()):
+        if ref() is page:
+            del _entries[ref]
+            unregister(entry)
+            register(page)
+
+
+def _page_deleted(ref):
+    entry = _entries.pop(ref, None)
+    if entry is not None:
+        _deleted.append(entry)
+        _drain()
+
+
+def entries():
+    """Return the list of (symfile address, size) for all entries registered
+    in this process, in the order seen by the debugger.
+    """
+    desc, notify = _get_interface()
+    result = []
+    e = desc.first_entry
+    while e:
+        result.append((e.contents.symfile_addr, e.contents.symfile_size))
+        e = e.contents.next_entry
+    return result
+
+
+def symbol_file(page, name):
+    """Return an ELF object file describing *page* as loaded in memory:
+    its labels as symbols and, if the page was assembled from a string, a
+    DWARF line table.
+    """
+    from .elf import object_file
+    lines = line_table(page)
+    debug = None
+    if len(lines) > 0:
+        debug = dwarf_sections(name, page.page_addr, len(page.code), lines)
+    return object_file(page, addr=page.page_addr, debug=debug)
+
+
+def line_table(page):
+    """Return a list of (offset, line number) for each instruction in *page*
+    that records the assembly source line it came from.
+    """
+    lines = []
+    if page.asm is None:
+        return lines
+    offset = 0
+    for item in page.asm:
+        lineno = getattr(item, 'lineno', None)
+        if lineno is not None:
+            lines.append((offset, lineno))
+        offset += len(item)
+    return lines
+
+
+def _uleb(val):
+    out = bytearray()
+    while True:
+        byte = val & 0x7f
+        val >>= 7
+        if val:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _sleb(val):
+    out = bytearray()
+    while True:
+        byte = val & 0x7f
+        val >>= 7
+        if (val == 0 and not byte & 0x40) or (val == -1 and byte & 0x40):
+            out.append(byte)
+            return bytes(out)
+        out.append(byte | 0x80)
+
+
+def dwarf_sections(name, addr, size, lines):
+    """Return the (name, data) of DWARF 2 sections describing a compile
+    unit named *name* that covers *size* bytes at *addr*, with the line
+    table *lines* (a list of (offset, line number)).
+    """
+    DW_TAG_compile_unit = 0x11
+    DW_AT_name, DW_AT_stmt_list, DW_AT_low_pc, DW_AT_high_pc = (
+        0x03, 0x10, 0x11, 0x12)
+    DW_AT_language = 0x13
+    DW_FORM_addr, DW_FORM_data2, DW_FORM_data4, DW_FORM_string = (
+        0x01, 0x05, 0x06, 0x08)
+    DW_LANG_Mips_Assembler = 0x8001
+    DW_LNS_copy, DW_LNS_advance_pc, DW_LNS_advance_line = 1, 2, 3
+    DW_LNE_end_sequence, DW_LNE_set_address = 1, 2
+    cname = name.encode('utf-8') + b'\0'
+
+    abbrev = _uleb(1) + _uleb(DW_TAG_compile_unit) + b'\0'
+    for attr, form in ((DW_AT_name, DW_FORM_string),
+                       (DW_AT_stmt_list, DW_FORM_data4),
+                       (DW_AT_low_pc, DW_FORM_addr),
+                       (DW_AT_high_pc, DW_FORM_addr),
+                       (DW_AT_language, DW_FORM_data2)):
+        abbrev += _uleb(attr) + _uleb(form)
+    abbrev += b'\0\0\0'
+
+    die = _uleb(1) + cname + struct.pack('<IQQH', 0, addr, addr + size,
+                                         DW_LANG_Mips_Assembler)
+    info = struct.pack('<HIB', 2, 0, 8) + die
+    info = struct.pack('<I', len(info)) + info
+
+    # Line number program header (version 2)
+    opcode_lengths = [0, 1, 1, 1, 1, 0, 0, 0, 1, 0, 0, 1]
+    header = struct.pack('<BBbBB', 1, 1, -5, 14, len(opcode_lengths) + 1)
+    header += bytes(bytearray(opcode_lengths))
+    header += b'\0'                                 # no include directories
+    header += cname + _uleb(0) + _uleb(0) + _uleb(0) + b'\0'
+    program = b'\0' + _uleb(9) + struct.pack('<BQ', DW_LNE_set_address, addr)
+    offset, line = 0, 1
+    for off, lineno in lines:
+        if lineno != line:
+            program += struct.pack('<B', DW_LNS_advance_line) + _sleb(lineno - line)
+            line = lineno
+        if off != offset:
+            program += struct.pack('<B', DW_LNS_advance_pc) + _uleb(off - offset)
+            offset = off
+        program += struct.pack('<B', DW_LNS_copy)
+    program += struct.pack('<B', DW_LNS_advance_pc) + _uleb(size - offset)
+    program += b'\0' + _uleb(1) + struct.pack('<B', DW_LNE_end_sequence)
+    line_prog = struct.pack('<HI', 2, len(header)) + header + program
+    line_prog = struct.pack('<I', len(line_prog)) + line_prog
+
+    return [('.debug_abbrev', abbrev), ('.debug_info', info),
+            ('.debug_line', line_prog)]
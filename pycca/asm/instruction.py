@@ -7,10 +7,13 @@ from .pointer import Pointer, pack_int, pack_uint, rex
 from .modrm import ModRmSib
 from .util import long
 from .label import Label
+from .patch import Patch
 from .code import Code
 from . import ARCH
 
 
+# high-byte registers, which cannot be encoded with a REX prefix
+_high_byte = ('ah', 'ch', 'dh', 'bh')
 
 
 class Instruction(object):
@@ -20,6 +23,7 @@ class Instruction(object):
     
     address_size = 'seg'  # address size is usually determined by code segment
     operand_size = 'reg'  # operand size is usually determined by register size
+                          # ('stack' for the stack width)
     
     def __init__(self, *args):
         self.args = []
@@ -45,6 +49,8 @@ class Instruction(object):
         self._rex_byte = None
         self._opcode = None
         self._operands = None
+        # (name, packing, sign-extended) of a patched immediate
+        self._patch = None
         
         # Complete, assembled instruction or Code instance
         self._code = None
@@ -215,6 +221,8 @@ class Instruction(object):
                     sig.append('imm%du' % bits)                
                 else:
                     sig.append('imm%d' % bits)
+            elif isinstance(arg, Patch):
+                sig.append('imm%d' % (arg.size*8))
             elif isinstance(arg, (str, bytes, bytearray)):
                 if len(arg) in (1, 2, 4, 8):
                     sig.append('imm%d' % (len(arg)*8))
@@ -302,8 +310,12 @@ class Instruction(object):
         *sig* may look like 'r16', 'm32', 'imm8', 'rel32', 'xmm1', etc.
         *mode* may look like 'r8', 'm32/64', 'r/m32', 'xmm1/m64', 'xmm2', etc.
         
-        
+        Modes that require one specific operand (such as 'cl' or '1' for
+        shift instructions) only match a signature of the same name.
         """
+        if mode in ('cl', '1'):
+            return sig == mode
+        
         sbits = sig.lstrip('irel/xm')
         stype = sig[:-len(sbits)] if len(sbits) > 0 else sig
         sbits = sbits.rstrip('u')
@@ -378,6 +390,13 @@ class Instruction(object):
         # assemble initial opcode
         opcode = bytearray.fromhex(opcode_s)
         
+        # SSE opcodes begin with a mandatory prefix (66, f2, or f3) that must
+        # be placed after any other prefixes but before the REX byte.
+        mandatory_prefix = None
+        if len(opcode) > 2 and opcode[0] in (0x66, 0xf2, 0xf3) and opcode[1] == 0x0f:
+            mandatory_prefix = bytes(opcode[:1])
+            opcode = opcode[1:]
+        
         # check for opcode extension
         opcode_ext = None
         if len(op_parts) > 1:
@@ -388,6 +407,8 @@ class Instruction(object):
 
         # Parse operands into encodable pieces
         prefixes, rex_byt, opcode_reg, modrm_reg, modrm_rm, imm = self.parse_operands()
+        if mandatory_prefix is not None:
+            prefixes.append(mandatory_prefix)
         
         
         # encode complete instruction:
@@ -418,6 +439,15 @@ class Instruction(object):
         if rexw:
             rex_byt |= rex.w
         
+        # ah, ch, dh and bh are encoded as spl, bpl, sil and dil when a REX
+        # byte is present
+        if rex_byt != 0:
+            for arg in self.args:
+                if isinstance(arg, Register) and arg.name in _high_byte:
+                    raise TypeError("Cannot use register %s in an instruction "
+                                    "that requires a REX prefix: %s" % 
+                                    (arg.name, self))
+        
         if rex_byt == 0:
             rex_byt = b''
         else:
@@ -443,6 +473,12 @@ class Instruction(object):
                       opcode)
         for op in operands:
             code = code + op
+        if self._patch is not None:
+            # the immediate is the last operand
+            name, packing, signed = self._patch
+            if not isinstance(code, Code):
+                code = Code(code)
+            code.replace(len(code) - struct.calcsize(packing), name, packing)
         self._code = code
 
     def parse_operands(self):
@@ -496,8 +532,21 @@ class Instruction(object):
                 reg = arg
             elif enc.startswith('imm'):
                 immsize = int(use_sig[i][3:].rstrip('u'))
+                # Immediates smaller than the other operands are 
+                # sign-extended by the CPU
+                if self.operand_size == 'stack':
+                    opsize = ARCH
+                else:
+                    opsize = max([a.bits or 0 for a in clean_args 
+                                  if isinstance(a, (Register, Pointer))] 
+                                 or [0])
                 
-                if isinstance(arg, (int, long)):
+                if isinstance(arg, Patch):
+                    # value is filled in when the code is compiled
+                    packing = {8: 'b', 16: 'h', 32: 'i', 64: 'q'}[immsize]
+                    self._patch = (arg.name, packing, opsize > immsize)
+                    arg = b'\0' * (immsize//8)
+                elif isinstance(arg, (int, long)):
                     # pack integer operand
                     styp = {8: 'b', 16: 'h', 32: 'i', 64: 'q'}
                     try:
@@ -505,7 +554,13 @@ class Instruction(object):
                     except struct.error:
                         # can't encode as signed int; try again as unsigned
                         # int. This should only happen if a larger imm size
-                        # was not available in the mode list.
+                        # was not available in the mode list. The value of
+                        # a sign-extended immediate would change.
+                        if opsize > immsize:
+                            raise ValueError("Immediate value %r does not fit "
+                                             "in a sign-extended %d-bit field "
+                                             "for %d-bit operands: %s" % 
+                                             (arg, immsize, opsize, self))
                         arg = struct.pack(styp[immsize].upper(), arg)
                             
                 opsize = 8 * len(arg)
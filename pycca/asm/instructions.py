@@ -3,6 +3,7 @@
 import collections, struct
 
 from .instruction import Instruction, RelBranchInstruction
+from .register import Register, cl
 
 
 #   Procedure management instructions
@@ -24,6 +25,7 @@ class push(Instruction):
     =============== ====== ====== ======================================
     """
     name = 'push'
+    operand_size = 'stack'  # immediates are sign-extended to the stack width
 
     modes = {
         ('r/m16',): ['ff /6', 'm', True, True],
@@ -129,6 +131,25 @@ class leave(Instruction):
         Instruction.__init__(self)
 
 
+class rdtsc(Instruction):
+    """ RDTSC
+    
+    Read time-stamp counter into EDX:EAX. Accepts no operands.
+    
+    The high-order 32 bits of the counter are loaded into EDX and the 
+    low-order 32 bits into EAX. On 64-bit processors, the high-order 32 bits 
+    of RAX and RDX are cleared.
+    """
+    name = 'rdtsc'
+    
+    modes = collections.OrderedDict([
+        ((), ['0f31', None, True, True]),
+    ])
+        
+    def __init__(self):  # set method signature
+        Instruction.__init__(self)
+
+
 class call(RelBranchInstruction):
     """Saves procedure linking information on the stack and branches to the 
     called procedure specified using the target operand. 
@@ -260,6 +281,168 @@ class movsd(Instruction):
 
 
 
+class movss(Instruction):
+    """MOVSS moves a scalar single-precision floating-point value from the 
+    source operand (second operand) to the destination operand (first operand).
+    
+    The source and destination operands can be XMM registers or 32-bit memory
+    locations. This instruction can be used to move a single-precision 
+    floating-point value to and from the low doubleword of an XMM register and
+    a 32-bit memory location, or to move a single-precision floating-point 
+    value between the low doublewords of two XMM registers. The instruction 
+    cannot be used to transfer data between memory locations.
+    
+    ====== ================= ====== ====== ======================================
+    dst    src               32-bit 64-bit description
+    ====== ================= ====== ====== ======================================
+    xmm    xmm, m32           X      X     Copy xmm or m32 to xmm
+    m32    xmm                X      X     Copy xmm to m32
+    ====== ================= ====== ====== ======================================
+    """
+    name = 'movss'
+    
+    modes = collections.OrderedDict([
+        (('xmm1', 'xmm2/m32'),   ['f30f10 /r', 'rm', True, True, 'sse']),
+        (('m32', 'xmm1'),   ['f30f11 /r', 'mr', True, True, 'sse']),
+    ])
+    
+    operand_enc = {
+        'mr': ['ModRM:r/m (w)', 'ModRM:reg (r)'],
+        'rm': ['ModRM:reg (w)', 'ModRM:r/m (r)'],
+    }
+    
+    def __init__(self, dst, src):  # set method signature
+        Instruction.__init__(self, dst, src)
+
+
+class movzx(Instruction):
+    """Copies the contents of the source operand (register or memory location)
+    to the destination operand (register) and zero extends the value. 
+    
+    The size of the converted value depends on the operand-size attribute.
+    
+    ====== ================= ====== ====== ======================================
+    dst    src               32-bit 64-bit description
+    ====== ================= ====== ====== ======================================
+    r16    r/m8               X      X     Copy src to dst with zero extension
+    r32    r/m8, r/m16        X      X     
+    r64    r/m8, r/m16               X
+    ====== ================= ====== ====== ======================================
+    """
+    name = 'movzx'
+    
+    modes = collections.OrderedDict([
+        (('r16', 'r/m8'),   ['0fb6 /r', 'rm', True, True]),
+        (('r32', 'r/m8'),   ['0fb6 /r', 'rm', True, True]),
+        (('r64', 'r/m8'),   ['REX.W + 0fb6 /r', 'rm', True, False]),
+        (('r32', 'r/m16'),  ['0fb7 /r', 'rm', True, True]),
+        (('r64', 'r/m16'),  ['REX.W + 0fb7 /r', 'rm', True, False]),
+    ])
+    
+    operand_enc = {
+        'rm': ['ModRM:reg (w)', 'ModRM:r/m (r)'],
+    }
+    
+    def generate_code(self):
+        # 16-bit source operands do not require the 66h prefix; only a 16-bit
+        # destination does.
+        if self.clean_args[0].bits != 16 and b'\x66' in self.prefixes:
+            self.prefixes.remove(b'\x66')
+        Instruction.generate_code(self)
+
+    def __init__(self, dst, src):  # set method signature
+        Instruction.__init__(self, dst, src)
+
+
+class movsx(Instruction):
+    """Copies the contents of the source operand (register or memory location)
+    to the destination operand (register) and sign extends the value.
+    
+    ====== ================= ====== ====== ======================================
+    dst    src               32-bit 64-bit description
+    ====== ================= ====== ====== ======================================
+    r16    r/m8               X      X     Copy src to dst with sign extension
+    r32    r/m8, r/m16        X      X     
+    r64    r/m8, r/m16               X
+    ====== ================= ====== ====== ======================================
+    """
+    name = 'movsx'
+    
+    modes = collections.OrderedDict([
+        (('r16', 'r/m8'),   ['0fbe /r', 'rm', True, True]),
+        (('r32', 'r/m8'),   ['0fbe /r', 'rm', True, True]),
+        (('r64', 'r/m8'),   ['REX.W + 0fbe /r', 'rm', True, False]),
+        (('r32', 'r/m16'),  ['0fbf /r', 'rm', True, True]),
+        (('r64', 'r/m16'),  ['REX.W + 0fbf /r', 'rm', True, False]),
+    ])
+    
+    operand_enc = {
+        'rm': ['ModRM:reg (w)', 'ModRM:r/m (r)'],
+    }
+    
+    def generate_code(self):
+        # 16-bit source operands do not require the 66h prefix; only a 16-bit
+        # destination does.
+        if self.clean_args[0].bits != 16 and b'\x66' in self.prefixes:
+            self.prefixes.remove(b'\x66')
+        Instruction.generate_code(self)
+
+    def __init__(self, dst, src):  # set method signature
+        Instruction.__init__(self, dst, src)
+
+
+class movsxd(Instruction):
+    """Copies a doubleword from the source operand (register or memory 
+    location) to a 64-bit destination register and sign extends the value.
+    
+    ====== ================= ====== ====== ======================================
+    dst    src               32-bit 64-bit description
+    ====== ================= ====== ====== ======================================
+    r64    r/m32                     X     Copy src to dst with sign extension
+    ====== ================= ====== ====== ======================================
+    """
+    name = 'movsxd'
+    
+    modes = collections.OrderedDict([
+        (('r64', 'r/m32'),  ['REX.W + 63 /r', 'rm', True, False]),
+    ])
+    
+    operand_enc = {
+        'rm': ['ModRM:reg (w)', 'ModRM:r/m (r)'],
+    }
+
+    def __init__(self, dst, src):  # set method signature
+        Instruction.__init__(self, dst, src)
+
+
+class movq(Instruction):
+    """Copies a quadword between a general-purpose register and the low 
+    quadword of an XMM register. When the destination is an XMM register, the
+    upper quadword of the destination is cleared.
+    
+    ====== ================= ====== ====== ======================================
+    dst    src               32-bit 64-bit description
+    ====== ================= ====== ====== ======================================
+    xmm    r64                       X     Copy r64 to xmm
+    r64    xmm                       X     Copy xmm to r64
+    ====== ================= ====== ====== ======================================
+    """
+    name = 'movq'
+    
+    modes = collections.OrderedDict([
+        (('xmm1', 'r64'),   ['REX.W + 660f6e /r', 'rm', True, False, 'sse2']),
+        (('r64', 'xmm1'),   ['REX.W + 660f7e /r', 'mr', True, False, 'sse2']),
+    ])
+    
+    operand_enc = {
+        'rm': ['ModRM:reg (w)', 'ModRM:r/m (r)'],
+        'mr': ['ModRM:r/m (w)', 'ModRM:reg (r)'],
+    }
+    
+    def __init__(self, dst, src):  # set method signature
+        Instruction.__init__(self, dst, src)
+
+
 #   Arithmetic instructions
 #----------------------------------------
 
@@ -346,7 +529,7 @@ class sub(Instruction):
         
         (('r/m16', 'imm8'),  ['83 /5', 'mi', True, True]),
         (('r/m32', 'imm8'),  ['83 /5', 'mi', True, True]),
-        (('r/m64', 'imm8'),  ['REX.W + 85 /0', 'mi', True, False]),        
+        (('r/m64', 'imm8'),  ['REX.W + 83 /5', 'mi', True, False]),        
         
         (('r/m8', 'r8'),   ['28 /r', 'mr', True, True]),
         (('r/m16', 'r16'), ['29 /r', 'mr', True, True]),
@@ -485,13 +668,21 @@ class imul(Instruction):
     """Performs a signed multiplication of two operands. This instruction has 
     three forms, depending on the number of operands.
     
-    * One-operand form — **[Not currently supported by pycca]**
-      This form is identical to that used by the MUL 
+    * One-operand form — This form is identical to that used by the MUL 
       instruction. Here, the source operand (in a general-purpose register or 
       memory location) is multiplied by the value in the AL, AX, EAX, or RAX 
       register (depending on the operand size) and the product (twice the size
       of the input operand) is stored in the AX, DX:AX, EDX:EAX, or RDX:RAX 
       registers, respectively.
+      
+      ====== ====== ====== ================================================
+      src    32-bit 64-bit description
+      ====== ====== ====== ================================================
+      r/m8   X      X      AX = AL \* src
+      r/m16  X      X      DX:AX = AX \* src
+      r/m32  X      X      EDX:EAX = EAX \* src
+      r/m64         X      RDX:RAX = RAX \* src
+      ====== ====== ====== ================================================
     
     * Two-operand form — With this form the destination operand (the first 
       operand) is multiplied by the source operand (second operand). The 
@@ -527,6 +718,11 @@ class imul(Instruction):
     name = "imul"
 
     modes = collections.OrderedDict([
+        (('r/m8',),   ['f6 /5', 'm', True, True]),
+        (('r/m16',),  ['f7 /5', 'm', True, True]),
+        (('r/m32',),  ['f7 /5', 'm', True, True]),
+        (('r/m64',),  ['REX.W + f7 /5', 'm', True, False]),
+        
         (('r16', 'r/m16'),   ['0faf /r', 'rm', True, True]),
         (('r32', 'r/m32'),   ['0faf /r', 'rm', True, True]),
         (('r64', 'r/m64'),   ['REX.W + 0faf /r', 'rm', True, False]),
@@ -541,6 +737,7 @@ class imul(Instruction):
     ])
 
     operand_enc = {
+        'm': ['ModRM:r/m (r)'],
         'rm': ['ModRM:reg (r,w)', 'ModRM:r/m (r)'],
         'rmi': ['ModRM:reg (r,w)', 'ModRM:r/m (r)', 'imm8/16/32'],
     }
@@ -568,7 +765,7 @@ class idiv(Instruction):
         (('r/m8',), ('f6 /7', 'm', True, True)),
         (('r/m16',), ('f7 /7', 'm', True, True)),
         (('r/m32',), ('f7 /7', 'm', True, True)),
-        (('r/m64',), ('REX.W + f6 /7', 'm', True, False)),
+        (('r/m64',), ('REX.W + f7 /7', 'm', True, False)),
     ])
 
     operand_enc = {
@@ -578,6 +775,70 @@ class idiv(Instruction):
     def __init__(self, src):  # set method signature
         Instruction.__init__(self, src)
 
+
+class cdq(Instruction):
+    """Doubles the size of the operand in register EAX by means of sign 
+    extension and stores the result in registers EDX:EAX. Accepts no operands.
+    
+    This is typically used to prepare the dividend before a 32-bit IDIV.
+    """
+    name = 'cdq'
+
+    modes = collections.OrderedDict([
+        ((), ['99', None, True, True]),
+    ])
+
+    def __init__(self):  # set method signature
+        Instruction.__init__(self)
+
+
+class cqo(Instruction):
+    """Doubles the size of the operand in register RAX by means of sign 
+    extension and stores the result in registers RDX:RAX. Accepts no operands.
+    
+    This is typically used to prepare the dividend before a 64-bit IDIV.
+    """
+    name = 'cqo'
+
+    modes = collections.OrderedDict([
+        ((), ['REX.W + 99', None, True, False]),
+    ])
+
+    def __init__(self):  # set method signature
+        Instruction.__init__(self)
+
+
+class neg(Instruction):
+    """Replaces the value of operand (the destination operand) with its two's
+    complement. (This operation is equivalent to subtracting the operand from 
+    0.) The destination operand is located in a general-purpose register or a
+    memory location.
+    
+    ====== ====== ====== ======================================
+    dst    32-bit 64-bit description
+    ====== ====== ====== ======================================
+    r/m8    X      X     dst = -dst
+    r/m16   X      X     
+    r/m32   X      X     
+    r/m64          X
+    ====== ====== ====== ======================================
+    """
+    name = 'neg'
+
+    modes = collections.OrderedDict([
+        (('r/m8',),  ['f6 /3', 'm', True, True]),
+        (('r/m16',), ['f7 /3', 'm', True, True]),
+        (('r/m32',), ['f7 /3', 'm', True, True]),
+        (('r/m64',), ['REX.W + f7 /3', 'm', True, False]),
+    ])
+
+    operand_enc = {
+        'm': ['ModRM:r/m (r,w)'],
+    }
+
+    def __init__(self, dst):  # set method signature
+        Instruction.__init__(self, dst)
+
     
 class fld(Instruction):
     """Pushes the source operand onto the FPU register stack.
@@ -1434,52 +1695,743 @@ class divsd(Instruction):
         Instruction.__init__(self, dst, src)
 
 
+class addss(Instruction):
+    """Adds the low single-precision floating-point values from the source 
+    operand (second operand) and the destination operand (first operand), and 
+    stores the single-precision floating-point result in the destination 
+    operand. The source operand can be an XMM register or a 32-bit memory 
+    location. The destination operand is an XMM register.
+    
+    ====== ================= ====== ====== ======================================
+    dst    src               32-bit 64-bit description
+    ====== ================= ====== ====== ======================================
+    xmm    xmm, m32           X      X     dst += src
+    ====== ================= ====== ====== ======================================
+    """
+    name = 'addss'
+    
+    modes = collections.OrderedDict([
+        (('xmm1', 'xmm2/m32'),   ['f30f58 /r', 'rm', True, True, 'sse']),
+    ])
+    
+    operand_enc = {
+        'rm': ['ModRM:reg (w)', 'ModRM:r/m (r)'],
+    }
+    
+    def __init__(self, dst, src):  # set method signature
+        Instruction.__init__(self, dst, src)
 
-# Need:
-# fchs, fxch
-# fsin, fcos, fptan, fpatan, fcom, 
-# mul, or, and, andn, not, xor
 
-# avx/sse2 instructions
-# addsd, subsd, mulsd, divsd, ...
-# movdq2q, movq2dq
+class subss(Instruction):
+    """Subtracts the low single-precision floating-point value in the source 
+    operand (second operand) from the low single-precision floating-point value
+    in the destination operand (first operand), and stores the single-precision
+    floating-point result in the destination operand. The source operand can be
+    an XMM register or a 32-bit memory location. The three high-order 
+    doublewords of the destination operand remain unchanged.
+    
+    ====== ================= ====== ====== ======================================
+    dst    src               32-bit 64-bit description
+    ====== ================= ====== ====== ======================================
+    xmm    xmm, m32           X      X     dst -= src
+    ====== ================= ====== ====== ======================================
+    """
+    name = 'subss'
+    
+    modes = collections.OrderedDict([
+        (('xmm1', 'xmm2/m32'),   ['f30f5c /r', 'rm', True, True, 'sse']),
+    ])
+    
+    operand_enc = {
+        'rm': ['ModRM:reg (w)', 'ModRM:r/m (r)'],
+    }
+    
+    def __init__(self, dst, src):  # set method signature
+        Instruction.__init__(self, dst, src)
 
 
+class mulss(Instruction):
+    """Multiplies the low single-precision floating-point value from the source
+    operand (second operand) by the low single-precision floating-point value 
+    in the destination operand (first operand), and stores the single-precision
+    floating-point result in the destination operand. The source operand can be
+    an XMM register or a 32-bit memory location. The three high-order 
+    doublewords of the destination operand remain unchanged.
+    
+    ====== ================= ====== ====== ======================================
+    dst    src               32-bit 64-bit description
+    ====== ================= ====== ====== ======================================
+    xmm    xmm, m32           X      X     dst *= src
+    ====== ================= ====== ====== ======================================
+    """
+    name = 'mulss'
+    
+    modes = collections.OrderedDict([
+        (('xmm1', 'xmm2/m32'),   ['f30f59 /r', 'rm', True, True, 'sse']),
+    ])
+    
+    operand_enc = {
+        'rm': ['ModRM:reg (w)', 'ModRM:r/m (r)'],
+    }
+    
+    def __init__(self, dst, src):  # set method signature
+        Instruction.__init__(self, dst, src)
+
 
-#   Testing instructions
+class divss(Instruction):
+    """Divides the low single-precision floating-point value in the first 
+    operand by the low single-precision floating-point value in the second 
+    source operand, and stores the single-precision floating-point result in 
+    the destination operand. The source operand can be an XMM register or a 
+    32-bit memory location. The three high-order doublewords of the 
+    destination operand remain unchanged.
+    
+    ====== ================= ====== ====== ======================================
+    dst    src               32-bit 64-bit description
+    ====== ================= ====== ====== ======================================
+    xmm    xmm, m32           X      X     dst /= src
+    ====== ================= ====== ====== ======================================
+    """
+    name = 'divss'
+    
+    modes = collections.OrderedDict([
+        (('xmm1', 'xmm2/m32'),   ['f30f5e /r', 'rm', True, True, 'sse']),
+    ])
+    
+    operand_enc = {
+        'rm': ['ModRM:reg (w)', 'ModRM:r/m (r)'],
+    }
+    
+    def __init__(self, dst, src):  # set method signature
+        Instruction.__init__(self, dst, src)
+
+
+
+
+#   Bitwise logical instructions
 #----------------------------------------
 
-class cmp(Instruction):
-    """Compares the first source operand with the second source operand and 
-    sets the status flags in the EFLAGS register according to the results. 
+class and_(Instruction):
+    """Performs a bitwise AND operation on the destination (first) and source 
+    (second) operands and stores the result in the destination operand 
+    location. 
     
-    The comparison is performed by subtracting the second operand from the
-    first operand and then setting the status flags in the same manner as the
-    SUB instruction. When an immediate value is used as an operand, it is 
-    sign-extended to the length of the first operand.
+    The source operand can be an immediate, a register, or a memory location;
+    the destination operand can be a register or a memory location. (However,
+    two memory operands cannot be used in one instruction.) Each bit of the
+    result is set to 1 if both corresponding bits of the first and second 
+    operands are 1; otherwise, it is set to 0.
     
     ====== =============== ====== ====== ======================================
-    src1   src2            32-bit 64-bit description
+    dst    src             32-bit 64-bit description
     ====== =============== ====== ====== ======================================
-    r/m8   r/m8, imm8       X      X     
+    r/m8   r/m8, imm8       X      X     dst &= src
     r/m16  r/m16, imm8/16   X      X     
     r/m32  r/m32, imm8/32   X      X
     r/m64  r/m64, imm8/32          X
     ====== =============== ====== ====== ======================================
     """
-    name = "cmp"
+    name = 'and'
     
     modes = collections.OrderedDict([
-        (('r/m8', 'imm8'), ('80 /7', 'mi', True, True)),
-        (('r/m16', 'imm16'), ('81 /7', 'mi', True, True)),
-        (('r/m32', 'imm32'), ('81 /7', 'mi', True, True)),
-        (('r/m64', 'imm32'), ('REX.W + 81 /7', 'mi', True, False)),
+        (('r/m8', 'imm8'),   ['80 /4', 'mi', True, True]),
+        (('r/m16', 'imm8'),  ['83 /4', 'mi', True, True]),
+        (('r/m32', 'imm8'),  ['83 /4', 'mi', True, True]),
+        (('r/m64', 'imm8'),  ['REX.W + 83 /4', 'mi', True, False]),
         
-        (('r/m16', 'imm8'), ('83 /7', 'mi', True, True)),
-        (('r/m32', 'imm8'), ('83 /7', 'mi', True, True)),
-        (('r/m64', 'imm8'), ('REX.W + 83 /7', 'mi', True, False)),
+        (('r/m16', 'imm16'), ['81 /4', 'mi', True, True]),
+        (('r/m32', 'imm32'), ['81 /4', 'mi', True, True]),
+        (('r/m64', 'imm32'), ['REX.W + 81 /4', 'mi', True, False]),
         
-        (('r/m8', 'r8'), ('38 /r', 'mr', True, True)),
+        (('r/m8', 'r8'),   ['20 /r', 'mr', True, True]),
+        (('r/m16', 'r16'), ['21 /r', 'mr', True, True]),
+        (('r/m32', 'r32'), ['21 /r', 'mr', True, True]),
+        (('r/m64', 'r64'), ['REX.W + 21 /r', 'mr', True, False]),
+        
+        (('r8', 'r/m8'),   ['22 /r', 'rm', True, True]),
+        (('r16', 'r/m16'), ['23 /r', 'rm', True, True]),
+        (('r32', 'r/m32'), ['23 /r', 'rm', True, True]),
+        (('r64', 'r/m64'), ['REX.W + 23 /r', 'rm', True, False]),
+    ])
+
+    operand_enc = {
+        'mi': ['ModRM:r/m (r,w)', 'imm8/16/32'],
+        'mr': ['ModRM:r/m (r,w)', 'ModRM:reg (r)'],
+        'rm': ['ModRM:reg (r,w)', 'ModRM:r/m (r)'],
+    }
+
+    def __init__(self, dst, src):  # set method signature
+        Instruction.__init__(self, dst, src)
+
+
+class or_(Instruction):
+    """Performs a bitwise inclusive OR operation between the destination (first)
+    and source (second) operands and stores the result in the destination 
+    operand location. 
+    
+    The source operand can be an immediate, a register, or a memory location;
+    the destination operand can be a register or a memory location. (However,
+    two memory operands cannot be used in one instruction.) Each bit of the
+    result is set to 0 if both corresponding bits of the first and second 
+    operands are 0; otherwise, each bit is set to 1.
+    
+    ====== =============== ====== ====== ======================================
+    dst    src             32-bit 64-bit description
+    ====== =============== ====== ====== ======================================
+    r/m8   r/m8, imm8       X      X     dst |= src
+    r/m16  r/m16, imm8/16   X      X     
+    r/m32  r/m32, imm8/32   X      X
+    r/m64  r/m64, imm8/32          X
+    ====== =============== ====== ====== ======================================
+    """
+    name = 'or'
+    
+    modes = collections.OrderedDict([
+        (('r/m8', 'imm8'),   ['80 /1', 'mi', True, True]),
+        (('r/m16', 'imm8'),  ['83 /1', 'mi', True, True]),
+        (('r/m32', 'imm8'),  ['83 /1', 'mi', True, True]),
+        (('r/m64', 'imm8'),  ['REX.W + 83 /1', 'mi', True, False]),
+        
+        (('r/m16', 'imm16'), ['81 /1', 'mi', True, True]),
+        (('r/m32', 'imm32'), ['81 /1', 'mi', True, True]),
+        (('r/m64', 'imm32'), ['REX.W + 81 /1', 'mi', True, False]),
+        
+        (('r/m8', 'r8'),   ['08 /r', 'mr', True, True]),
+        (('r/m16', 'r16'), ['09 /r', 'mr', True, True]),
+        (('r/m32', 'r32'), ['09 /r', 'mr', True, True]),
+        (('r/m64', 'r64'), ['REX.W + 09 /r', 'mr', True, False]),
+        
+        (('r8', 'r/m8'),   ['0a /r', 'rm', True, True]),
+        (('r16', 'r/m16'), ['0b /r', 'rm', True, True]),
+        (('r32', 'r/m32'), ['0b /r', 'rm', True, True]),
+        (('r64', 'r/m64'), ['REX.W + 0b /r', 'rm', True, False]),
+    ])
+
+    operand_enc = {
+        'mi': ['ModRM:r/m (r,w)', 'imm8/16/32'],
+        'mr': ['ModRM:r/m (r,w)', 'ModRM:reg (r)'],
+        'rm': ['ModRM:reg (r,w)', 'ModRM:r/m (r)'],
+    }
+
+    def __init__(self, dst, src):  # set method signature
+        Instruction.__init__(self, dst, src)
+
+
+class xor(Instruction):
+    """Performs a bitwise exclusive OR (XOR) operation on the destination (first)
+    and source (second) operands and stores the result in the destination 
+    operand location. 
+    
+    The source operand can be an immediate, a register, or a memory location;
+    the destination operand can be a register or a memory location. (However,
+    two memory operands cannot be used in one instruction.) Each bit of the
+    result is 1 if the corresponding bits of the operands are different; each
+    bit is 0 if the corresponding bits are the same.
+    
+    ====== =============== ====== ====== ======================================
+    dst    src             32-bit 64-bit description
+    ====== =============== ====== ====== ======================================
+    r/m8   r/m8, imm8       X      X     dst ^= src
+    r/m16  r/m16, imm8/16   X      X     
+    r/m32  r/m32, imm8/32   X      X
+    r/m64  r/m64, imm8/32          X
+    ====== =============== ====== ====== ======================================
+    """
+    name = 'xor'
+    
+    modes = collections.OrderedDict([
+        (('r/m8', 'imm8'),   ['80 /6', 'mi', True, True]),
+        (('r/m16', 'imm8'),  ['83 /6', 'mi', True, True]),
+        (('r/m32', 'imm8'),  ['83 /6', 'mi', True, True]),
+        (('r/m64', 'imm8'),  ['REX.W + 83 /6', 'mi', True, False]),
+        
+        (('r/m16', 'imm16'), ['81 /6', 'mi', True, True]),
+        (('r/m32', 'imm32'), ['81 /6', 'mi', True, True]),
+        (('r/m64', 'imm32'), ['REX.W + 81 /6', 'mi', True, False]),
+        
+        (('r/m8', 'r8'),   ['30 /r', 'mr', True, True]),
+        (('r/m16', 'r16'), ['31 /r', 'mr', True, True]),
+        (('r/m32', 'r32'), ['31 /r', 'mr', True, True]),
+        (('r/m64', 'r64'), ['REX.W + 31 /r', 'mr', True, False]),
+        
+        (('r8', 'r/m8'),   ['32 /r', 'rm', True, True]),
+        (('r16', 'r/m16'), ['33 /r', 'rm', True, True]),
+        (('r32', 'r/m32'), ['33 /r', 'rm', True, True]),
+        (('r64', 'r/m64'), ['REX.W + 33 /r', 'rm', True, False]),
+    ])
+
+    operand_enc = {
+        'mi': ['ModRM:r/m (r,w)', 'imm8/16/32'],
+        'mr': ['ModRM:r/m (r,w)', 'ModRM:reg (r)'],
+        'rm': ['ModRM:reg (r,w)', 'ModRM:r/m (r)'],
+    }
+
+    def __init__(self, dst, src):  # set method signature
+        Instruction.__init__(self, dst, src)
+
+
+class not_(Instruction):
+    """Performs a bitwise NOT operation (each 1 is set to 0, and each 0 is set
+    to 1) on the destination operand and stores the result in the destination
+    operand location. The destination operand can be a register or a memory 
+    location.
+    
+    ====== ====== ====== ======================================
+    dst    32-bit 64-bit description
+    ====== ====== ====== ======================================
+    r/m8    X      X     dst = ~dst
+    r/m16   X      X     
+    r/m32   X      X     
+    r/m64          X
+    ====== ====== ====== ======================================
+    """
+    name = 'not'
+
+    modes = collections.OrderedDict([
+        (('r/m8',),  ['f6 /2', 'm', True, True]),
+        (('r/m16',), ['f7 /2', 'm', True, True]),
+        (('r/m32',), ['f7 /2', 'm', True, True]),
+        (('r/m64',), ['REX.W + f7 /2', 'm', True, False]),
+    ])
+
+    operand_enc = {
+        'm': ['ModRM:r/m (r,w)'],
+    }
+
+    def __init__(self, dst):  # set method signature
+        Instruction.__init__(self, dst)
+
+
+class ShiftInstruction(Instruction):
+    """Base class for shift instructions. 
+    
+    Subclasses must set the *digit* attribute to the opcode extension that
+    selects the shift operation. The shift count may be an immediate value or
+    the register cl.
+    """
+    digit = None
+    
+    operand_enc = {
+        'm1': ['ModRM:r/m (r,w)', None],
+        'mc': ['ModRM:r/m (r,w)', None],
+        'mi': ['ModRM:r/m (r,w)', 'imm8'],
+    }
+    
+    def __init__(self, dst, count):  # set method signature
+        Instruction.__init__(self, dst, count)
+        
+    @property
+    def modes(self):
+        d = self.digit
+        return collections.OrderedDict([
+            (('r/m8', '1'),  ['d0 /%d' % d, 'm1', True, True]),
+            (('r/m16', '1'), ['d1 /%d' % d, 'm1', True, True]),
+            (('r/m32', '1'), ['d1 /%d' % d, 'm1', True, True]),
+            (('r/m64', '1'), ['REX.W + d1 /%d' % d, 'm1', True, False]),
+            
+            (('r/m8', 'cl'),  ['d2 /%d' % d, 'mc', True, True]),
+            (('r/m16', 'cl'), ['d3 /%d' % d, 'mc', True, True]),
+            (('r/m32', 'cl'), ['d3 /%d' % d, 'mc', True, True]),
+            (('r/m64', 'cl'), ['REX.W + d3 /%d' % d, 'mc', True, False]),
+            
+            (('r/m8', 'imm8'),  ['c0 /%d ib' % d, 'mi', True, True]),
+            (('r/m16', 'imm8'), ['c1 /%d ib' % d, 'mi', True, True]),
+            (('r/m32', 'imm8'), ['c1 /%d ib' % d, 'mi', True, True]),
+            (('r/m64', 'imm8'), ['REX.W + c1 /%d ib' % d, 'mi', True, False]),
+        ])
+
+    def read_signature(self):
+        Instruction.read_signature(self)
+        # The shift count is either the register cl or an immediate; a count
+        # of 1 has its own (shorter) encoding.
+        count = self.args[1]
+        sig = list(self._sig)
+        if isinstance(count, Register):
+            if count is not cl:
+                raise TypeError("Shift count register must be cl (got %s)." % 
+                                count.name)
+            sig[1] = 'cl'
+        elif count == 1:
+            sig[1] = '1'
+        self._sig = tuple(sig)
+
+
+class shl(ShiftInstruction):
+    """Shifts the bits in the first operand (destination operand) to the left 
+    by the number of bits specified in the second operand (count operand). 
+    Bits shifted beyond the destination operand boundary are first shifted 
+    into the CF flag, then discarded. Empty bit positions are cleared.
+    
+    The count operand can be an immediate value or the CL register. The count
+    is masked to 5 bits (or 6 bits if in 64-bit mode and REX.W is used).
+    
+    ====== =============== ====== ====== ======================================
+    dst    count           32-bit 64-bit description
+    ====== =============== ====== ====== ======================================
+    r/m8   1, cl, imm8      X      X     dst <<= count
+    r/m16  1, cl, imm8      X      X     
+    r/m32  1, cl, imm8      X      X
+    r/m64  1, cl, imm8             X
+    ====== =============== ====== ====== ======================================
+    """
+    name = 'shl'
+    digit = 4
+
+
+class shr(ShiftInstruction):
+    """Shifts the bits in the first operand (destination operand) to the right
+    by the number of bits specified in the second operand (count operand). 
+    Empty high-order bit positions are cleared (unsigned shift).
+    
+    The count operand can be an immediate value or the CL register. The count
+    is masked to 5 bits (or 6 bits if in 64-bit mode and REX.W is used).
+    
+    ====== =============== ====== ====== ======================================
+    dst    count           32-bit 64-bit description
+    ====== =============== ====== ====== ======================================
+    r/m8   1, cl, imm8      X      X     dst >>= count  (unsigned)
+    r/m16  1, cl, imm8      X      X     
+    r/m32  1, cl, imm8      X      X
+    r/m64  1, cl, imm8             X
+    ====== =============== ====== ====== ======================================
+    """
+    name = 'shr'
+    digit = 5
+
+
+class sar(ShiftInstruction):
+    """Shifts the bits in the first operand (destination operand) to the right
+    by the number of bits specified in the second operand (count operand). 
+    Empty high-order bit positions are filled with the sign bit of the 
+    original value (signed shift).
+    
+    The count operand can be an immediate value or the CL register. The count
+    is masked to 5 bits (or 6 bits if in 64-bit mode and REX.W is used).
+    
+    ====== =============== ====== ====== ======================================
+    dst    count           32-bit 64-bit description
+    ====== =============== ====== ====== ======================================
+    r/m8   1, cl, imm8      X      X     dst >>= count  (signed)
+    r/m16  1, cl, imm8      X      X     
+    r/m32  1, cl, imm8      X      X
+    r/m64  1, cl, imm8             X
+    ====== =============== ====== ====== ======================================
+    """
+    name = 'sar'
+    digit = 7
+
+
+
+#   SSE conversion and comparison instructions
+#----------------------------------------
+
+class cvtsi2sd(Instruction):
+    """Converts a signed doubleword integer (or signed quadword integer) in the
+    source operand to a double-precision floating-point value in the 
+    destination operand. The result is stored in the low quadword of the 
+    destination operand, and the high quadword is left unchanged. 
+    
+    ====== ================= ====== ====== ======================================
+    dst    src               32-bit 64-bit description
+    ====== ================= ====== ====== ======================================
+    xmm    r/m32              X      X     dst = (double)src
+    xmm    r/m64                     X     
+    ====== ================= ====== ====== ======================================
+    """
+    name = 'cvtsi2sd'
+    
+    modes = collections.OrderedDict([
+        (('xmm1', 'r/m32'),   ['f20f2a /r', 'rm', True, True, 'sse2']),
+        (('xmm1', 'r/m64'),   ['REX.W + f20f2a /r', 'rm', True, False, 'sse2']),
+    ])
+    
+    operand_enc = {
+        'rm': ['ModRM:reg (w)', 'ModRM:r/m (r)'],
+    }
+    
+    def __init__(self, dst, src):  # set method signature
+        Instruction.__init__(self, dst, src)
+
+
+class cvttsd2si(Instruction):
+    """Converts a double-precision floating-point value in the source operand
+    (second operand) to a signed doubleword integer (or signed quadword 
+    integer) in the destination operand (first operand). The source operand 
+    can be an XMM register or a 64-bit memory location. 
+    
+    The result is truncated (rounded toward zero), matching the semantics of a
+    C cast from double to int.
+    
+    ====== ================= ====== ====== ======================================
+    dst    src               32-bit 64-bit description
+    ====== ================= ====== ====== ======================================
+    r32    xmm, m64           X      X     dst = (int)src
+    r64    xmm, m64                  X     
+    ====== ================= ====== ====== ======================================
+    """
+    name = 'cvttsd2si'
+    
+    modes = collections.OrderedDict([
+        (('r32', 'xmm1/m64'),   ['f20f2c /r', 'rm', True, True, 'sse2']),
+        (('r64', 'xmm1/m64'),   ['REX.W + f20f2c /r', 'rm', True, False, 'sse2']),
+    ])
+    
+    operand_enc = {
+        'rm': ['ModRM:reg (w)', 'ModRM:r/m (r)'],
+    }
+    
+    def __init__(self, dst, src):  # set method signature
+        Instruction.__init__(self, dst, src)
+
+
+class cvtsi2ss(Instruction):
+    """Converts a signed doubleword integer (or signed quadword integer) in the
+    source operand to a single-precision floating-point value in the 
+    destination operand. The result is stored in the low doubleword of the 
+    destination operand, and the upper three doublewords are left unchanged. 
+    
+    ====== ================= ====== ====== ======================================
+    dst    src               32-bit 64-bit description
+    ====== ================= ====== ====== ======================================
+    xmm    r/m32              X      X     dst = (float)src
+    xmm    r/m64                     X     
+    ====== ================= ====== ====== ======================================
+    """
+    name = 'cvtsi2ss'
+    
+    modes = collections.OrderedDict([
+        (('xmm1', 'r/m32'),   ['f30f2a /r', 'rm', True, True, 'sse']),
+        (('xmm1', 'r/m64'),   ['REX.W + f30f2a /r', 'rm', True, False, 'sse']),
+    ])
+    
+    operand_enc = {
+        'rm': ['ModRM:reg (w)', 'ModRM:r/m (r)'],
+    }
+    
+    def __init__(self, dst, src):  # set method signature
+        Instruction.__init__(self, dst, src)
+
+
+class cvttss2si(Instruction):
+    """Converts a single-precision floating-point value in the source operand
+    (second operand) to a signed doubleword integer (or signed quadword 
+    integer) in the destination operand (first operand). The source operand 
+    can be an XMM register or a 32-bit memory location. 
+    
+    The result is truncated (rounded toward zero), matching the semantics of a
+    C cast from float to int.
+    
+    ====== ================= ====== ====== ======================================
+    dst    src               32-bit 64-bit description
+    ====== ================= ====== ====== ======================================
+    r32    xmm, m32           X      X     dst = (int)src
+    r64    xmm, m32                  X     
+    ====== ================= ====== ====== ======================================
+    """
+    name = 'cvttss2si'
+    
+    modes = collections.OrderedDict([
+        (('r32', 'xmm1/m32'),   ['f30f2c /r', 'rm', True, True, 'sse']),
+        (('r64', 'xmm1/m32'),   ['REX.W + f30f2c /r', 'rm', True, False, 'sse']),
+    ])
+    
+    operand_enc = {
+        'rm': ['ModRM:reg (w)', 'ModRM:r/m (r)'],
+    }
+    
+    def __init__(self, dst, src):  # set method signature
+        Instruction.__init__(self, dst, src)
+
+
+class cvtss2sd(Instruction):
+    """Converts a single-precision floating-point value in the source operand
+    (second operand) to a double-precision floating-point value in the 
+    destination operand (first operand). The source operand can be an XMM 
+    register or a 32-bit memory location. 
+    
+    ====== ================= ====== ====== ======================================
+    dst    src               32-bit 64-bit description
+    ====== ================= ====== ====== ======================================
+    xmm    xmm, m32           X      X     dst = (double)src
+    ====== ================= ====== ====== ======================================
+    """
+    name = 'cvtss2sd'
+    
+    modes = collections.OrderedDict([
+        (('xmm1', 'xmm2/m32'),   ['f30f5a /r', 'rm', True, True, 'sse2']),
+    ])
+    
+    operand_enc = {
+        'rm': ['ModRM:reg (w)', 'ModRM:r/m (r)'],
+    }
+    
+    def __init__(self, dst, src):  # set method signature
+        Instruction.__init__(self, dst, src)
+
+
+class cvtsd2ss(Instruction):
+    """Converts a double-precision floating-point value in the source operand
+    (second operand) to a single-precision floating-point value in the 
+    destination operand (first operand). The source operand can be an XMM 
+    register or a 64-bit memory location. The result is rounded according to
+    the rounding control bits in the MXCSR register.
+    
+    ====== ================= ====== ====== ======================================
+    dst    src               32-bit 64-bit description
+    ====== ================= ====== ====== ======================================
+    xmm    xmm, m64           X      X     dst = (float)src
+    ====== ================= ====== ====== ======================================
+    """
+    name = 'cvtsd2ss'
+    
+    modes = collections.OrderedDict([
+        (('xmm1', 'xmm2/m64'),   ['f20f5a /r', 'rm', True, True, 'sse2']),
+    ])
+    
+    operand_enc = {
+        'rm': ['ModRM:reg (w)', 'ModRM:r/m (r)'],
+    }
+    
+    def __init__(self, dst, src):  # set method signature
+        Instruction.__init__(self, dst, src)
+
+
+class ucomisd(Instruction):
+    """Performs an unordered compare of the double-precision floating-point 
+    values in the low quadwords of operand 1 (first operand) and operand 2 
+    (second operand), and sets the ZF, PF, and CF flags in the EFLAGS register
+    according to the result (unordered, greater than, less than, or equal). 
+    
+    The OF, SF and AF flags in the EFLAGS register are set to 0. The unordered
+    result is returned if either source operand is a NaN (QNaN or SNaN).
+    
+    ====== ================= ====== ====== ======================================
+    src1   src2              32-bit 64-bit description
+    ====== ================= ====== ====== ======================================
+    xmm    xmm, m64           X      X     
+    ====== ================= ====== ====== ======================================
+    
+    =========== === === ===
+    Result      ZF  PF  CF
+    =========== === === ===
+    unordered    1   1   1
+    greater      0   0   0
+    less         0   0   1
+    equal        1   0   0
+    =========== === === ===
+    """
+    name = 'ucomisd'
+    
+    modes = collections.OrderedDict([
+        (('xmm1', 'xmm2/m64'),   ['660f2e /r', 'rm', True, True, 'sse2']),
+    ])
+    
+    operand_enc = {
+        'rm': ['ModRM:reg (r)', 'ModRM:r/m (r)'],
+    }
+    
+    def __init__(self, src1, src2):  # set method signature
+        Instruction.__init__(self, src1, src2)
+
+
+class ucomiss(Instruction):
+    """Performs an unordered compare of the single-precision floating-point 
+    values in the low doublewords of operand 1 (first operand) and operand 2 
+    (second operand), and sets the ZF, PF, and CF flags in the EFLAGS register
+    according to the result (unordered, greater than, less than, or equal). 
+    The flags are set as for ucomisd.
+    
+    ====== ================= ====== ====== ======================================
+    src1   src2              32-bit 64-bit description
+    ====== ================= ====== ====== ======================================
+    xmm    xmm, m32           X      X     
+    ====== ================= ====== ====== ======================================
+    """
+    name = 'ucomiss'
+    
+    modes = collections.OrderedDict([
+        (('xmm1', 'xmm2/m32'),   ['0f2e /r', 'rm', True, True, 'sse']),
+    ])
+    
+    operand_enc = {
+        'rm': ['ModRM:reg (r)', 'ModRM:r/m (r)'],
+    }
+    
+    def __init__(self, src1, src2):  # set method signature
+        Instruction.__init__(self, src1, src2)
+
+
+class xorpd(Instruction):
+    """Performs a bitwise logical exclusive-OR of the two packed 
+    double-precision floating-point values from the source operand (second 
+    operand) and the destination operand (first operand), and stores the 
+    result in the destination operand.
+    
+    ====== ================= ====== ====== ======================================
+    dst    src               32-bit 64-bit description
+    ====== ================= ====== ====== ======================================
+    xmm    xmm, m128          X      X     dst ^= src
+    ====== ================= ====== ====== ======================================
+    """
+    name = 'xorpd'
+    
+    modes = collections.OrderedDict([
+        (('xmm1', 'xmm2/m128'),   ['660f57 /r', 'rm', True, True, 'sse2']),
+    ])
+    
+    operand_enc = {
+        'rm': ['ModRM:reg (r,w)', 'ModRM:r/m (r)'],
+    }
+    
+    def __init__(self, dst, src):  # set method signature
+        Instruction.__init__(self, dst, src)
+
+
+
+# Need:
+# fchs, fxch
+# fsin, fcos, fptan, fpatan, fcom, 
+# mul, andn
+
+# avx/sse2 instructions
+# movdq2q, movq2dq
+
+
+
+#   Testing instructions
+#----------------------------------------
+
+class cmp(Instruction):
+    """Compares the first source operand with the second source operand and 
+    sets the status flags in the EFLAGS register according to the results. 
+    
+    The comparison is performed by subtracting the second operand from the
+    first operand and then setting the status flags in the same manner as the
+    SUB instruction. When an immediate value is used as an operand, it is 
+    sign-extended to the length of the first operand.
+    
+    ====== =============== ====== ====== ======================================
+    src1   src2            32-bit 64-bit description
+    ====== =============== ====== ====== ======================================
+    r/m8   r/m8, imm8       X      X     
+    r/m16  r/m16, imm8/16   X      X     
+    r/m32  r/m32, imm8/32   X      X
+    r/m64  r/m64, imm8/32          X
+    ====== =============== ====== ====== ======================================
+    """
+    name = "cmp"
+    
+    modes = collections.OrderedDict([
+        (('r/m8', 'imm8'), ('80 /7', 'mi', True, True)),
+        (('r/m16', 'imm16'), ('81 /7', 'mi', True, True)),
+        (('r/m32', 'imm32'), ('81 /7', 'mi', True, True)),
+        (('r/m64', 'imm32'), ('REX.W + 81 /7', 'mi', True, False)),
+        
+        (('r/m16', 'imm8'), ('83 /7', 'mi', True, True)),
+        (('r/m32', 'imm8'), ('83 /7', 'mi', True, True)),
+        (('r/m64', 'imm8'), ('REX.W + 83 /7', 'mi', True, False)),
+        
+        (('r/m8', 'r8'), ('38 /r', 'mr', True, True)),
         (('r/m16', 'r16'), ('39 /r', 'mr', True, True)),
         (('r/m32', 'r32'), ('39 /r', 'mr', True, True)),
         (('r/m64', 'r64'), ('REX.W + 39 /r', 'mr', True, False)),
@@ -1539,6 +2491,58 @@ class test(Instruction):
 
 
 
+def _setcc(name, opcode, doc):
+    """Create a setcc instruction class.
+    """
+    modes = {
+        ('r/m8',): [opcode + ' /0', 'm', True, True],
+    }
+
+    op_enc = {
+        'm': ['ModRM:r/m (w)'],
+    }
+
+    d = (" Sets the byte in the destination operand to 1 if the condition is"
+         " met, and to 0 otherwise.")
+    return type(name, (Instruction,), {'modes': modes, 
+                                       'operand_enc': op_enc,
+                                       '__doc__': doc + d}) 
+
+
+seta   = _setcc('seta',   '0f97', """Set byte if above (CF=0 and ZF=0).""")
+setae  = _setcc('setae',  '0f93', """Set byte if above or equal (CF=0).""")
+setb   = _setcc('setb',   '0f92', """Set byte if below (CF=1).""")
+setbe  = _setcc('setbe',  '0f96', """Set byte if below or equal (CF=1 or ZF=1).""")
+setc   = _setcc('setc',   '0f92', """Set byte if carry (CF=1).""")
+sete   = _setcc('sete',   '0f94', """Set byte if equal (ZF=1).""")
+setz   = _setcc('setz',   '0f94', """Set byte if 0 (ZF=1).""")
+setg   = _setcc('setg',   '0f9f', """Set byte if greater (ZF=0 and SF=OF).""")
+setge  = _setcc('setge',  '0f9d', """Set byte if greater or equal (SF=OF).""")
+setl   = _setcc('setl',   '0f9c', """Set byte if less (SF≠ OF).""")
+setle  = _setcc('setle',  '0f9e', """Set byte if less or equal (ZF=1 or SF≠ OF).""")
+setna  = _setcc('setna',  '0f96', """Set byte if not above (CF=1 or ZF=1).""")
+setnae = _setcc('setnae', '0f92', """Set byte if not above or equal (CF=1).""")
+setnb  = _setcc('setnb',  '0f93', """Set byte if not below (CF=0).""")
+setnbe = _setcc('setnbe', '0f97', """Set byte if not below or equal (CF=0 and ZF=0).""")
+setnc  = _setcc('setnc',  '0f93', """Set byte if not carry (CF=0).""")
+setne  = _setcc('setne',  '0f95', """Set byte if not equal (ZF=0).""")
+setng  = _setcc('setng',  '0f9e', """Set byte if not greater (ZF=1 or SF≠ OF).""")
+setnge = _setcc('setnge', '0f9c', """Set byte if not greater or equal (SF ≠ OF).""")
+setnl  = _setcc('setnl',  '0f9d', """Set byte if not less (SF=OF).""")
+setnle = _setcc('setnle', '0f9f', """Set byte if not less or equal (ZF=0 and SF=OF).""")
+setno  = _setcc('setno',  '0f91', """Set byte if not overflow (OF=0).""")
+setnp  = _setcc('setnp',  '0f9b', """Set byte if not parity (PF=0).""")
+setns  = _setcc('setns',  '0f99', """Set byte if not sign (SF=0).""")
+setnz  = _setcc('setnz',  '0f95', """Set byte if not zero (ZF=0).""")
+seto   = _setcc('seto',   '0f90', """Set byte if overflow (OF=1).""")
+setp   = _setcc('setp',   '0f9a', """Set byte if parity (PF=1).""")
+setpe  = _setcc('setpe',  '0f9a', """Set byte if parity even (PF=1).""")
+setpo  = _setcc('setpo',  '0f9b', """Set byte if parity odd (PF=0).""")
+sets   = _setcc('sets',   '0f98', """Set byte if sign (SF=1).""")
+
+
+
+
 #   Branching instructions
 #----------------------------------------
 
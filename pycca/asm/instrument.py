@@ -0,0 +1,166 @@
+# -'- coding: utf-8 -'-
+"""
+Call counters and cycle timers for generated functions.
+
+A CodePage created with ``profile=True`` has each function entry and each
+``ret`` instruction wrapped with code that reads the time-stamp counter and
+atomically updates a counter table outside the code page::
+
+    page = CodePage(asm, profile=True)
+    ...
+    page.profile.stats()     # {'func': (calls, cycles), ...}
+    page.profile.reset()
+
+At entry, the call count is incremented and the current time stamp is
+subtracted from the cycle total; each ``ret`` adds the time stamp back, so
+that the total accumulates the cycles spent inside the function (including
+any functions it calls) without storing per-call state. The totals are only
+meaningful while no instrumented call is in progress.
+
+The instrumentation preserves all registers except the flags. Functions are
+the entry points found by :func:`function_labels` (or the labels given 
+explicitly); each ``ret`` is attributed to the nearest preceding function
+label.
+"""
+
+import ctypes
+from .instruction import Instruction, RelBranchInstruction, Label
+from .align import Align
+from .instructions import (push, pop, rdtsc, shl, or_, neg, mov, add, ret, 
+                           call, jmp)
+from .elf import _is_local
+from .register import rax, rdx
+from .pointer import qword
+
+
+class ProfileCounter(ctypes.Structure):
+    _fields_ = [
+        ('calls', ctypes.c_uint64),
+        ('cycles', ctypes.c_uint64),
+    ]
+
+
+class Profile(object):
+    """Table of call counts and cycle totals for instrumented functions.
+
+    The table is a ctypes array of :class:`ProfileCounter` that is updated in
+    place by the generated code; ``profile['name']`` returns the live counter
+    for one function, and :func:`array` returns a numpy view of the table.
+    """
+    def __init__(self, names):
+        self.names = list(names)
+        self.table = (ProfileCounter * len(self.names))()
+        self.address = ctypes.addressof(self.table)
+
+    def __getitem__(self, name):
+        return self.table[self.names.index(name)]
+
+    def stats(self):
+        """Return a dict of {name: (calls, cycles)}.
+        """
+        return dict((name, (c.calls, c.cycles))
+                    for name, c in zip(self.names, self.table))
+
+    def array(self):
+        """Return a numpy structured array (with fields 'calls' and
+        'cycles') that shares memory with the counter table.
+        """
+        import numpy as np
+        return np.ctypeslib.as_array(self.table)
+
+    def reset(self):
+        """Set all counters to zero.
+        """
+        ctypes.memset(self.table, 0, ctypes.sizeof(self.table))
+
+
+def _lock(instr):
+    # lock prefix makes the read-modify-write atomic across threads
+    return b'\xf0' + instr.code
+
+
+def _counter_code(addr, entry):
+    # Read the time stamp into rax and update the counter at *addr*
+    code = [
+        push(rax),
+        push(rdx),
+        rdtsc(),
+        shl(rdx, 32),
+        or_(rax, rdx),
+        mov(rdx, addr),
+    ]
+    if entry:
+        code += [
+            neg(rax),
+            _lock(add(qword([rdx]), 1)),
+        ]
+    code += [
+        _lock(add(qword([rdx + 8]), rax)),
+        pop(rdx),
+        pop(rax),
+    ]
+    return code
+
+
+def function_labels(asm):
+    """Return the names of labels in *asm* that are function entry points,
+    in order.
+
+    Entry points are labels that are called from the page, or are global 
+    names (not beginning with a single underscore; see 
+    :mod:`pycca.asm.elf`) that are not the target of a jump. They must be
+    followed by an instruction (rather than data) and must not be reached 
+    by falling through from the preceding instruction.
+    """
+    called = set()
+    targets = set()
+    for cmd in asm:
+        if isinstance(cmd, RelBranchInstruction) and isinstance(cmd.args[0], 
+                                                                str):
+            (called if isinstance(cmd, call) else targets).add(cmd.args[0])
+    names = []
+    pending = []
+    falls_through = False
+    for cmd in asm:
+        if isinstance(cmd, Label):
+            pending.append(cmd.name)
+            continue
+        if isinstance(cmd, Align):
+            # padding does not change the control flow
+            continue
+        if isinstance(cmd, Instruction) and not falls_through:
+            names.extend(n for n in pending 
+                         if n in called or 
+                         (not _is_local(n) and n not in targets))
+        pending = []
+        falls_through = (isinstance(cmd, Instruction) and 
+                         not isinstance(cmd, (ret, jmp)))
+    return names
+
+
+def instrument(asm, functions=None):
+    """Return (asm, Profile) where the returned list of instructions has
+    counters added at the entry and each return of *functions* (a list of
+    label names; by default all labels that are not jump targets).
+    """
+    if functions is None:
+        functions = function_labels(asm)
+    names = [cmd.name for cmd in asm if isinstance(cmd, Label)]
+    for name in functions:
+        if name not in names:
+            raise NameError("Label '%s' does not exist." % name)
+    # keep the page order of functions
+    functions = [name for name in names if name in functions]
+    profile = Profile(functions)
+
+    out = []
+    current = None
+    for cmd in asm:
+        if isinstance(cmd, ret) and current is not None:
+            out.extend(_counter_code(current, entry=False))
+        out.append(cmd)
+        if isinstance(cmd, Label) and cmd.name in functions:
+            index = functions.index(cmd.name)
+            current = profile.address + index * ctypes.sizeof(ProfileCounter)
+            out.extend(_counter_code(current, entry=True))
+    return out, profile
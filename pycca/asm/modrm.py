@@ -3,7 +3,7 @@
 import sys
 
 from .register import Register
-from .pointer import Pointer, mod_reg_rm
+from .pointer import Pointer, mod_reg_rm, rex
 from .util import long
 from .code import Code
 
@@ -0,0 +1,236 @@
+# -'- coding: utf-8 -'-
+"""
+Run machine code on several cores by splitting arrays into chunks.
+
+Functions are called from a persistent pool of Python threads. Functions
+created with ``nogil=True`` (the default for 
+:func:`CodePage.get_function() <pycca.asm.CodePage.get_function>` and 
+:class:`CCode <pycca.cc.CCode>`) release the GIL while they run, so chunks 
+are processed concurrently.
+"""
+
+import os, sys, ctypes, threading, functools
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from .batch import Py_buffer, _release_buffer
+
+
+PyBUF_WRITABLE = 0x0001
+PyBUF_ND = 0x0008
+
+# Default amount of data (in bytes, summed over all arrays) per chunk; about
+# the size of a typical per-core L2 cache.
+CHUNK_BYTES = 256 * 1024
+
+
+class ThreadPool(object):
+    """A persistent pool of *threads* worker threads (default: one per 
+    available CPU).
+
+    If *affinity* is True, worker *i* is pinned to the *i*-th available
+    CPU. *affinity* may also be a list giving the CPU (or set of CPUs) for
+    each worker. Thread affinity is only supported on Linux.
+    """
+    def __init__(self, threads=None, affinity=None):
+        cpus = _available_cpus()
+        if threads is None:
+            threads = len(cpus)
+        if affinity is True:
+            affinity = [cpus[i % len(cpus)] for i in range(threads)]
+        if affinity is not None:
+            if not hasattr(os, 'sched_setaffinity'):
+                raise NotImplementedError("Thread affinity is not supported "
+                                          "on this platform.")
+            if len(affinity) != threads:
+                raise ValueError("affinity must give one CPU set per thread.")
+            affinity = [set([a]) if isinstance(a, int) else set(a) 
+                        for a in affinity]
+        self.affinity = affinity
+        self.tasks = queue.Queue()
+        self.threads = []
+        for i in range(threads):
+            cpus = None if affinity is None else affinity[i]
+            thread = threading.Thread(target=self._work, args=(cpus,),
+                                      name='pycca-worker-%d' % i)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def __len__(self):
+        return len(self.threads)
+
+    def _work(self, cpus):
+        if cpus is not None:
+            # pid 0 refers to the calling thread
+            os.sched_setaffinity(0, cpus)
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                return
+            func, args, results, index, done = task
+            try:
+                results[index] = (True, func(*args))
+            except Exception:
+                results[index] = (False, sys.exc_info()[1])
+            done.put(index)
+
+    def run(self, func, arglist):
+        """Call ``func(*args)`` for each item in *arglist* using the worker
+        threads, and return the list of results in order.
+
+        If any call raises an exception, the first such exception is raised
+        after all calls have finished.
+        """
+        if len(self.threads) == 0:
+            raise RuntimeError("Thread pool is closed.")
+        results = [None] * len(arglist)
+        done = queue.Queue()
+        for i, args in enumerate(arglist):
+            self.tasks.put((func, args, results, i, done))
+        for i in range(len(arglist)):
+            done.get()
+        for ok, value in results:
+            if not ok:
+                raise value
+        return [value for ok, value in results]
+
+    def close(self):
+        """Stop all worker threads.
+        """
+        for thread in self.threads:
+            self.tasks.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+
+def _available_cpus():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(_cpu_count()))
+
+
+def _cpu_count():
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except (ImportError, NotImplementedError):
+        return 1
+
+
+_default_pool = None
+_pool_lock = threading.Lock()
+
+def default_pool():
+    """Return the shared ThreadPool used when no pool is specified, with 
+    one thread per available CPU.
+    """
+    global _default_pool
+    with _pool_lock:
+        if _default_pool is None:
+            _default_pool = ThreadPool()
+    return _default_pool
+
+
+def _get_buffers(arrays, outputs):
+    # Return a Py_buffer view of each array; views of the arrays whose 
+    # indices are in *outputs* must be writable. The views must be released
+    # with _release_buffers().
+    get = ctypes.pythonapi.PyObject_GetBuffer
+    get.argtypes = [ctypes.py_object, ctypes.POINTER(Py_buffer), 
+                    ctypes.c_int]
+    views = []
+    try:
+        for i, arr in enumerate(arrays):
+            view = Py_buffer()
+            # C-contiguous buffer with shape information
+            flags = PyBUF_ND
+            if i in outputs:
+                flags |= PyBUF_WRITABLE
+            get(arr, ctypes.byref(view), flags)
+            views.append(view)
+    except Exception:
+        _release_buffers(views)
+        raise
+    return views
+
+
+def _release_buffers(views):
+    for view in views:
+        _release_buffer(view)
+
+
+def _chunks(views, chunk_size, pool, extra_args):
+    # Return the list of argument tuples for calling *func* on each chunk:
+    # a pointer into each buffer followed by the chunk length.
+    lengths = set(view.shape[0] if view.ndim > 0 else 1 for view in views)
+    if len(lengths) != 1:
+        raise ValueError("Arrays must have the same number of items; "
+                         "got lengths %s" % sorted(lengths))
+    length = lengths.pop()
+    # Size in bytes of one item (first-axis entry) of each array
+    itemsizes = [view.len // length if length > 0 else 0 for view in views]
+    if chunk_size is None:
+        chunk_size = max(1, CHUNK_BYTES // max(1, sum(itemsizes)))
+        # make sure all threads have work
+        chunk_size = min(chunk_size, max(1, -(-length // len(pool))))
+    arglist = []
+    for start in range(0, length, chunk_size):
+        n = min(chunk_size, length - start)
+        ptrs = tuple(view.buf + start * size 
+                     for view, size in zip(views, itemsizes))
+        arglist.append(ptrs + tuple(extra_args) + (n,))
+    return arglist
+
+
+def parallel_map(func, arrays, chunk_size=None, pool=None, args=(), 
+                 outputs=()):
+    """Call *func* on chunks of *arrays* using a pool of threads.
+
+    *func* (typically a ctypes function returned by
+    :func:`CodePage.get_function() <pycca.asm.CodePage.get_function>` or a
+    :class:`CCode <pycca.cc.CCode>` function) is called as 
+    ``func(ptr1, ptr2, ..., *args, n)``, where each pointer is the address 
+    of the first item of the chunk in the corresponding array and *n* is
+    the number of items in the chunk. *arrays* must be C-contiguous objects
+    supporting the buffer protocol, with the same number of items along the
+    first axis. Output arrays are written in place; *outputs* gives the 
+    indices of these in *arrays*, which must be writable. The buffers of
+    all arrays are held until every chunk has finished.
+
+    By default, chunks hold about 256 kB of data (summed over all arrays).
+    *chunk_size* sets the number of items per chunk instead. *pool* is the
+    ThreadPool to use (default: :func:`default_pool`).
+
+    Returns the list of results of each call, in order.
+    """
+    if pool is None:
+        pool = default_pool()
+    views = _get_buffers(arrays, outputs)
+    try:
+        arglist = _chunks(views, chunk_size, pool, args)
+        return pool.run(func, arglist)
+    finally:
+        _release_buffers(views)
+
+
+def parallel_reduce(func, arrays, combine=None, chunk_size=None, pool=None,
+                    args=(), outputs=()):
+    """Call *func* on chunks of *arrays* as for :func:`parallel_map`, and
+    combine the result of each chunk using ``combine(a, b)``. 
+
+    *combine* may be any callable, including a function generated by pycca
+    that takes two values and returns one. The default adds the results. 
+    Partial results are combined in chunk order.
+    """
+    results = parallel_map(func, arrays, chunk_size=chunk_size, pool=pool,
+                           args=args, outputs=outputs)
+    if len(results) == 0:
+        raise ValueError("Cannot reduce empty arrays.")
+    if combine is None:
+        combine = lambda a, b: a + b
+    return functools.reduce(combine, results)
@@ -1,6 +1,8 @@
 import re
 from . import instructions, register, pointer
 from .instruction import Label, Instruction
+from .align import Align
+from . import data
 
 
 # Collect all registers in a single namespace for evaluating operands.
@@ -68,6 +70,10 @@ def parse_asm(asm, namespace=None):
         else:
             lineno, line, origline = line
         
+        if line.startswith('.'):
+            code.append(parse_directive(line, lineno, origline, eval_ns))
+            continue
+        
         m = re.match(r'([a-zA-Z_][a-zA-Z0-9_]*)( .*)?$', line)
         if m is None:
             raise SyntaxError('Expected instruction mnemonic on assembly line %d:'
@@ -76,10 +82,12 @@ def parse_asm(asm, namespace=None):
         mnem, ops = m.groups()
         mnem = mnem.strip()
         
-        # Get instruction class
-        try:
-            icls = getattr(instructions, mnem)
-        except AttributeError:
+        # Get instruction class (mnemonics that are python keywords, like 
+        # "and" or "int", are defined with a trailing underscore)
+        icls = getattr(instructions, mnem, None)
+        if icls is None:
+            icls = getattr(instructions, mnem + '_', None)
+        if icls is None:
             raise NameError('Unknown instruction "%s" on assembly line %d:' %
                             (mnem, lineno))
         
@@ -114,9 +122,69 @@ def parse_asm(asm, namespace=None):
             inst = icls(*args)
             # generate an error here if there is a compile problem:
             inst.code
+            # source line, used for debugging information
+            inst.lineno = lineno
             code.append(inst)
         except Exception as err:
             raise type(err)('Error creating instruction "%s %s" on assembly line'
                             ' %d:\n    %s' % (mnem, ops, lineno, str(err)))
     
     return code
+
+
+def parse_directive(line, lineno, origline, eval_ns):
+    """Return the code object for an assembler directive.
+    
+    Supported directives are:
+    
+    * ``.align n[, fill[, max_skip]]`` (as for GNU-as; *fill* is a byte 
+      value, or empty to pad with NOP instructions)
+    * ``.byte``, ``.word``, ``.long`` (or ``.int``), ``.quad``, ``.float``
+      (or ``.single``), and ``.double``, followed by a list of values
+    """
+    name, _, ops = line.partition(' ')
+    args = []
+    for op in ops.split(','):
+        op = op.strip()
+        if op == '':
+            args.append(None)
+            continue
+        try:
+            args.append(eval(op, {'__builtins__': {}}, eval_ns))
+        except Exception as err:
+            raise type(err)('Error parsing operand "%s" on assembly line'
+                            ' %d:\n    %s' % (op, lineno, str(err)))
+    
+    if name == '.align':
+        if len(args) > 3 or args[0] is None:
+            raise SyntaxError('Expected ".align n[, fill[, max_skip]]" on '
+                              'assembly line %d: "%s"' % (lineno, origline))
+        args += [None] * (3 - len(args))
+        try:
+            return Align(args[0], max_skip=args[2], fill=args[1])
+        except Exception as err:
+            raise type(err)('Error creating directive "%s" on assembly line'
+                            ' %d:\n    %s' % (line, lineno, str(err)))
+    if name in _data_directives:
+        if None in args:
+            raise SyntaxError('Expected a list of values on assembly line %d:'
+                              ' "%s"' % (lineno, origline))
+        try:
+            return _data_directives[name](*args)
+        except Exception as err:
+            raise type(err)('Error creating directive "%s" on assembly line'
+                            ' %d:\n    %s' % (line, lineno, str(err)))
+    raise NameError('Unknown directive "%s" on assembly line %d:' % 
+                    (name, lineno))
+
+
+_data_directives = {
+    '.byte': data.db,
+    '.word': data.dw,
+    '.long': data.dd,
+    '.int': data.dd,
+    '.quad': data.dq,
+    '.float': data.dfloat,
+    '.single': data.dfloat,
+    '.double': data.ddouble,
+}
@@ -0,0 +1,39 @@
+# -'- coding: utf-8 -'-
+
+import re
+
+
+def patch(name, size=4, value=0):
+    """
+    Create a named patch point to be used as an immediate operand.
+    
+    The operand is encoded as an immediate of at least *size* bytes (1, 2, 4,
+    or 8) holding *value*. After the code is loaded, the value may be changed
+    in place with :func:`CodePage.patch() <pycca.asm.CodePage.patch>`; the
+    same name may be used for more than one instruction.
+    
+    Example::
+    
+        page = CodePage([mov(rax, patch('threshold', 8)), ret()])
+        page.patch('threshold', 100)
+    """
+    return Patch(name, size, value)
+
+
+class Patch(object):
+    """Immediate operand whose value may be changed after compiling.
+    """
+    def __init__(self, name, size=4, value=0):
+        if re.match(r'[a-zA-Z_][a-zA-Z0-9_]*$', name) is None:
+            raise ValueError("Invalid patch point name '%s'" % name)
+        if size not in (1, 2, 4, 8):
+            raise ValueError("Patch point size must be 1, 2, 4, or 8 bytes.")
+        self.name = name
+        self.size = size
+        self.value = value
+        
+    def __str__(self):
+        return self.name
+    
+    def __repr__(self):
+        return "patch(%r, %d, %r)" % (self.name, self.size, self.value)
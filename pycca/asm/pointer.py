@@ -561,7 +561,9 @@ class Pointer(object):
             if base is None:
                 base = rbp
                 mod = 'ind'
-                disp = disp + b'\0' * (4-len(disp))
+                # disp32 is required without a base register
+                disp = pack_int(self.disp or 0, try_uint=True, int8=False,
+                                int16=False, int32=True, int64=False)
             
             mrex, modrm = mod_reg_rm(mod, reg, 'sib')
             srex, sib = mk_sib(byts, offset, base)            
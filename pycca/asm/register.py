@@ -126,7 +126,7 @@ class Register(object):
         """Raise an exception if this register is not supported for the current
         architecture. 
         """
-        if ARCH == 32 and self.name[0] == 'r':
+        if ARCH == 32 and (self.name[0] == 'r' or self.rex):
             raise TypeError("Register %s not supported on 32 bit arch." % self.name)
         
 
@@ -223,6 +223,15 @@ xmm5 = Register(0b101, 'xmm5', 128)
 xmm6 = Register(0b110, 'xmm6', 128)
 xmm7 = Register(0b111, 'xmm7', 128)
 
+xmm8  = Register(0b1000, 'xmm8',  128)  # 64-bit only
+xmm9  = Register(0b1001, 'xmm9',  128)
+xmm10 = Register(0b1010, 'xmm10', 128)
+xmm11 = Register(0b1011, 'xmm11', 128)
+xmm12 = Register(0b1100, 'xmm12', 128)
+xmm13 = Register(0b1101, 'xmm13', 128)
+xmm14 = Register(0b1110, 'xmm14', 128)
+xmm15 = Register(0b1111, 'xmm15', 128)
+
 
 # FP stack registers
 _st_registers = [Register(i, 'st(%d)' % i, 80) for i in range(8)]
@@ -140,6 +140,7 @@ def test_effective_address():
     itest(mov(edx, dword([0x1000])))
     itest(mov(edx, dword([0x1000 + ecx])))
     itest(mov(edx, dword([0x1000 + 2*ecx])))
+    itest(mov(edx, dword([-0x10 + 2*ecx])))
 
     # test using rbp as the SIB base
     itest(mov(edx, dword([ebp + 4*ecx + 0x1000])))
@@ -248,6 +249,51 @@ def test_movsd():
     itest(movsd([rax+rbx*4+0x1000], xmm1))
     itest(movsd(xmm1, qword([eax+ebx*4+0x1000])))
     itest(movsd(qword([eax+ebx*4+0x1000]), xmm1))
+    itest(movsd(xmm9, xmm1))
+    itest(movsd(xmm1, [r12+8]))
+    itest(movsd([r12+8], xmm15))
+
+def test_movss():
+    itest(movss(xmm1, [rax+rbx*4+0x1000]))
+    itest(movss([rax+rbx*4+0x1000], xmm1))
+    itest(movss(xmm1, dword([eax+ebx*4+0x1000])))
+    itest(movss(xmm9, xmm1))
+    itest(movss([r12+8], xmm15))
+
+def test_movzx():
+    itest(movzx(bx, cl))
+    itest(movzx(ebx, cl))
+    itest(movzx(rbx, r9b))
+    itest(movzx(ebx, word([rax])))
+    itest(movzx(rbx, byte([rax+rcx*2])))
+
+def test_movsx():
+    itest(movsx(bx, cl))
+    itest(movsx(ebx, cl))
+    itest(movsx(rbx, r9b))
+    itest(movsx(ebx, word([rax])))
+    itest(movsx(rbx, byte([rax+rcx*2])))
+    itest(movsxd(rbx, ecx))
+    itest(movsxd(r10, dword([rax])))
+
+def test_high_byte_rex():
+    # ah, ch, dh, bh cannot be encoded in instructions with a REX prefix
+    assert mov(ah, bl).code == b'\x88\xdc'
+    assert movzx(eax, bh).code == b'\x0f\xb6\xc7'
+    if ARCH == 32:
+        return
+    for instr in [lambda: cmp(bh, r10b), lambda: movzx(r9d, bh), 
+                  lambda: movsx(r9, ah), lambda: mov(r14b, ah), 
+                  lambda: and_(r12b, bh), lambda: mov(byte([r8]), ch),
+                  lambda: movzx(rax, dh)]:
+        with raises(TypeError):
+            instr().code
+
+def test_movq():
+    itest(movq(xmm1, rbx))
+    itest(movq(xmm12, r9))
+    itest(movq(rbx, xmm1))
+    itest(movq(r9, xmm12))
 
 
 # Procedure management instructions
@@ -276,6 +322,9 @@ def test_ret():
     itest(ret())
     itest(ret(4))
 
+def test_rdtsc():
+    itest(rdtsc())
+
 def test_call():
     # relative calls
     assert call(0x0) == as_code('call .+0x0', cache=True)
@@ -302,6 +351,24 @@ def test_add():
         for ptr in addresses(dest):
             itest(add(dest, ptr))
 
+
+def test_imm_sign_extension():
+    # immediates are sign-extended to the operand size; values that would
+    # change are rejected
+    assert and_(eax, 0xffffffff).code == b'\x81\xe0\xff\xff\xff\xff'
+    assert add(al, 0xff).code == b'\x80\xc0\xff'
+    if ARCH == 32:
+        return
+    assert and_(rax, -1).code == b'\x48\x83\xe0\xff'
+    assert mov(rax, 0xffffffff).code == b'\x48\xb8\xff\xff\xff\xff\0\0\0\0'
+    for instr in [lambda: and_(rax, 0xffffffff), lambda: or_(r14, 2787920088),
+                  lambda: xor(rbx, 2**31), lambda: test(rax, 0x80000000),
+                  lambda: imul(rax, rbx, 0x80000000), 
+                  lambda: add(qword([rax]), 0xffffffff),
+                  lambda: push(0x80000000)]:
+        with raises(ValueError):
+            instr().code
+
     
 def test_sub():
     itest( sub(rax, rbx) )
@@ -331,6 +398,12 @@ def test_imul():
     itest( imul(eax, dword([ebp])), True)
     itest( imul(rax, qword([rbp])) )
     
+    itest( imul(bl) )
+    itest( imul(bx) )
+    itest( imul(ebx) )
+    itest( imul(r10) )
+    itest( imul(dword([rbx])) )
+    
     for imm in [0x2, 0x2000]:
         itest( imul(ax, bp, imm), True)
         itest( imul(eax, ebp, imm), True)
@@ -342,6 +415,20 @@ def test_imul():
     
 def test_idiv():
     itest( idiv(ebp) )
+    itest( idiv(rbp) )
+    itest( idiv(r9) )
+    itest( idiv(dword([rax])) )
+
+def test_cdq():
+    itest( cdq() )
+    itest( cqo() )
+
+def test_neg():
+    itest( neg(bl) )
+    itest( neg(bx) )
+    itest( neg(ebx) )
+    itest( neg(r11) )
+    itest( neg(qword([rax+8])) )
 
 def test_lea():
     itest( lea(rax, [rbx+rcx*2+0x100]) )
@@ -449,6 +536,93 @@ def test_divsd():
     itest( divsd(xmm3, [rax]) )
 
 
+def test_cvtsi2sd():
+    itest( cvtsi2sd(xmm3, ebx) )
+    itest( cvtsi2sd(xmm3, rbx) )
+    itest( cvtsi2sd(xmm11, r9) )
+    itest( cvtsi2sd(xmm3, dword([rax])) )
+    itest( cvtsi2sd(xmm3, qword([rax])) )
+
+def test_cvttsd2si():
+    itest( cvttsd2si(ebx, xmm3) )
+    itest( cvttsd2si(rbx, xmm3) )
+    itest( cvttsd2si(r9, xmm11) )
+    itest( cvttsd2si(ebx, qword([rax])) )
+
+def test_float_arith():
+    for instr in (addss, subss, mulss, divss):
+        itest( instr(xmm1, xmm2) )
+        itest( instr(xmm9, xmm2) )
+        itest( instr(xmm1, xmm14) )
+        itest( instr(xmm1, dword([rax+rbx*2+4])) )
+    
+def test_cvtsi2ss():
+    itest( cvtsi2ss(xmm3, eax) )
+    itest( cvtsi2ss(xmm3, rax) )
+    itest( cvtsi2ss(xmm10, r10d) )
+    itest( cvtsi2ss(xmm3, dword([rax])) )
+    itest( cvttss2si(eax, xmm3) )
+    itest( cvttss2si(rax, xmm3) )
+    itest( cvttss2si(r12, xmm9) )
+    itest( cvttss2si(eax, dword([rbx+8])) )
+
+def test_ucomiss():
+    itest( ucomiss(xmm0, xmm1) )
+    itest( ucomiss(xmm8, xmm1) )
+    itest( ucomiss(xmm0, dword([rax])) )
+
+def test_cvtss2sd():
+    itest( cvtss2sd(xmm3, xmm4) )
+    itest( cvtss2sd(xmm11, xmm1) )
+    itest( cvtss2sd(xmm3, dword([rax])) )
+    itest( cvtsd2ss(xmm3, xmm4) )
+    itest( cvtsd2ss(xmm3, xmm12) )
+    itest( cvtsd2ss(xmm3, qword([rax+8])) )
+
+def test_ucomisd():
+    itest( ucomisd(xmm3, xmm4) )
+    itest( ucomisd(xmm3, [rax]) )
+    itest( ucomisd(xmm8, xmm14) )
+
+def test_xorpd():
+    itest( xorpd(xmm3, xmm4) )
+    itest( xorpd(xmm3, [rax]) )
+    itest( xorpd(xmm13, xmm2) )
+
+
+# Bitwise logical instructions
+
+def test_and():
+    for op in (and_, or_, xor):
+        itest( op(rcx, rbx) )
+        itest( op(bl, 0x10) )
+        itest( op(rbx, 0x10) )
+        itest( op(ebx, -1) )
+        itest( op(ebx, 0xff) )
+        itest( op(rbx, 0x1000) )
+        itest( op(bx, 0x1000) )
+        itest( op(r9, r12) )
+        itest( op(dword([0x1000]), eax) )
+        itest( op(eax, dword([0x1000])) )
+        itest( op(dword([0x1000]), 0x1000) )
+        itest( op(ax, [eax]) )
+
+def test_not():
+    itest( not_(bl) )
+    itest( not_(bx) )
+    itest( not_(ebx) )
+    itest( not_(r11) )
+    itest( not_(qword([rax+8])) )
+
+def test_shift():
+    for op in (shl, shr, sar):
+        for dst in (bl, bx, ebx, rbx, r9, dword([rax])):
+            itest( op(dst, 1) )
+            itest( op(dst, 5) )
+            itest( op(dst, cl) )
+    with raises(TypeError):
+        shl(eax, dl).code
+
 
 # Testing instructions
 
@@ -460,6 +634,15 @@ def test_cmp():
 def test_test():
     itest( test(eax, eax) )
 
+def test_setcc():
+    all_setcc = ('a,ae,b,be,c,e,z,g,ge,l,le,na,nae,nb,nbe,nc,ne,ng,nge,nl,nle,'
+                 'no,np,ns,nz,o,p,pe,po,s').split(',')
+    for name in all_setcc:
+        func = globals()['set' + name]
+        itest( func(al) )
+        itest( func(r10b) )
+        itest( func(byte([rax])) )
+
 
 # Branching instructions
 
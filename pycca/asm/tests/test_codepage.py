@@ -22,4 +22,702 @@ def test_labels():
     fn = cp.get_function('func2')
     fn.restype = ctypes.c_uint32
     assert fn() == 0xbeadface
-    
\ No newline at end of file
+    
+
+def test_nogil():
+    cp = CodePage([mov(eax, 5), ret()])
+    for nogil in (True, False):
+        fn = cp.get_function(nogil=nogil)
+        fn.restype = ctypes.c_uint32
+        assert fn() == 5
+        # ctypes holds the GIL only for functions flagged as using the C API
+        assert bool(fn._flags_ & ctypes._FUNCFLAG_PYTHONAPI) is not nogil
+
+
+def test_builtin():
+    import array, sys
+    from pytest import raises
+    if ARCH == 32 or sys.platform == 'win32':
+        return
+    cp = CodePage([
+        label('add'), lea(rax, [rdi+rsi]), ret(),
+        label('fma'), mulsd(xmm0, xmm1), addsd(xmm0, xmm2), ret(),
+        label('addf'), addss(xmm0, xmm1), ret(),
+        label('second'), mov(eax, dword([rdi+4])), ret(),
+        label('ident'), mov(rax, rdi), ret(),
+        label('nop'), ret(),
+    ])
+    long_t, int_t, dbl, flt, ptr = (ctypes.c_long, ctypes.c_int, 
+                                    ctypes.c_double, ctypes.c_float, 
+                                    ctypes.c_void_p)
+    add = cp.get_builtin('add', long_t, [long_t, long_t])
+    assert add(3, 4) == 7
+    assert add(-5, 2**40) == 2**40 - 5
+    assert add.__name__ == 'add'
+    
+    fma = cp.get_builtin('fma', dbl, [dbl, dbl, dbl], nogil=False)
+    assert fma(2.0, 3, 0.5) == 6.5
+    addf = cp.get_builtin('addf', flt, [flt, flt])
+    assert addf(1.5, 0.25) == 1.75
+    
+    # pointer arguments accept buffers, addresses, and None
+    second = cp.get_builtin('second', int_t, [ptr])
+    data = array.array('i', [10, -20, 30])
+    assert second(data) == -20
+    assert second(bytearray(b'\0\0\0\0\x05\0\0\0')) == 5
+    assert second(data.buffer_info()[0]) == -20
+    ident = cp.get_builtin('ident', ptr, [ptr])
+    # NULL is returned as None, as for ctypes c_void_p
+    assert ident(None) is None
+    assert ident(0) is None
+    assert ident(1234) == 1234
+    # ctypes pointers pass the address they hold
+    assert ident(ptr(1234)) == 1234
+    value = ctypes.c_int(7)
+    assert ident(ctypes.pointer(value)) == ctypes.addressof(value)
+    assert second(ctypes.pointer((ctypes.c_int * 2)(3, 4))) == 4
+    # read-only buffers are accepted only for const pointers
+    with raises(TypeError):
+        second(b'\0\0\0\0\x05\0\0\0')
+    csecond = cp.get_builtin('second', int_t, [ConstPointer(ptr)])
+    assert csecond(b'\0\0\0\0\x05\0\0\0') == 5
+    assert csecond(data) == -20
+    with raises(TypeError):
+        ConstPointer(long_t)
+    
+    nop = cp.get_builtin('nop')
+    assert nop() is None
+    
+    # errors are raised without calling the function
+    with raises(TypeError):
+        add(1)
+    with raises(TypeError):
+        add(1, 2, 3)
+    with raises(TypeError):
+        add('x', 1)
+    with raises(TypeError):
+        fma(1.0, 'a', 2.0)
+    with raises(TypeError):
+        second('abc')
+    with raises(OverflowError):
+        add(2**64, 1)
+    with raises(TypeError):
+        cp.get_builtin('add', ctypes.c_char, [])
+
+
+def test_buffer_args():
+    import array, sys
+    from pytest import raises
+    if ARCH == 32 or sys.platform == 'win32':
+        return
+    # sum(double* data, long n, long stride)
+    cp = CodePage([
+        label('sum'),
+        xorpd(xmm0, xmm0),
+        test(rsi, rsi), 
+        je('end'),
+        label('loop'),
+        addsd(xmm0, qword([rdi])),
+        lea(rdi, [rdi+rdx*8]),
+        dec(rsi), 
+        jne('loop'),
+        label('end'), 
+        ret(),
+        label('length'), 
+        mov(rax, rsi), 
+        ret(),
+    ])
+    dbl = ctypes.c_double
+    total = cp.get_builtin('sum', dbl, [Buffer(dbl, length=True, strided=True)])
+    data = array.array('d', range(10))
+    assert total(data) == 45
+    assert total(memoryview(data)[::3]) == 18
+    assert total(memoryview(data)[::-1]) == 45
+    assert total(array.array('d')) == 0
+
+    length = cp.get_builtin('length', ctypes.c_long, 
+                            [Buffer(ctypes.c_int, length=True), 
+                             Buffer(ctypes.c_char, length=True, writable=True)])
+    assert length(array.array('i', [1, 2, 3]), bytearray(5)) == 3
+    
+    with raises(TypeError):
+        total(array.array('f', [1]))
+    with raises(TypeError):
+        total(3)
+    with raises(ValueError):
+        total(memoryview(bytes(16)).cast('d', (2, 1)))
+    # non-contiguous and read-only buffers are rejected
+    with raises(BufferError):
+        length(memoryview(array.array('i', range(6)))[::2], bytearray(1))
+    with raises(BufferError):
+        length(array.array('i', [1]), b'read-only')
+        
+
+def test_numpy_buffer_args():
+    import sys
+    from pytest import importorskip, raises
+    np = importorskip('numpy')
+    if ARCH == 32 or sys.platform == 'win32':
+        return
+    cp = CodePage([mov(rax, rsi), ret()])
+    length = cp.get_builtin(restype=ctypes.c_long, 
+                            argtypes=[Buffer(ctypes.c_double, length=True)])
+    assert length(np.zeros((3, 4))) == 12
+    with raises(TypeError):
+        length(np.zeros(3, dtype=np.float32))
+    # numpy raises ValueError for non-contiguous arrays
+    with raises((BufferError, ValueError)):
+        length(np.zeros((3, 4))[:, 0])
+
+
+def test_batch():
+    import array, sys
+    from pytest import raises
+    if ARCH == 32 or sys.platform == 'win32':
+        return
+    cp = CodePage([
+        label('add'), lea(rax, [rdi+rsi]), ret(),
+        label('fma'), mulsd(xmm0, xmm1), addsd(xmm0, xmm2), ret(),
+        label('scale'), cvtsi2ss(xmm1, edi), mulss(xmm0, xmm1), ret(),
+    ])
+    long_t, dbl = ctypes.c_long, ctypes.c_double
+    add = cp.get_batch('add', long_t, [long_t, long_t])
+    a = array.array('l', range(10))
+    b = array.array('l', range(100, 110))
+    assert list(add(a, b)) == list(range(100, 120, 2))
+    # strided arguments
+    assert list(add(memoryview(a)[::2], memoryview(b)[1::2])) == [101, 105, 109, 113, 117]
+    assert len(add(array.array('l'), array.array('l'))) == 0
+    
+    fma = cp.get_batch('fma', dbl, [dbl, dbl, dbl])
+    x = array.array('d', [1, 2, 3])
+    out = array.array('d', [0] * 4)
+    assert fma(x, x, x, out=out) is out
+    assert list(out) == [2, 6, 12, 0]
+    
+    scale = cp.get_batch('scale', ctypes.c_float, [ctypes.c_int, ctypes.c_float])
+    assert list(scale(array.array('i', [1, -2, 3]), array.array('f', [0.5] * 3))) == [0.5, -1, 1.5]
+    
+    with raises(TypeError):
+        add(a, x)
+    with raises(TypeError):
+        add(a)
+    with raises(ValueError):
+        add(a, b[:5])
+    with raises(ValueError):
+        fma(x, x, x, out=array.array('d'))
+
+    # the driver does not modify the caller's column pointers, in either the
+    # contiguous or the strided loop
+    res = array.array('l', [0] * 10)
+    addrs = [a.buffer_info()[0], b.buffer_info()[0], res.buffer_info()[0]]
+    for step in (1, 2):
+        columns = (ctypes.c_void_p * 3)(*addrs)
+        strides = (ctypes.c_ssize_t * 3)(*[8 * step] * 3)
+        n = ctypes.c_ssize_t(10 // step)
+        add.driver(columns, ctypes.byref(n), strides, None)
+        assert list(columns) == addrs
+        assert list(res[::step]) == list(range(100, 120, 2 * step))
+        
+
+def test_numpy_batch():
+    import sys
+    from pytest import importorskip
+    np = importorskip('numpy')
+    if ARCH == 32 or sys.platform == 'win32':
+        return
+    cp = CodePage([mulsd(xmm0, xmm1), ret()])
+    mul = cp.get_batch(restype=ctypes.c_double, 
+                       argtypes=[ctypes.c_double, ctypes.c_double])
+    rec = np.zeros(5, dtype=[('x', float), ('y', float), ('i', int)])
+    rec['x'] = np.arange(5)
+    rec['y'] = 2
+    out = np.empty(5)
+    mul(rec, out=out)
+    assert np.all(out == np.arange(5) * 2)
+
+
+def test_ufunc():
+    import sys
+    from pytest import importorskip
+    np = importorskip('numpy')
+    if ARCH == 32 or sys.platform == 'win32':
+        return
+    cp = CodePage([
+        label('addi'), lea(eax, [edi+esi]), ret(),
+        label('addd'), addsd(xmm0, xmm1), ret(),
+        # inner loop: out[i] = 2 * in[i] for doubles
+        label('double'),
+        mov(rcx, qword([rsi])),
+        mov(rsi, qword([rdi])),
+        mov(rdi, qword([rdi+8])),
+        mov(r8, qword([rdx])),
+        mov(r9, qword([rdx+8])),
+        test(rcx, rcx),
+        je('double_done'),
+        label('double_loop'),
+        movsd(xmm0, qword([rsi])),
+        addsd(xmm0, xmm0),
+        movsd(qword([rdi]), xmm0),
+        add(rsi, r8),
+        add(rdi, r9),
+        dec(rcx),
+        jne('double_loop'),
+        label('double_done'),
+        ret(),
+    ])
+    i32, dbl = ctypes.c_int32, ctypes.c_double
+    plus = cp.get_ufunc('plus', [('addi', i32, [i32, i32]), 
+                                 ('addd', dbl, [dbl, dbl])], identity=0)
+    assert plus.types == ['ii->i', 'dd->d']
+    x = np.arange(10.)
+    assert np.all(plus(x, 1) == x + 1)
+    # strided, broadcast, and integer arguments
+    assert np.all(plus(x[::2], x[1::2]) == x[::2] + x[1::2])
+    m = np.arange(12.).reshape(3, 4)
+    assert np.all(plus(m, x[:4]) == m + x[:4])
+    ints = plus(np.arange(5, dtype=np.int32), np.int32(3))
+    assert ints.dtype == np.int32 and list(ints) == [3, 4, 5, 6, 7]
+    # reductions, out=, where=
+    assert plus.reduce(x) == 45
+    assert plus.reduce(np.zeros(0)) == 0
+    assert np.all(plus.reduce(m, axis=0) == m.sum(axis=0))
+    out = np.zeros(10)
+    plus(x, x, out=out, where=x > 4)
+    assert np.all(out == np.where(x > 4, 2 * x, 0))
+    
+    double = cp.get_ufunc('double', [('double', [dbl, dbl])])
+    assert np.all(double(x) == 2 * x)
+    assert np.all(double(m[:, ::2]) == 2 * m[:, ::2])
+
+    # the code page is kept alive by the ufuncs that use it, and no longer
+    import gc, weakref
+    ref = weakref.ref(cp)
+    del cp
+    gc.collect()
+    assert np.all(double(x) == 2 * x)
+    assert np.all(plus(x, x) == 2 * x)
+    del plus, double
+    gc.collect()
+    assert ref() is None
+
+
+def _shared_child(page, queue):
+    fn = page.get_function('get')
+    fn.restype = ctypes.c_int
+    queue.put((page.page_addr, fn()))
+
+
+def test_shared():
+    import sys, pickle, multiprocessing
+    from pytest import raises
+    from pycca.asm.code import Code
+    if ARCH == 32 or not sys.platform.startswith('linux'):
+        return
+    # 'ptr' holds the absolute address of 'data', which must be relocated
+    # if the code is mapped at a different address.
+    ptr = Code(b'\0' * 8)
+    ptr.replace(0, 'data', 'Q')
+    cp = CodePage([
+        label('data'), b'\x05\0\0\0', 
+        label('ptr'), ptr, 
+        label('get'),
+        mov(rax, qword([label('ptr')])),
+        mov(eax, dword([rax])),
+        ret(),
+    ], shared=True)
+    assert cp.relocations == [(4, 'Q')]
+    fn = cp.get_function('get')
+    fn.restype = ctypes.c_int
+    assert fn() == 5
+    
+    # Unpickling in the same process maps a private, relocated copy
+    cp2 = pickle.loads(pickle.dumps(cp))
+    assert cp2.page_addr != cp.page_addr
+    fn2 = cp2.get_function('get')
+    fn2.restype = ctypes.c_int
+    assert fn2() == 5
+    ctypes.c_int.from_address(cp2.labels['data']).value = 7
+    assert fn2() == 7 and fn() == 5
+    
+    # Other processes map the code at the same address without recompiling
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_shared_child, args=(cp, queue))
+    proc.start()
+    addr, val = queue.get(timeout=30)
+    proc.join()
+    assert val == 5
+    
+    with raises(TypeError):
+        pickle.dumps(CodePage([ret()]))
+
+
+def test_profile():
+    from pytest import raises
+    if ARCH == 32:
+        return
+    asm = """
+    sum3:
+        lea rax, [rdi+rsi]
+        add rax, rdx
+        ret
+    repeat:
+        mov rcx, rdi
+      loop:
+        push rcx
+        mov rdi, 1
+        mov rsi, 2
+        mov rdx, 3
+        call sum3
+        pop rcx
+        dec rcx
+        jnz loop
+        ret
+    data:
+    """
+    plain = CodePage(asm)
+    assert plain.profile is None
+    cp = CodePage(asm, profile=True)
+    assert cp.profile.names == ['sum3', 'repeat']
+    assert len(cp.code) > len(plain.code)
+
+    # registers used by arguments and return values are preserved
+    sum3 = cp.get_function('sum3')
+    sum3.restype = ctypes.c_long
+    sum3.argtypes = (ctypes.c_long,) * 3
+    assert sum3(10, 20, 30) == 60
+    assert cp.profile['sum3'].calls == 1
+    cp.profile.reset()
+    repeat = cp.get_function('repeat')
+    repeat.restype = ctypes.c_long
+    repeat.argtypes = (ctypes.c_long,)
+    assert repeat(100) == 6
+
+    stats = cp.profile.stats()
+    assert stats['sum3'][0] == 100
+    assert stats['repeat'][0] == 1
+    # time spent in repeat includes the calls to sum3
+    assert 0 < stats['sum3'][1] < stats['repeat'][1] < 2**63
+    cp.profile.reset()
+    assert cp.profile.stats() == {'sum3': (0, 0), 'repeat': (0, 0)}
+
+    cp = CodePage(asm, profile=['repeat'])
+    assert cp.profile.names == ['repeat']
+    with raises(NameError):
+        CodePage(asm, profile=['missing'])
+
+
+def test_add():
+    from pytest import raises
+    cp = CodePage([label('one'), mov(eax, 1), ret()], capacity=64)
+    one = cp.get_function('one')
+    one.restype = ctypes.c_uint32
+    page_addr = cp.page_addr
+
+    # fits in the reserved capacity (rounded up to whole pages)
+    funcs = cp.add([
+        label('two'), call('one'), add(eax, eax), ret(),
+    ])
+    assert list(funcs) == ['two']
+    funcs['two'].restype = ctypes.c_uint32
+    assert funcs['two']() == 2
+    assert cp.segments == []
+
+    # does not fit; placed in a new segment that calls back into the page
+    funcs = cp.add([
+        label('three'), call('two'), inc(eax), jmp('three_end'),
+        b'\x90' * len(cp.page),
+        label('three_end'), ret(),
+    ])
+    assert list(funcs) == ['three']
+    assert len(cp.segments) == 1
+    three = cp.get_function('three')
+    three.restype = ctypes.c_uint32
+    assert three() == 3
+
+    # the new segment is filled before another is created
+    funcs = cp.add("four:\n call three\n inc eax\n ret\n")
+    funcs['four'].restype = ctypes.c_uint32
+    assert funcs['four']() == 4
+    assert len(cp.segments) == 1
+
+    # existing functions are unchanged
+    assert cp.page_addr == page_addr
+    assert one() == 1
+    assert 'three' not in cp.dump()
+
+    with raises(NameError):
+        cp.add([label('one'), ret()])
+
+
+def test_patch():
+    from pytest import raises
+    if ARCH == 64:
+        scale, base = patch('scale', 1, 2), patch('base', 8, 0x1234)
+        cp = CodePage([
+            label('mul'), mov(eax, 3), imul(eax, eax, scale), ret(),
+            label('addr'), mov(rax, base), ret(),
+        ])
+        fn = cp.get_function('addr')
+        fn.restype = ctypes.c_uint64
+        assert fn() == 0x1234
+        cp.patch('base', 2**48 + 5)
+        assert fn() == 2**48 + 5
+        # the 8-byte field at offset 11 crosses a word boundary
+        assert cp.patch_atomic('base') is False
+    else:
+        scale = patch('scale', 1, 2)
+        cp = CodePage([
+            label('mul'), mov(eax, 3), imul(eax, eax, scale), ret(),
+        ])
+    fn = cp.get_function('mul')
+    fn.restype = ctypes.c_int32
+    assert fn() == 6
+    # a 1-byte field never crosses a word boundary
+    assert cp.patch_atomic('scale') is True
+    cp.patch('scale', -5)
+    assert fn() == -15
+
+    # every use of the name is patched, including code added later, which
+    # is compiled with the current value
+    funcs = cp.add([label('set'), mov(eax, patch('scale', 4, 2)), ret()])
+    funcs['set'].restype = ctypes.c_int32
+    assert funcs['set']() == -5
+    cp.patch('scale', 7)
+    assert fn() == 21
+    assert funcs['set']() == 7
+    
+    # values are checked against every field before any is written
+    with raises(ValueError) as exc:
+        cp.patch('scale', 300)
+    assert "'scale'" in str(exc.value)
+    assert fn() == 21
+    assert funcs['set']() == 7
+    cp.patch('scale', -128)
+    assert fn() == -384
+    assert funcs['set']() == -128
+    
+    with raises(NameError):
+        cp.patch('offset', 1)
+    with raises(NameError):
+        CodePage([label('x'), mov(eax, patch('x')), ret()])
+    
+    if ARCH == 32:
+        return
+    # sign-extended fields accept only values that are read back unchanged
+    cp = CodePage([label('add'), mov(rax, 0), add(rax, patch('k', 4)), ret(),
+                   label('get'), mov(eax, patch('u', 4)), ret()])
+    add_k, get_u = cp.get_function('add'), cp.get_function('get')
+    add_k.restype = ctypes.c_int64
+    get_u.restype = ctypes.c_uint32
+    with raises(ValueError) as exc:
+        cp.patch('k', 0xffffffff)
+    assert "'k'" in str(exc.value)
+    assert add_k() == 0
+    cp.patch('k', -1)
+    assert add_k() == -1
+    # a 32-bit field of a 32-bit operand may hold unsigned values
+    cp.patch('u', 0xffffffff)
+    assert get_u() == 0xffffffff
+    funcs = cp.add([label('get2'), mov(eax, patch('u', 4, 5)), ret()])
+    funcs['get2'].restype = ctypes.c_uint32
+    assert funcs['get2']() == 0xffffffff
+
+
+def test_wx():
+    import sys
+    from pytest import raises
+    if sys.platform == 'win32':
+        return
+    for wx in (True, 'dual'):
+        if wx == 'dual' and not sys.platform.startswith('linux'):
+            continue
+        cp = CodePage([label('one'), mov(eax, patch('value', 4, 1)), ret()],
+                      wx=wx)
+        page = cp.page
+        assert page.rw_offset == (0 if wx is True else page.rw_addr - 
+                                  page.addr)
+        one = cp.get_function('one')
+        one.restype = ctypes.c_uint32
+        assert one() == 1
+        if wx is True:
+            # the code cannot be written directly
+            assert _protection(cp.page_addr) == 'r-x'
+        with cp.writable():
+            if wx is True:
+                assert _protection(cp.page_addr) == 'rw-'
+            cp.patch('value', 5)
+            funcs = cp.add([label('two'), mov(eax, 2), ret()])
+            assert page._writers == 1
+        assert page._writers == 0
+        if wx is True:
+            assert _protection(cp.page_addr) == 'r-x'
+        assert one() == 5
+        funcs['two'].restype = ctypes.c_uint32
+        assert funcs['two']() == 2
+        
+        # new segments are protected as well
+        funcs = cp.add([label('three'), mov(eax, 3), ret(),
+                        b'\x90' * len(cp.page)])
+        assert cp.segments[0].wx == wx
+        funcs['three'].restype = ctypes.c_uint32
+        assert funcs['three']() == 3
+
+    with raises(ValueError):
+        CodePage([ret()], wx='rwx')
+
+
+def _protection(addr):
+    # return the permissions of the mapping containing *addr*
+    import sys
+    if not sys.platform.startswith('linux'):
+        return None
+    for line in open('/proc/self/maps'):
+        start, end = [int(x, 16) for x in line.split()[0].split('-')]
+        if start <= addr < end:
+            return line.split()[1][:3]
+
+
+def test_hugepages():
+    import sys
+    from pycca.asm.codepage import HUGE_PAGE_SIZE
+    if not sys.platform.startswith('linux'):
+        return
+    for wx in (False, True):
+        cp = CodePage([label('one'), mov(eax, 1), ret()], hugepages=True,
+                      wx=wx)
+        assert cp.backing in ('hugetlb', 'thp', 'normal')
+        assert cp.page_addr % HUGE_PAGE_SIZE == 0
+        assert len(cp.page) == HUGE_PAGE_SIZE
+        fn = cp.get_function('one')
+        fn.restype = ctypes.c_uint32
+        assert fn() == 1
+        funcs = cp.add([label('two'), mov(eax, 2), ret()])
+        funcs['two'].restype = ctypes.c_uint32
+        assert funcs['two']() == 2
+    
+    # falls back to normal pages where huge pages are not supported
+    cp = CodePage([ret()], hugepages=True, wx='dual')
+    assert cp.backing == 'normal'
+    assert CodePage([ret()]).backing == 'normal'
+
+
+def test_align():
+    from pycca.asm.align import Align
+    cp = CodePage([
+        label('one'), mov(eax, 1), ret(),
+        align(32), label('two'), mov(eax, 2), ret(),
+        align(64, max_skip=4), label('three'), mov(eax, 3), ret(),
+        b'\x01', align(4, fill=0), label('data'), b'\x02',
+    ])
+    assert cp.labels['two'] % 32 == 0
+    assert cp.labels['three'] - cp.labels['two'] == 6
+    assert cp.labels['data'] % 4 == 0
+    tail = cp.code[cp.code.rindex(b'\x01'):]
+    assert tail == b'\x01' + b'\0' * (len(tail) - 2) + b'\x02'
+    for i, name in enumerate(['one', 'two', 'three']):
+        fn = cp.get_function(name)
+        fn.restype = ctypes.c_uint32
+        assert fn() == i + 1
+    assert '.align 32' in cp.dump()
+
+    # automatic alignment of function entries and loop targets
+    asm = """
+        count:
+            mov eax, 0
+        loop:
+            inc eax
+            cmp eax, 10
+            jne loop
+        done:
+            ret
+        next:
+            mov eax, 7
+            jmp done
+    """
+    cp = CodePage(asm, align=16)
+    aligned = [cmd.addr + len(cmd) for cmd in cp.asm if isinstance(cmd, Align)]
+    # (done is the target of a backward jump)
+    names = ('count', 'loop', 'done', 'next')
+    assert sorted(aligned) == sorted(cp.labels[name] for name in names)
+    assert all(cp.labels[name] % 16 == 0 for name in names)
+    fn = cp.get_function('count')
+    fn.restype = ctypes.c_uint32
+    assert fn() == 10
+    funcs = cp.add("again:\n jmp loop\n")
+    assert cp.labels['again'] % 16 == 0
+
+    # labels reached by falling through are not padded unless they are loop
+    # targets
+    asm = """
+        check:
+            mov eax, 1
+            cmp eax, 2
+            je skip
+        middle:
+            inc eax
+        skip:
+            ret
+    """
+    cp = CodePage(asm, align=16)
+    aligned = [cmd.addr + len(cmd) for cmd in cp.asm if isinstance(cmd, Align)]
+    assert aligned == [cp.labels['check']]
+    plain = CodePage(asm)
+    for name in ('middle', 'skip'):
+        assert (cp.labels[name] - cp.labels['check'] == 
+                plain.labels[name] - plain.labels['check'])
+    fn = cp.get_function('check')
+    fn.restype = ctypes.c_uint32
+    assert fn() == 2
+
+
+def test_data():
+    import struct
+    cp = CodePage([
+        label('get'), mov(eax, [label('table') + 4]), ret(),
+        align(4), label('table'), dd(1, -2, 0xffffffff), db(3, b'ab'),
+        dw(-1), dq(2**63 + 1), dfloat(0.5), ddouble(1.5),
+    ])
+    offset = cp.labels['table'] - cp.page_addr
+    assert cp.code[offset:] == (struct.pack('<iiI', 1, -2, 0xffffffff) + 
+                                b'\x03ab' + b'\xff\xff' + 
+                                struct.pack('<Qfd', 2**63 + 1, 0.5, 1.5))
+    fn = cp.get_function('get')
+    fn.restype = ctypes.c_int32
+    assert fn() == -2
+    assert 'dd 1, -2, 4294967295' in cp.dump()
+
+
+def test_constant_pool():
+    from pytest import raises
+    from pycca.asm.data import ConstantPool
+    pool = ConstantPool()
+    a = pool.double(1.5)
+    assert pool.double(1.5).label == a.label
+    assert len(pool) == 1
+    cp = CodePage([
+        label('f'), movsd(xmm0, a), addsd(xmm0, pool.double(1.5)), 
+        mulsd(xmm0, pool.double(2.0)), ret(),
+        label('g'), mov(eax, pool.long(7)), ret(),
+    ], constants=pool)
+    assert cp.labels[a.label] % 8 == 0
+    assert len(pool) == 3
+    fn = cp.get_function('f')
+    fn.restype = ctypes.c_double
+    assert fn() == 6.0
+    fn = cp.get_function('g')
+    fn.restype = ctypes.c_uint32
+    assert fn() == 7
+
+    # constants used by code added later are placed after that code
+    funcs = cp.add([label('h'), movsd(xmm0, pool.double(2.0)), 
+                    addsd(xmm0, pool.double(0.25)), ret()])
+    funcs['h'].restype = ctypes.c_double
+    assert funcs['h']() == 2.25
+    assert len(pool) == 4
+
+    with raises(ValueError):
+        db(256)
+    with raises(TypeError):
+        dw(b'ab')
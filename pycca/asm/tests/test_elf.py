@@ -0,0 +1,119 @@
+import os, sys, ctypes, subprocess
+from pytest import raises, skip
+from pycca.asm import *
+from pycca.asm.code import Code
+
+
+def make_page():
+    # 'ptr' holds the absolute address of 'data' and needs a relocation
+    ptr = Code(b'\0' * 8)
+    ptr.replace(0, 'data', 'Q')
+    return CodePage([
+        label('add'), 
+        lea(rax, [rdi+rsi]), 
+        ret(),
+        label('_helper'), 
+        mov(eax, 3), 
+        ret(),
+        label('three'), 
+        call('_helper'), 
+        ret(),
+        label('data'), 
+        b'\x05\0\0\0', 
+        label('ptr'), 
+        ptr,
+        label('get'), 
+        mov(rax, qword([label('ptr')])), 
+        mov(eax, dword([rax])), 
+        ret(),
+    ])
+
+
+def check_library(path):
+    lib = ctypes.CDLL(path)
+    lib.add.restype = ctypes.c_long
+    lib.add.argtypes = [ctypes.c_long, ctypes.c_long]
+    lib.get.restype = ctypes.c_int
+    assert lib.add(2, 40) == 42
+    assert lib.three() == 3
+    assert lib.get() == 5
+    with raises(AttributeError):
+        lib._helper
+
+
+def run(*cmd):
+    try:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, 
+                                stderr=subprocess.PIPE)
+    except OSError:
+        skip("%s is not available" % cmd[0])
+    out, err = proc.communicate()
+    assert proc.returncode == 0, err
+    return out.decode()
+
+
+def test_shared_library(tmpdir):
+    if ARCH == 32 or not sys.platform.startswith('linux'):
+        return
+    path = str(tmpdir.join('libkernels.so'))
+    make_page().write_library(path, soname='libkernels.so')
+    check_library(path)
+    
+    dis = run('objdump', '-d', path)
+    assert '<add>:' in dis
+    assert 'call' in dis
+    
+    
+def test_object_file(tmpdir):
+    if ARCH == 32 or not sys.platform.startswith('linux'):
+        return
+    obj = str(tmpdir.join('kernels.o'))
+    make_page().write_object(obj)
+    
+    dis = run('objdump', '-dr', obj)
+    for name in ('add', '_helper', 'three', 'get'):
+        assert '<%s>:' % name in dis
+    assert 'R_X86_64_64\t.text+0x11' in dis
+    assert 'call   5 <_helper>' in dis
+    
+    syms = run('objdump', '-t', obj)
+    assert [l for l in syms.splitlines() if l.endswith(' add')][0][17] == 'g'
+    assert [l for l in syms.splitlines() if l.endswith(' _helper')][0][17] == 'l'
+    
+    lib = str(tmpdir.join('libkernels.so'))
+    run('ld', '-shared', '-z', 'notext', '-o', lib, obj)
+    check_library(lib)
+
+
+def test_symbol_types(tmpdir):
+    if ARCH == 32 or not sys.platform.startswith('linux'):
+        return
+    from pycca.cc import compile
+    c = compile("""
+        double f(double* x, int n) {
+            double s = 0;
+            int i;
+            for (i = 0; i < n; i++) {
+                if (x[i] < 0) continue;
+                s += x[i] * 2.5;
+            }
+            return s;
+        }
+        int g(int a) { return a + 1; }
+    """)
+    obj = str(tmpdir.join('f.o'))
+    c.codepage.write_object(obj)
+    syms = {}
+    for line in run('objdump', '-t', obj).splitlines():
+        if ' .text\t' in line and not line.endswith(' .text'):
+            size, name = line.split('\t')[1].split()
+            syms[name] = (line[17], line[23], int(size, 16))
+    labels = c.codepage.labels
+    start = c.codepage.page_addr
+    # functions extend to the next function; labels within them have no
+    # type; constants are data objects
+    assert syms['f'] == ('g', 'F', labels['g'] - start)
+    assert syms['g'] == ('g', 'F', labels['_const_0'] - labels['g'])
+    assert syms['_f_for1'] == ('l', ' ', 0)
+    assert syms['_f_return0'] == ('l', ' ', 0)
+    assert syms['_const_0'] == ('l', 'O', 8)
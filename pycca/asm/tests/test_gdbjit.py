@@ -0,0 +1,151 @@
+import re, sys, gc, ctypes, subprocess
+from pytest import skip
+from pycca.asm import *
+from pycca.asm import gdbjit
+
+
+source = """
+add_one:
+    mov rax, rdi
+    add rax, 1
+    ret
+_inner:
+    ret
+"""
+
+
+def run(*cmd):
+    try:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+    except OSError:
+        skip("%s is not available" % cmd[0])
+    out, err = proc.communicate()
+    assert proc.returncode == 0, err
+    return out.decode()
+
+
+def test_register(tmpdir):
+    if ARCH == 32 or not sys.platform.startswith('linux'):
+        return
+    page = CodePage(source)
+    entry = gdbjit.register(page, name='kernels.s')
+    assert (entry.entry.symfile_addr, len(entry.symfile)) in gdbjit.entries()
+
+    # the symbol file describes the code at its address in memory
+    path = str(tmpdir.join('jit.o'))
+    with open(path, 'wb') as fh:
+        fh.write(entry.symfile.raw)
+    syms = run('objdump', '-t', path)
+    assert '%016x g     F .text\t000000000000000c add_one' % page.page_addr in syms
+    # (_inner is not called, so it is a label within add_one)
+    assert '%016x l       .text\t0000000000000000 _inner' % (page.page_addr + 11) in syms
+    lines = run('readelf', '--debug-dump=decodedline', path)
+    rows = re.findall(r'kernels\.s\s+(\d+)\s+0x([0-9a-f]+)', lines)
+    assert [(int(l), int(a, 16) - page.page_addr) for l, a in rows] == [
+        (3, 0), (4, 3), (5, 10), (7, 11)]
+
+    # entries are removed when the page is deleted
+    registered = len(gdbjit.entries())
+    del page
+    gc.collect()
+    assert len(gdbjit.entries()) == registered - 1
+    assert not entry.registered
+
+
+def test_enable():
+    if ARCH == 32 or not sys.platform.startswith('linux'):
+        return
+    registered = len(gdbjit.entries())
+    gdbjit.enable()
+    try:
+        page = CodePage(source)
+    finally:
+        gdbjit.enable(False)
+    assert len(gdbjit.entries()) == registered + 1
+    CodePage(source)
+    assert len(gdbjit.entries()) == registered + 1
+
+    # registered code still runs
+    fn = page.get_function('add_one')
+    fn.restype = ctypes.c_long
+    fn.argtypes = [ctypes.c_long]
+    assert fn(41) == 42
+
+
+def test_deleted_while_locked():
+    if ARCH == 32 or not sys.platform.startswith('linux'):
+        return
+    registered = len(gdbjit.entries())
+    page = CodePage(source)
+    entry = gdbjit.register(page)
+    # pages deleted while the lock is held are unregistered once it is free
+    with gdbjit._lock:
+        del page
+        gc.collect()
+        assert entry.registered
+    other = gdbjit.register(CodePage(source))
+    assert not entry.registered
+    gdbjit.unregister(other)
+    assert len(gdbjit.entries()) == registered
+
+
+def test_descriptor_protection():
+    if ARCH == 32 or not sys.platform.startswith('linux'):
+        return
+    gdbjit.entries()
+    lib, desc, notify = gdbjit._interface
+    if 'pycca-gdbjit' not in lib._name:
+        skip("The JIT interface is provided by the process.")
+    # the generated descriptor is writable but not executable
+    addr = ctypes.addressof(desc)
+    with open('/proc/self/maps') as fh:
+        for line in fh:
+            start, end = [int(a, 16) for a in line.split()[0].split('-')]
+            if start <= addr < end:
+                assert line.split()[1].startswith('rw-')
+                break
+        else:
+            raise AssertionError("Descriptor is not mapped")
+    notify()
+
+
+fault_script = """
+from pycca.cc import compile
+c = compile('''
+    double f(double* x, int n) {
+        double s = 0;
+        int i;
+        for (i = 0; i < n; i++)
+            s += x[i];
+        return s;
+    }
+''')
+c.f(16, 10)
+"""
+
+
+def test_gdb_backtrace(tmpdir):
+    import os
+    if ARCH == 32 or not sys.platform.startswith('linux'):
+        return
+    # a fault inside a loop of a compiled C function is reported in that
+    # function by gdb
+    script = str(tmpdir.join('fault.py'))
+    with open(script, 'w') as fh:
+        fh.write(fault_script)
+    root = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(gdbjit.__file__))))
+    env = dict(os.environ, PYCCA_GDB_JIT='1', 
+               PYTHONPATH=os.pathsep.join([root, 
+                                           os.environ.get('PYTHONPATH', '')]))
+    try:
+        proc = subprocess.Popen(['gdb', '-nx', '-batch', '-ex', 'run', 
+                                 '-ex', 'bt', '--args', sys.executable, 
+                                 script], stdout=subprocess.PIPE, 
+                                stderr=subprocess.STDOUT, env=env)
+    except OSError:
+        skip("gdb is not available")
+    out = proc.communicate()[0].decode('utf-8', 'replace')
+    assert 'SIGSEGV' in out, out
+    assert re.search(r'^#0\s.*\bin f \(', out, re.M), out
@@ -0,0 +1,113 @@
+import ctypes, array, threading
+from pytest import raises
+from pycca.asm import *
+from pycca.asm.parallel import ThreadPool, parallel_map, parallel_reduce
+
+
+def make_sum():
+    # long sum(int* data, long n)
+    fn = mkfunction([
+        xor(eax, eax),
+        test(rsi, rsi),
+        je('done'),
+        label('loop'),
+        movsxd(rcx, dword([rdi])),
+        add(rax, rcx),
+        add(rdi, 4),
+        dec(rsi),
+        jne('loop'),
+        label('done'),
+        ret(),
+    ])
+    fn.argtypes = [ctypes.c_void_p, ctypes.c_long]
+    fn.restype = ctypes.c_long
+    return fn
+
+
+def test_parallel_reduce():
+    if ARCH == 32:
+        return
+    array_sum = make_sum()
+    data = array.array('i', range(-500, 100000))
+    total = sum(data)
+    assert parallel_reduce(array_sum, [data]) == total
+    assert parallel_reduce(array_sum, [data], chunk_size=7) == total
+    # custom combiner
+    assert parallel_reduce(array_sum, [data], combine=max, 
+                           chunk_size=len(data) // 2 + 1) == sum(data[len(data)//2+1:])
+    assert parallel_map(array_sum, [data[:10]], chunk_size=4) == [-1994, -1978, -983]
+    with raises(ValueError):
+        parallel_reduce(array_sum, [array.array('i')])
+    
+
+def test_parallel_map():
+    if ARCH == 32:
+        return
+    # void scale(double* x, double* y, double k, long n): y = k * x
+    scale = mkfunction([
+        test(rdx, rdx),
+        je('done'),
+        label('loop'),
+        movsd(xmm1, qword([rdi])),
+        mulsd(xmm1, xmm0),
+        movsd(qword([rsi]), xmm1),
+        add(rdi, 8),
+        add(rsi, 8),
+        dec(rdx),
+        jne('loop'),
+        label('done'),
+        ret(),
+    ])
+    scale.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_double,
+                      ctypes.c_long]
+    x = array.array('d', range(1000))
+    y = array.array('d', [0]) * 1000
+    parallel_map(scale, [x, y], args=(3.0,), chunk_size=33, outputs=[1])
+    assert list(y) == [3 * v for v in x]
+    # outputs must be writable
+    import sys
+    if sys.version_info[0] > 2:
+        readonly = memoryview(y.tobytes()).cast('d')
+        with raises(BufferError):
+            parallel_map(scale, [x, readonly], args=(3.0,), outputs=[1])
+        parallel_map(scale, [readonly, y], args=(0.5,), outputs=[1])
+        assert list(y) == [1.5 * v for v in x]
+    with raises(ValueError):
+        parallel_map(scale, [x, y[:10]], args=(3.0,))
+    
+    # exceptions are re-raised in the calling thread
+    def fail(ptr, n):
+        raise KeyError(n)
+    with raises(KeyError):
+        parallel_map(fail, [x])
+
+    # buffers are held until all chunks have finished (array.array cannot be
+    # resized while exported)
+    def resize(ptr, n):
+        x.append(0)
+    with raises(BufferError):
+        parallel_map(resize, [x], chunk_size=100)
+    assert len(x) == 1000
+    x.append(0)
+
+
+def test_thread_pool():
+    if ARCH == 32:
+        return
+    import os
+    pool = ThreadPool(3)
+    assert len(pool) == 3
+    names = pool.run(lambda: threading.current_thread().name, [()] * 10)
+    assert set(names) <= set(t.name for t in pool.threads)
+    assert parallel_reduce(make_sum(), [array.array('i', range(100))], 
+                           pool=pool) == 4950
+    pool.close()
+    with raises(RuntimeError):
+        pool.run(len, [('a',)])
+    
+    if hasattr(os, 'sched_getaffinity'):
+        cpu = sorted(os.sched_getaffinity(0))[0]
+        pool = ThreadPool(2, affinity=[cpu, cpu])
+        affinity = pool.run(lambda: os.sched_getaffinity(0), [()] * 4)
+        assert all(a == set([cpu]) for a in affinity)
+        pool.close()
@@ -34,6 +34,7 @@ def test_parser():
         add eax, dword ptr [eax]
         mov bx, word ptr [ebx+eax]
         fadd st(0), st(5)
+        and eax, 0xff
         ret
     """, {'some_val': some_val})
     page1 = CodePage(asm)
@@ -49,6 +50,7 @@ def test_parser():
         add(eax, dword([eax])),
         mov(bx, word([ebx+eax])),
         fadd(st(0), st(5)),
+        and_(eax, 0xff),
         ret(),
     ]
     page2 = CodePage(code)
@@ -87,4 +89,46 @@ def test_parse_errors():
         with raises(TypeError):
             parse_asm(asm)
     
-    
\ No newline at end of file
+    
+
+def test_align():
+    from pycca.asm.align import Align
+    code = parse_asm("""
+        .align 16
+        func: ret
+        .align 32, , 7
+        .align 8, 0xcc
+    """)
+    check_typs(code, [Align, Label, ret, Align, Align])
+    assert (code[0].n, code[0].max_skip, code[0].fill) == (16, None, None)
+    assert (code[3].n, code[3].max_skip, code[3].fill) == (32, 7, None)
+    assert (code[4].n, code[4].max_skip, code[4].fill) == (8, None, 0xcc)
+    assert str(code[3]) == '.align 32, , 7'
+
+    with raises(SyntaxError):
+        parse_asm(".align")
+    with raises(ValueError):
+        parse_asm(".align 12")
+    with raises(NameError):
+        parse_asm(".bogus 1")
+
+
+def test_data_directives():
+    from pycca.asm.data import Data
+    code = parse_asm("""
+        table:
+        .byte 1, 2, 0xff
+        .word -1
+        .long 7
+        .quad 1 << 40
+        .double 1.5
+        .float 0.5
+    """)
+    check_typs(code, [Label] + [Data] * 6)
+    assert b''.join(d.code for d in code[1:]) == (
+        b'\x01\x02\xff' + b'\xff\xff' + b'\x07\0\0\0' + 
+        b'\0\0\0\0\0\x01\0\0' + b'\0\0\0\0\0\0\xf8\x3f' + b'\0\0\0\x3f')
+    with raises(SyntaxError):
+        parse_asm(".byte 1,,2")
+    with raises(ValueError):
+        parse_asm(".byte 300")
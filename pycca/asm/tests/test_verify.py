@@ -0,0 +1,103 @@
+# -'- coding: utf-8 -'-
+import sys, multiprocessing
+from pytest import skip
+from pycca.asm import *
+from pycca.asm.util import as_code
+from pycca.asm import verify, util
+
+
+def check_gas():
+    try:
+        as_code('nop')
+    except Exception:
+        skip("GNU-as is not available")
+
+
+def test_as_code_batch():
+    check_gas()
+    asms = ['ret', 'mov eax, 1', 'bogus eax', 'add byte ptr [eax], al',
+            'nop', 'call .+0x10']
+    codes = verify.as_code_batch(asms, shard_size=2, threads=2)
+    assert isinstance(codes[2], Exception)
+    assert 'bogus' in str(codes[2])
+    for asm, code in zip(asms, codes):
+        if asm != 'bogus eax':
+            assert code == as_code(asm)
+
+
+def test_diff():
+    check_gas()
+    ptr = [0x1000 + ecx*2] if ARCH == 32 else [-0x80 + rcx*2]
+    diffs = verify.diff([
+        mov(eax, dword(ptr)),
+        cmp(dword(ptr), 1),   # GNU-as uses a shorter immediate
+        jmp(0x10),            # ..and a shorter offset
+    ])
+    assert [d.kind for d in diffs] == ['equivalent', 'equivalent']
+    
+    diffs = verify.diff([fld([ptr[0]]), fld(qword(ptr))])
+    assert [d.kind for d in diffs] == ['syntax']
+
+
+def test_fuzz():
+    check_gas()
+    instrs = verify.fuzz_instructions(2000, seed=0)
+    assert len(instrs) == 2000
+    diffs = verify.diff(instrs)
+    # wrong encodings, and instructions that GNU-as rejects (other than 
+    # known syntax differences), are errors
+    assert [str(d) for d in diffs if d.kind in ('mismatch', 'pycca')] == []
+
+
+def _fill_cache(args):
+    filename, start = args
+    cache = util.AsCodeCache(filename)
+    for i in range(start, start + 50):
+        cache.put('mov eax, %d' % i, False, True, b'\xb8' + bytes(bytearray(4)))
+
+
+def test_as_code_cache(tmpdir):
+    filename = str(tmpdir.join('cache.sqlite'))
+    cache = util.AsCodeCache(filename, max_size=500)
+    assert cache.get('nop', False) is None
+    cache.put('nop', False, True, b'\x90')
+    cache.put('bogus', False, False, ('Error: bogus', 'output'))
+    assert cache.get('nop', False) == (True, b'\x90')
+    assert cache.get('nop', True) is None
+    assert cache.get('bogus', False) == (False, ('Error: bogus', 'output'))
+
+    # concurrent writes from several processes
+    pool = multiprocessing.Pool(4)
+    try:
+        pool.map(_fill_cache, [(filename, i * 50) for i in range(4)])
+    finally:
+        pool.close()
+        pool.join()
+    assert cache.get('mov eax, 199', False) == (True, b'\xb8\0\0\0\0')
+
+    assert cache.size() > 500
+    cache.clear()
+    assert cache.size() == 0
+
+    # least recently used results are evicted
+    _fill_cache((filename, 0))
+    cache.touch_interval = 0
+    cache.get('mov eax, 0', False)
+    cache.evict()
+    assert 0 < cache.size() <= 450
+    assert cache.get('mov eax, 0', False) is not None
+    assert cache.get('mov eax, 1', False) is None
+    assert cache.get('mov eax, 49', False) is not None
+
+
+def test_nop_padding():
+    from pycca.asm.align import _nops, nop_padding
+    try:
+        verify.disassemble([b'\x90'])
+    except Exception:
+        skip("objdump is not available")
+    texts = verify.disassemble(_nops[1:])
+    for text in texts:
+        assert text is not None and text.split()[0] in ('nop', 'xchg')
+    for size in range(40):
+        assert len(nop_padding(size)) == size
@@ -0,0 +1,133 @@
+# -'- coding: utf-8 -'-
+"""
+NumPy universal functions built from machine code.
+
+A ufunc is made from one or more inner loops, one per supported type
+signature. Inner loops may be written directly (they have the signature
+``void loop(char** args, npy_intp* n, npy_intp* steps, void* data)``), or
+generated by pycca around a scalar function that is called once per
+element (see :func:`batch_driver() <pycca.asm.batch.batch_driver>`).
+NumPy then provides broadcasting, type dispatch, ``out=``, ``where=``, and
+reductions. No C compiler is needed: the ufunc is created by calling the
+NumPy C API through ctypes.
+"""
+
+import ctypes
+
+from .batch import batch_driver
+
+
+# Identity values understood by PyUFunc_FromFuncAndData
+_identities = {None: -1, 0: 0, 1: 1, -1: 2}
+
+
+class _PyUFuncObject(ctypes.Structure):
+    # Leading fields of PyUFuncObject (numpy/ufuncobject.h), up to the 
+    # object that the ufunc releases when it is deallocated.
+    _fields_ = [
+        ('ob_refcnt', ctypes.c_ssize_t),
+        ('ob_type', ctypes.c_void_p),
+        ('nin', ctypes.c_int),
+        ('nout', ctypes.c_int),
+        ('nargs', ctypes.c_int),
+        ('identity', ctypes.c_int),
+        ('functions', ctypes.c_void_p),
+        ('data', ctypes.c_void_p),
+        ('ntypes', ctypes.c_int),
+        ('reserved1', ctypes.c_int),
+        ('name', ctypes.c_void_p),
+        ('types', ctypes.c_void_p),
+        ('doc', ctypes.c_void_p),
+        ('ptr', ctypes.c_void_p),
+        ('obj', ctypes.c_void_p),
+    ]
+
+
+def _attach(ufunc, refs):
+    # Make *ufunc* hold a reference to the tuple *refs* in its obj slot, 
+    # which it releases when it is deallocated.
+    struct = _PyUFuncObject.from_address(id(ufunc))
+    if (struct.nargs != ufunc.nin + ufunc.nout or 
+            struct.ntypes != ufunc.ntypes or struct.obj is not None):
+        raise RuntimeError("Unsupported numpy ufunc object layout.")
+    ctypes.pythonapi.Py_IncRef(ctypes.py_object(refs))
+    struct.obj = id(refs)
+
+
+class InnerLoop(object):
+    """A ufunc inner loop at *addr* operating on arrays with the ctypes 
+    *types* given for each input followed by each of *nout* outputs.
+
+    *target* is kept alive as long as the loop is in use.
+    """
+    def __init__(self, addr, types, nout=1, target=None):
+        self.addr = addr
+        self.types = list(types)
+        self.nout = nout
+        self.nin = len(self.types) - nout
+        self.target = target
+
+    @classmethod
+    def from_scalar(cls, addr, restype, argtypes, target=None):
+        """Return an InnerLoop that calls the scalar function at *addr* with
+        signature (*restype*, *argtypes*) once per element.
+        """
+        from .codepage import CodePage
+        if restype is None:
+            raise TypeError("Scalar ufunc kernels must return a value.")
+        page = CodePage(batch_driver(addr, restype, argtypes))
+        return cls(page.page_addr, list(argtypes) + [restype], 
+                   target=(page, target))
+
+
+def _ufunc_api():
+    # Return the address of NumPy's ufunc C API function table
+    try:
+        from numpy._core import _multiarray_umath as umath
+    except ImportError:
+        from numpy.core import _multiarray_umath as umath
+    get = ctypes.pythonapi.PyCapsule_GetPointer
+    get.restype = ctypes.c_void_p
+    get.argtypes = [ctypes.py_object, ctypes.c_char_p]
+    return get(umath._UFUNC_API, None)
+
+
+def make_ufunc(name, loops, identity=None, doc=None):
+    """Return a new numpy ufunc named *name* that uses the given inner 
+    *loops* (a list of :class:`InnerLoop`), one per type signature. All
+    loops must have the same number of inputs and outputs.
+
+    *identity* (None, 0, 1, or -1) is the value of a reduction over an 
+    empty array.
+    """
+    import numpy
+    if len(loops) == 0:
+        raise ValueError("At least one loop is required.")
+    nin, nout = loops[0].nin, loops[0].nout
+    for loop in loops:
+        if (loop.nin, loop.nout) != (nin, nout):
+            raise ValueError("All loops must have the same number of inputs "
+                             "and outputs.")
+    if identity not in _identities:
+        raise ValueError("Unsupported identity %r" % identity)
+
+    funcs = (ctypes.c_void_p * len(loops))(*[l.addr for l in loops])
+    data = (ctypes.c_void_p * len(loops))()
+    types = []
+    for loop in loops:
+        types.extend(numpy.dtype(t).num for t in loop.types)
+    types = (ctypes.c_char * len(types))(*types)
+    name_buf = ctypes.create_string_buffer(name.encode('ascii'))
+    doc_buf = ctypes.create_string_buffer((doc or '').encode('utf-8'))
+
+    # PyUFunc_FromFuncAndData is entry 1 in the ufunc API table
+    addr = (ctypes.c_void_p * 2).from_address(_ufunc_api())[1]
+    from_func = ctypes.PYFUNCTYPE(
+        ctypes.py_object, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p,
+        ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int,
+        ctypes.c_char_p, ctypes.c_char_p, ctypes.c_int)(addr)
+    ufunc = from_func(funcs, data, types, len(loops), nin, nout, 
+                      _identities[identity], name_buf, doc_buf, 0)
+    # The ufunc keeps the memory it references alive
+    _attach(ufunc, (funcs, data, types, name_buf, doc_buf, tuple(loops)))
+    return ufunc
@@ -1,6 +1,6 @@
 # -'- coding: utf-8 -'-
 
-import os, re, sys, pickle, tempfile, subprocess, atexit
+import os, re, sys, tempfile, subprocess
 
 try:
     from __builtin__ import long
@@ -140,8 +140,8 @@ def as_code(asm, quiet=False, check_invalid_reg=False, cache=False):
     instruction makes use of a register that is not supported on the current
     architecture (by default, GNU-as silently ignores such symbols).
     
-    If *cache* is True, then the result will be cached in 
-    ``pycca/asm/gnu_as_cache.pk`` to speed up subsequent requests for the same
+    If *cache* is True, then the result will be cached (see 
+    :class:`AsCodeCache`) to speed up subsequent requests for the same
     instruction.
     """
     # First try returning cached output
@@ -164,59 +164,178 @@ def as_code(asm, quiet=False, check_invalid_reg=False, cache=False):
     return code
 
 
+def cache_dir():
+    """Return the directory used for pycca's persistent caches.
+
+    This is $PYCCA_CACHE_DIR if set, or otherwise a "pycca" directory in the
+    platform's user cache directory.
+    """
+    path = os.environ.get('PYCCA_CACHE_DIR')
+    if path:
+        return path
+    if sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA', os.path.expanduser('~'))
+        return os.path.join(base, 'pycca', 'Cache')
+    if sys.platform == 'darwin':
+        return os.path.expanduser('~/Library/Caches/pycca')
+    base = os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache'))
+    return os.path.join(base, 'pycca')
+
+
+class AsCodeCache(object):
+    """Persistent cache of GNU-as results, used by ``as_code(cache=True)``.
+
+    Results are stored in an SQLite database (in WAL mode, so that several
+    processes, such as pytest-xdist workers, may read and write it
+    concurrently). Each result is written in its own transaction and is
+    looked up individually when needed. When the total size of the stored
+    results exceeds *max_size* bytes, the least recently used results are
+    removed.
+    """
+    # how often (in writes) to check the size of the cache
+    check_interval = 100
+    # minimum interval (s) between updates of a result's last-use time
+    touch_interval = 3600
+
+    def __init__(self, filename=None, max_size=32 * 1024**2):
+        if filename is None:
+            filename = os.path.join(cache_dir(), 'gnu_as_cache.sqlite')
+        self.filename = filename
+        self.max_size = max_size
+        self._db = None
+        self._pid = None
+        self._writes = 0
+
+    @property
+    def db(self):
+        # Connections are not shared with forked processes
+        if self._db is None or self._pid != os.getpid():
+            import sqlite3
+            dirname = os.path.dirname(self.filename)
+            if dirname and not os.path.isdir(dirname):
+                try:
+                    os.makedirs(dirname)
+                except OSError:
+                    if not os.path.isdir(dirname):
+                        raise
+            db = sqlite3.connect(self.filename, timeout=60,
+                                 isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.execute('CREATE TABLE IF NOT EXISTS as_code ('
+                       'asm TEXT, check_reg INTEGER, arch INTEGER, '
+                       'ok INTEGER, code BLOB, message TEXT, output TEXT, '
+                       'size INTEGER, used REAL, '
+                       'PRIMARY KEY (asm, check_reg, arch))')
+            db.execute('CREATE INDEX IF NOT EXISTS as_code_used '
+                       'ON as_code (used)')
+            self._db = db
+            self._pid = os.getpid()
+        return self._db
+
+    def get(self, asm, check_invalid_reg):
+        """Return (True, code) or (False, (message, output)) for a cached
+        result, or None if *asm* is not in the cache.
+        """
+        from . import ARCH
+        import time
+        key = (asm, int(check_invalid_reg), ARCH)
+        row = self.db.execute('SELECT ok, code, message, output, used '
+                              'FROM as_code WHERE asm=? AND check_reg=? '
+                              'AND arch=?', key).fetchone()
+        if row is None:
+            return None
+        ok, code, message, output, used = row
+        now = time.time()
+        if now - used > self.touch_interval:
+            self.db.execute('UPDATE as_code SET used=? WHERE asm=? AND '
+                            'check_reg=? AND arch=?', (now,) + key)
+        if ok:
+            return True, bytes(code)
+        return False, (message, output)
+
+    def put(self, asm, check_invalid_reg, ok, output):
+        """Store a result (as returned by :func:`get`) in the cache.
+        """
+        import sqlite3, time
+        from . import ARCH
+        if ok:
+            code, message, text = sqlite3.Binary(bytes(output)), None, None
+            size = len(asm) + len(output)
+        else:
+            code = None
+            message, text = output
+            size = len(asm) + len(message or '') + len(text or '')
+        self.db.execute('INSERT OR REPLACE INTO as_code VALUES '
+                        '(?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        (asm, int(check_invalid_reg), ARCH, int(ok), code,
+                         message, text, size, time.time()))
+        self._writes += 1
+        if self._writes % self.check_interval == 0:
+            self.evict()
+
+    def size(self):
+        """Return the total size (bytes) of the cached results.
+        """
+        return self.db.execute('SELECT COALESCE(SUM(size), 0) '
+                               'FROM as_code').fetchone()[0]
+
+    def evict(self):
+        """Remove least recently used results until the cache is no larger
+        than 90% of *max_size*.
+        """
+        excess = self.size() - self.max_size
+        if excess <= 0:
+            return
+        excess += self.max_size // 10
+        removed = 0
+        for rowid, size in self.db.execute('SELECT rowid, size FROM as_code '
+                                           'ORDER BY used').fetchall():
+            if removed >= excess:
+                break
+            self.db.execute('DELETE FROM as_code WHERE rowid=?', (rowid,))
+            removed += size
+
+    def clear(self):
+        """Remove all results from the cache.
+        """
+        self.db.execute('DELETE FROM as_code')
+
+
 _as_code_cache = None
+def as_code_cache():
+    """Return the :class:`AsCodeCache` used by ``as_code(cache=True)``.
+    """
+    global _as_code_cache
+    if _as_code_cache is None:
+        _as_code_cache = AsCodeCache()
+    return _as_code_cache
+
+
 def as_code_cached(asm, quiet, check_invalid_reg):
     # return cached output of as_code(). This returns the compiled machine
     # code or raises an exception with a cached error message.
-    global _as_code_cache
-    path = os.path.dirname(__file__)
-    cachefile = os.path.join(path, 'gnu_as_cache.pk')
-    key = (asm, check_invalid_reg)
-    if _as_code_cache is None:
-        if os.path.exists(cachefile):
-            if sys.version_info.major == 2:
-                _as_code_cache = pickle.load(open(cachefile, 'rb'))
-            else:
-                _as_code_cache = pickle.load(open(cachefile, 'rb'), fix_imports=True)
-        else:
-            _as_code_cache = {'__counter__': 0}
-        atexit.register(write_as_code_cache)
-    if key not in _as_code_cache:
+    cache = as_code_cache()
+    result = cache.get(asm, check_invalid_reg)
+    if result is None:
         try:
-            _as_code_cache[key] = (True, as_code(asm, quiet, check_invalid_reg, cache=False))
+            code = as_code(asm, quiet, check_invalid_reg, cache=False)
         except Exception as err:
-            _as_code_cache[key] = (False, (err.message, err.output))
+            cache.put(asm, check_invalid_reg, False,
+                      (str(err), getattr(err, 'output', '')))
             raise
-        finally:
-            cnt = (_as_code_cache['__counter__'] + 1) % 100
-            _as_code_cache['__counter__'] = cnt
-            if cnt == 0:
-                write_as_code_cache()
-    ok, output = _as_code_cache[key]
+        cache.put(asm, check_invalid_reg, True, code)
+        return code
+    ok, output = result
     if ok:
         return output
     else:
         err = Exception(output[0])
+        err.message = output[0]
         err.output = output[1]
         raise err
 
 
-def write_as_code_cache():
-    # write the cache of as_code() results to disk. 
-    global _as_code_cache
-    path = os.path.dirname(__file__)
-    cachefile = os.path.join(path, 'gnu_as_cache.pk')
-    if sys.version_info.major == 2:
-        pk = pickle.dumps(_as_code_cache, protocol=0)
-    else:
-        pk = pickle.dumps(_as_code_cache, protocol=0, fix_imports=True)
-    try:
-        open(cachefile, 'wb').write(pk)
-    except IOError:
-        # probably no write permission; skip caching.
-        pass
-
-
 def all_registers():
     """Return all registers defined in asm.register
     (excluding st(i) registers)
@@ -245,15 +364,13 @@ def invalid_regs():
     if _invalid_regs is not None:
         return _invalid_regs
 
-    _invalid_regs = []
-    nullptr = as_code('push [0x0]')
-    for reg in all_registers():
-        try:
-            code = as_code('push %s' % reg.name, quiet=True)
-            if code == nullptr:
-                _invalid_regs.append(reg)
-        except:
-            pass
+    from .verify import as_code_batch
+    regs = all_registers()
+    codes = as_code_batch(['push [0x0]'] + ['push %s' % reg.name 
+                                            for reg in regs])
+    nullptr = codes[0]
+    _invalid_regs = [reg for reg, code in zip(regs, codes[1:]) 
+                     if code == nullptr]
     return _invalid_regs
             
 
@@ -275,29 +392,34 @@ def check_valid_pointer(instr='push', pre=None, post=None):
     print(line)
         
     icls = getattr(instructions, instr)
+    regs = [reg for reg in regs 
+            if reg not in invalid_regs() and 'mm' not in reg.name]
+    instrs = []
     for reg in regs:
-        if reg in invalid_regs() or 'mm' in reg.name:
-            continue
-        line = reg.name + ':'
-        line += ' '*(cols[0]-len(line))
-        for i,check in enumerate(checks):
+        for check in checks:
             arg = check.format(reg=reg.name)
             arg = eval(arg, {reg.name: reg})
             args = [x for x in [pre, arg, post] if x is not None]
-            instr = icls(*args)
+            instrs.append(icls(*args))
             
+    # compile all instructions with GNU-as at once
+    from .verify import as_code_batch
+    gnu = as_code_batch([str(instr) for instr in instrs], 
+                        check_invalid_reg=True)
+    
+    for reg in regs:
+        line = reg.name + ':'
+        line += ' '*(cols[0]-len(line))
+        for i,check in enumerate(checks):
+            instr = instrs.pop(0)
+            code2 = gnu.pop(0)
+            err2 = isinstance(code2, Exception)
             try:
                 code1 = instr.code
                 err1 = False
             except:
                 err1 = True
                 
-            try:
-                code2 = as_code(str(instr), quiet=True, check_invalid_reg=True)
-                err2 = False
-            except:
-                err2 = True
-                
             if err1 and err2:
                 add = '.'
             elif err1:
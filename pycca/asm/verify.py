@@ -0,0 +1,487 @@
+# -'- coding: utf-8 -'-
+"""
+Differential verification of the assembler against GNU-as.
+
+:func:`as_code() <pycca.asm.util.as_code>` runs GNU-as once per instruction,
+which is slow for large numbers of instructions. :func:`as_code_batch`
+instead assembles many instructions in one run: each instruction is
+preceded by a marker label, and the objdump output is split back into
+instructions using the marker addresses. Lines that GNU-as rejects are
+reported individually and the remaining lines are assembled again. Batches
+are sharded across several concurrent GNU-as processes.
+
+:func:`diff` compares pycca's encoding of a list of instructions with the
+output of GNU-as, and :func:`fuzz` does the same for randomly generated
+operand combinations of every instruction. This module may also be run as
+a script::
+
+    python -m pycca.asm.verify --count 20000 --seed 1
+"""
+
+from __future__ import print_function
+import os, re, sys, random, shutil, tempfile, subprocess
+from multiprocessing.pool import ThreadPool
+from multiprocessing import cpu_count
+from . import ARCH
+from .util import invalid_regs, all_registers, long
+from . import util
+
+
+MARKER = '__pycca_line_%s'
+
+# Instructions that pycca accepts with an unsized memory operand, but GNU-as
+# rejects as ambiguous (pycca's x87 loads and stores default to 64 bits).
+SYNTAX_DIFFERENCES = ('fld', 'fst', 'fstp')
+
+
+def _gas_error(message, output=''):
+    exc = Exception(message)
+    exc.message = message
+    exc.output = output
+    return exc
+
+
+def _run(cmd):
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT)
+    out = proc.communicate()[0].decode('ascii', 'replace')
+    return proc.returncode, out
+
+
+def _assemble(asms, tmpdir):
+    # Assemble a list of asm strings in as few GNU-as runs as possible.
+    # Returns a list of bytearray or Exception.
+    results = [None] * len(asms)
+    pending = list(range(len(asms)))
+    src = os.path.join(tmpdir, 'batch.s')
+    obj = os.path.join(tmpdir, 'batch.o')
+    while len(pending) > 0:
+        lines = ['.intel_syntax noprefix']
+        line_item = {}
+        for i in pending:
+            lines.append((MARKER % i) + ':')
+            for line in asms[i].split('\n'):
+                lines.append(line)
+                line_item[len(lines)] = i
+        with open(src, 'w') as fh:
+            fh.write('\n'.join(lines) + '\n')
+
+        status, out = _run(['as', src, '-o', obj])
+        if status != 0:
+            # Mark each line with an error as failed, then try again with
+            # the remaining lines.
+            failed = 0
+            for m in re.finditer(r':(\d+): Error:\s*(.*)', out):
+                i = line_item.get(int(m.groups()[0]))
+                if i is not None and results[i] is None:
+                    results[i] = _gas_error(m.groups()[1], out)
+                    failed += 1
+            if failed == 0:
+                raise _gas_error("Error running 'as':\n" + out, out)
+            pending = [i for i in pending if results[i] is None]
+            continue
+
+        status, out = _run(['objdump', '-z', '-t', '-d', obj])
+        if status != 0:
+            raise _gas_error("Error running 'objdump':\n" + out, out)
+        starts = {}
+        for m in re.finditer(r'^([0-9a-f]+) .*\s%s$' % (MARKER % r'(\d+)'),
+                             out, re.M):
+            starts[int(m.groups()[1])] = int(m.groups()[0], 16)
+        text = bytearray()
+        for m in re.finditer(r'^\s*([0-9a-f]+):\t((?:[0-9a-f]{2} )+)', out,
+                             re.M):
+            assert int(m.groups()[0], 16) == len(text)
+            text += bytearray.fromhex(m.groups()[1])
+        offsets = sorted(set(starts.values())) + [len(text)]
+        for i in pending:
+            start = starts[i]
+            end = offsets[offsets.index(start) + 1]
+            results[i] = text[start:end]
+        break
+    return results
+
+
+def disassemble(codes):
+    """Disassemble each machine code string in *codes* with objdump and
+    return a list of the instruction text, or None if the code is not
+    exactly one instruction.
+
+    Each instruction is disassembled at the same address, so that relative
+    branch targets are comparable.
+    """
+    slot = 16
+    data = bytearray()
+    for code in codes:
+        data += bytearray(code)[:slot]
+        data += b'\x90' * (slot - len(data) % slot or slot)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        fname = os.path.join(tmpdir, 'code.bin')
+        with open(fname, 'wb') as fh:
+            fh.write(bytes(data))
+        machine = 'i386:x86-64' if ARCH == 64 else 'i386'
+        status, out = _run(['objdump', '-D', '-z', '--insn-width=16', '-b',
+                            'binary', '-m', machine, '-M', 'intel', fname])
+    finally:
+        shutil.rmtree(tmpdir)
+    if status != 0:
+        raise _gas_error("Error running 'objdump':\n" + out, out)
+    lines = {}
+    for m in re.finditer(r'^\s*([0-9a-f]+):\t((?:[0-9a-f]{2} )+)\s*\t?(.*)$',
+                         out, re.M):
+        addr = int(m.groups()[0], 16)
+        lines[addr] = (len(m.groups()[1]) // 3, m.groups()[2])
+    result = []
+    for i, code in enumerate(codes):
+        addr = i * slot
+        length, text = lines.get(addr, (0, None))
+        if length != len(code):
+            result.append(None)
+            continue
+        # branch targets are printed relative to the slot address
+        text = re.sub(r'\b(0x[0-9a-f]+)\b(?= <|$)',
+                      lambda m: '.%+d' % (int(m.groups()[0], 16) - addr),
+                      text.strip()) if text.startswith(('j', 'call')) else text
+        # drop comments (such as rip-relative target addresses)
+        text = re.sub(r'\s*#.*$', '', text.strip())
+        text = re.sub(r'^movabs', 'mov', re.sub(r'\s+', ' ', text))
+        result.append(text)
+    return result
+
+
+def _assemble_shard(args):
+    asms, = args
+    tmpdir = tempfile.mkdtemp()
+    try:
+        return _assemble(asms, tmpdir)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def as_code_batch(asms, check_invalid_reg=False, shard_size=1000,
+                  threads=None, cache=False):
+    """Use GNU assembler to compile each string in the list *asms*.
+
+    Returns a list with one item per string: the machine code as a
+    bytearray, or an Exception describing why GNU-as rejected the code.
+    Arguments are as for :func:`as_code() <pycca.asm.util.as_code>`; the
+    strings must not define labels.
+
+    Strings are assembled in shards of *shard_size* lines, using up to
+    *threads* concurrent GNU-as processes (by default, the number of CPUs).
+    If *cache* is True, results are read from and added to the cache used
+    by ``as_code(asm, cache=True)``.
+    """
+    results = [None] * len(asms)
+    todo = []
+    if cache:
+        store = util.as_code_cache()
+    for i, asm in enumerate(asms):
+        cached = store.get(asm, check_invalid_reg) if cache else None
+        if cached is not None:
+            ok, output = cached
+            results[i] = output if ok else _gas_error(*output)
+            continue
+        if check_invalid_reg:
+            bad = [reg.name for reg in invalid_regs() if reg.name in asm]
+            if len(bad) > 0:
+                results[i] = _gas_error("asm '%s' contains invalid register "
+                                        "'%s'" % (asm, bad[0]))
+                continue
+        todo.append(i)
+
+    shards = [todo[i:i+shard_size] for i in range(0, len(todo), shard_size)]
+    if threads is None:
+        threads = cpu_count()
+    threads = max(1, min(threads, len(shards)))
+    jobs = [([asms[i] for i in shard],) for shard in shards]
+    if threads == 1:
+        outputs = list(map(_assemble_shard, jobs))
+    else:
+        # Each thread waits on its own GNU-as process
+        pool = ThreadPool(threads)
+        try:
+            outputs = pool.map(_assemble_shard, jobs)
+        finally:
+            pool.close()
+
+    for shard, output in zip(shards, outputs):
+        for i, result in zip(shard, output):
+            results[i] = result
+            if cache:
+                if isinstance(result, Exception):
+                    store.put(asms[i], check_invalid_reg, False,
+                              (result.message, result.output))
+                else:
+                    store.put(asms[i], check_invalid_reg, True, result)
+    return results
+
+
+class Difference(object):
+    """A disagreement between pycca and GNU-as about one instruction.
+
+    *kind* is 'mismatch' (both produced different code), 'equivalent'
+    (both produced different encodings of the same instruction), 'pycca'
+    (only pycca accepted the instruction), 'syntax' (only pycca accepted
+    the instruction, because of a known syntax difference listed in 
+    ``SYNTAX_DIFFERENCES``), or 'gas' (only GNU-as accepted it).
+    *pycca* and *gas* are the machine code or Exception from each.
+    """
+    def __init__(self, instr, kind, pycca, gas):
+        self.instr = instr
+        self.kind = kind
+        self.pycca = pycca
+        self.gas = gas
+
+    def __str__(self):
+        def fmt(x):
+            if isinstance(x, Exception):
+                return 'error: %s' % x
+            return ' '.join('%02x' % c for c in bytearray(x))
+        return '%s [%s]\n    py:  %s\n    gnu: %s' % (self.instr, self.kind,
+                                                    fmt(self.pycca),
+                                                    fmt(self.gas))
+
+    def __repr__(self):
+        return '<Difference %s: %s>' % (self.kind, self.instr)
+
+
+def gas_string(instr):
+    """Return the GNU-as syntax for *instr*.
+
+    pycca treats an integer branch target as an offset relative to the next
+    instruction, whereas GNU-as treats it as an absolute address.
+    """
+    from .instruction import RelBranchInstruction
+    if (isinstance(instr, RelBranchInstruction) and len(instr.args) == 1 and
+            isinstance(instr.args[0], (int, long))):
+        return '%s .%+d' % (instr.name, instr.args[0])
+    return str(instr)
+
+
+def diff(instrs, **kwds):
+    """Compare pycca's encoding of each instruction in *instrs* with the
+    output of GNU-as, and return a list of :class:`Difference`.
+
+    Extra keyword arguments are passed to :func:`as_code_batch`.
+    """
+    kwds.setdefault('check_invalid_reg', True)
+    codes = []
+    for instr in instrs:
+        try:
+            codes.append(instr.code)
+        except Exception as exc:
+            codes.append(exc)
+    gas = as_code_batch([gas_string(instr) for instr in instrs], **kwds)
+    diffs = []
+    for instr, code, gcode in zip(instrs, codes, gas):
+        py_ok = not isinstance(code, Exception)
+        gas_ok = not isinstance(gcode, Exception)
+        if py_ok and gas_ok:
+            if bytearray(code) != gcode:
+                diffs.append(Difference(instr, 'mismatch', code, gcode))
+        elif py_ok:
+            kind = 'syntax' if _syntax_difference(instr) else 'pycca'
+            diffs.append(Difference(instr, kind, code, gcode))
+        elif gas_ok:
+            diffs.append(Difference(instr, 'gas', code, gcode))
+
+    # Different encodings of the same instruction (for example, a shorter
+    # immediate or branch offset chosen by GNU-as) are not errors.
+    mismatch = [d for d in diffs if d.kind == 'mismatch']
+    if len(mismatch) > 0:
+        py_text = disassemble([d.pycca for d in mismatch])
+        gas_text = disassemble([d.gas for d in mismatch])
+        for d, py, gnu in zip(mismatch, py_text, gas_text):
+            if py is not None and py == gnu:
+                d.kind = 'equivalent'
+    return diffs
+
+
+def _syntax_difference(instr):
+    from .pointer import Pointer
+    return (instr.name in SYNTAX_DIFFERENCES and 
+            any(isinstance(arg, Pointer) and arg.bits is None 
+                for arg in instr.args))
+
+
+class OperandGenerator(object):
+    """Generates random operands for instruction mode signatures.
+    """
+    def __init__(self, rng):
+        self.rng = rng
+        invalid = invalid_regs() if ARCH == 32 else []
+        regs = [r for r in all_registers() if r not in invalid]
+        self.gp = {}
+        self.xmm = []
+        for reg in regs:
+            if 'xmm' in reg.name:
+                self.xmm.append(reg)
+            elif 'mm' not in reg.name:
+                self.gp.setdefault(reg.bits, []).append(reg)
+
+    def imm(self, bits):
+        rng = self.rng
+        choice = rng.randint(0, 4)
+        if choice == 0:
+            return rng.choice([0, 1, -1])
+        elif choice == 1:
+            return (1 << (bits - 1)) - 1
+        elif choice == 2:
+            return -(1 << (bits - 1))
+        return rng.randint(-(1 << (bits - 1)), (1 << bits) - 1)
+
+    def pointer(self, bits):
+        from .pointer import Pointer, byte, word, dword, qword
+        rng = self.rng
+        addr_regs = self.gp[ARCH]
+        if ARCH == 64 and rng.random() < 0.1:
+            addr_regs = self.gp[32]
+        parts = []
+        if rng.random() < 0.8:
+            parts.append(rng.choice(addr_regs))
+        if rng.random() < 0.5:
+            parts.append(rng.choice(addr_regs) * rng.choice([1, 2, 4, 8]))
+        if len(parts) == 0 or rng.random() < 0.6:
+            parts.append(rng.choice([0, 1, -1, 0x7f, -0x80, 0x80, 0x1234,
+                                     -0x1234, 0x7fffffff]))
+        if ARCH == 64 and rng.random() < 0.05:
+            from .register import rip
+            parts = [rip, rng.choice([0, 0x10, -0x1000])]
+        expr = parts[0]
+        for part in parts[1:]:
+            expr = expr + part
+        sizes = {8: byte, 16: word, 32: dword, 64: qword}
+        return sizes.get(bits, Pointer)([expr])
+
+    def operand(self, kind):
+        """Return a random operand for the operand type *kind* (as used in
+        :attr:`Instruction.modes`).
+        """
+        from .register import st, cl
+        rng = self.rng
+        if kind.startswith('imm'):
+            return self.imm(int(kind[3:]))
+        if kind.startswith('rel'):
+            return self.imm(int(kind[3:]))
+        if kind in ('r8', 'r16', 'r32', 'r64'):
+            return rng.choice(self.gp.get(int(kind[1:]), self.gp[32]))
+        if kind.startswith('r/m'):
+            bits = int(kind[3:])
+            if rng.random() < 0.5 and bits in self.gp:
+                return rng.choice(self.gp[bits])
+            return self.pointer(bits)
+        if kind.startswith('xmm'):
+            if kind == 'xmm1' or rng.random() < 0.5:
+                return rng.choice(self.xmm)
+            return self.pointer(int(kind.partition('/m')[2]))
+        if kind == 'st(0)':
+            return st(0)
+        if kind.lower() == 'st(i)':
+            return st(rng.randint(0, 7))
+        if kind.startswith('m'):
+            digits = ''.join(c for c in kind if c.isdigit())
+            return self.pointer(int(digits) if digits else None)
+        if kind == '1':
+            return 1
+        if kind == 'cl':
+            return cl
+        raise ValueError("Unknown operand type %r" % kind)
+
+
+def instruction_modes():
+    """Return a list of (instruction class, modes) for all instructions.
+    """
+    from . import instructions
+    from .instruction import Instruction, RelBranchInstruction
+    result = []
+    for name in sorted(dir(instructions)):
+        cls = getattr(instructions, name)
+        if (not isinstance(cls, type) or not issubclass(cls, Instruction) or
+                cls in (Instruction, RelBranchInstruction) or
+                cls.__name__ != name):
+            continue
+        modes = cls.modes
+        if isinstance(modes, property):
+            try:
+                modes = object.__new__(cls).modes
+            except TypeError:
+                # base class; modes are defined by subclasses
+                continue
+        result.append((cls, modes))
+    return result
+
+
+def fuzz_instructions(count, seed=None, classes=None):
+    """Return a list of *count* instructions with random operands, chosen
+    uniformly from the modes of all instructions (or only those in
+    *classes*).
+    """
+    rng = random.Random(seed)
+    gen = OperandGenerator(rng)
+    archind = 2 if ARCH == 64 else 3
+    modes = []
+    for cls, cls_modes in instruction_modes():
+        if classes is not None and cls not in classes:
+            continue
+        for sig, mode in cls_modes.items():
+            if mode[archind]:
+                modes.append((cls, sig))
+    instrs = []
+    while len(instrs) < count:
+        cls, sig = rng.choice(modes)
+        try:
+            instr = cls(*[gen.operand(kind) for kind in sig])
+            str(instr)
+        except Exception:
+            continue
+        instrs.append(instr)
+    return instrs
+
+
+def fuzz(count=10000, seed=None, classes=None, **kwds):
+    """Compare *count* random instructions with GNU-as, and return a list
+    of :class:`Difference`.
+    """
+    return diff(fuzz_instructions(count, seed, classes), **kwds)
+
+
+def main(argv=None):
+    import argparse, time
+    parser = argparse.ArgumentParser(description="Compare pycca's "
+                                     "instruction encoding with GNU-as.")
+    parser.add_argument('--count', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--instructions', default=None,
+                        help="comma-separated instruction names to test")
+    parser.add_argument('--all', action='store_true',
+                        help="also report instructions encoded differently, "
+                        "instructions only accepted by GNU-as, and known "
+                        "syntax differences")
+    args = parser.parse_args(argv)
+
+    classes = None
+    if args.instructions is not None:
+        from . import instructions
+        classes = [getattr(instructions, name)
+                   for name in args.instructions.split(',')]
+    start = time.time()
+    diffs = fuzz(args.count, args.seed, classes, threads=args.threads)
+    kinds = {}
+    for d in diffs:
+        kinds.setdefault(d.kind, []).append(d)
+        if args.all or d.kind in ('mismatch', 'pycca'):
+            print(d)
+    print("%d instructions in %0.1f s: %d mismatched, %d encoded "
+          "differently, %d only accepted by pycca (and %d known syntax "
+          "differences), %d only accepted by GNU-as" % 
+          (args.count, time.time() - start, len(kinds.get('mismatch', [])),
+           len(kinds.get('equivalent', [])), len(kinds.get('pycca', [])), 
+           len(kinds.get('syntax', [])), len(kinds.get('gas', []))))
+    return 1 if 'mismatch' in kinds or 'pycca' in kinds else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -10,5 +10,8 @@ http://en.wikipedia.org/wiki/X86_calling_conventions
 
 
 """
-from .ccode import CCode
-from .statements import Function, Assign, Return
+from .ccode import CCode, compile
+from .statements import (Function, Prototype, FunctionCall, Assign, Return,
+                         Declaration, If, ElseIf, Else, ForLoop, WhileLoop,
+                         DoWhileLoop, Block, Break, Continue)
+from .parser import parse_c
@@ -1,13 +1,52 @@
 # -*- coding: utf-8 -*-
 import ctypes
-from ..asm import CodePage
+from ..asm import CodePage, ConstantPool
 from .codeobject import CodeContainer
-from .statements import Function
+from .statements import Function, Prototype
+from .parser import parse_c
+
 
 class CCode(CodeContainer):
-    def __init__(self, code):
+    """Compiled C code.
+    
+    *code* may be a list of code objects (Function, etc.) or a string of C
+    source code. Each function is available as an attribute of the CCode
+    object after compiling.
+    
+    *globals* may be a dict that maps names to functions called by the code:
+    either ctypes functions or integer addresses. Functions with argtypes set
+    may be called without a prototype; any other function needs a prototype
+    in the source code. Names that are not found in *globals* are looked up 
+    in the libraries loaded by the current process.
+    
+    If *nogil* is True (the default), the GIL is released while the compiled
+    functions run, so they may run concurrently in several Python threads.
+    Calls to the Python C API are then rejected at compile time. With
+    *nogil* False, the GIL is held and the Python C API may be used (for
+    example, to release the GIL explicitly with PyEval_SaveThread).
+    
+    If *builtin* is True, the function attributes are Python builtin
+    functions (see :func:`CodePage.get_builtin()
+    <pycca.asm.CodePage.get_builtin>`), which are much cheaper to call than
+    ctypes functions. Pointer arguments of these functions accept writable,
+    C-contiguous buffers (numpy arrays, array.array, bytearray, ...) of the
+    matching item type. The ctypes functions remain available in
+    :attr:`globals`.
+    
+    If *profile* is True (64-bit only), each function counts its calls and
+    the processor cycles spent in it; the counters are available as 
+    ``codepage.profile`` (see :mod:`pycca.asm.instrument`).
+    """
+    def __init__(self, code, globals=None, nogil=True, builtin=False,
+                 profile=False):
+        if isinstance(code, str):
+            code = parse_c(code)
         CodeContainer.__init__(self, code)
         self.compiled = False
+        self.nogil = nogil
+        self.builtin = builtin
+        self.profile = profile
+        self.externals = {} if globals is None else globals
         self.globals = None
         self.asm = None
         self.codepage = None
@@ -15,21 +54,70 @@ class CCode(CodeContainer):
         
     def compile(self):
         self.asm = []
-        scope = {}
+        constants = ConstantPool()
+        scope = {'__globals__': self.externals, '__nogil__': self.nogil,
+                 '__constants__': constants}
+        for name, obj in self.externals.items():
+            if getattr(obj, 'argtypes', None) is not None:
+                scope[name] = Prototype.from_ctypes(name, obj)
+        # functions may be called before they are defined
+        for item in self.code:
+            if isinstance(item, Function):
+                scope[item.name] = item
         for item in self.code:
             self.asm.extend(item.compile(scope))
 
-        self.codepage = CodePage(self.asm)
+        # only the functions' entry labels are instrumented
+        profile = False
+        if self.profile:
+            profile = [item.name for item in self.code 
+                       if isinstance(item, Function)]
+        self.codepage = CodePage(self.asm, constants=constants, 
+                                 profile=profile)
         
         self.globals = {}
         for name, obj in scope.items():
             if isinstance(obj, Function):
-                func = self.codepage.get_function(obj.name)
+                func = self.codepage.get_function(obj.name, nogil=self.nogil)
                 func.restype = obj.c_restype
                 func.argtypes = obj.c_argtypes
                 func.name = obj.name
                 self.globals[obj.name] = func
+                if self.builtin:
+                    func = self.codepage.get_builtin(
+                        obj.name, obj.c_restype, obj.builtin_argtypes, 
+                        nogil=self.nogil)
                 setattr(self, obj.name, func)
         
+    def ufunc(self, name, functions=None, identity=None, doc=None):
+        """Return a numpy ufunc that calls compiled scalar functions once per
+        element.
+        
+        *functions* is a list of names of functions in this code (by default,
+        the function called *name*), one for each supported type signature.
+        As with numpy's own ufuncs, list smaller types first. See
+        :func:`make_ufunc() <pycca.asm.ufunc.make_ufunc>` for *identity*.
+        """
+        if functions is None:
+            functions = [name]
+        funcs = dict((f.name, f) for f in self.code if isinstance(f, Function))
+        kernels = []
+        for fname in functions:
+            if fname not in funcs:
+                raise NameError("No function named '%s'" % fname)
+            func = funcs[fname]
+            kernels.append((fname, func.c_restype, func.c_argtypes))
+        return self.codepage.get_ufunc(name, kernels, identity=identity, 
+                                       doc=doc)
+
     def dump_asm(self):
         return self.codepage.dump()
+
+
+def compile(source, globals=None, nogil=True, builtin=False, profile=False):
+    """Compile a string of C source code and return a CCode object.
+    
+    See :class:`CCode` for a description of *globals*, *nogil*, *builtin*,
+    and *profile*.
+    """
+    return CCode(source, globals, nogil, builtin, profile)
@@ -3,12 +3,21 @@
 class CodeObject(object):
     """Base class for all C code constructs.
     """
+    # True for constructs whose code may execute many times
+    loop = False
+    
     def __init__(self, lineno=None):
         self._lineno = lineno
 
     def attach(self):
         CCode.append(self)
 
+    def expressions(self):
+        """Return the expressions evaluated by this object (not including
+        those of any nested code).
+        """
+        return []
+
 
 class CodeContainer(CodeObject):
     """C code construct that may contain others (functions, loops, etc).
@@ -28,6 +37,11 @@ class CodeContainer(CodeObject):
     def code(self):
         return self._code
         
+    def children(self):
+        """Return the list of statements nested directly within this object.
+        """
+        return self._code
+        
     @property
     def current(self):
         return self._code_stack[-1]
@@ -1,204 +1,1787 @@
-import struct, re
-from .variable import Variable
-from .codeobject import CodeObject, CodeContainer
+# -*- coding: utf-8 -*-
+import struct, re, math
+from .variable import (Variable, type_bits, int_types, float_types, storage_bits,
+                       is_pointer, is_array, element_type, sizeof)
+from .codeobject import CodeObject
+from .frame import sized, is_xmm
 from .. import asm
 
 
+#   Tokenizer
+#----------------------------------------
+
+_token_re = re.compile(r'''
+    (?P<space>\s+) |
+    (?P<comment>//[^\n]*|/\*.*?\*/) |
+    (?P<float>(?:[0-9]+\.[0-9]*|\.[0-9]+)(?:[eE][-+]?[0-9]+)?[fFlL]? |
+              [0-9]+[eE][-+]?[0-9]+[fFlL]?) |
+    (?P<int>(?:0[xX][0-9a-fA-F]+|[0-9]+)[uUlL]*) |
+    (?P<name>[A-Za-z_][A-Za-z0-9_]*) |
+    (?P<op>\.\.\.|<<=|>>=|->|\+\+|--|<<|>>|<=|>=|==|!=|&&|\|\||
+           [-+*/%&|^]=|[-+*/%&|^~!<>=?:,;.(){}\[\]])
+''', re.S | re.X)
+
+
+def tokenize(source):
+    """Split C source code into a list of (kind, text, lineno) tuples.
+
+    *kind* is one of 'int', 'float', 'name', or 'op'. Whitespace and comments
+    are discarded.
+    """
+    tokens = []
+    lineno = 1
+    pos = 0
+    match = _token_re.match
+    while pos < len(source):
+        m = match(source, pos)
+        if m is None:
+            raise SyntaxError("Invalid character %r on line %d" %
+                              (source[pos], lineno))
+        kind = m.lastgroup
+        text = m.group(kind)
+        if kind not in ('space', 'comment'):
+            tokens.append((kind, text, lineno))
+        lineno += text.count('\n')
+        pos = m.end()
+    return tokens
+
+
+#   Expression tree
+#----------------------------------------
+
+class Node(object):
+    """Base class for nodes in a parsed expression tree.
+    """
+    fields = ()
+
+    def __init__(self, *args):
+        for name, arg in zip(self.fields, args):
+            setattr(self, name, arg)
+
+    def __repr__(self):
+        args = ', '.join(repr(getattr(self, f)) for f in self.fields)
+        return '%s(%s)' % (self.__class__.__name__, args)
+
+
+class Const(Node):
+    fields = ('value', 'type')
+
+class Name(Node):
+    fields = ('name',)
+
+class Unary(Node):
+    fields = ('op', 'arg')
+
+class Binary(Node):
+    fields = ('op', 'left', 'right')
+
+class Assignment(Node):
+    fields = ('op', 'target', 'value')
+
+class IncDec(Node):
+    fields = ('op', 'arg', 'prefix')
+
+class Conditional(Node):
+    fields = ('cond', 'true', 'false')
+
+class Cast(Node):
+    fields = ('type', 'arg')
+
+class Call(Node):
+    # *func* is a Name, or an object describing the function (see Prototype)
+    fields = ('func', 'args')
+
+
+def parse_int(text):
+    """Convert a C integer literal to a Const node.
+    """
+    digits = text.rstrip('uUlL')
+    value = int(digits, 16 if digits[:2] in ('0x', '0X') else
+                (8 if len(digits) > 1 and digits[0] == '0' else 10))
+    if 'l' in text[len(digits):].lower() or not -2**31 <= value < 2**31:
+        return Const(value, 'long')
+    return Const(value, 'int')
+
+
+class ExpressionParser(object):
+    """Precedence-climbing parser for C expressions.
+
+    Operates on the token list produced by :func:`tokenize`, starting at
+    *pos*. After parsing, ``pos`` indicates the first unused token.
+    """
+    binary_precedence = {
+        '*': 10, '/': 10, '%': 10,
+        '+': 9, '-': 9,
+        '<<': 8, '>>': 8,
+        '<': 7, '<=': 7, '>': 7, '>=': 7,
+        '==': 6, '!=': 6,
+        '&': 5,
+        '^': 4,
+        '|': 3,
+        '&&': 2,
+        '||': 1,
+    }
+    assign_ops = ('=', '+=', '-=', '*=', '/=', '%=', '<<=', '>>=', '&=', '^=',
+                  '|=')
+    type_names = ('void', 'char', 'int', 'long', 'float', 'double')
+    # fixed-width typedefs from stdint.h
+    type_aliases = {'int8_t': 'char', 'int32_t': 'int', 'int64_t': 'long'}
+    qualifiers = ('const', 'volatile', 'restrict', '__restrict')
+
+    def __init__(self, tokens, pos=0):
+        self.tokens = tokens
+        self.pos = pos
+
+    def peek(self, offset=0):
+        """Return the text of the next token, or None at the end of input.
+        """
+        i = self.pos + offset
+        if i < len(self.tokens):
+            return self.tokens[i][1]
+        return None
+
+    def next(self):
+        if self.pos >= len(self.tokens):
+            raise SyntaxError("Unexpected end of expression")
+        tok = self.tokens[self.pos]
+        self.pos += 1
+        return tok
+
+    def expect(self, text):
+        tok = self.next()
+        if tok[1] != text:
+            self.error("Expected '%s'" % text, tok)
+        return tok
+
+    def error(self, msg, tok=None):
+        if tok is None:
+            tok = self.tokens[min(self.pos, len(self.tokens)-1)]
+        raise SyntaxError("%s near '%s' on line %d" % (msg, tok[1], tok[2]))
+
+    def is_type(self, offset=0):
+        """Return True if the token at *offset* begins a type name.
+        """
+        text = self.peek(offset)
+        return (text in self.type_names or text in self.type_aliases or
+                text in self.qualifiers)
+
+    def skip_qualifiers(self):
+        while self.peek() in self.qualifiers:
+            self.next()
+
+    def parse_base_type(self):
+        """Parse a type name without any pointer declarators and return it as 
+        a string.
+        """
+        self.skip_qualifiers()
+        tok = self.next()
+        typ = self.type_aliases.get(tok[1], tok[1])
+        if typ not in self.type_names:
+            self.error("Expected type name", tok)
+        # 'long int' and 'long long' are both 64-bit
+        while typ == 'long' and self.peek() in ('int', 'long'):
+            self.next()
+        self.skip_qualifiers()
+        return typ
+
+    def parse_pointers(self, typ):
+        """Parse any '*' following a type; returns the pointer type string
+        (for example, 'double**').
+        """
+        while self.peek() == '*':
+            self.next()
+            self.skip_qualifiers()
+            typ += '*'
+        return typ
+
+    def parse_type(self):
+        """Parse a type name (as used in casts) and return it as a string.
+        """
+        return self.parse_pointers(self.parse_base_type())
+
+    def parse(self):
+        """Parse a complete expression; all tokens must be consumed.
+        """
+        node = self.parse_expression()
+        if self.pos < len(self.tokens):
+            self.error("Unexpected token")
+        return node
+
+    def parse_expression(self):
+        node = self.parse_assignment()
+        while self.peek() == ',':
+            self.next()
+            node = Binary(',', node, self.parse_assignment())
+        return node
+
+    def parse_assignment(self):
+        node = self.parse_conditional()
+        if self.peek() in self.assign_ops:
+            op = self.next()[1]
+            node = Assignment(op, node, self.parse_assignment())
+        return node
+
+    def parse_conditional(self):
+        node = self.parse_binary(1)
+        if self.peek() == '?':
+            self.next()
+            true = self.parse_expression()
+            self.expect(':')
+            false = self.parse_conditional()
+            node = Conditional(node, true, false)
+        return node
+
+    def parse_binary(self, min_prec):
+        node = self.parse_unary()
+        while True:
+            op = self.peek()
+            prec = self.binary_precedence.get(op, 0)
+            if prec < min_prec or self.tokens[self.pos][0] != 'op':
+                return node
+            self.next()
+            node = Binary(op, node, self.parse_binary(prec + 1))
+
+    def parse_unary(self):
+        op = self.peek()
+        if op in ('-', '+', '!', '~', '*', '&'):
+            self.next()
+            return Unary(op, self.parse_unary())
+        if op in ('++', '--'):
+            self.next()
+            return IncDec(op, self.parse_unary(), True)
+        if op == '(' and self.is_type(1):
+            self.next()
+            typ = self.parse_type()
+            self.expect(')')
+            return Cast(typ, self.parse_unary())
+        return self.parse_postfix()
+
+    def parse_postfix(self):
+        node = self.parse_primary()
+        while self.peek() in ('++', '--', '[', '('):
+            if self.peek() == '[':
+                # a[i] is *(a + i)
+                self.next()
+                index = self.parse_expression()
+                self.expect(']')
+                node = Unary('*', Binary('+', node, index))
+            elif self.peek() == '(':
+                self.next()
+                args = []
+                while self.peek() != ')':
+                    if len(args) > 0:
+                        self.expect(',')
+                    args.append(self.parse_assignment())
+                self.next()
+                node = Call(node, args)
+            else:
+                node = IncDec(self.next()[1], node, False)
+        return node
+
+    def parse_primary(self):
+        tok = self.next()
+        kind, text = tok[:2]
+        if kind == 'int':
+            return parse_int(text)
+        elif kind == 'float':
+            value = float(text.rstrip('fFlL'))
+            if text[-1] in 'fF':
+                return Const(to_float32(value), 'float')
+            return Const(value, 'double')
+        elif kind == 'name':
+            return Name(text)
+        elif text == '(':
+            node = self.parse_expression()
+            self.expect(')')
+            return node
+        self.error("Unexpected token", tok)
+
+
+def walk(node):
+    """Iterate over *node* and all of its descendants.
+    """
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        yield node
+        for name in node.fields:
+            child = getattr(node, name)
+            if isinstance(child, Node):
+                stack.append(child)
+            elif isinstance(child, list):
+                stack.extend(c for c in child if isinstance(c, Node))
+
+
+def parse(expr):
+    """Return an expression tree for *expr*, which may be a string of C code,
+    a Python int or float, or an existing Node.
+    """
+    if isinstance(expr, Node):
+        return expr
+    if isinstance(expr, bool):
+        return Const(int(expr), 'int')
+    if isinstance(expr, int):
+        return Const(expr, 'int' if fits32(expr) else 'long')
+    if isinstance(expr, float):
+        return Const(expr, 'double')
+    return ExpressionParser(tokenize(expr)).parse()
+
+
+#   Constant arithmetic with C semantics
+#----------------------------------------
+
+def wrap(value, bits):
+    """Wrap integer *value* to a signed integer with the given number of bits.
+    """
+    mask = (1 << bits) - 1
+    value &= mask
+    if value >> (bits - 1):
+        value -= 1 << bits
+    return value
+
+
+def fits32(value):
+    return -2**31 <= value < 2**31
+
+
+def is_const(loc):
+    return isinstance(loc, (int, float))
+
+
+def to_float32(value):
+    """Round *value* to the nearest single-precision float.
+    """
+    try:
+        return struct.unpack('f', struct.pack('f', value))[0]
+    except OverflowError:
+        return math.copysign(float('inf'), value)
+
+
+def arith_type(t1, t2):
+    """Return the type resulting from the usual arithmetic conversions.
+    
+    Pointers are compared as 64-bit integers.
+    """
+    if is_pointer(t1) or is_pointer(t2):
+        return 'long'
+    for typ in ('double', 'float', 'long'):
+        if typ in (t1, t2):
+            return typ
+    return 'int'
+
+
+def fold(op, a, b, typ):
+    """Evaluate binary operator *op* for constants *a* and *b* of type *typ*.
+
+    Returns None if the operation must be left for runtime.
+    """
+    if op in _compare_ops:
+        return int({'<': a < b, '<=': a <= b, '>': a > b, '>=': a >= b,
+                    '==': a == b, '!=': a != b}[op])
+    if typ in float_types:
+        if op == '/' and b == 0:
+            return None
+        value = {'+': a + b, '-': a - b, '*': a * b, '/': a / b if b else 0}[op]
+        return to_float32(value) if typ == 'float' else value
+    bits = type_bits[typ]
+    if op in ('/', '%'):
+        if b == 0:
+            raise ZeroDivisionError("Division by zero in constant expression")
+        # C division truncates toward zero
+        q = abs(a) // abs(b)
+        if (a < 0) != (b < 0):
+            q = -q
+        return wrap(q if op == '/' else a - q * b, bits)
+    if op == '<<':
+        return wrap(a << (b & (bits-1)), bits)
+    if op == '>>':
+        return a >> (b & (bits-1))
+    return wrap({'+': a + b, '-': a - b, '*': a * b, '&': a & b, '|': a | b,
+                 '^': a ^ b}[op], bits)
+
+
+_compare_ops = ('<', '<=', '>', '>=', '==', '!=')
+_swap_compare = {'<': '>', '<=': '>=', '>': '<', '>=': '<=', '==': '==', '!=': '!='}
+_negate_compare = {'<': '>=', '<=': '>', '>': '<=', '>=': '<', '==': '!=', '!=': '=='}
+_int_cc = {'<': 'l', '<=': 'le', '>': 'g', '>=': 'ge', '==': 'e', '!=': 'ne'}
+
+_int_instr = {'+': asm.add, '-': asm.sub, '*': asm.imul, '&': asm.and_,
+              '|': asm.or_, '^': asm.xor}
+_float_instr = {
+    'double': {'+': asm.addsd, '-': asm.subsd, '*': asm.mulsd, '/': asm.divsd},
+    'float': {'+': asm.addss, '-': asm.subss, '*': asm.mulss, '/': asm.divss},
+}
+
+
+#   Code generation
+#----------------------------------------
+
 class Expression(CodeObject):
+    """A C expression.
+
+    *expr* may be a string of C code, a number, or a parsed expression tree.
+    Compiling the expression generates code that computes its value;
+    afterward, ``location`` gives the Register, Pointer, or constant holding
+    the result and ``type`` gives its C type.
+
+    The code generator evaluates the more complex operand of each binary
+    operator first to minimize register usage, folds constants, and uses
+    cheaper instruction sequences where possible (lea for addition, shifts and
+    lea for multiplication by constants, and multiplication by a magic number
+    for division by constants).
+    """
     def __init__(self, expr):
         CodeObject.__init__(self)
         self.expr = expr
         self.type = None
-        # name introduced into scope to reference the result of this expression
-        #self.name = "%s_%x" % (self.__class__.__name__, id(self))
-        
-    def compile(self, scope):
-        if isinstance(self.expr, (int, float)):
-            tokens = [self.expr]
+        self.location = None
+
+    def compile(self, scope, dest=None, cast=None, discard=False):
+        """Return code that evaluates this expression.
+
+        If *cast* is given, the result is converted to that type. If *dest* is
+        given, the result is moved to that register. If *discard* is True,
+        the result is not needed (the expression is evaluated only for its
+        side effects).
+        """
+        self._begin(scope)
+        tree = parse(self.expr)
+        loc, typ = self._compile(tree, want=dest, discard=discard)
+        if cast is not None:
+            loc = self._convert(loc, typ, cast)
+            typ = cast
+        if dest is not None and loc is not dest:
+            self._store(dest, loc, typ)
+            self.frame.release(loc)
+            loc = dest
+        self.location = loc
+        self.type = typ
+        return self.code
+
+    def expressions(self):
+        return [self.expr]
+
+    def compile_branch(self, scope, label, jump_if=True):
+        """Return code that jumps to *label* if the truth value of this
+        expression is equal to *jump_if*.
+        """
+        self._begin(scope)
+        self._branch(parse(self.expr), label, jump_if)
+        self.type = 'int'
+        return self.code
+
+    def _begin(self, scope):
+        self.scope = scope
+        self.frame = scope['__frame__']
+        self.code = []
+
+    def emit(self, *instrs):
+        self.code.extend(instrs)
+
+    def _lookup(self, name):
+        var = self.scope.get(name, None)
+        if not isinstance(var, Variable):
+            raise NameError("Undefined variable '%s'" % name)
+        return var
+
+    #  Helpers for moving values around
+    #------------------------------------
+
+    @staticmethod
+    def _kind(typ):
+        return 'float' if typ in float_types else 'int'
+
+    @staticmethod
+    def _sized(loc, bits):
+        """Return a view of register or pointer *loc* with the given size.
+        """
+        if isinstance(loc, asm.Register):
+            return sized(loc, bits)
+        ptr = loc.copy()
+        ptr.bits = bits
+        return ptr
+
+    def _alloc(self, typ, want=None, exclude=(), byte=False):
+        reg = self.frame.alloc(self._kind(typ), want, exclude, byte)
+        if typ in float_types:
+            return reg
+        return sized(reg, 8 * sizeof(typ))
+
+    def _load_const(self, value, typ, want=None, exclude=()):
+        """Return a new temporary register containing constant *value*.
+        """
+        reg = self._alloc(typ, want, exclude)
+        self._set_const(reg, value, typ, exclude)
+        return reg
+
+    def _set_const(self, reg, value, typ, exclude=()):
+        # Load a constant into a register using the shortest encoding
+        if typ in float_types:
+            value = float(value)
+            if value == 0 and math.copysign(1, value) > 0:
+                self.emit(asm.xorpd(reg, reg))
+            elif self.scope.get('__constants__') is not None:
+                # one rip-relative load from the page's constant pool
+                pool = self.scope['__constants__']
+                if typ == 'float':
+                    self.emit(asm.movss(reg, pool.float(value)))
+                else:
+                    self.emit(asm.movsd(reg, pool.double(value)))
+            elif typ == 'float':
+                bits = struct.unpack('i', struct.pack('f', value))[0]
+                self.emit(asm.mov(asm.dword([asm.rsp-8]), bits),
+                          asm.movss(reg, [asm.rsp-8]))
+            else:
+                tmp = self._alloc('long', exclude=exclude)
+                self.emit(asm.mov(tmp, struct.pack('d', value)),
+                          asm.mov([asm.rsp-8], tmp),
+                          asm.movsd(reg, [asm.rsp-8]))
+                self.frame.release(tmp)
+        elif value == 0:
+            reg32 = sized(reg, 32)
+            self.emit(asm.xor(reg32, reg32))
+        elif reg.bits == 64 and 0 < value < 2**32:
+            # writes to 32-bit registers are zero-extended
+            self.emit(asm.mov(sized(reg, 32), wrap(value, 32)))
         else:
-            tokens = self._tokenize(scope)
-        #return tokens
-        groups = self._group(tokens)
-        self.type = groups.type
-        #return groups
-        code, location = self._compile_subexpr(groups, scope)
-        #scope[self.name] = Variable('int', self.name, reg=location)
-        self.location = location
-        
-        return code
-    
-    def _compile_subexpr(self, group, scope):
-        code = []
-        args = group.args
-        ops = []
-        
-        for arg in args:
-            if arg is None:
-                continue
-            if isinstance(arg, TokGrp):
-                c, loc = self._compile_subexpr(arg, scope)
-                code.extend(c)
-                ops.append(loc)
-            elif isinstance(arg, Variable):
-                ops.append(arg.location)
-            else:
-                ops.append(arg)
+            self.emit(asm.mov(reg, value))
+
+    def _load(self, loc, typ, want=None, exclude=()):
+        """Return a register containing the value at *loc*. The register may
+        be a variable's home and must not be modified.
+        """
+        if isinstance(loc, asm.Register) and self.frame.base(loc) not in exclude:
+            return loc
+        return self._copy(loc, typ, want, exclude)
+
+    def _writable(self, loc, typ, want=None, exclude=()):
+        """Return a temporary register containing the value at *loc*. The
+        register may be modified.
+        """
+        if self.frame.is_temp(loc) and self.frame.base(loc) not in exclude:
+            return loc
+        return self._copy(loc, typ, want, exclude)
+
+    def _copy(self, loc, typ, want=None, exclude=()):
+        if is_const(loc):
+            return self._load_const(loc, typ, want, exclude)
+        # The registers used to address a pointer may be reused for the result
+        self.frame.release(loc)
+        reg = self._alloc(typ, want, exclude)
+        self._store(reg, loc, typ)
+        return reg
+
+    def _operand(self, loc, typ):
+        """Return *loc* in a form usable as the source operand of a two-operand
+        instruction (register, memory, or 32-bit immediate).
+        """
+        if is_const(loc) and (typ in float_types or not fits32(loc)):
+            return self._load_const(loc, typ)
+        return loc
+
+    def _fetch(self, loc, typ, want=None):
+        """Return a new temporary register containing the value at *loc*.
         
-        if group.op is None and len(ops) == 1:
-            if isinstance(ops[0], (asm.Register, asm.Pointer)):
-                location = ops[0]
-            elif isinstance(ops[0], int):
-                code.append(asm.mov(asm.rax, ops[0]))
-                location = asm.rax
-            elif isinstance(ops[0], float):
-                code.extend([
-                    asm.mov(asm.rax, struct.pack('d', ops[0])),
-                    asm.mov([asm.rsp-8], asm.rax),
-                    asm.movsd(asm.xmm0, [asm.rsp-8])
-                ])
-                location = asm.xmm0
-            else:
-                raise TypeError("Unsupported expression type:", ops[0])
-        elif group.op == '+':
-            code.append(asm.add(*ops))
-            location = ops[0]
+        Unlike _copy(), registers used to address *loc* are not released, so
+        *loc* may be written afterward. char values are promoted to int.
+        """
+        if typ in storage_bits:
+            reg = self._alloc('int', want)
+            self.emit(asm.movsx(reg, loc))
+            return reg
+        reg = self._alloc(typ, want)
+        self._store(reg, loc, typ)
+        return reg
+
+    def _store(self, dst, loc, typ):
+        """Copy the value at *loc* to register or pointer *dst*.
+        """
+        if typ in storage_bits:
+            return self._store_byte(dst, loc)
+        if is_const(loc) and isinstance(dst, asm.Register):
+            self._set_const(dst, loc, typ)
+            return
+        tmp = None
+        if ((isinstance(loc, asm.Pointer) and isinstance(dst, asm.Pointer)) or
+                (is_const(loc) and (typ in float_types or not fits32(loc)))):
+            # no memory-to-memory moves or 64-bit immediates to memory
+            loc = tmp = self._load_const(loc, typ) if is_const(loc) else self._copy(loc, typ)
+        if loc is not dst:
+            if typ == 'float':
+                self.emit(asm.movss(dst, loc))
+            elif typ in float_types:
+                self.emit(asm.movsd(dst, loc))
+            else:
+                self.emit(asm.mov(dst, loc))
+        self.frame.release(tmp)
+
+    def _store_byte(self, dst, loc):
+        # Store the low byte of int value *loc* to memory
+        tmp = None
+        if is_const(loc):
+            loc = wrap(loc, 8)
         else:
-            raise NotImplementedError('operand: %s' % group.op)
-            
-        return code, location
-    
-    def _tokenize(self, scope):
-        # Parse expression into tokens
-        tokens = []
-        expr = self.expr
-        while len(expr) > 0:
-            expr = expr.lstrip()
-            if expr[0] in '+-*/()':
-                tokens.append(expr[0])
-                expr = expr[1:]
-                continue
-            m = re.match(r'([a-zA-Z_][a-zA-Z0-9_]*)(.*)', expr)
-            if m is not None:
-                tokens.append(scope[m.groups()[0]])
-                expr = m.groups()[1]
+            if not isinstance(loc, asm.Register) or sized(loc, 8) is None:
+                # sil and dil are not available
+                tmp = self._alloc('int', byte=True)
+                self._store(tmp, loc, 'int')
+                loc = tmp
+            loc = sized(loc, 8)
+        self.emit(asm.mov(dst, loc))
+        self.frame.release(tmp)
+
+    def _convert(self, loc, frm, to):
+        """Convert the value at *loc* from type *frm* to type *to*.
+        """
+        # pointers convert like 64-bit integers; char values are truncated
+        # when stored
+        frm = 'long' if is_pointer(frm) else frm
+        to = 'long' if is_pointer(to) else ('int' if to in storage_bits else to)
+        if frm == to:
+            return loc
+        if is_const(loc):
+            if to == 'float':
+                return to_float32(loc)
+            if to in float_types:
+                return float(loc)
+            return wrap(int(loc), type_bits[to])
+        if to in float_types:
+            if frm in float_types:
+                instr = asm.cvtss2sd if to == 'double' else asm.cvtsd2ss
+            else:
+                instr = asm.cvtsi2sd if to == 'double' else asm.cvtsi2ss
+            reg = self._alloc(to)
+            # xorpd breaks the dependency on the previous value of reg
+            self.emit(asm.xorpd(reg, reg), instr(reg, loc))
+            self.frame.release(loc)
+            return reg
+        bits = type_bits[to]
+        if frm in float_types:
+            reg = self._alloc(to)
+            instr = asm.cvttsd2si if frm == 'double' else asm.cvttss2si
+            self.emit(instr(reg, loc))
+            self.frame.release(loc)
+            return reg
+        if bits < type_bits[frm]:
+            # truncation just uses the lower part of the register / memory
+            return self._sized(loc, bits)
+        if self.frame.is_temp(loc):
+            reg = sized(loc, bits)
+        else:
+            reg = self._alloc(to)
+            self.frame.release(loc)
+        self.emit(asm.movsxd(reg, loc))
+        return reg
+
+    def _reserve(self, regs):
+        """Claim registers required as implicit operands (rax, rdx, rcx).
+
+        Registers that are in use are pushed to the stack. Returns the list of
+        pushed registers, to be passed to _unreserve().
+        """
+        saved = []
+        for reg in regs:
+            if self.frame.in_use(reg):
+                self.emit(asm.push(reg))
+                saved.append(reg)
+            else:
+                self.frame.take(reg)
+        return saved
+
+    def _unreserve(self, regs, saved, result=None):
+        """Release registers claimed by _reserve(). If *result* is one of the
+        reserved registers, it is kept (or moved if its register must be
+        restored) and the new location is returned.
+        """
+        base = None if result is None else self.frame.base(result)
+        if base in saved:
+            reg = self._alloc('long', exclude=regs)
+            reg = sized(reg, result.bits)
+            self.emit(asm.mov(reg, result))
+            result = reg
+            base = None
+        for reg in regs:
+            if reg not in saved and reg is not base:
+                self.frame.release(reg)
+        for reg in reversed(saved):
+            self.emit(asm.pop(reg))
+        return result
+
+    #  Static type analysis
+    #------------------------------------
+
+    def _type_of(self, node):
+        """Return the C type of the value of *node* without generating code.
+        """
+        if isinstance(node, Const):
+            return node.type
+        if isinstance(node, Name):
+            typ = self._lookup(node.name).type
+            # arrays decay to pointers
+            return element_type(typ) + '*' if is_array(typ) else typ
+        if isinstance(node, Cast):
+            return node.type
+        if isinstance(node, Call):
+            return self._function(node).rtype
+        if isinstance(node, Unary):
+            if node.op == '*':
+                typ = element_type(self._type_of(node.arg))
+                return 'int' if typ in storage_bits else typ
+            if node.op == '&':
+                if isinstance(node.arg, Unary) and node.arg.op == '*':
+                    return self._type_of(node.arg.arg)
+                return self._type_of(node.arg) + '*'
+            return 'int' if node.op == '!' else self._type_of(node.arg)
+        if isinstance(node, IncDec):
+            return self._type_of(node.arg)
+        if isinstance(node, Assignment):
+            return self._type_of(node.target)
+        if isinstance(node, Conditional):
+            t1 = self._type_of(node.true)
+            t2 = self._type_of(node.false)
+            if is_pointer(t1) or is_pointer(t2):
+                return t1 if is_pointer(t1) else t2
+            return arith_type(t1, t2)
+        if node.op in _compare_ops or node.op in ('&&', '||'):
+            return 'int'
+        if node.op == ',':
+            return self._type_of(node.right)
+        if node.op in ('<<', '>>'):
+            return self._type_of(node.left)
+        t1 = self._type_of(node.left)
+        t2 = self._type_of(node.right)
+        if node.op in ('+', '-') and (is_pointer(t1) or is_pointer(t2)):
+            if is_pointer(t1) and is_pointer(t2):
+                # pointer difference
+                return 'long'
+            return t1 if is_pointer(t1) else t2
+        return arith_type(t1, t2)
+
+    def _need(self, node):
+        """Estimate the number of registers needed to evaluate *node*.
+        """
+        if isinstance(node, (Const, Name)):
+            return 0
+        if isinstance(node, Call):
+            # values in caller-saved registers are saved around calls; 
+            # evaluating calls first avoids this.
+            return len(self.frame.int_scratch)
+        if isinstance(node, Binary) and node.op not in ('&&', '||', ','):
+            left, right = self._need(node.left), self._need(node.right)
+            if left == right:
+                return left + 1
+            return max(left, right)
+        return 1
+
+    #  Memory addressing
+    #------------------------------------
+
+    def _address(self, node):
+        """Return (Pointer, type) for the memory referenced by the pointer
+        expression *node*.
+
+        Sums of pointers and integers are folded into a single
+        base + index*scale + disp operand, so that ``a[i]`` and ``a[i+1]``
+        need no separate address arithmetic.
+        """
+        ptype = self._type_of(node)
+        if not is_pointer(ptype):
+            raise TypeError("Cannot dereference value of type '%s'" % ptype)
+        typ = element_type(ptype)
+        if typ == 'void':
+            raise TypeError("Cannot dereference 'void*'")
+        base, index, scale, disp = self._addr_terms(node)
+        if not fits32(disp):
+            base = self._collapse([base, index, scale, disp])
+            index = scale = None
+            disp = 0
+        ptr = asm.Pointer(reg1=index, scale=scale, reg2=base, disp=disp or None)
+        ptr.bits = 8 * sizeof(typ)
+        return ptr, typ
+
+    def _addr_terms(self, node):
+        # Return [base, index, scale, disp] for the address computed by
+        # pointer expression *node*. base and index are 64-bit registers
+        # (index may be None).
+        if isinstance(node, Name):
+            var = self._lookup(node.name)
+            if is_array(var.type):
+                # arrays are stored on the stack
+                loc = var.location
+                return [loc.reg1, None, None, loc.disp or 0]
+        elif isinstance(node, Binary) and node.op in ('+', '-'):
+            lt = self._type_of(node.left)
+            rt = self._type_of(node.right)
+            ptr = None
+            if is_pointer(lt) and not is_pointer(rt):
+                ptr, offset = node.left, node.right
+            elif node.op == '+' and is_pointer(rt) and not is_pointer(lt):
+                ptr, offset = node.right, node.left
+            if ptr is not None:
+                size = sizeof(element_type(self._type_of(ptr)))
+                terms = self._addr_terms(ptr)
+                sign = -1 if node.op == '-' else 1
+                self._add_offset(terms, offset, size, sign)
+                return terms
+        loc, typ = self._compile(node)
+        return [self._load(loc, 'long'), None, None, 0]
+
+    def _add_offset(self, terms, node, size, sign):
+        # Add sign * (integer expression *node*) * size to address *terms*.
+        # Constant parts are folded into the displacement.
+        if isinstance(node, Const):
+            if node.type not in int_types:
+                raise TypeError("Pointer offset must be an integer")
+            terms[3] += sign * node.value * size
+            return
+        if (isinstance(node, Binary) and node.op in ('+', '-') and
+                self._type_of(node) in int_types):
+            if isinstance(node.right, Const):
+                rsign = sign if node.op == '+' else -sign
+                self._add_offset(terms, node.right, size, rsign)
+                return self._add_offset(terms, node.left, size, sign)
+            if isinstance(node.left, Const) and node.op == '+':
+                self._add_offset(terms, node.left, size, sign)
+                return self._add_offset(terms, node.right, size, sign)
+
+        # a[i*c] can use the scale factor directly
+        scale = size
+        if (isinstance(node, Binary) and node.op == '*' and sign > 0 and
+                self._derived_variable(node) is None):
+            for a, b in ((node.left, node.right), (node.right, node.left)):
+                if (isinstance(b, Const) and b.type in int_types and
+                        size * b.value in (1, 2, 4, 8)):
+                    node, scale = a, size * b.value
+                    break
+
+        loc, typ = self._compile(node)
+        if typ not in int_types:
+            raise TypeError("Pointer offset must be an integer")
+        loc = self._convert(loc, typ, 'long')
+        if is_const(loc):
+            terms[3] += sign * loc * scale
+            return
+        if sign < 0:
+            loc = self._writable(loc, 'long')
+            self.emit(asm.neg(loc))
+        else:
+            loc = self._load(loc, 'long')
+        if terms[1] is not None:
+            terms[:] = [self._collapse(terms), None, None, 0]
+        terms[1] = loc
+        terms[2] = scale
+
+    def _collapse(self, terms, want=None):
+        """Return a register containing the address described by *terms*.
+        """
+        base, index, scale, disp = terms
+        if index is None and disp == 0:
+            return base
+        if not fits32(disp):
+            dreg = self._load_const(disp, 'long')
+            if index is None:
+                index, scale = dreg, 1
+            else:
+                self.emit(asm.add(dreg, base))
+                self.frame.release(base)
+                base = dreg
+            disp = 0
+        ptr = asm.Pointer(reg1=index, scale=scale, reg2=base, disp=disp or None)
+        return self._lea(ptr, 'long', want)[0]
+
+    def _lea(self, ptr, typ, want=None):
+        # Load the address of *ptr* into a new register
+        reg = self._alloc('long', want)
+        self.emit(asm.lea(reg, ptr.copy()))
+        self.frame.release(ptr)
+        return reg, typ
+
+    def _address_of(self, node, want):
+        # Compile &node
+        if isinstance(node, Unary) and node.op == '*':
+            # &*p is p, and &a[i] is a + i
+            ptype = self._type_of(node.arg)
+            if not is_pointer(ptype):
+                raise TypeError("Cannot dereference value of type '%s'" % ptype)
+            return self._compile(node.arg, want)
+        if isinstance(node, Name):
+            var = self._lookup(node.name)
+            if is_array(var.type):
+                raise TypeError("Cannot take the address of array '%s'" % node.name)
+            if isinstance(var.location, asm.Pointer):
+                return self._lea(var.location, var.type + '*', want)
+            raise TypeError("Cannot take the address of register variable "
+                            "'%s'" % node.name)
+        raise TypeError("Cannot take the address of expression %r" % node)
+
+    @staticmethod
+    def _uses(loc, regs):
+        """Return True if *loc* is, or is addressed using, one of *regs*.
+        """
+        if isinstance(loc, asm.Register):
+            return sized(loc, 64) in regs
+        if isinstance(loc, asm.Pointer):
+            return any(r is not None and sized(r, 64) in regs
+                       for r in (loc.reg1, loc.reg2))
+        return False
+
+    #  Expression compiling
+    #------------------------------------
+
+    def _compile(self, node, want=None, discard=False):
+        """Generate code for *node* and return (location, type).
+        """
+        if isinstance(node, Const):
+            return node.value, node.type
+        elif isinstance(node, Name):
+            var = self._lookup(node.name)
+            if is_array(var.type):
+                return self._lea(var.location, element_type(var.type) + '*', want)
+            return var.location, var.type
+        elif isinstance(node, Cast):
+            if node.type not in type_bits and not is_pointer(node.type):
+                raise TypeError("Unsupported type '%s'" % node.type)
+            loc, typ = self._compile(node.arg)
+            return self._convert(loc, typ, node.type), node.type
+        elif isinstance(node, Unary):
+            return self._unary(node, want)
+        elif isinstance(node, Binary):
+            if node.op == ',':
+                self._discard(node.left)
+                return self._compile(node.right, want, discard)
+            if node.op in ('&&', '||'):
+                return self._logical(node, want)
+            return self._binary(node, want)
+        elif isinstance(node, Assignment):
+            return self._assign(node, want, discard)
+        elif isinstance(node, IncDec):
+            return self._incdec(node, want, discard)
+        elif isinstance(node, Conditional):
+            return self._conditional(node, want)
+        elif isinstance(node, Call):
+            return self._call(node, want, discard)
+        raise TypeError("Cannot compile expression %r" % node)
+
+    def _discard(self, node):
+        loc, typ = self._compile(node, discard=True)
+        self.frame.release(loc)
+
+    def _unary(self, node, want):
+        op = node.op
+        if op == '!':
+            # !x is the same as x == 0
+            return self._compile(Binary('==', node.arg, Const(0, 'int')), want)
+        if op == '*':
+            ptr, typ = self._address(node.arg)
+            if typ in storage_bits:
+                self.frame.release(ptr)
+                return self._fetch(ptr, typ, want), 'int'
+            return ptr, typ
+        if op == '&':
+            return self._address_of(node.arg, want)
+        loc, typ = self._compile(node.arg)
+        if op == '+':
+            return loc, typ
+        if op == '~' and typ not in int_types:
+            raise TypeError("Invalid operand type '%s' for '~'" % typ)
+        if is_const(loc):
+            if op == '-':
+                return (-loc if typ in float_types else
+                        wrap(-loc, type_bits[typ])), typ
+            return wrap(~loc, type_bits[typ]), typ
+
+        reg = self._writable(loc, typ, want)
+        if op == '~':
+            self.emit(asm.not_(reg))
+        elif typ in int_types:
+            self.emit(asm.neg(reg))
+        else:
+            # flip the sign bit
+            mask = self._alloc('double')
+            tmp = self._alloc('long')
+            self._set_const(tmp, 2**31 if typ == 'float' else -2**63, 'long')
+            self.emit(asm.movq(mask, tmp),
+                      asm.xorpd(reg, mask))
+            self.frame.release(tmp)
+            self.frame.release(mask)
+        return reg, typ
+
+    def _operands(self, node):
+        # Compile both operands of a binary node, evaluating the operand that
+        # needs more registers first.
+        if self._need(node.right) > self._need(node.left):
+            b = self._compile(node.right)
+            a = self._compile(node.left)
+        else:
+            a = self._compile(node.left)
+            b = self._compile(node.right)
+        return a, b
+
+    def _binary(self, node, want):
+        if node.op == '*':
+            derived = self._derived_variable(node)
+            if derived is not None:
+                return derived.location, derived.type
+        if node.op in ('+', '-'):
+            typ = self._type_of(node)
+            if is_pointer(typ):
+                # p + n is computed with lea
+                reg = self._collapse(self._addr_terms(node), want)
+                return reg, typ
+            if is_pointer(self._type_of(node.left)):
+                return self._pointer_diff(node, want), typ
+        (a, at), (b, bt) = self._operands(node)
+        return self._binop(node.op, a, at, b, bt, want)
+
+    def _pointer_diff(self, node, want):
+        # p - q is the number of elements between two pointers
+        (a, at), (b, bt) = self._operands(node)
+        reg = self._int_binop('-', a, b, 'long', want)
+        size = sizeof(element_type(at))
+        if size > 1:
+            reg = self._writable(reg, 'long', want)
+            self.emit(asm.sar(reg, size.bit_length() - 1))
+        return reg
+
+    def _derived_variable(self, node):
+        # Inside loops, a product of the induction variable may have been
+        # replaced by a derived induction variable (see ForLoop).
+        reduced = self.scope.get('__reduced__', None)
+        if not reduced:
+            return None
+        for a, b in ((node.left, node.right), (node.right, node.left)):
+            if not isinstance(a, Name):
                 continue
-            m = re.match(r'(-?(([0-9]+(\.[0-9]*)?)|(([0-9]*\.)?[0-9]+))(e-?[0-9]+)?)(.*)', expr)
-            if m is not None:
-                tokens.append(eval(m.groups()[0]))
-                expr = m.groups()[-1]
+            if isinstance(b, Const) and b.type in int_types:
+                key = b.value
+            elif isinstance(b, Name):
+                key = self.scope.get(b.name, None)
+            else:
                 continue
-        return tokens
+            derived = reduced.get((self.scope.get(a.name, None), key), None)
+            if derived is not None:
+                return derived
+        return None
 
-    def _group(self, tokens):
-        # parse a list of tokens into nested groups containing no more than
-        # one operand per group.
-        op_order =  '*/+-'
-        unary_ops = '-'
-        
-        group = TokGrp()
-        while len(tokens) > 0:
-            tok = tokens.pop(0)
-            #print tok
-            if tok == '(':
-                if group.accepts_arg:
-                    newgrp = TokGrp(parent=group)
-                    group.add_arg(newgrp)
-                    group = newgrp
-                else:
-                    raise TypeError("Parse error in expression %s")
-            elif tok == ')':
-                if group.parent is not None:
-                    group = group.parent
-            elif isinstance(tok, str):
-                if group.op is None:
-                    group.set_op(tok)
-                else:
-                    # need a new group. Decide how to handle nesting:
-                    
-                    if op_order.index(group.op) > op_order.index(tok):
-                        # insert new group inside current group
-                        newgrp = TokGrp(op=tok, arg1=group.args[1], parent=group)
-                        group.args[1] = newgrp
-                        group = newgrp
-                    else:
-                        # insert current group into new group
-                        newgrp = TokGrp(op=tok, arg1=group, parent=group.parent)
-                        group.parent = newgrp
-                        group = newgrp
-            else:
-                if group.accepts_arg:
-                    group.add_arg(tok)
-                else:
-                    raise TypeError("Parse error in expression %s")
-                
-            root_group = group
-            while True:
-                parent = root_group.parent
-                if parent is None:
-                    break
-                else:
-                    root_group = parent
-            #print root_group
-        return root_group
-
-            
-class TokGrp(object):
-    def __init__(self, parent=None, op=None, arg1=None, arg2=None, binary=True):
-        self.parent = parent
-        self.binary = binary
-        self.op = op
-        self.args = [arg1, arg2]
-        
-    @property
-    def type(self):
-        # todo: decide when to do automatic type casting
-        if isinstance(self.args[0], (TokGrp, Variable)):
-            return self.args[0].type
-        elif isinstance(self.args[0], int):
-            return 'int'
-        elif isinstance(self.args[0], float):
-            return 'float'
+    def _binop(self, op, a, at, b, bt, want=None):
+        """Generate code for binary operator *op* applied to the values at *a*
+        and *b*. Returns (location, type).
+        """
+        if op in ('<<', '>>'):
+            if at not in int_types or bt not in int_types:
+                raise TypeError("Invalid operand types for '%s'" % op)
+            if is_const(a) and is_const(b):
+                return fold(op, a, b, at), at
+            return self._shift(op, a, b, bt, at, want), at
+
+        if (is_pointer(at) or is_pointer(bt)) and op not in _compare_ops:
+            raise TypeError("Invalid operand types '%s' and '%s' for '%s'" %
+                            (at, bt, op))
+        typ = arith_type(at, bt)
+        if typ in float_types and op in ('%', '&', '|', '^'):
+            raise TypeError("Invalid operand type '%s' for '%s'" % (typ, op))
+        a = self._convert(a, at, typ)
+        b = self._convert(b, bt, typ)
+        if is_const(a) and is_const(b):
+            value = fold(op, a, b, typ)
+            if value is not None:
+                return value, ('int' if op in _compare_ops else typ)
+
+        if op in _compare_ops:
+            return self._compare_value(op, a, b, typ, want), 'int'
+        if typ in float_types:
+            return self._float_binop(op, a, b, typ, want), typ
+        return self._int_binop(op, a, b, typ, want), typ
+
+    def _float_binop(self, op, a, b, typ, want):
+        if op in ('+', '*') and not self.frame.is_temp(a) and self.frame.is_temp(b):
+            a, b = b, a
+        reg = self._writable(a, typ, want)
+        src = self._operand(b, typ)
+        self.emit(_float_instr[typ][op](reg, src))
+        self.frame.release(src)
+        return reg
+
+    def _int_binop(self, op, a, b, typ, want):
+        frame = self.frame
+        bits = type_bits[typ]
+        if op in ('+', '*', '&', '|', '^') and not is_const(b):
+            if is_const(a) or (not frame.is_temp(a) and frame.is_temp(b)):
+                a, b = b, a
+        if is_const(b):
+            if op == '-':
+                op, b = '+', wrap(-b, bits)
+            if op == '*':
+                return self._mul_const(a, b, typ, want)
+            if (op in ('+', '|', '^') and b == 0) or (op == '&' and b == -1):
+                return a
+            if op == '&' and b == 0:
+                frame.release(a)
+                return 0
+        if op in ('/', '%'):
+            if is_const(b):
+                return self._div_const(op, a, b, typ, want)
+            return self._idiv(op, a, b, typ)
+
+        if (op == '+' and isinstance(a, asm.Register) and not frame.is_temp(a)
+                and (isinstance(b, asm.Register) or (is_const(b) and fits32(b)))):
+            # lea computes the sum without modifying either operand
+            reg = self._alloc(typ, want)
+            if is_const(b):
+                addr = sized(a, 64) + b
+            else:
+                addr = sized(a, 64) + sized(b, 64)
+            self.emit(asm.lea(reg, [addr]))
+            frame.release(b)
+            return reg
+
+        reg = self._writable(a, typ, want)
+        src = self._operand(b, typ)
+        self.emit(_int_instr[op](reg, src))
+        frame.release(src)
+        return reg
+
+    def _mul_const(self, a, c, typ, want):
+        """Multiply *a* by the constant *c*.
+        """
+        bits = type_bits[typ]
+        if c == 0:
+            self.frame.release(a)
+            return 0
+        if c == 1:
+            return a
+        if c == -1 or (c > 0 and c & (c - 1) == 0):
+            reg = self._writable(a, typ, want)
+            if c == -1:
+                self.emit(asm.neg(reg))
+            else:
+                self.emit(asm.shl(reg, c.bit_length() - 1))
+            return reg
+        if c in (3, 5, 9):
+            # a + a*2, a + a*4, a + a*8
+            src = sized(self._load(a, typ), 64)
+            reg = self._alloc(typ, want)
+            self.emit(asm.lea(reg, [src + src * (c-1)]))
+            self.frame.release(src)
+            return reg
+        if fits32(c):
+            reg = a if self.frame.is_temp(a) else self._alloc(typ, want)
+            self.emit(asm.imul(reg, a, c))
+            if reg is not a:
+                self.frame.release(a)
+            return reg
+        reg = self._writable(a, typ, want)
+        src = self._load_const(c, typ)
+        self.emit(asm.imul(reg, src))
+        self.frame.release(src)
+        return reg
+
+    def _div_const(self, op, a, d, typ, want):
+        """Divide *a* by the constant *d* without using idiv.
+        """
+        if d == 0:
+            raise ZeroDivisionError("Division by zero in expression")
+        ad = abs(d)
+        if ad == 1:
+            if op == '%':
+                self.frame.release(a)
+                return 0
+            if d == 1:
+                return a
+            reg = self._writable(a, typ, want)
+            self.emit(asm.neg(reg))
+            return reg
+        if ad & (ad - 1) == 0:
+            return self._div_pow2(op, a, d, typ, want)
+        return self._div_magic(op, a, d, typ, want)
+
+    def _div_pow2(self, op, a, d, typ, want):
+        # Signed division by 2**k: add 2**k-1 to negative dividends so that
+        # the arithmetic shift rounds toward zero.
+        bits = type_bits[typ]
+        k = abs(d).bit_length() - 1
+        src = self._load(a, typ)
+        bias = self._alloc(typ, want if op == '/' else None)
+        self.emit(asm.mov(bias, src))
+        if k > 1:
+            self.emit(asm.sar(bias, bits - 1))
+        self.emit(asm.shr(bias, bits - k),
+                  asm.add(bias, src))
+        if op == '/':
+            self.frame.release(src)
+            self.emit(asm.sar(bias, k))
+            if d < 0:
+                self.emit(asm.neg(bias))
+            return bias
+
+        # a % d == a - (a rounded toward zero to a multiple of d)
+        mask = self._operand(wrap(-2**k, bits), typ)
+        self.emit(asm.and_(bias, mask))
+        self.frame.release(mask)
+        reg = self._writable(src, typ, want)
+        self.emit(asm.sub(reg, bias))
+        self.frame.release(bias)
+        return reg
+
+    def _div_magic(self, op, a, d, typ, want):
+        # Division by an invariant integer using multiplication (Granlund &
+        # Montgomery, 1994): q = floor(a * m / 2**(bits+l-1)) + (a < 0), where
+        # m = 2**(bits+l-1) // |d| + 1 and l = ceil(log2(|d|)).
+        frame = self.frame
+        bits = type_bits[typ]
+        ad = abs(d)
+        l = ad.bit_length()
+        m = (1 << (bits + l - 1)) // ad + 1
+        src = a if isinstance(a, asm.Pointer) else self._load(a, typ)
+
+        if bits == 32:
+            # The product fits in 64 bits
+            q = self._alloc('long', want if op == '/' else None)
+            self.emit(asm.movsxd(q, src))
+            if fits32(m):
+                self.emit(asm.imul(q, q, m))
+            else:
+                mreg = self._load_const(m, 'long')
+                self.emit(asm.imul(q, mreg))
+                frame.release(mreg)
+            self.emit(asm.sar(q, bits + l - 1))
+            q = sized(q, 32)
         else:
-            raise NotImplementedError("Can't determine expression type: %s" % self.args)
-        
-    @property
-    def accepts_arg(self):
-        """Return True if the group will allow another argument to be added.
+            # Use the high half of the 128-bit product m * a from rdx:rax. The
+            # multiplier exceeds 2**63, so multiply by (m - 2**64) and add a
+            # back to the high half.
+            regs = (asm.rax, asm.rdx)
+            if self._uses(src, regs):
+                src = self._copy(src, typ, exclude=regs)
+            saved = self._reserve(regs)
+            self.emit(asm.mov(asm.rax, m - 2**64),
+                      asm.imul(src),
+                      asm.add(asm.rdx, src),
+                      asm.sar(asm.rdx, l - 1))
+            q = self._unreserve(regs, saved, asm.rdx)
+
+        # Add 1 if the dividend is negative
+        sign = self._alloc(typ)
+        self.emit(asm.mov(sign, src),
+                  asm.shr(sign, bits - 1),
+                  asm.add(q, sign))
+        frame.release(sign)
+        if d < 0:
+            self.emit(asm.neg(q))
+        if op == '/':
+            frame.release(src)
+            return q
+
+        # a % d == a - (a / d) * d
+        q = self._mul_const(q, d, typ, None)
+        reg = self._writable(src, typ, want)
+        self.emit(asm.sub(reg, q))
+        frame.release(q)
+        return reg
+
+    def _idiv(self, op, a, b, typ):
+        # General signed division using idiv, which requires the dividend in
+        # rdx:rax and leaves the quotient in rax and the remainder in rdx.
+        frame = self.frame
+        bits = type_bits[typ]
+        regs = (asm.rax, asm.rdx)
+        if self._uses(b, regs):
+            b = self._copy(b, typ, exclude=regs)
+        # A temporary dividend is consumed here; its value remains readable
+        # until rax is written.
+        frame.release(a)
+        saved = self._reserve(regs)
+        dividend = sized(asm.rax, bits)
+        if a is not dividend:
+            self._store(dividend, a, typ)
+        self.emit(asm.cdq() if bits == 32 else asm.cqo(),
+                  asm.idiv(b))
+        frame.release(b)
+        result = dividend if op == '/' else sized(asm.rdx, bits)
+        return self._unreserve(regs, saved, result)
+
+    def _shift(self, op, a, b, bt, typ, want):
+        instr = asm.shl if op == '<<' else asm.sar
+        bits = type_bits[typ]
+        if is_const(b):
+            count = b & (bits - 1)
+            if count == 0:
+                return a
+            reg = self._writable(a, typ, want)
+            self.emit(instr(reg, count))
+            return reg
+
+        # variable shift count must be in cl
+        regs = (asm.rcx,)
+        reg = self._writable(a, typ, want, exclude=regs)
+        if isinstance(b, asm.Register) and self.frame.base(b) is asm.rcx:
+            self.emit(instr(reg, asm.cl))
+            self.frame.release(b)
+            return reg
+        saved = self._reserve(regs)
+        self.emit(asm.mov(asm.ecx, self._sized(b, 32)),
+                  instr(reg, asm.cl))
+        self.frame.release(b)
+        self._unreserve(regs, saved)
+        return reg
+
+    #  Comparisons and logical operators
+    #------------------------------------
+
+    def _compare(self, op, a, b, typ):
+        """Compare *a* and *b*, setting the flags register. Returns the
+        operator to test, which may differ from *op* if the operands were
+        swapped. For doubles, the returned operator is one of '>', '>=',
+        '==', '!='.
         """
-        return self.args[1] is None
-        
-    def add_arg(self, arg):
-        if self.binary and self.args[0] is None:
-            self.args[0] = arg
+        frame = self.frame
+        if typ in float_types:
+            # ucomisd sets CF for both 'less than' and 'unordered', so test
+            # a < b as b > a to get the correct result for NaN.
+            if op in ('<', '<='):
+                a, b, op = b, a, _swap_compare[op]
+            reg = self._load(a, typ)
+            src = self._operand(b, typ)
+            instr = asm.ucomiss if typ == 'float' else asm.ucomisd
+            self.emit(instr(reg, src))
         else:
-            self.args[1] = arg
+            if is_const(a):
+                a, b, op = b, a, _swap_compare[op]
+            if isinstance(a, asm.Pointer) and isinstance(b, asm.Pointer):
+                a = self._load(a, typ)
+            if is_const(b) and b == 0 and isinstance(a, asm.Register):
+                self.emit(asm.test(a, a))
+                src = b
+            else:
+                src = self._operand(b, typ)
+                self.emit(asm.cmp(a, src))
+            reg = a
+        frame.release(reg)
+        frame.release(src)
+        return op
 
-    def set_op(self, op):
-        assert self.op is None
-        self.op = op
-        if self.args[0] is None:
-            self.binary = False
+    def _compare_value(self, op, a, b, typ, want):
+        # Comparison result is an int 0 or 1.
+        reg = self._alloc('int', want, byte=True)
+        tmp = None
+        if typ in float_types and op in ('==', '!='):
+            tmp = sized(self._alloc('int', byte=True), 8)
+        self.emit(asm.xor(reg, reg))
+        op = self._compare(op, a, b, typ)
+        reg8 = sized(reg, 8)
+        if typ in int_types:
+            self.emit(getattr(asm, 'set' + _int_cc[op])(reg8))
+        elif op == '==':
+            # unordered operands compare not equal
+            self.emit(asm.sete(reg8), asm.setnp(tmp), asm.and_(reg8, tmp))
+        elif op == '!=':
+            self.emit(asm.setne(reg8), asm.setp(tmp), asm.or_(reg8, tmp))
+        else:
+            self.emit({'>': asm.seta, '>=': asm.setae}[op](reg8))
+        self.frame.release(tmp)
+        return reg
 
-    def __str__(self):
-        if self.binary:
-            if self.op is None and self.args[1] is None:
-                return str(self.args[0])
+    def _jump(self, op, typ, label, jump_if):
+        # Emit a conditional jump to *label* following _compare().
+        if typ in int_types:
+            if not jump_if:
+                op = _negate_compare[op]
+            self.emit(getattr(asm, 'j' + _int_cc[op])(label))
+        elif op in ('>', '>='):
+            if jump_if:
+                self.emit({'>': asm.ja, '>=': asm.jae}[op](label))
             else:
-                return '(%s %s %s)' % (self.args[0], self.op, self.args[1])
+                self.emit({'>': asm.jbe, '>=': asm.jb}[op](label))
+        elif (op == '==') == jump_if:
+            # jump if equal and ordered
+            skip = self.frame.new_label()
+            self.emit(asm.jp(skip), asm.je(label), asm.label(skip))
         else:
-            return '(%s %s)' % (self.op, self.args[1])
+            # jump if not equal or unordered
+            self.emit(asm.jp(label), asm.jne(label))
 
+    def _branch(self, node, label, jump_if):
+        """Generate code that jumps to *label* if the truth value of *node*
+        equals *jump_if*.
+        """
+        if isinstance(node, Unary) and node.op == '!':
+            return self._branch(node.arg, label, not jump_if)
+        if isinstance(node, Binary) and node.op in ('&&', '||'):
+            if (node.op == '||') == jump_if:
+                # jump if either operand matches
+                self._branch(node.left, label, jump_if)
+                self._branch(node.right, label, jump_if)
+            else:
+                skip = self.frame.new_label()
+                self._branch(node.left, skip, not jump_if)
+                self._branch(node.right, label, jump_if)
+                self.emit(asm.label(skip))
+            return
+        if isinstance(node, Binary) and node.op == ',':
+            self._discard(node.left)
+            return self._branch(node.right, label, jump_if)
 
-class _SubExpr(object):
-    def __init__(self, arg1, op=None, arg2=None):
-        self.arg1 = arg1
-        self.op = op
-        self.arg2 = arg2
-        
-        # compile simple expression
-        self.location = arg1.location
-        
-        self.code = []
-        if op == '+':
-            self.code = [asm.add(arg1.location, arg2)]
-            
+        if isinstance(node, Binary) and node.op in _compare_ops:
+            (a, at), (b, bt) = self._operands(node)
+            typ = arith_type(at, bt)
+            a = self._convert(a, at, typ)
+            b = self._convert(b, bt, typ)
+            op = node.op
+        else:
+            a, typ = self._compile(node)
+            b = 0.0 if typ in float_types else 0
+            op = '!='
+        if is_const(a) and is_const(b):
+            if bool(fold(op, a, b, typ)) == jump_if:
+                self.emit(asm.jmp(label))
+            return
+        op = self._compare(op, a, b, typ)
+        self._jump(op, typ, label, jump_if)
+
+    def _logical(self, node, want):
+        # Value of && or || is an int 0 or 1
+        false = self.frame.new_label()
+        end = self.frame.new_label()
+        self._branch(node, false, False)
+        reg = self._alloc('int', want)
+        self.emit(asm.mov(reg, 1),
+                  asm.jmp(end),
+                  asm.label(false),
+                  asm.xor(reg, reg),
+                  asm.label(end))
+        return reg, 'int'
+
+    def _conditional(self, node, want):
+        typ = self._type_of(node)
+        reg = self._alloc(typ, want)
+        false = self.frame.new_label()
+        end = self.frame.new_label()
+        self._branch(node.cond, false, False)
+        for i, arg in enumerate((node.true, node.false)):
+            loc, atyp = self._compile(arg)
+            loc = self._convert(loc, atyp, typ)
+            self._store(reg, loc, typ)
+            self.frame.release(loc)
+            if i == 0:
+                self.emit(asm.jmp(end), asm.label(false))
+        self.emit(asm.label(end))
+        return reg, typ
+
+    #  Function calls
+    #------------------------------------
+
+    # System V AMD64 argument registers
+    _int_args = [asm.rdi, asm.rsi, asm.rdx, asm.rcx, asm.r8, asm.r9]
+    _float_args = [asm.xmm0, asm.xmm1, asm.xmm2, asm.xmm3, asm.xmm4, asm.xmm5,
+                   asm.xmm6, asm.xmm7]
+
+    def _function(self, node):
+        # Return the Function or Prototype called by *node*
+        func = node.func
+        if isinstance(func, Name):
+            name = func.name
+            func = self.scope.get(name, None)
+            if func is None and name in self.scope.get('__globals__', {}):
+                raise TypeError("Function '%s' needs a prototype or argtypes."
+                                % name)
+            if func is None:
+                raise NameError("Undefined function '%s'" % name)
+            if not hasattr(func, 'call_target'):
+                raise TypeError("'%s' is not a function" % name)
+        return func
+
+    def _call_args(self, func, nodes):
+        # Evaluate the arguments of a call to *func*, the most complex first.
+        # Returns a list of (location, type, dst) where the value has been
+        # converted to the parameter type and dst is the argument register
+        # (or None for arguments passed on the stack), and the list of stack
+        # slots used to hold arguments.
+        params = [typ for typ, name in func.args]
+        if len(nodes) < len(params) or (len(nodes) > len(params) and 
+                                        not func.varargs):
+            raise TypeError("Function '%s' takes %d arguments (%d given)" %
+                            (func.name, len(params), len(nodes)))
+        types = []
+        dsts = []
+        regs = {'int': list(self._int_args), 'float': list(self._float_args)}
+        for i, node in enumerate(nodes):
+            typ = self._type_of(node)
+            if i < len(params):
+                ptype = params[i]
+            else:
+                # variadic arguments: float is promoted to double
+                ptype = 'double' if typ == 'float' else typ
+            if (typ == 'void' or (typ in float_types and is_pointer(ptype)) or
+                    (ptype in float_types and is_pointer(typ))):
+                raise TypeError("Invalid type '%s' for argument %d of '%s'" %
+                                (typ, i+1, func.name))
+            pool = regs[self._kind(ptype)]
+            dst = pool.pop(0) if len(pool) > 0 else None
+            if dst is not None and ptype not in float_types:
+                dst = sized(dst, 8 * sizeof(ptype))
+            types.append(ptype)
+            dsts.append(dst)
+
+        args = [None] * len(nodes)
+        order = sorted(range(len(nodes)), key=lambda i: -self._need(nodes[i]))
+        calls = len([n for n in nodes if self._has_call(n)])
+        slots = []
+        for i in order:
+            loc, typ = self._compile(nodes[i], want=dsts[i])
+            loc = self._convert(loc, typ, types[i])
+            if (self._uses(loc, self.frame.int_scratch) and 
+                    not isinstance(loc, asm.Register)):
+                # address registers may be overwritten by other arguments
+                loc = self._copy(loc, types[i], want=dsts[i])
+            if self._has_call(nodes[i]):
+                calls -= 1
+            if calls > 0 and isinstance(loc, asm.Register):
+                # keep registers free for the remaining calls
+                slot = self._sized(self.frame.alloc_slot(), 8 * sizeof(types[i]))
+                self._store(slot, loc, types[i])
+                self.frame.release(loc)
+                loc = slot
+                slots.append(slot)
+            args[i] = (loc, types[i], dsts[i])
+        return args, slots
+
+    def _has_call(self, node):
+        return any(isinstance(n, Call) for n in walk(node))
+
+    def _move_args(self, moves):
+        # Move register arguments into place. *moves* is a list of
+        # (dst, src, type) where some sources may be the destinations of other
+        # moves.
+        base = self.frame.base
+        pending = [m for m in moves if base(m[0]) != base(m[1])]
+        while len(pending) > 0:
+            for i, (dst, src, typ) in enumerate(pending):
+                srcs = [base(m[1]) for m in pending if m is not pending[i]]
+                if base(dst) not in srcs:
+                    self._store(dst, src, typ)
+                    pending.pop(i)
+                    break
+            else:
+                # Only cycles remain, so every source is an argument register;
+                # move one source out of the way.
+                dst, src, typ = pending[0]
+                tmp = asm.xmm15 if is_xmm(src) else sized(asm.r11, src.bits)
+                self._store(tmp, src, typ)
+                pending[0] = (dst, tmp, typ)
+
+    def _call(self, node, want, discard):
+        """Call a function using the System V AMD64 calling convention.
+
+        Caller-saved registers holding live values (temporaries and variables)
+        are saved to the stack frame around the call. Functions defined in
+        the same code are called directly by label; others are called through
+        r11.
+        """
+        func = self._function(node)
+        rtype = func.rtype
+        if rtype == 'void' and not discard:
+            raise TypeError("Function '%s' does not return a value" % func.name)
+        if self.scope.get('__nogil__', False) and func.needs_gil(self.scope):
+            raise TypeError("Function '%s' requires the GIL; compile with "
+                            "nogil=False to call it." % func.name)
+        # rsp is 16-byte aligned in the body of functions with a frame
+        self.frame.frame_pointer = True
+        moves = []
+        stack = []
+        args, slots = self._call_args(func, node.args)
+        for loc, typ, dst in args:
+            if dst is not None:
+                moves.append((dst, loc, typ))
+                continue
+            if is_const(loc) and (typ in float_types or not fits32(loc)):
+                self.frame.release(loc)
+                loc = self._load_const(loc, typ)
+            stack.append((loc, typ))
+        for dst, loc, typ in moves:
+            self.frame.release(loc)
+        for loc, typ in stack:
+            self.frame.release(loc)
+
+        # Save live caller-saved registers
+        frame = self.frame
+        live = [r for r in frame.int_scratch + frame.float_scratch
+                if frame.in_use(r)]
+        spills = []
+        for reg in live:
+            slot = self._sized(frame.alloc_slot(), 64)
+            self.emit((asm.movsd if is_xmm(reg) else asm.mov)(slot, reg))
+            spills.append((reg, slot))
+
+        # Arguments beyond the argument registers are pushed right to left
+        size = 8 * len(stack) 
+        pad = size % 16
+        if pad > 0:
+            self.emit(asm.sub(asm.rsp, pad))
+        for loc, typ in reversed(stack):
+            if is_xmm(loc):
+                instr = asm.movss if typ == 'float' else asm.movsd
+                self.emit(asm.sub(asm.rsp, 8), instr([asm.rsp], loc))
+            elif isinstance(loc, asm.Register):
+                self.emit(asm.push(sized(loc, 64)))
+            elif isinstance(loc, asm.Pointer):
+                self.emit(asm.push(self._sized(loc, 64)))
+            else:
+                self.emit(asm.push(loc))
+
+        # Register arguments; memory and constants are loaded last because
+        # they do not depend on other argument registers
+        self._move_args([m for m in moves if isinstance(m[1], asm.Register)])
+        for dst, src, typ in moves:
+            if is_const(src):
+                self._set_const(dst, src, typ, exclude=self._int_args)
+            elif not isinstance(src, asm.Register):
+                self._store(dst, src, typ)
+        if func.varargs:
+            # al holds the number of vector registers used
+            nfloat = len([m for m in moves if is_xmm(m[0])])
+            self._set_const(asm.eax, nfloat, 'int')
+
+        target = func.call_target(self.scope)
+        if isinstance(target, str):
+            self.emit(asm.call(target))
+        else:
+            self.emit(asm.mov(asm.r11, target), asm.call(asm.r11))
+        if size + pad > 0:
+            self.emit(asm.add(asm.rsp, size + pad))
+
+        result = None
+        if not discard and rtype != 'void':
+            if rtype in float_types:
+                ret = asm.xmm0
+            else:
+                ret = sized(asm.rax, 8 * sizeof(rtype))
+            if frame.in_use(ret):
+                # the register will be restored below
+                result = self._alloc(rtype, want)
+                self._store(result, ret, rtype)
+            else:
+                frame.take(ret)
+                result = ret
+
+        for reg, slot in spills:
+            self.emit((asm.movsd if is_xmm(reg) else asm.mov)(reg, slot))
+            frame.release_slot(slot)
+        for slot in slots:
+            frame.release_slot(slot)
+        return result, rtype
+
+    #  Assignment
+    #------------------------------------
+
+    def _target(self, node):
+        # Return (location, type) of an assignable expression. For a char
+        # target, the type is 'char' (values are truncated when stored).
+        if isinstance(node, Unary) and node.op == '*':
+            return self._address(node.arg)
+        if not isinstance(node, Name):
+            raise TypeError("Cannot assign to expression %r" % node)
+        var = self._lookup(node.name)
+        if is_array(var.type):
+            raise TypeError("Cannot assign to array '%s'" % node.name)
+        return var.location, var.type
+
+    def _result(self, home, typ, discard):
+        # Value of an assignment expression whose target is *home*
+        if typ in storage_bits and not discard:
+            reg = self._fetch(home, typ)
+            self.frame.release(home)
+            return reg, 'int'
+        return home, typ
+
+    def _assign(self, node, want, discard):
+        home, typ = self._target(node.target)
+        op = node.op
+        value = node.value
+        if op == '=':
+            # rewrite x = x op y as x op= y
+            if (isinstance(node.target, Name) and isinstance(value, Binary) and
+                    isinstance(value.left, Name) and
+                    value.left.name == node.target.name and
+                    value.op in ('+', '-', '*', '/', '&', '|', '^', '<<', '>>')):
+                self.frame.release(home)
+                return self._assign(Assignment(value.op + '=', node.target,
+                                               value.right), want, discard)
+            loc, vtyp = self._compile(value)
+            loc = self._convert(loc, vtyp, typ)
+            self._store(home, loc, typ)
+            self.frame.release(loc)
+            return self._result(home, typ, discard)
+
+        op = op[:-1]
+        vtyp = self._type_of(value)
+        if is_pointer(typ) and op in ('+', '-'):
+            # p += n advances p by n elements
+            if vtyp not in int_types:
+                raise TypeError("Pointer offset must be an integer")
+            loc, vtyp = self._compile(value)
+            loc = self._convert(loc, vtyp, 'long')
+            size = sizeof(element_type(typ))
+            if is_const(loc):
+                loc = wrap(loc * size, 64)
+            else:
+                loc = self._mul_const(self._load(loc, 'long'), size, 'long', None)
+            in_place = True
+            typ, ptype = 'long', typ
+        else:
+            in_place = arith_type(typ, vtyp) == typ and (
+                (typ in int_types and op in ('+', '-', '&', '|', '^')) or
+                (typ in float_types and op in _float_instr[typ] and
+                 isinstance(home, asm.Register)))
+            ptype = typ
+            if in_place:
+                loc, vtyp = self._compile(value)
+                loc = self._convert(loc, vtyp, typ)
+        if in_place:
+            if typ in int_types and isinstance(home, asm.Pointer):
+                if isinstance(loc, asm.Pointer):
+                    loc = self._load(loc, typ)
+            src = self._operand(loc, typ)
+            instr = _int_instr if typ in int_types else _float_instr[typ]
+            self.emit(instr[op](home, src))
+            self.frame.release(src)
+            return home, ptype
+
+        # Load the current value without releasing any registers used to
+        # address the target
+        cur, ctyp = home, typ
+        if isinstance(home, asm.Pointer):
+            cur = self._fetch(home, typ)
+            ctyp = 'int' if typ in storage_bits else typ
+        loc, vtyp = self._compile(value)
+        loc, rtyp = self._binop(op, cur, ctyp, loc, vtyp)
+        loc = self._convert(loc, rtyp, typ)
+        self._store(home, loc, typ)
+        self.frame.release(loc)
+        return self._result(home, typ, discard)
+
+    def _incdec(self, node, want, discard):
+        home, typ = self._target(node.arg)
+        result = home
+        if not node.prefix and not discard:
+            # postfix returns the original value
+            result = self._fetch(home, typ, want)
+        if typ in float_types:
+            instr = _float_instr[typ][node.op[0]]
+            one = self._load_const(1.0, typ)
+            reg = home
+            if not isinstance(home, asm.Register):
+                reg = self._fetch(home, typ)
+            self.emit(instr(reg, one))
+            self._store(home, reg, typ)
+            self.frame.release(one)
+            if reg is not home:
+                self.frame.release(reg)
+        else:
+            # pointers advance by the size of one element
+            step = sizeof(element_type(typ)) if is_pointer(typ) else 1
+            instr = asm.add if node.op == '++' else asm.sub
+            self.emit(instr(home, step))
+        if result is home:
+            return self._result(home, typ, discard)
+        self.frame.release(home)
+        return result, ('int' if typ in storage_bits else typ)
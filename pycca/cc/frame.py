@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+import itertools
+from .. import asm
+from ..asm import register
+
+
+# Map (rex, val) => {bits: Register} so that we can switch between the 8, 16,
+# 32, and 64-bit views of a general-purpose register.
+_gp_views = {}
+for _name in dir(register):
+    _reg = getattr(register, _name)
+    if not isinstance(_reg, register.Register):
+        continue
+    if _reg.bits not in (8, 16, 32, 64) or _reg._val is None:
+        continue
+    if 'mm' in _reg.name or _reg.name in ('ah', 'ch', 'dh', 'bh'):
+        continue
+    _gp_views.setdefault((_reg.rex, _reg.val), {})[_reg.bits] = _reg
+
+
+def sized(reg, bits):
+    """Return the view of general-purpose register *reg* with the requested
+    number of bits (for example, ``sized(rax, 32)`` returns eax).
+
+    Returns None if the register has no such view (sil and dil are not
+    available as 8-bit registers).
+    """
+    return _gp_views[(reg.rex, reg.val)].get(bits)
+
+
+def is_xmm(reg):
+    return isinstance(reg, asm.Register) and reg.name.startswith('xmm')
+
+
+class Frame(object):
+    """Tracks register and stack usage while compiling a single function.
+
+    Scratch registers are handed out to expressions as temporaries and
+    returned after use. Variables are given a permanent home (a register or
+    a stack slot) for the lifetime of the function. Callee-saved registers
+    are only used when the caller-saved set is exhausted (or for variables in
+    functions that make calls); they are saved and restored by the function
+    prologue / epilogue.
+
+    All registers handled by the frame are 64-bit (or xmm) registers; use
+    :func:`sized` to obtain 32/16/8-bit views.
+    """
+    int_scratch = [asm.rax, asm.rcx, asm.rdx, asm.rsi, asm.rdi,
+                   asm.r8, asm.r9, asm.r10, asm.r11]
+    int_saved = [asm.rbx, asm.r12, asm.r13, asm.r14, asm.r15]
+    # Registers used to hold variables, in order of preference. rax, rcx,
+    # rdx, and r11 are left for temporaries because several instructions
+    # use them implicitly.
+    int_homes = [asm.rsi, asm.rdi, asm.r8, asm.r9, asm.r10]
+    float_homes = [asm.xmm8, asm.xmm9, asm.xmm10, asm.xmm11, asm.xmm12,
+                   asm.xmm13, asm.xmm14, asm.xmm15, asm.xmm7, asm.xmm6,
+                   asm.xmm5, asm.xmm4]
+    float_scratch = [asm.xmm0, asm.xmm1, asm.xmm2, asm.xmm3, asm.xmm4,
+                     asm.xmm5, asm.xmm6, asm.xmm7, asm.xmm8, asm.xmm9,
+                     asm.xmm10, asm.xmm11, asm.xmm12, asm.xmm13, asm.xmm14,
+                     asm.xmm15]
+
+    def __init__(self, name, rtype=None):
+        self.name = name
+        self.rtype = rtype
+        self.free = {'int': list(self.int_scratch),
+                     'float': list(self.float_scratch)}
+        self.saved = []        # callee-saved registers used by this function
+        self.temps = set()     # registers currently allocated as temporaries
+        self.homes = set()     # registers permanently assigned to variables
+        self.stack_size = 0    # bytes of stack used for local variables
+        self.frame_pointer = False  # True if rbp must be set up
+        self.plan = {}         # Declaration => preassigned variable home
+        self.calls = False     # True if the function calls other functions
+        self.free_slots = []   # stack slots available to alloc_slot()
+        self._label_counter = itertools.count()
+        self.return_label = self.new_label('return')
+
+    def new_label(self, hint='L'):
+        """Return a new label name that is unique within this function.
+        """
+        return '_%s_%s%d' % (self.name, hint, next(self._label_counter))
+
+    def _take_saved(self):
+        # Claim the next unused callee-saved register, or return None.
+        for reg in self.int_saved:
+            if reg not in self.saved:
+                self.saved.append(reg)
+                return reg
+        return None
+
+    def reserve(self, reg):
+        """Permanently assign *reg* to a variable.
+        """
+        reg = self.base(reg)
+        for pool in self.free.values():
+            if reg in pool:
+                pool.remove(reg)
+        self.homes.add(reg)
+
+    def alloc_home(self, kind, bits, stack=True):
+        """Choose a permanent location for a variable of *kind* ('int' or
+        'float') with the given size.
+
+        Returns a register (64-bit or xmm) if one is available, or else a
+        sized rbp-relative Pointer. If *stack* is False, return None instead
+        of allocating stack space.
+        """
+        if kind == 'int':
+            pool = [r for r in self.int_homes if r in self.free['int']]
+            if len(pool) == 0 or self.calls:
+                # callee-saved registers need not be saved around calls
+                reg = self.alloc_saved()
+                if reg is not None:
+                    return reg
+        else:
+            pool = [r for r in self.float_homes if r in self.free['float']]
+        if len(pool) > 0:
+            self.reserve(pool[0])
+            return pool[0]
+        if not stack:
+            return None
+        ptr = self.alloc_stack(bits // 8)
+        ptr.bits = bits
+        return ptr
+
+    def alloc_saved(self):
+        """Permanently assign an unused callee-saved register to a variable.
+        Returns None if all are in use.
+        """
+        reg = self._take_saved()
+        if reg is not None:
+            self.homes.add(reg)
+        return reg
+
+    def available(self, kind):
+        """Return the number of registers of *kind* that may still be
+        allocated as temporaries.
+        """
+        count = len(self.free[kind])
+        if kind == 'int':
+            count += len([r for r in self.int_saved if r not in self.saved])
+        return count
+
+    def alloc(self, kind, want=None, exclude=(), byte=False):
+        """Allocate a temporary register of *kind* ('int' or 'float').
+
+        If *want* is given and free, it is used. Registers in *exclude* are
+        never returned. If *byte* is True, the register must have an 8-bit
+        view.
+        """
+        pool = self.free[kind]
+        exclude = [self.base(r) for r in exclude]
+        candidates = [r for r in pool if r not in exclude and
+                      (not byte or sized(r, 8) is not None)]
+        if want is not None and self.base(want) in candidates:
+            reg = self.base(want)
+        elif len(candidates) > 0:
+            reg = candidates[0]
+        elif kind == 'int':
+            # Fall back to callee-saved registers
+            reg = self._take_saved()
+            if reg is None:
+                raise RuntimeError("Expression in function '%s' is too complex;"
+                                   " out of registers." % self.name)
+            pool.append(reg)
+        else:
+            raise RuntimeError("Expression in function '%s' is too complex;"
+                               " out of xmm registers." % self.name)
+        pool.remove(reg)
+        self.temps.add(reg)
+        return reg
+
+    def take(self, reg):
+        """Allocate a specific register as a temporary. The register must be
+        free.
+        """
+        reg = self.base(reg)
+        kind = 'float' if is_xmm(reg) else 'int'
+        self.free[kind].remove(reg)
+        self.temps.add(reg)
+        return reg
+
+    def release(self, loc):
+        """Return *loc* to the pool of free registers if it is a temporary.
+
+        If *loc* is a Pointer, any temporaries used to compute its address are
+        released. Any other value (variable homes, constants) is ignored.
+        """
+        if isinstance(loc, asm.Pointer):
+            for reg in (loc.reg1, loc.reg2):
+                if reg is not None:
+                    self.release(reg)
+            return
+        if not isinstance(loc, asm.Register):
+            return
+        reg = self.base(loc)
+        if reg in self.temps:
+            self.temps.remove(reg)
+            kind = 'float' if is_xmm(reg) else 'int'
+            self.free[kind].insert(0, reg)
+
+    def release_all(self):
+        """Release all temporary registers (called between statements).
+        """
+        for reg in list(self.temps):
+            self.release(reg)
+
+    def is_temp(self, loc):
+        return isinstance(loc, asm.Register) and self.base(loc) in self.temps
+
+    def in_use(self, reg):
+        """Return True if *reg* currently holds a temporary or a variable.
+        """
+        reg = self.base(reg)
+        return reg in self.temps or reg in self.homes
+
+    @staticmethod
+    def base(reg):
+        """Return the 64-bit register that contains *reg*.
+        """
+        if is_xmm(reg):
+            return reg
+        return sized(reg, 64)
+
+    def alloc_stack(self, size):
+        """Allocate *size* bytes on the stack and return the (unsized)
+        rbp-relative Pointer to the new slot.
+
+        Slots are aligned to their size, up to 16 bytes.
+        """
+        size = max(size, 8)
+        align = min(size, 16)
+        self.stack_size = (self.stack_size + size + align - 1) // align * align
+        self.frame_pointer = True
+        return asm.Pointer([asm.rbp - self.stack_size])
+
+    def alloc_slot(self):
+        """Return an (unsized) rbp-relative Pointer to an 8-byte stack slot 
+        for temporary use, such as saving registers across function calls.
+
+        Slots returned by release_slot() are reused.
+        """
+        if len(self.free_slots) > 0:
+            return self.free_slots.pop()
+        return self.alloc_stack(8)
+
+    def release_slot(self, slot):
+        self.free_slots.append(slot)
+
+    def wrap(self, body):
+        """Return the complete code for the function: entry label, prologue,
+        *body*, and epilogue.
+        """
+        # A trailing jump to the epilogue is unnecessary
+        if (len(body) > 0 and isinstance(body[-1], asm.jmp) and
+                body[-1].args[0] == self.return_label):
+            body = body[:-1]
+
+        code = [asm.label(self.name)]
+        epilogue = [asm.label(self.return_label)]
+        if self.frame_pointer or len(self.saved) > 0:
+            # Saved registers are stored below the local variables
+            size = self.stack_size + 8 * len(self.saved)
+            size = (size + 15) // 16 * 16
+            code.extend([asm.push(asm.rbp), asm.mov(asm.rbp, asm.rsp)])
+            if size > 0:
+                code.append(asm.sub(asm.rsp, size))
+            for i, reg in enumerate(self.saved):
+                slot = asm.qword([asm.rbp - (self.stack_size + 8 * (i+1))])
+                code.append(asm.mov(slot, reg))
+                epilogue.append(asm.mov(reg, slot))
+            epilogue.append(asm.leave())
+        epilogue.append(asm.ret())
+        return code + body + epilogue
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+from .expression import ExpressionParser, Expression, tokenize, parse_int
+from .statements import (Function, Prototype, Declaration, Return, If, ElseIf,
+                         Else, ForLoop, WhileLoop, DoWhileLoop, Block, Break,
+                         Continue)
+from .variable import is_pointer
+
+
+class CParser(ExpressionParser):
+    """Recursive-descent parser for a subset of C.
+
+    Supports function definitions and prototypes with scalar and pointer
+    arguments, local variables (including arrays), if / else, for, while, and
+    do-while loops, break, continue, return, function calls, and expression
+    statements. Produces the tree of code objects used by :class:`CCode`.
+    """
+    # storage class specifiers that have no effect on generated code
+    specifiers = ('static', 'inline', 'extern', 'register')
+    unsupported = ('switch', 'case', 'default', 'goto', 'struct', 'union',
+                   'enum', 'typedef', 'unsigned', 'signed', 'short')
+
+    def at_end(self):
+        return self.pos >= len(self.tokens)
+
+    def parse_source(self):
+        """Parse a complete source file and return a list of Functions.
+        """
+        code = []
+        while not self.at_end():
+            item = self.parse_external()
+            if item is not None:
+                code.append(item)
+        return code
+
+    def skip_specifiers(self):
+        while self.peek() in self.specifiers:
+            self.next()
+
+    def check_supported(self):
+        text = self.peek()
+        if text in self.unsupported:
+            self.error("'%s' is not supported" % text)
+
+    def parse_external(self):
+        # Function definition or prototype at file scope
+        self.skip_specifiers()
+        self.check_supported()
+        rtype = self.parse_type()
+        name = self.parse_name()
+        if self.peek() != '(':
+            self.error("Global variables are not supported")
+        args, varargs, const_args = self.parse_params()
+        if self.peek() == ';':
+            self.next()
+            return Prototype(rtype, name, args, varargs)
+        if varargs:
+            self.error("Variadic function definitions are not supported")
+        return Function(rtype, name, args, self.parse_compound(), 
+                        const_args=const_args)
+
+    def parse_name(self):
+        tok = self.next()
+        if tok[0] != 'name' or self.is_type(-1):
+            self.error("Expected identifier", tok)
+        return tok[1]
+
+    def parse_params(self):
+        # Return the list of (type, name) parameters, whether the parameter
+        # list ends with '...', and the names of pointer parameters whose 
+        # referenced values are const. Names are optional (for prototypes).
+        self.expect('(')
+        args = []
+        const_args = []
+        varargs = False
+        if self.peek() == 'void' and self.peek(1) == ')':
+            self.next()
+        while self.peek() != ')':
+            if len(args) > 0:
+                self.expect(',')
+            if self.peek() == '...':
+                self.next()
+                varargs = True
+                break
+            start = self.pos
+            typ = self.parse_type()
+            # 'const' before the first '*' qualifies the referenced value
+            words = [tok[1] for tok in self.tokens[start:self.pos]]
+            if '*' in words:
+                words = words[:words.index('*')]
+            const = 'const' in words
+            name = None
+            if self.peek() not in (',', ')', '['):
+                name = self.parse_name()
+            if self.peek() == '[':
+                # array arguments are passed as pointers
+                self.next()
+                while self.peek() != ']':
+                    self.next()
+                self.next()
+                typ += '*'
+            if const and is_pointer(typ):
+                const_args.append(name)
+            args.append((typ, name))
+        self.expect(')')
+        return args, varargs, const_args
+
+    def parse_compound(self):
+        """Parse ``{ statements }`` and return the list of statements.
+        """
+        self.expect('{')
+        code = []
+        while self.peek() != '}':
+            if self.at_end():
+                self.error("Expected '}'")
+            code.extend(self.parse_statement())
+        self.next()
+        return code
+
+    def parse_body(self):
+        # Body of a loop or if statement
+        if self.peek() == '{':
+            return self.parse_compound()
+        return self.parse_statement()
+
+    def parse_statement(self):
+        """Parse a single statement and return a list of code objects.
+        """
+        text = self.peek()
+        if text == '{':
+            return [Block(self.parse_compound())]
+        if text == ';':
+            self.next()
+            return []
+        if self.is_type() or text in self.specifiers:
+            code = self.parse_declaration()
+            self.expect(';')
+            return code
+        self.check_supported()
+        method = getattr(self, 'parse_' + text + '_statement', None)
+        if method is not None and self.tokens[self.pos][0] == 'name':
+            self.next()
+            return method()
+        expr = self.parse_expression()
+        self.expect(';')
+        return [Expression(expr)]
+
+    def parse_declaration(self):
+        """Parse a declaration (without the trailing semicolon) and return a
+        list of Declarations.
+        """
+        self.skip_specifiers()
+        base = self.parse_base_type()
+        decls = []
+        while True:
+            typ = self.parse_pointers(base)
+            name = self.parse_name()
+            while self.peek() == '[':
+                self.next()
+                size = self.next()
+                if size[0] != 'int':
+                    self.error("Array size must be an integer constant", size)
+                self.expect(']')
+                typ += '[%d]' % parse_int(size[1]).value
+            init = None
+            if self.peek() == '=':
+                self.next()
+                init = self.parse_assignment()
+            decls.append(Declaration(typ, name, init))
+            if self.peek() != ',':
+                return decls
+            self.next()
+
+    def parse_condition(self):
+        self.expect('(')
+        cond = self.parse_expression()
+        self.expect(')')
+        return cond
+
+    def parse_if_statement(self):
+        # if / else if / else chains are flattened into If, ElseIf, Else
+        chain = [If(self.parse_condition(), self.parse_body())]
+        while self.peek() == 'else':
+            self.next()
+            if self.peek() != 'if':
+                chain.append(Else(self.parse_body()))
+                break
+            self.next()
+            chain.append(ElseIf(self.parse_condition(), self.parse_body()))
+        return chain
+
+    def parse_while_statement(self):
+        cond = self.parse_condition()
+        return [WhileLoop(cond, self.parse_body())]
+
+    def parse_do_statement(self):
+        body = self.parse_body()
+        self.expect('while')
+        cond = self.parse_condition()
+        self.expect(';')
+        return [DoWhileLoop(cond, body)]
+
+    def parse_for_statement(self):
+        self.expect('(')
+        init = cond = update = None
+        if self.is_type():
+            init = self.parse_declaration()
+            if len(init) == 1:
+                init = init[0]
+        elif self.peek() != ';':
+            init = self.parse_expression()
+        self.expect(';')
+        if self.peek() != ';':
+            cond = self.parse_expression()
+        self.expect(';')
+        if self.peek() != ')':
+            update = self.parse_expression()
+        self.expect(')')
+        return [ForLoop(init, cond, update, self.parse_body())]
+
+    def parse_return_statement(self):
+        expr = None
+        if self.peek() != ';':
+            expr = self.parse_expression()
+        self.expect(';')
+        return [Return(expr)]
+
+    def parse_break_statement(self):
+        self.expect(';')
+        return [Break()]
+
+    def parse_continue_statement(self):
+        self.expect(';')
+        return [Continue()]
+
+
+def parse_c(source):
+    """Parse C source code and return a list of code objects that may be used
+    to construct a CCode.
+    """
+    return CParser(tokenize(source)).parse_source()
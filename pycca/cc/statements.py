@@ -1,20 +1,194 @@
 # -*- coding: utf-8 -*-
 import ctypes
 
-from .variable import Variable
-from .expression import Expression
+import collections
+
+from .variable import (Variable, type_bits, int_types, float_types, is_pointer,
+                       is_array, element_type, sizeof, check_type)
+from .expression import (Expression, Assignment, Binary, Unary, IncDec, Name,
+                         Const, Call, parse, walk, arith_type)
+from .frame import Frame, sized
 from .codeobject import CodeObject, CodeContainer
 from .. import asm
+from ..asm.util import long
+from ..asm.builtin import Buffer, ConstPointer
+
+
+def compile_block(code, scope):
+    """Compile a list of statements in *scope*.
+    
+    Strings are compiled as expression statements, and each If is combined
+    with the ElseIf / Else statements that follow it.
+    """
+    frame = scope['__frame__']
+    asm_code = []
+    items = list(code)
+    i = 0
+    while i < len(items):
+        item = items[i]
+        i += 1
+        if isinstance(item, If):
+            chain = [item]
+            while i < len(items) and isinstance(items[i], (ElseIf, Else)):
+                chain.append(items[i])
+                i += 1
+                if isinstance(chain[-1], Else):
+                    break
+            asm_code.extend(compile_conditional(chain, scope))
+        elif isinstance(item, (ElseIf, Else)):
+            raise SyntaxError("%s without matching If" % item.__class__.__name__)
+        elif isinstance(item, Expression):
+            asm_code.extend(item.compile(scope, discard=True))
+        elif isinstance(item, CodeObject):
+            asm_code.extend(item.compile(scope))
+        else:
+            asm_code.extend(Expression(item).compile(scope, discard=True))
+        frame.release_all()
+    return asm_code
+
+
+def walk_code(code):
+    """Iterate over all statements in *code*, including nested statements.
+    """
+    for item in code:
+        yield item
+        if isinstance(item, CodeContainer):
+            for child in walk_code(item.children()):
+                yield child
+
+
+def count_uses(code, counts, weight=1):
+    """Count references to each variable name in *code*, weighting references
+    inside loops more heavily. 
+    """
+    for item in code:
+        if not isinstance(item, CodeObject):
+            item = Expression(item)
+        if item.loop:
+            weight *= 10
+        for expr in item.expressions():
+            for node in walk(parse(expr)):
+                if isinstance(node, Name):
+                    counts[node.name] += weight
+        if isinstance(item, CodeContainer):
+            count_uses(item.children(), counts, weight)
+        if item.loop:
+            weight //= 10
+
+
+def addressed_names(code):
+    """Return the set of variable names whose address is taken (``&x``) in
+    *code*.
+    """
+    names = set()
+    for item in walk_code(code):
+        if not isinstance(item, CodeObject):
+            item = Expression(item)
+        for expr in item.expressions():
+            for node in walk(parse(expr)):
+                if (isinstance(node, Unary) and node.op == '&' and 
+                        isinstance(node.arg, Name)):
+                    names.add(node.arg.name)
+    return names
+
+
+def has_calls(code):
+    """Return True if any expression in *code* calls a function.
+    """
+    for item in walk_code(code):
+        if isinstance(item, FunctionCall):
+            return True
+        if not isinstance(item, CodeObject):
+            item = Expression(item)
+        for expr in item.expressions():
+            for node in walk(parse(expr)):
+                if isinstance(node, Call):
+                    return True
+    return False
+
+
+def assigned_names(code):
+    """Return the set of variable names that are assigned or declared in
+    *code*.
+    """
+    names = set()
+    for item in walk_code(code):
+        if isinstance(item, Declaration):
+            names.add(item.name)
+        if not isinstance(item, CodeObject):
+            item = Expression(item)
+        for expr in item.expressions():
+            for node in walk(parse(expr)):
+                if isinstance(node, Assignment):
+                    target = node.target
+                elif isinstance(node, IncDec):
+                    target = node.arg
+                else:
+                    continue
+                if isinstance(target, Name):
+                    names.add(target.name)
+    return names
 
 
 def decl(type, name, init=None):
     return Declaration(type, name, init)
     
 class Declaration(CodeObject):
-    def __init__(self, type, name, init):
+    """Declare a local variable, optionally with an initial value.
+    
+    Variables are kept in registers when possible; the most heavily used
+    variables (weighted by loop nesting) are given registers first. Arrays
+    (for example, type ``'double[16]'``) and variables whose address is 
+    taken are stored on the stack.
+    """
+    def __init__(self, type, name, init=None):
         CodeObject.__init__(self)
-        self.var = Variable(type, name, init)
-        current_scope.declare(var)
+        check_type(type)
+        if is_array(type) and init is not None:
+            raise TypeError("Array initializers are not supported")
+        self.type = type
+        self.name = name
+        self.init = init
+
+    def expressions(self):
+        if self.init is None:
+            return []
+        return [Assignment('=', Name(self.name), parse(self.init))]
+
+    def compile(self, scope):
+        frame = scope.get('__frame__', None)
+        if frame is None:
+            raise TypeError("Variable '%s' must be declared inside a function."
+                            % self.name)
+        loc = frame.plan.pop(self, None)
+        if loc is None:
+            loc = self.alloc_home(frame)
+        if isinstance(loc, asm.Register):
+            if self.type in int_types:
+                loc = sized(loc, type_bits[self.type])
+            var = Variable(self.type, self.name, self.init, reg=loc)
+        else:
+            var = Variable(self.type, self.name, self.init, addr=loc)
+        scope[self.name] = var
+        
+        code = []
+        for expr in self.expressions():
+            code.extend(Expression(expr).compile(scope, discard=True))
+        return code
+
+    def alloc_home(self, frame, stack=False):
+        """Allocate a location for this variable in *frame*. If *stack* is 
+        True, the variable is always placed on the stack.
+        """
+        if is_array(self.type):
+            return frame.alloc_stack(sizeof(self.type))
+        bits = 8 * sizeof(self.type)
+        if stack:
+            loc = frame.alloc_stack(bits // 8)
+            loc.bits = bits
+            return loc
+        kind = 'float' if self.type in float_types else 'int'
+        return frame.alloc_home(kind, bits)
 
 
 def func(rtype, name, *args):
@@ -24,61 +198,253 @@ class Function(CodeContainer):
     ctype_map = {
         'void': None,
         'int': ctypes.c_int,
+        'long': ctypes.c_long,
+        'float': ctypes.c_float,
         'double': ctypes.c_double,
     }
     
-    def __init__(self, rtype, name, args, code):
+    varargs = False
+    
+    def __init__(self, rtype, name, args, code, const_args=()):
         CodeContainer.__init__(self, code)
         self.rtype = rtype
         self.name = name
         self.args = args
+        # names of pointer arguments whose referenced values are const
+        self.const_args = set(const_args)
+        
+    def call_target(self, scope):
+        # Functions in the same CCode are called directly by label
+        return self.name
+        
+    def needs_gil(self, scope):
+        return False
+
+    @classmethod
+    def ctype(cls, typ):
+        # All pointers are passed as c_void_p, which accepts integer 
+        # addresses as well as ctypes arrays and pointers.
+        if is_pointer(typ):
+            return ctypes.c_void_p
+        return cls.ctype_map[typ]
 
     @property
     def c_restype(self):
-        return self.ctype_map[self.rtype]
+        return self.ctype(self.rtype)
     
     @property
     def c_argtypes(self):
         types = []
         for argtype, argname in self.args:
-            types.append(self.ctype_map[argtype])
+            types.append(self.ctype(argtype))
+        return types
+
+    @property
+    def builtin_argtypes(self):
+        # Pointers to scalar types are passed as typed buffers so that the 
+        # item type and contiguity of arrays are checked on each call. 
+        # Read-only buffers are accepted only for pointers to const.
+        types = []
+        for argtype, argname in self.args:
+            base = element_type(argtype) if is_pointer(argtype) else None
+            writable = argname not in self.const_args
+            if base == 'char':
+                types.append(Buffer(ctypes.c_char, writable=writable))
+            elif base in self.ctype_map and base != 'void':
+                types.append(Buffer(self.ctype_map[base], writable=writable))
+            elif base is not None and not writable:
+                types.append(ConstPointer(self.ctype(argtype)))
+            else:
+                types.append(self.ctype(argtype))
         return types
 
     def compile(self, scope):
+        if self.rtype != 'void':
+            check_type(self.rtype)
         scope[self.name] = self
         
         scope = scope.copy()
+        frame = Frame(self.name, self.rtype)
+        scope['__frame__'] = frame
+        frame.calls = has_calls(self.code)
         
-        # load function args into scope
+        # load function args into scope; register arguments stay in the
+        # registers they were passed in unless their address is taken.
+        addressed = addressed_names(self.code)
+        code = []
         argi = [asm.rdi, asm.rsi, asm.rdx, asm.rcx, asm.r8, asm.r9]
         argf = [asm.xmm0, asm.xmm1, asm.xmm2, asm.xmm3, asm.xmm4, asm.xmm5, asm.xmm6, asm.xmm7]
-        stackp = 0
+        stackp = 16  # skip saved rbp and return address
         for argtype, argname in self.args:
-            # todo: only works for single int arg
-            if argtype == 'int':
-                if len(argi) > 0:
-                    loc = argi.pop(0)
-                else:
-                    stackp -= 4
-                    loc = [asm.rbp + stackp]
-            elif argtype == 'double':
-                if len(argf) > 0:
-                    loc = argf.pop(0)
-                else:
-                    stackp -= 4
-                    loc = [asm.rbp + stackp]
+            check_type(argtype)
+            if argtype in int_types or is_pointer(argtype):
+                regs = argi
+            elif argtype in float_types:
+                regs = argf
             else:
                 raise TypeError('arg type %s not supported.' % argtype)
-            var = Variable(argtype, argname, reg=loc)
+            if len(regs) > 0:
+                reg = regs.pop(0)
+                if argtype in int_types:
+                    reg = sized(reg, type_bits[argtype])
+                if argname in addressed:
+                    addr = frame.alloc_stack(sizeof(argtype))
+                    addr.bits = 8 * sizeof(argtype)
+                    if argtype == 'float':
+                        code.append(asm.movss(addr, reg))
+                    elif argtype == 'double':
+                        code.append(asm.movsd(addr, reg))
+                    else:
+                        code.append(asm.mov(addr, reg))
+                    var = Variable(argtype, argname, addr=addr)
+                else:
+                    home = None
+                    if frame.calls and regs is argi:
+                        # keep the value in a register preserved by calls
+                        home = frame.alloc_saved()
+                    if home is None:
+                        frame.reserve(reg)
+                    else:
+                        home = sized(home, reg.bits)
+                        code.append(asm.mov(home, reg))
+                        reg = home
+                    var = Variable(argtype, argname, reg=reg)
+            else:
+                addr = asm.Pointer([asm.rbp + stackp])
+                addr.bits = 8 * sizeof(argtype)
+                stackp += 8
+                frame.frame_pointer = True
+                var = Variable(argtype, argname, addr=addr)
             scope[argname] = var
         
-        code = [asm.label(self.name)]
+        # Assign homes to local variables, most frequently used first
+        counts = collections.defaultdict(int)
+        count_uses(self.code, counts)
+        decls = [item for item in walk_code(self.code) if isinstance(item, Declaration)]
+        decls.sort(key=lambda d: -counts[d.name])
+        for d in decls:
+            frame.plan[d] = d.alloc_home(frame, stack=d.name in addressed)
         
-        for item in self.code:
-            code.extend(item.compile(scope))
-            
-        code.append(asm.ret())
-        return code
+        code.extend(compile_block(self.code, scope))
+        return frame.wrap(code)
+
+
+def prototype(rtype, name, *args):
+    return Prototype(rtype, name, *args)
+
+class Prototype(CodeObject):
+    """Declaration of a function that is defined elsewhere, such as
+    ``double exp(double x);``.
+    
+    *args* is a list of (type, name) pairs; names may be None. If *varargs*
+    is True, the function accepts extra arguments after *args* (like printf).
+    
+    Unless an *address* is given, the function is looked up by name in the
+    globals of the CCode being compiled and then in the symbols loaded into
+    the current process (with dlsym).
+    """
+    # Map ctypes types to C types
+    ctype_names = {
+        None: 'void',
+        ctypes.c_int: 'int',
+        ctypes.c_int32: 'int',
+        ctypes.c_long: 'long',
+        ctypes.c_longlong: 'long',
+        ctypes.c_int64: 'long',
+        ctypes.c_size_t: 'long',
+        ctypes.c_float: 'float',
+        ctypes.c_double: 'double',
+        ctypes.c_void_p: 'void*',
+        ctypes.c_char_p: 'char*',
+    }
+    
+    def __init__(self, rtype, name, args, varargs=False, address=None,
+                 gil=False):
+        CodeObject.__init__(self)
+        self.rtype = rtype
+        self.name = name
+        self.args = args
+        self.varargs = varargs
+        self.address = address
+        self.gil = gil
+        
+    @classmethod
+    def from_ctypes(cls, name, func):
+        """Return a Prototype for ctypes function *func*, using its argtypes
+        and restype attributes.
+        """
+        if func.argtypes is None:
+            raise TypeError("Cannot determine argument types of '%s'; set "
+                            "argtypes or declare a prototype." % name)
+        types = []
+        for typ in [func.restype] + list(func.argtypes):
+            if typ in cls.ctype_names:
+                types.append(cls.ctype_names[typ])
+            elif issubclass(typ, ctypes._Pointer):
+                types.append('void*')
+            else:
+                raise TypeError("Unsupported type %s in function '%s'" % 
+                                (typ.__name__, name))
+        address = ctypes.cast(func, ctypes.c_void_p).value
+        return cls(types[0], name, [(t, None) for t in types[1:]], 
+                   address=address, gil=needs_gil(name, func))
+        
+    def compile(self, scope):
+        if self.rtype != 'void':
+            check_type(self.rtype)
+        for argtype, argname in self.args:
+            check_type(argtype)
+        # Function definitions take precedence over prototypes
+        if not isinstance(scope.get(self.name, None), Function):
+            scope[self.name] = self
+        return []
+    
+    def call_target(self, scope):
+        """Return the address of the function.
+        """
+        if self.address is not None:
+            return self.address
+        obj = scope.get('__globals__', {}).get(self.name, None)
+        if obj is None:
+            obj = process_symbol(self.name)
+        if isinstance(obj, ctypes._CFuncPtr):
+            obj = ctypes.cast(obj, ctypes.c_void_p).value
+        if not isinstance(obj, (int, long)):
+            raise TypeError("Global '%s' is not a function or address." % 
+                            self.name)
+        return obj
+    
+    def needs_gil(self, scope):
+        """Return True if the function may only be called while holding the
+        GIL.
+        """
+        return self.gil or needs_gil(self.name, 
+                                     scope.get('__globals__', {}).get(self.name))
+
+
+def needs_gil(name, func=None):
+    """Return True if *name* is part of the Python C API, or *func* is a 
+    ctypes function that must be called with the GIL held.
+    """
+    if name.startswith(('Py', '_Py')):
+        return True
+    flags = getattr(func, '_flags_', 0)
+    return bool(flags & ctypes._FUNCFLAG_PYTHONAPI)
+
+
+_process = None
+
+def process_symbol(name):
+    """Return a ctypes function for symbol *name* from the libraries loaded 
+    into the current process.
+    """
+    global _process
+    if _process is None:
+        _process = ctypes.CDLL(None)
+    try:
+        return getattr(_process, name)
+    except AttributeError:
+        raise NameError("Undefined function '%s'" % name)
 
 
 class Assign(CodeObject):
@@ -86,12 +452,14 @@ class Assign(CodeObject):
         CodeObject.__init__(self)
         self.assignments = kwds
         
+    def expressions(self):
+        return [Assignment('=', Name(name), parse(expr)) 
+                for name, expr in self.assignments.items()]
+        
     def compile(self, scope):
         code = []
-        for name, expr in self.assignments.items():
-            expr = Expression(expr)
-            code.extend(expr.compile(scope))
-            scope[name].set_location(expr.location)
+        for expr in self.expressions():
+            code.extend(Expression(expr).compile(scope, discard=True))
         return code
 
 
@@ -100,18 +468,25 @@ class Return(CodeObject):
         CodeObject.__init__(self)
         self.expr = expr
         
+    def expressions(self):
+        return [] if self.expr is None else [self.expr]
+        
     def compile(self, scope):
+        frame = scope['__frame__']
         code = []
         if self.expr is not None:
             expr = Expression(self.expr)
-            code.extend(expr.compile(scope))
-        
-            if expr.type == 'int' and expr.location is not asm.rax:
-                code.append(asm.mov(asm.rax, expr.location))
-            elif expr.type == 'double' and expr.location is not asm.xmm0:
-                code.append(asm.movsd(asm.xmm0, expr.location))
+            rtype = frame.rtype
+            if rtype in int_types or is_pointer(rtype):
+                dest = sized(asm.rax, 8 * sizeof(rtype))
+                code.extend(expr.compile(scope, dest=dest, cast=rtype))
+            elif rtype in float_types:
+                code.extend(expr.compile(scope, dest=asm.xmm0, cast=rtype))
+            else:
+                code.extend(expr.compile(scope, discard=True))
             
-        # code.append(asm.ret())  # Function handles this part.
+        # Function places the epilogue at the return label
+        code.append(asm.jmp(frame.return_label))
         return code
         
 
@@ -121,14 +496,343 @@ def call(func, *args):
     return FunctionCall(func, *args)
 
 class FunctionCall(CodeObject):
+    """Call a function and discard its return value.
+    
+    *func* may be the name of a function (defined in the same CCode, declared
+    with a Prototype, or given in the CCode globals) or a ctypes function 
+    with its argtypes set.
+    """
     def __init__(self, func, *args):
         CodeObject.__init__(self)
         self.func = func
         self.args = args
+        
+    def expressions(self):
+        func = self.func
+        if isinstance(func, str):
+            func = Name(func)
+        else:
+            name = getattr(func, '__name__', 'function')
+            func = Prototype.from_ctypes(name, func)
+        return [Call(func, [parse(arg) for arg in self.args])]
+        
+    def compile(self, scope):
+        return Expression(self.expressions()[0]).compile(scope, discard=True)
+
+
+def ends_with_jump(code):
+    return len(code) > 0 and isinstance(code[-1], asm.jmp)
+
+
+def compile_conditional(chain, scope):
+    """Compile an If statement followed by any number of ElseIf statements and
+    an optional Else.
+    """
+    frame = scope['__frame__']
+    end = frame.new_label('endif')
+    code = []
+    for i, item in enumerate(chain):
+        if isinstance(item, Else):
+            code.extend(compile_block(item.code, scope.copy()))
+            break
+        last = i == len(chain) - 1
+        skip = end if last else frame.new_label('else')
+        code.extend(Expression(item.cond).compile_branch(scope, skip, False))
+        frame.release_all()
+        body = compile_block(item.code, scope.copy())
+        code.extend(body)
+        if not last:
+            if not ends_with_jump(body):
+                code.append(asm.jmp(end))
+            code.append(asm.label(skip))
+    code.append(asm.label(end))
+    return code
+
+
+class If(CodeContainer):
+    """Execute *code* if *cond* is true.
+    
+    May be followed by ElseIf and Else statements in the same block.
+    """
+    def __init__(self, cond, code=None):
+        CodeContainer.__init__(self, code)
+        self.cond = cond
+        
+    def expressions(self):
+        return [self.cond]
+    
+    def compile(self, scope):
+        return compile_conditional([self], scope)
 
 
-def forloop(init, cond, update):
-    return ForLoop(init, cond, update)
+class ElseIf(If):
+    """Execute *code* if *cond* is true and the conditions of the preceding 
+    If / ElseIf statements were false.
+    """
+    def compile(self, scope):
+        raise SyntaxError("ElseIf without matching If")
+
+
+class Else(CodeContainer):
+    """Execute *code* if the conditions of the preceding If / ElseIf 
+    statements were false.
+    """
+    def compile(self, scope):
+        raise SyntaxError("Else without matching If")
 
-def whileloop(cond):
-    return WhileLoop(cond)
+
+def forloop(init, cond, update, code=None):
+    return ForLoop(init, cond, update, code)
+
+class ForLoop(CodeContainer):
+    """C for loop: ``for (init; cond; update) { code }``.
+    
+    *init* may be an expression, a Declaration, or a list of Declarations. Any
+    of *init*, *cond*, or *update* may be None.
+    
+    The loop test is placed at the bottom of the loop (with a guard before the
+    first iteration) so that each iteration executes only one branch. If 
+    *update* steps an integer variable by a constant, products of that
+    variable with constants or loop-invariant variables are replaced by
+    derived induction variables that are updated by addition.
+    """
+    loop = True
+    # Number of registers that must remain free for temporaries after
+    # allocating derived induction variables
+    min_temps = 6
+    
+    def __init__(self, init, cond, update, code=None):
+        CodeContainer.__init__(self, code)
+        self.init = init
+        self.cond = cond
+        self.update = update
+        
+    def _init_items(self):
+        if self.init is None:
+            return []
+        if isinstance(self.init, list):
+            return self.init
+        return [self.init]
+        
+    def children(self):
+        return [item for item in self._init_items() 
+                if isinstance(item, CodeObject)] + self.code
+    
+    def expressions(self):
+        exprs = [item for item in self._init_items() 
+                 if not isinstance(item, CodeObject)]
+        return exprs + [expr for expr in (self.cond, self.update) 
+                        if expr is not None]
+    
+    def compile(self, scope):
+        frame = scope['__frame__']
+        scope = scope.copy()
+        code = compile_block(self._init_items(), scope)
+        reduce_code, increments = self._reduce_induction(scope)
+        code.extend(reduce_code)
+        
+        start = frame.new_label('for')
+        cont = frame.new_label('continue')
+        end = frame.new_label('break')
+        if self.cond is not None:
+            code.extend(Expression(self.cond).compile_branch(scope, end, False))
+        code.append(asm.label(start))
+        
+        body_scope = scope.copy()
+        body_scope['__loop__'] = (cont, end)
+        code.extend(compile_block(self.code, body_scope))
+        
+        code.append(asm.label(cont))
+        update = [self.update] if self.update is not None else []
+        code.extend(compile_block(update + increments, scope))
+        if self.cond is not None:
+            code.extend(Expression(self.cond).compile_branch(scope, start, True))
+        else:
+            code.append(asm.jmp(start))
+        code.append(asm.label(end))
+        return code
+    
+    def _induction_variable(self, scope):
+        # Return (Variable, step) if the update expression adds a constant to
+        # an integer variable that is kept in a register.
+        if self.update is None:
+            return None
+        node = parse(self.update)
+        name = step = None
+        if isinstance(node, IncDec) and isinstance(node.arg, Name):
+            name = node.arg.name
+            step = 1 if node.op == '++' else -1
+        elif isinstance(node, Assignment) and isinstance(node.target, Name):
+            value = node.value
+            op = node.op[0]
+            if node.op == '=' and isinstance(value, Binary) and isinstance(value.left, Name):
+                if value.left.name != node.target.name:
+                    return None
+                op = value.op
+                value = value.right
+            if (op in '+-' and isinstance(value, Const) and 
+                    value.type in int_types):
+                name = node.target.name
+                step = value.value if op == '+' else -value.value
+        var = scope.get(name, None)
+        if (not isinstance(var, Variable) or var.type not in int_types or 
+                not isinstance(var.location, asm.Register)):
+            return None
+        return var, step
+    
+    def _reduce_induction(self, scope):
+        """Find products of the loop induction variable that can be replaced
+        by derived induction variables.
+        
+        Returns code that initializes the derived variables and a list of
+        expressions that update them after each iteration.
+        """
+        iv = self._induction_variable(scope)
+        if iv is None:
+            return [], []
+        var, step = iv
+        frame = scope['__frame__']
+        body = list(self.code)
+        if self.cond is not None:
+            body.append(Expression(self.cond))
+        assigned = assigned_names(body)
+        if var.name in assigned:
+            return [], []
+        
+        # collect distinct multipliers of the induction variable
+        products = collections.OrderedDict()
+        for item in walk_code(body):
+            if not isinstance(item, CodeObject):
+                item = Expression(item)
+            for expr in item.expressions():
+                for node in walk(parse(expr)):
+                    if not isinstance(node, Binary) or node.op != '*':
+                        continue
+                    for a, b in ((node.left, node.right), (node.right, node.left)):
+                        if not isinstance(a, Name) or a.name != var.name:
+                            continue
+                        if isinstance(b, Const) and b.type in int_types:
+                            # small powers of two are cheap to compute
+                            if b.value & (b.value - 1) == 0 and abs(b.value) <= 8:
+                                continue
+                            products[b.value] = b
+                        elif (isinstance(b, Name) and b.name not in assigned and
+                              b.name != var.name and abs(step) == 1):
+                            mult = scope.get(b.name, None)
+                            if isinstance(mult, Variable) and mult.type in int_types:
+                                products[mult] = b
+        
+        code = []
+        increments = []
+        reduced = dict(scope.get('__reduced__', {}))
+        for key, mult in products.items():
+            # leave enough registers for evaluating expressions
+            if frame.available('int') <= self.min_temps:
+                break
+            typ = arith_type(var.type, key.type if isinstance(key, Variable) else mult.type)
+            reg = frame.alloc_home('int', type_bits[typ], stack=False)
+            if reg is None:
+                break
+            name = frame.new_label('iv')
+            derived = Variable(typ, name, reg=sized(reg, type_bits[typ]))
+            scope[name] = derived
+            init = Assignment('=', Name(name), Binary('*', Name(var.name), mult))
+            code.extend(Expression(init).compile(scope, discard=True))
+            if isinstance(key, Variable):
+                inc = Assignment('+=' if step > 0 else '-=', Name(name), mult)
+            else:
+                inc = Assignment('+=', Name(name), Const(key * step, typ))
+            increments.append(inc)
+            reduced[(var, key)] = derived
+        scope['__reduced__'] = reduced
+        return code, increments
+
+
+def whileloop(cond, code=None):
+    return WhileLoop(cond, code)
+
+class WhileLoop(CodeContainer):
+    """C while loop: ``while (cond) { code }``.
+    
+    The loop test is placed at the bottom of the loop (with a guard before the
+    first iteration).
+    """
+    loop = True
+    
+    def __init__(self, cond, code=None):
+        CodeContainer.__init__(self, code)
+        self.cond = cond
+        
+    def expressions(self):
+        return [self.cond]
+    
+    def compile(self, scope):
+        frame = scope['__frame__']
+        start = frame.new_label('while')
+        cont = frame.new_label('continue')
+        end = frame.new_label('break')
+        code = Expression(self.cond).compile_branch(scope, end, False)
+        code.append(asm.label(start))
+        body_scope = scope.copy()
+        body_scope['__loop__'] = (cont, end)
+        code.extend(compile_block(self.code, body_scope))
+        code.append(asm.label(cont))
+        code.extend(Expression(self.cond).compile_branch(scope, start, True))
+        code.append(asm.label(end))
+        return code
+
+
+def dowhileloop(cond, code=None):
+    return DoWhileLoop(cond, code)
+
+class DoWhileLoop(CodeContainer):
+    """C do-while loop: ``do { code } while (cond);``.
+    """
+    loop = True
+    
+    def __init__(self, cond, code=None):
+        CodeContainer.__init__(self, code)
+        self.cond = cond
+        
+    def expressions(self):
+        return [self.cond]
+    
+    def compile(self, scope):
+        frame = scope['__frame__']
+        start = frame.new_label('do')
+        cont = frame.new_label('continue')
+        end = frame.new_label('break')
+        code = [asm.label(start)]
+        body_scope = scope.copy()
+        body_scope['__loop__'] = (cont, end)
+        code.extend(compile_block(self.code, body_scope))
+        code.append(asm.label(cont))
+        code.extend(Expression(self.cond).compile_branch(scope, start, True))
+        code.append(asm.label(end))
+        return code
+
+
+class Block(CodeContainer):
+    """A compound statement ``{ code }``. Variables declared in the block are
+    not visible after it.
+    """
+    def compile(self, scope):
+        return compile_block(self.code, scope.copy())
+
+
+class Break(CodeObject):
+    """Exit the innermost loop.
+    """
+    def compile(self, scope):
+        if '__loop__' not in scope:
+            raise SyntaxError("Break outside of loop")
+        return [asm.jmp(scope['__loop__'][1])]
+
+
+class Continue(CodeObject):
+    """Skip to the next iteration of the innermost loop.
+    """
+    def compile(self, scope):
+        if '__loop__' not in scope:
+            raise SyntaxError("Continue outside of loop")
+        return [asm.jmp(scope['__loop__'][0])]
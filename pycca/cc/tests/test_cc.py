@@ -1,3 +1,5 @@
+import time, struct
+from pytest import raises
 from pycca.cc import *
 from pycca.asm import ARCH
 
@@ -43,3 +45,741 @@ def test_func_args():
     
     
 
+
+def cdiv(a, b):
+    # C integer division truncates toward zero
+    q = abs(a) // abs(b)
+    return q if (a < 0) == (b < 0) else -q
+
+
+def test_int_operators():
+    """Check arithmetic, bitwise, shift, and comparison operators on ints.
+    """
+    if ARCH == 32:
+        # disabled for now
+        return
+
+    exprs = [
+        ('x + y', lambda x, y: x + y),
+        ('x - y', lambda x, y: x - y),
+        ('x * y', lambda x, y: x * y),
+        ('x / y', lambda x, y: cdiv(x, y)),
+        ('x % y', lambda x, y: x - cdiv(x, y) * y),
+        ('x & y', lambda x, y: x & y),
+        ('x | y', lambda x, y: x | y),
+        ('x ^ y', lambda x, y: x ^ y),
+        ('x << (y & 7)', lambda x, y: x << (y & 7)),
+        ('x >> (y & 7)', lambda x, y: x >> (y & 7)),
+        ('-x + ~y', lambda x, y: -x + ~y),
+        ('x < y', lambda x, y: int(x < y)),
+        ('x <= y', lambda x, y: int(x <= y)),
+        ('x > y', lambda x, y: int(x > y)),
+        ('x >= y', lambda x, y: int(x >= y)),
+        ('x == y', lambda x, y: int(x == y)),
+        ('x != y', lambda x, y: int(x != y)),
+        ('!x', lambda x, y: int(not x)),
+        ('x && y', lambda x, y: int(bool(x and y))),
+        ('x || y', lambda x, y: int(bool(x or y))),
+        ('x > y ? x - y : y - x', lambda x, y: abs(x - y)),
+        ('x*3 + y*5 - x*9 + y*12', lambda x, y: x*3 + y*5 - x*9 + y*12),
+        ('(x + 1) * (y - 2) / (x | 1)', lambda x, y: cdiv((x + 1) * (y - 2), x | 1)),
+    ]
+    args = [('int', 'x'), ('int', 'y')]
+    for expr, check in exprs:
+        c = CCode([Function('int', 'fn', args, [Return(expr)])])
+        for x, y in [(10, 3), (-17, 5), (6, -4), (0, 1), (-1, -1)]:
+            assert c.fn(x, y) == check(x, y), (expr, x, y)
+
+
+def test_div_const():
+    """Check division and modulus by constants, which avoid idiv.
+    """
+    if ARCH == 32:
+        # disabled for now
+        return
+
+    vals = [0, 1, -1, 7, -7, 100, -100, 12345678, -12345678, 2**31-1, -2**31]
+    for typ in ('int', 'long'):
+        for d in (2, -2, 3, -3, 7, 8, -16, 10, 641, 1000003):
+            c = CCode([Function(typ, 'div', [(typ, 'x')], [Return('x / %d' % d)]),
+                       Function(typ, 'mod', [(typ, 'x')], [Return('x %% %d' % d)])])
+            for x in vals + [2**40 + 3, -2**63 + 1] * (typ == 'long'):
+                assert c.div(x) == cdiv(x, d), (typ, x, d)
+                assert c.mod(x) == x - cdiv(x, d) * d, (typ, x, d)
+
+
+def test_double_operators():
+    """Check arithmetic and comparison of doubles, including NaN.
+    """
+    if ARCH == 32:
+        # disabled for now
+        return
+
+    nan = float('nan')
+    args = [('double', 'x'), ('double', 'y')]
+    c = CCode([Function('double', 'fn', args, [Return('(x + y) * 2.5 - x / y')])])
+    assert c.fn(1.5, 0.5) == (1.5 + 0.5) * 2.5 - 1.5 / 0.5
+    c = CCode([Function('double', 'fn', args, [Return('-x')])])
+    assert c.fn(2.5, 0.0) == -2.5
+    
+    compares = ['x < y', 'x <= y', 'x > y', 'x >= y', 'x == y', 'x != y']
+    for expr in compares:
+        c = CCode([Function('int', 'fn', args, [Return(expr)])])
+        for x, y in [(1.0, 2.0), (2.0, 1.0), (1.0, 1.0), (nan, 1.0), (1.0, nan)]:
+            assert c.fn(x, y) == eval(expr), (expr, x, y)
+
+
+def test_type_promotion():
+    """Check mixed int/long/double expressions and conversions.
+    """
+    if ARCH == 32:
+        # disabled for now
+        return
+
+    c = CCode([Function('double', 'fn', [('int', 'i'), ('double', 'x')], [Return('i / 2 + x * i')])])
+    assert c.fn(7, 0.5) == 3 + 3.5
+    
+    c = CCode([Function('int', 'fn', [('int', 'i'), ('double', 'x')], [Return('i * x')])])
+    assert c.fn(-7, 1.5) == -10
+    
+    c = CCode([Function('long', 'fn', [('int', 'i'), ('long', 'j')], [Return('i * j')])])
+    assert c.fn(-3, 2**40) == -3 * 2**40
+    
+    c = CCode([Function('double', 'fn', [('double', 'x')], [Return('(int)x + (double)(long)(x * 10)')])])
+    assert c.fn(2.75) == 29.0
+
+
+def test_assign():
+    """Check assignment, compound assignment, and increment operators.
+    """
+    if ARCH == 32:
+        # disabled for now
+        return
+
+    args = [('int', 'x'), ('int', 'y')]
+    c = CCode([Function('int', 'fn', args, [Assign(x='x * 3'), Assign(y='y + x'), 
+                                            Return('x -= y, x++ + ++y')])])
+    assert c.fn(2, 5) == (6 - 11) + 12
+    
+    args = [('double', 'x'), ('int', 'n')]
+    c = CCode([Function('double', 'fn', args, [Assign(n='n + x * x'), Return('x /= n')])])
+    assert c.fn(1.5, 2) == 1.5 / 4
+
+
+def test_if_else():
+    """Check If / ElseIf / Else chains.
+    """
+    if ARCH == 32:
+        # disabled for now
+        return
+
+    c = CCode([Function('int', 'fn', [('int', 'x')], [
+        If('x < 0', [Return(-1)]),
+        ElseIf('x == 0', [Return(0)]),
+        ElseIf('x < 10 && x != 5', [Assign(x='x * 2')]),
+        Else([Assign(x='x + 100')]),
+        Return('x'),
+    ])])
+    assert c.fn(-5) == -1
+    assert c.fn(0) == 0
+    assert c.fn(3) == 6
+    assert c.fn(5) == 105
+    assert c.fn(50) == 150
+    
+    
+def test_loops():
+    """Check for / while loops, including break and continue.
+    """
+    if ARCH == 32:
+        # disabled for now
+        return
+
+    # induction variable products are strength-reduced
+    c = CCode([Function('long', 'fn', [('int', 'n')], [
+        Declaration('long', 's', 0),
+        ForLoop(Declaration('int', 'i', 0), 'i < n', 'i++', [
+            Assign(s='s + i*7 + i*n'),
+        ]),
+        Return('s'),
+    ])])
+    assert c.fn(10) == sum(i*7 + i*10 for i in range(10))
+    assert c.fn(0) == 0
+    assert c.fn(-3) == 0
+
+    c = CCode([Function('int', 'fn', [('int', 'n')], [
+        Declaration('int', 'count', 0),
+        Declaration('int', 'k', 0),
+        WhileLoop('1', [
+            'k++',
+            If('k > n', [Break()]),
+            If('k % 3 == 0', [Continue()]),
+            'count += k',
+        ]),
+        Return('count'),
+    ])])
+    assert c.fn(10) == sum(k for k in range(1, 11) if k % 3 != 0)
+
+    # nested loops with a double accumulator
+    c = CCode([Function('double', 'fn', [('int', 'n'), ('double', 'h')], [
+        Declaration('double', 'acc', 0.0),
+        ForLoop(Declaration('int', 'i', 0), 'i < n', 'i += 2', [
+            ForLoop(Declaration('int', 'j', 0), 'j <= i', 'j++', [
+                'acc += (i*3 + j*5) * h',
+            ]),
+        ]),
+        Return('acc'),
+    ])])
+    assert c.fn(9, 0.5) == sum((i*3 + j*5) * 0.5 for i in range(0, 9, 2) for j in range(i+1))
+
+
+def test_many_locals():
+    """Check that variables are moved to callee-saved registers and the stack
+    when registers run out.
+    """
+    if ARCH == 32:
+        # disabled for now
+        return
+
+    n = 14
+    decls = [Declaration('long', 'v%d' % i, i) for i in range(n)]
+    body = ['v%d = v%d + v%d * 2' % (i, i, (i+1) % n) for i in range(n)]
+    c = CCode([Function('long', 'fn', [], decls + [
+        ForLoop(Declaration('int', 'k', 0), 'k < 3', 'k++', body),
+        Return(' + '.join('v%d' % i for i in range(n))),
+    ])])
+    v = list(range(n))
+    for k in range(3):
+        for i in range(n):
+            v[i] = v[i] + v[(i+1) % n] * 2
+    assert c.fn() == sum(v)
+
+
+def test_float():
+    """Check single-precision arithmetic, conversions, and comparisons.
+    """
+    if ARCH == 32:
+        # disabled for now
+        return
+
+    args = [('float', 'x'), ('float', 'y')]
+    c = CCode([Function('float', 'fn', args, [Return('x * y - 0.1f')])])
+    f32 = lambda x: struct.unpack('f', struct.pack('f', x))[0]
+    assert c.fn(1.5, 2.0) == f32(3.0 - f32(0.1))
+    
+    # mixed float / double arithmetic is done in double precision
+    c = CCode([Function('double', 'fn', args, [Return('x / 3.0 + y')])])
+    assert c.fn(1.5, 2.0) == 2.5
+    
+    c = CCode([Function('int', 'fn', args, [
+        Return('(x < y) + 2*(x == y) + 4*(x != y) + 8*(x >= y)')])])
+    assert c.fn(1.0, 2.0) == 5
+    assert c.fn(-2.5, -2.5) == 10
+    assert c.fn(float('nan'), 1.0) == 4
+    
+    c = CCode([Function('int', 'fn', args, [Return('(int)(x*2.0f) + -y')])])
+    assert c.fn(-2.5, -2.5) == -2
+    
+    c = CCode([Function('float', 'fn', [('long', 'n')], [
+        Declaration('float', 'r', 'n'),
+        'r++',
+        Return('r / 2'),
+    ])])
+    assert c.fn(7) == 4.0
+
+
+def test_parse_c():
+    """Check compiling functions from C source code.
+    """
+    if ARCH == 32:
+        # disabled for now
+        return
+
+    c = compile("""
+        /* prototypes are accepted and ignored */
+        static int gcd(int a, int b);
+        
+        int gcd(int a, int b) {
+            while (b != 0) {
+                int t = b;
+                b = a % b;
+                a = t;
+            }
+            return a;
+        }
+        
+        long sum(long n) {
+            long s = 0, i;
+            for (i = 0; i < n; i++)
+                s += i * 3;
+            return s;
+        }
+        
+        int sign(double x) {
+            if (x < 0) return -1;
+            else if (x == 0) return 0;
+            else return 1;
+        }
+        
+        int collatz(int64_t n) {
+            int steps = 0;
+            do {
+                if (n == 1)
+                    break;
+                n = n % 2 ? 3*n + 1 : n / 2;
+                steps++;
+            } while (1);
+            return steps;
+        }
+        
+        float poly(const float x, int n) {
+            float acc = 0.0f;
+            for (int i = 0, j = n; i < n; i++, j--) {
+                // nested block with its own locals
+                { double t = x * j; acc += (float)t; }
+            }
+            return acc;
+        }
+    """)
+    assert c.gcd(12, 18) == 6
+    assert c.sum(10) == 135
+    assert [c.sign(x) for x in (-2.0, 0.0, 0.5)] == [-1, 0, 1]
+    assert c.collatz(27) == 111
+    assert c.poly(0.5, 4) == 5.0
+    
+    # 'else' binds to the nearest 'if'
+    c = compile("""int fn(int x, int y) { 
+        if (x) if (y) return 1; else return 2; 
+        return 3; 
+    }""")
+    assert (c.fn(1, 1), c.fn(1, 0), c.fn(0, 1)) == (1, 2, 3)
+
+
+def test_parse_errors():
+    """Check that unsupported or invalid C raises SyntaxError.
+    """
+    for source in ["int x;", 
+                   "int fn(int x) { return x }",
+                   "int fn(int x) { switch (x) { } }",
+                   "int fn(int x) { return x @ 2; }",
+                   "int fn(int x) { if (x) { return 1; }"]:
+        with raises(SyntaxError):
+            parse_c(source)
+
+
+def test_parse_speed():
+    """Check that a 1,000-line source file parses quickly.
+    """
+    fn = """
+    double kernel%d(double x, double y, int n) {
+        double acc = 0.0;
+        int i;
+        for (i = 0; i < n; i++) {
+            double t = x * i + y;
+            if (t > 100.0) {
+                acc -= t / 3.0;
+            } else if (t < -100.0) {
+                acc += t * 0.5;
+            } else {
+                acc += t;
+            }
+            x = x * 0.99;
+        }
+        while (acc > 1e6)
+            acc /= 2.0;
+        return acc + %d;
+    }
+    """
+    source = ''.join(fn % (i, i) for i in range(53))
+    assert source.count('\n') > 1000
+    start = time.time()
+    code = parse_c(source)
+    assert time.time() - start < 0.5
+    assert len(code) == 53
+
+
+def test_pointers():
+    """Check pointer arguments, array indexing, and local arrays.
+    """
+    import ctypes
+    if ARCH == 32:
+        return
+    c = compile("""
+        int find_greater(int* array, int size, int threshold) {
+            int i;
+            for (i = 0; i < size; i++) {
+                if (array[i] > threshold)
+                    return i;
+            }
+            return -1;
+        }
+        double dot(double* a, double* b, int n) {
+            double acc = 0.0;
+            int i;
+            for (i = 0; i < n; i++)
+                acc += a[i] * b[i];
+            return acc;
+        }
+        void saxpy(float a, float* x, float* y, int n) {
+            int i;
+            for (i = 0; i < n; i++)
+                y[i] = a * x[i] + y[i];
+        }
+        long offsets(int64_t* p, long i) {
+            p[i+2] = p[i] + p[2*i + 1];
+            return *(p + 3) - p[0];
+        }
+        int length(char* s) {
+            char* p = s;
+            while (*p)
+                p++;
+            return p - s;
+        }
+        void upper(char* s) {
+            for (; *s; s++)
+                if (*s >= 97 && *s <= 122)
+                    *s -= 32;
+        }
+        int squares(int n) {
+            int sq[16];
+            int* p = sq;
+            int i, acc = 0;
+            for (i = 0; i < 16; i++)
+                sq[i] = i * i;
+            for (i = 0; i < n; i++)
+                acc += *(p + i);
+            return acc + (&sq[10] - p);
+        }
+        int swap(int x, int y) {
+            int* px = &x;
+            int* py = &y;
+            int t = *px;
+            *px = *py;
+            *py = t;
+            return x * 10 + y;
+        }
+    """)
+    
+    arr = (ctypes.c_int * 6)(3, 9, -4, 12, 7, 1)
+    addr = ctypes.addressof(arr)
+    assert c.find_greater(addr, 6, 8) == 1
+    assert c.find_greater(addr, 6, 10) == 3
+    assert c.find_greater(addr, 6, 20) == -1
+    
+    a = (ctypes.c_double * 4)(1.0, 2.0, 3.0, 4.0)
+    b = (ctypes.c_double * 4)(0.5, -1.0, 2.0, 0.25)
+    assert c.dot(ctypes.addressof(a), ctypes.addressof(b), 4) == 5.5
+    
+    x = (ctypes.c_float * 3)(1.0, 2.0, 3.0)
+    y = (ctypes.c_float * 3)(0.5, 0.25, -1.0)
+    c.saxpy(2.0, ctypes.addressof(x), ctypes.addressof(y), 3)
+    assert list(y) == [2.5, 4.25, 5.0]
+    
+    p = (ctypes.c_int64 * 6)(10, 20, 30, 40, 50, 60)
+    assert c.offsets(ctypes.addressof(p), 1) == 50
+    assert list(p) == [10, 20, 30, 60, 50, 60]
+    
+    s = ctypes.create_string_buffer(b'Hello, world!')
+    assert c.length(ctypes.addressof(s)) == 13
+    c.upper(ctypes.addressof(s))
+    assert s.value == b'HELLO, WORLD!'
+    
+    assert c.squares(4) == 0 + 1 + 4 + 9 + 10
+    assert c.swap(3, 4) == 43
+    
+    for source in ["int fn(int x) { return *x; }",
+                   "int fn(int x) { int a[4]; a = 0; return x; }",
+                   "int fn(int* p, int* q) { return p * q; }",
+                   "int fn(int x) { int a[2][2]; return x; }"]:
+        with raises(TypeError):
+            compile(source)
+
+
+def test_calls():
+    """Check calls between functions, to external C functions, and to 
+    functions given in globals.
+    """
+    import ctypes, ctypes.util, math
+    if ARCH == 32:
+        return
+    c = compile("""
+        long sq(long x);
+        int fib(int n) {
+            if (n < 2) 
+                return n;
+            return fib(n - 1) + fib(n - 2);
+        }
+        long sumsq(long n) {
+            long s = 0;
+            long i;
+            for (i = 0; i < n; i++)
+                s += sq(i);
+            return s;
+        }
+        long sq(long x) { return x * x; }
+        long sum8(long a, long b, long c, long d, long e, long f, long g, 
+                  long h) {
+            return a + 2*b + 3*c + 4*d + 5*e + 6*f + 7*g + 8*h;
+        }
+        long nested(long x, long y) {
+            // arguments are swapped between registers and passed on the stack
+            return sum8(y, x, sq(x), 4, sum8(1, 2, 3, 4, 5, 6, x, y), 6, 
+                        sq(y) + 1, x) + x;
+        }
+        double dsum(double a, double b, double c, double d, double e, 
+                    double f, double g, double h, double i, float j) {
+            return a + 2*b + 3*c + 4*d + 5*e + 6*f + 7*g + 8*h + 9*i + 10*j;
+        }
+        double calld(double x, int n) {
+            return dsum(x, 1.0, 2.0, 3.0, n, 5.0, 6.0, 7.0, x * 2.0, 0.5) + x;
+        }
+        long strlen(char* s);
+        int snprintf(char* buf, long n, char* fmt, ...);
+        long len2(char* s) { return strlen(s) + strlen(s + 1); }
+        int format(char* buf, char* fmt, int a, double x, float y) {
+            return snprintf(buf, 100, fmt, a, x, y, a + 1, x * 2.0);
+        }
+    """)
+    assert c.fib(15) == 610
+    assert c.sumsq(10) == 285
+    
+    def sum8(*args):
+        return sum((i+1) * v for i, v in enumerate(args))
+    assert c.nested(3, 5) == sum8(5, 3, 9, 4, sum8(1, 2, 3, 4, 5, 6, 3, 5), 
+                                  6, 26, 3) + 3
+    assert c.calld(1.5, 4) == sum8(1.5, 1, 2, 3, 4, 5, 6, 7, 3.0, 0.5) + 1.5
+    
+    s = ctypes.create_string_buffer(b'hello')
+    assert c.len2(ctypes.addressof(s)) == 9
+    buf = ctypes.create_string_buffer(100)
+    fmt = ctypes.create_string_buffer(b'%d %.2f %.1f %d %.1f')
+    c.format(ctypes.addressof(buf), ctypes.addressof(fmt), 7, 1.25, 0.5)
+    assert buf.value == b'7 1.25 0.5 8 2.5'
+    
+    # ctypes functions given as globals
+    libm = ctypes.CDLL(ctypes.util.find_library('m'))
+    cos = libm.cos
+    cos.argtypes = [ctypes.c_double]
+    cos.restype = ctypes.c_double
+    d = compile("""
+        double sin(double x);
+        double fn(double x) { return cos(x) * 2.0 + sin(x); }
+        long fib2(int n) { return c_fib(n) * 2; }
+    """, globals={'cos': cos, 'sin': libm.sin, 'c_fib': c.fib})
+    assert d.fn(0.3) == math.cos(0.3) * 2.0 + math.sin(0.3)
+    assert d.fib2(10) == 110
+    
+    # python callbacks
+    values = []
+    cb = ctypes.CFUNCTYPE(None, ctypes.c_long)(values.append)
+    e = CCode([
+        Function('void', 'fn', [('long', 'n')], [
+            ForLoop(Declaration('long', 'i', 0), 'i < n', 'i++', [
+                FunctionCall(cb, 'i * i'),
+            ])
+        ])
+    ])
+    e.fn(4)
+    assert values == [0, 1, 4, 9]
+    
+    with raises(NameError):
+        compile("int fn(int x) { return undefined_fn(x); }")
+    for source in ["int g(int a); int fn(int x) { return g(x, 1); }",
+                   "void g(int a) { } int fn(int x) { return g(x); }",
+                   "int fn(int x) { return x(1); }"]:
+        with raises(TypeError):
+            compile(source)
+
+
+def test_nogil():
+    """Check that compiled functions release the GIL unless nogil=False, and
+    that the Python C API may only be called with the GIL held.
+    """
+    import ctypes, threading
+    if ARCH == 32:
+        return
+    src = """
+        long wait(long* flag, long n) {
+            long i;
+            for (i = 0; i < n; i++)
+                if (*flag) 
+                    return i;
+            return -1;
+        }
+    """
+    flag = ctypes.c_long(0)
+    def set_flag():
+        time.sleep(0.01)
+        flag.value = 1
+        
+    # Another thread can only set the flag while the GIL is released
+    for nogil in (True, False):
+        c = compile(src, nogil=nogil)
+        flag.value = 0
+        thread = threading.Thread(target=set_flag)
+        thread.start()
+        result = c.wait(ctypes.addressof(flag), 10**8)
+        thread.join()
+        assert (result >= 0) is nogil
+        
+    c = compile("""
+        void* PyEval_SaveThread(void);
+        void PyEval_RestoreThread(void* state);
+        long wait(long* flag, long n) {
+            void* state = PyEval_SaveThread();
+            long i;
+            for (i = 0; i < n; i++)
+                if (*flag) 
+                    break;
+            PyEval_RestoreThread(state);
+            return i < n;
+        }
+    """, nogil=False)
+    flag.value = 0
+    thread = threading.Thread(target=set_flag)
+    thread.start()
+    assert c.wait(ctypes.addressof(flag), 10**10) == 1
+    thread.join()
+    
+    with raises(TypeError):
+        compile("void* PyEval_SaveThread(void); "
+                "void fn() { PyEval_SaveThread(); }")
+
+
+def test_builtin():
+    import ctypes, array, sys
+    if ARCH == 32 or sys.platform == 'win32':
+        return
+    c = compile("""
+        double dot(double* a, double* b, int n) {
+            double s = 0;
+            int i;
+            for (i = 0; i < n; i++)
+                s += a[i] * b[i];
+            return s;
+        }
+        float scale(float x, long k) {
+            return x * k;
+        }
+    """, builtin=True)
+    a = array.array('d', [1, 2, 3])
+    b = array.array('d', [4, 5, 6])
+    assert c.dot(a, b, 3) == 32
+    assert c.scale(1.5, 3) == 4.5
+    assert type(c.dot).__name__ == 'builtin_function_or_method'
+    # ctypes functions are still available
+    assert c.globals['dot'](a.buffer_info()[0], b.buffer_info()[0], 2) == 14
+    with raises(TypeError):
+        c.dot(a, b)
+    # arrays must have the declared item type
+    with raises(TypeError):
+        c.dot(a, array.array('f', [4, 5, 6]), 3)
+
+    # read-only buffers are accepted only for pointers to const
+    c = compile("""
+        double total(const double *x, int n) {
+            double s = 0;
+            int i;
+            for (i = 0; i < n; i++)
+                s += x[i];
+            return s;
+        }
+        void fill(double *x, int n) {
+            int i;
+            for (i = 0; i < n; i++)
+                x[i] = i;
+        }
+    """, builtin=True)
+    assert c.total(a, 3) == 6
+    if sys.version_info[0] > 2:
+        data = memoryview(a.tobytes()).cast('d')
+        assert data.readonly
+        assert c.total(data, 3) == 6
+        with raises(BufferError):
+            c.fill(data, 3)
+    c.fill(a, 3)
+    assert list(a) == [0, 1, 2]
+
+    # the same holds for void pointers
+    c = compile("""
+        void* ident(void *p) { return p; }
+        const void* cident(const void *p) { return p; }
+    """, builtin=True)
+    with raises(TypeError):
+        c.ident(b'abc')
+    assert c.cident(b'abc') is not None
+    assert c.ident(ctypes.c_void_p(1234)) == 1234
+
+
+def test_ufunc():
+    from pytest import importorskip
+    np = importorskip('numpy')
+    if ARCH == 32:
+        return
+    c = compile("""
+        float hypotf(float x, float y) { return x * x + y * y; }
+        double hypot(double x, double y) { return x * x + y * y; }
+    """)
+    hypot = c.ufunc('hypot', ['hypotf', 'hypot'])
+    x = np.arange(6.).reshape(2, 3)
+    assert np.all(hypot(x, 2) == x**2 + 4)
+    assert hypot(np.float32(3), np.float32(4)).dtype == np.float32
+    with raises(NameError):
+        c.ufunc('missing')
+
+
+def test_float_constants():
+    """Floating point constants are loaded from the page's constant pool.
+    """
+    if ARCH == 32:
+        return
+    from pycca.asm import movsd, movss
+    c = compile("""
+        double f(double x) { return x * 2.5 + 1.5 - 2.5; }
+        float g(float x) { return x + 0.25f; }
+    """)
+    assert c.f(2.0) == 4.0
+    assert c.g(1.0) == 1.25
+    loads = [cmd for cmd in c.codepage.asm if isinstance(cmd, (movsd, movss))
+             and 'rsp' not in str(cmd) and '_const' in str(cmd)]
+    assert len(loads) == 4
+    assert len(c.codepage.constants) == 3
+    assert 'rsp' not in c.dump_asm()
+
+
+def test_profile():
+    """Only function entries are instrumented; labels inside loops are not.
+    """
+    if ARCH == 32:
+        return
+    from pycca.asm import CodePage
+    from pycca.asm.instrument import function_labels
+    source = """
+        long sum(long n) {
+            long s = 0, i;
+            for (i = 0; i < n; i++) {
+                if (i == 5)
+                    continue;
+                s += i * 3;
+            }
+            return s;
+        }
+        
+        long twice(long n) {
+            return sum(n) * 2;
+        }
+    """
+    c = compile(source, profile=True)
+    assert c.codepage.profile.names == ['sum', 'twice']
+    assert function_labels(c.asm) == ['sum', 'twice']
+    assert c.sum(10) == 120
+    assert c.twice(10) == 240
+    stats = c.codepage.profile.stats()
+    assert stats['sum'][0] == 2
+    assert stats['twice'][0] == 1
+    for calls, cycles in stats.values():
+        # a counter entered without a matching return would wrap around
+        assert 0 < cycles < 2**62
+
+    # the default selection of functions agrees
+    page = CodePage(c.asm, profile=True)
+    assert page.profile.names == ['sum', 'twice']
@@ -2,6 +2,72 @@
 from ..asm import Register, Pointer
 
 
+# Supported scalar types and their sizes in bits
+type_bits = {
+    'int': 32,
+    'long': 64,
+    'float': 32,
+    'double': 64,
+}
+int_types = ('int', 'long')
+float_types = ('float', 'double')
+# Types that may only be accessed through pointers; their values are promoted
+# to int when loaded.
+storage_bits = {'char': 8}
+
+
+def is_pointer(typ):
+    return typ.endswith('*')
+
+
+def is_array(typ):
+    return typ.endswith(']')
+
+
+def element_type(typ):
+    """Return the type referenced by pointer or array type *typ*.
+    """
+    if is_pointer(typ):
+        return typ[:-1]
+    return typ[:typ.index('[')]
+
+
+def array_length(typ):
+    return int(typ[typ.index('[')+1:-1])
+
+
+def sizeof(typ):
+    """Return the size in bytes of a value of type *typ*.
+    """
+    if is_pointer(typ):
+        return 8
+    if is_array(typ):
+        return array_length(typ) * sizeof(element_type(typ))
+    if typ in storage_bits:
+        return storage_bits[typ] // 8
+    return type_bits[typ] // 8
+
+
+def check_type(typ):
+    """Raise TypeError if *typ* is not a valid type for a variable.
+    """
+    base = typ
+    if is_array(typ):
+        if typ.count('[') > 1:
+            raise TypeError("Multidimensional arrays are not supported")
+        if array_length(typ) <= 0:
+            raise TypeError("Invalid array size in type '%s'" % typ)
+        base = element_type(typ)
+        if base in storage_bits:
+            return
+    if is_pointer(base):
+        base = base.rstrip('*')
+        if base == 'void' or base in storage_bits:
+            return
+    if base not in type_bits:
+        raise TypeError("Unsupported variable type '%s'" % typ)
+
+
 class Variable(object):
     def __init__(self, type, name, init=None, addr=None, reg=None):
         self.type = type